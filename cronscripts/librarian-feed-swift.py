@@ -94,6 +94,35 @@ def add_my_options(self):
             metavar="NUM_INSTANCES",
             help="Run NUM_INSTANCES parallel workers",
         )
+        self.parser.add_option(
+            "--workers",
+            action="store",
+            type=int,
+            default=1,
+            metavar="NUM_WORKERS",
+            help=(
+                "Upload files using NUM_WORKERS threads, each migrating a "
+                "range of content IDs (default: 1)"
+            ),
+        )
+        self.parser.add_option(
+            "--checkpoint",
+            action="store",
+            default=None,
+            metavar="FILE",
+            help=(
+                "Record progress in FILE, and resume from the progress "
+                "recorded there by an interrupted run"
+            ),
+        )
+        self.parser.add_option(
+            "--max-bytes-per-second",
+            action="store",
+            type=int,
+            default=None,
+            metavar="BYTES",
+            help="Limit the combined upload rate of all workers",
+        )
 
     @property
     def lockfilename(self):
@@ -151,10 +180,15 @@ def main(self):
                 "--num-instances"
             )
 
+        if self.options.workers < 1:
+            self.parser.error("--workers must be at least 1")
+
         kwargs = {
             "instance_id": self.options.instance_id,
             "num_instances": self.options.num_instances,
             "remove_func": remove,
+            "num_workers": self.options.workers,
+            "max_bytes_per_second": self.options.max_bytes_per_second,
         }
 
         if self.options.ids and (self.options.start or self.options.end):
@@ -173,6 +207,7 @@ def main(self):
                 self.logger,
                 start_lfc_id=self.options.start,
                 end_lfc_id=self.options.end,
+                checkpoint_path=self.options.checkpoint,
                 **kwargs,
             )
         self.logger.info("Done")
@@ -160,6 +160,19 @@ def getPubConfig(archive):
     else:
         pubconf.stagingroot = None
 
+    # Rendered index stanzas are kept here between publisher runs so that
+    # indexes can be regenerated incrementally.  The directory is private
+    # to the publisher, so it lives outside the (possibly public) archive
+    # tree and is keyed by archive ID since PPA names are not unique.
+    if archive.publishing_method == ArchivePublishingMethod.LOCAL:
+        pubconf.stanzaroot = os.path.join(
+            db_pubconf.absolute_root_dir,
+            "%s-stanzas" % archive.distribution.name,
+            str(archive.id),
+        )
+    else:
+        pubconf.stanzaroot = None
+
     return pubconf
 
 
@@ -10,6 +10,16 @@
 
 # This code came from sourcerer but has been heavily modified since.
 
+__all__ = [
+    "BadEpochError",
+    "BadInputError",
+    "BadRevisionError",
+    "BadUpstreamError",
+    "Version",
+    "VersionError",
+    "version_sort_key",
+]
+
 import re
 
 from debian import changelog
@@ -82,3 +92,83 @@ def __init__(self, ver):
             raise BadUpstreamError(
                 "Bad upstream version format %s" % self.upstream_version
             )
+
+
+# A run of non-digits followed by a run of digits, either of which may be
+# empty.
+_version_segment = re.compile(r"([^0-9]*)([0-9]*)")
+
+# Byte weights used by `version_sort_key`.  "~" sorts before an empty
+# fragment, which sorts before the end of a run of non-digits, which sorts
+# before letters, which sort before everything else.
+_TILDE = 0x01
+_EMPTY = 0x02
+_END = 0x03
+
+
+def _char_sort_weight(char):
+    """Return the sort weight of a non-digit version character."""
+    if char == "~":
+        return _TILDE
+    elif char.isascii() and char.isalpha():
+        return ord(char)
+    elif char.isascii():
+        return 0x80 | ord(char)
+    else:
+        raise BadInputError("Non-ASCII character in version")
+
+
+def _fragment_sort_key(fragment):
+    """Encode an epoch, upstream version or revision for `version_sort_key`.
+
+    Each run of non-digits is encoded as its character weights followed by
+    `_END`, and each run of digits as its length without leading zeroes
+    followed by the remaining digits, so that longer numbers sort after
+    shorter ones.  A final `_END` stands for the end of the fragment.  An
+    empty fragment is just `_EMPTY`.
+    """
+    if not fragment:
+        return bytes([_EMPTY])
+    key = bytearray()
+    position = 0
+    while True:
+        match = _version_segment.match(fragment, position)
+        non_digits, digits = match.groups()
+        key.extend(_char_sort_weight(char) for char in non_digits)
+        key.append(_END)
+        digits = digits.lstrip("0")
+        length = len(digits)
+        while length >= 0xFF:
+            key.append(0xFF)
+            length -= 0xFF
+        key.append(length)
+        key.extend(digits.encode("ASCII"))
+        position = match.end()
+        if position >= len(fragment):
+            break
+    key.append(_END)
+    return bytes(key)
+
+
+def version_sort_key(version):
+    """Return a bytewise-sortable key for a Debian version string.
+
+    For valid versions, comparing the keys of two versions gives the same
+    result as comparing the versions themselves using
+    `apt_pkg.version_compare`, and versions that compare equal (such as
+    "1.0" and "1.00") have equal keys.  This makes it cheap to sort many
+    versions, or to find the highest one, without pairwise comparisons.
+    """
+    version = str(version)
+    epoch, colon, rest = version.partition(":")
+    if not colon:
+        epoch, rest = "0", version
+    upstream, hyphen, revision = rest.rpartition("-")
+    if not hyphen:
+        # A missing revision is equivalent to "0", but an empty one is not.
+        upstream, revision = rest, "0"
+    return (
+        _fragment_sort_key(epoch)
+        + _fragment_sort_key(upstream)
+        + _fragment_sort_key(revision)
+    )
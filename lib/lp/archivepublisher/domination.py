@@ -59,10 +59,12 @@
 
 import apt_pkg
 from storm.expr import And, Cast, Count, Desc, Not, Select
+from storm.info import ClassAlias
 from zope.component import getUtility
 
+from lp.archivepublisher.debversion import version_sort_key
 from lp.registry.model.sourcepackagename import SourcePackageName
-from lp.services.database.bulk import load_related
+from lp.services.database.bulk import dbify_value, load_related
 from lp.services.database.constants import UTC_NOW
 from lp.services.database.decoratedresultset import DecoratedResultSet
 from lp.services.database.interfaces import IStore
@@ -70,12 +72,13 @@
     block_implicit_flushes,
     flush_database_updates,
 )
-from lp.services.database.stormexpr import IsDistinctFrom
+from lp.services.database.stormexpr import BulkUpdate, IsDistinctFrom, Values
 from lp.services.orderingcheck import OrderingCheck
 from lp.soyuz.adapters.packagelocation import PackageLocation
 from lp.soyuz.enums import BinaryPackageFormat, PackagePublishingStatus
 from lp.soyuz.interfaces.publishing import (
     IPublishingSet,
+    active_publishing_status,
     inactive_publishing_status,
 )
 from lp.soyuz.model.binarypackagebuild import BinaryPackageBuild
@@ -148,6 +151,22 @@ def getPackageRelease(bpph):
         return bpph.binarypackagerelease
 
 
+class VersionIndex(dict):
+    """Memoised sort keys for Debian version strings.
+
+    Sorting each package's publications using `apt_pkg.version_compare`
+    compares the same versions over and over again.  Instead, we sort
+    publications by `version_sort_key`, which orders versions in the same
+    way.  There are many more publications than distinct versions, so this
+    maps each version to its key, computing keys on demand; a `Dominator`
+    shares one index between all the suites it handles.
+    """
+
+    def __missing__(self, version):
+        key = self[version] = version_sort_key(version)
+        return key
+
+
 class GeneralizedPublication:
     """Generalize handling of publication records.
 
@@ -157,12 +176,20 @@ class GeneralizedPublication:
     class.
     """
 
-    def __init__(self, is_source=True):
+    def __init__(self, is_source=True, version_index=None):
+        """Create a generalization.
+
+        :param is_source: True for source publications, False for binary
+            publications.
+        :param version_index: An optional `VersionIndex` to use when
+            sorting publications.
+        """
         self.is_source = is_source
         if is_source:
             self.traits = SourcePublicationTraits
         else:
             self.traits = BinaryPublicationTraits
+        self.version_index = version_index
 
     def getPackageName(self, pub):
         """Get the package's name."""
@@ -190,9 +217,17 @@ def compare(self, pub1, pub2):
         else:
             return version_comparison
 
+    def getSortKey(self):
+        """Return a key function that orders publications like `compare`."""
+        if self.version_index is None:
+            return cmp_to_key(self.compare)
+        version_index = self.version_index
+        get_version = self.getPackageVersion
+        return lambda pub: (version_index[get_version(pub)], pub.datecreated)
+
     def sortPublications(self, publications):
         """Sort publications from most to least current versions."""
-        return sorted(publications, key=cmp_to_key(self.compare), reverse=True)
+        return sorted(publications, key=self.getSortKey(), reverse=True)
 
 
 def make_package_location(pub):
@@ -262,11 +297,12 @@ class ArchSpecificPublicationsCache:
     This class looks up whether publications for a release need that
     reprieve.  That only needs to be looked up in the database once per
     (source package release, archive, distroseries, pocket).  Hence this
-    cache.
+    cache, which can also be filled in bulk using `prefetch`.
     """
 
     def __init__(self):
         self.cache = {}
+        self.prefetched = set()
 
     @staticmethod
     def getKey(bpph):
@@ -292,6 +328,45 @@ def hasArchSpecificPublications(self, bpph):
             self.cache[key] = self._lookUp(*key)
         return self.cache[key]
 
+    def prefetch(self, bpphs):
+        """Look up the answers for many publications at once.
+
+        This loads the builds and source package releases of any
+        architecture-independent publications among `bpphs`, and fills the
+        cache for all of them using one query per (archive, distroseries,
+        pocket).  Publications that have already been prefetched are
+        skipped.
+        """
+        bpphs = [
+            bpph
+            for bpph in bpphs
+            if bpph.id not in self.prefetched
+            and not bpph.architecture_specific
+            and bpph.binarypackagerelease.ci_build_id is None
+        ]
+        if not bpphs:
+            return
+        self.prefetched.update(bpph.id for bpph in bpphs)
+        bpbs = load_related(
+            BinaryPackageBuild,
+            [bpph.binarypackagerelease for bpph in bpphs],
+            ["build_id"],
+        )
+        load_related(SourcePackageRelease, bpbs, ["source_package_release_id"])
+
+        sprs_by_location = defaultdict(set)
+        for bpph in bpphs:
+            key = self.getKey(bpph)
+            if key not in self.cache:
+                spr, archive, distroseries, pocket = key
+                sprs_by_location[(archive, distroseries, pocket)].add(spr)
+        for (archive, distroseries, pocket), sprs in sprs_by_location.items():
+            found = self._lookUpMany(sprs, archive, distroseries, pocket)
+            for spr in sprs:
+                self.cache[(spr, archive, distroseries, pocket)] = (
+                    spr.id in found
+                )
+
     @staticmethod
     def _lookUp(spr, archive, distroseries, pocket):
         """Look up an answer in the database."""
@@ -300,6 +375,30 @@ def _lookUp(spr, archive, distroseries, pocket):
         )
         return not query.is_empty()
 
+    @staticmethod
+    def _lookUpMany(sprs, archive, distroseries, pocket):
+        """Look up answers for several releases in the database.
+
+        :return: The set of IDs of those `sprs` that have active,
+            arch-specific publications.
+        """
+        BPPH = BinaryPackagePublishingHistory
+        rows = IStore(BPPH).find(
+            BinaryPackageBuild.source_package_release_id,
+            BinaryPackageBuild.source_package_release_id.is_in(
+                {spr.id for spr in sprs}
+            ),
+            BinaryPackageRelease.build == BinaryPackageBuild.id,
+            BPPH.binarypackagerelease_id == BinaryPackageRelease.id,
+            BPPH.archive == archive,
+            BPPH.distroarchseries_id == DistroArchSeries.id,
+            DistroArchSeries.distroseries == distroseries,
+            BPPH.pocket == pocket,
+            BPPH.status.is_in(active_publishing_status),
+            BinaryPackageRelease.architecturespecific == True,
+        )
+        return set(rows.config(distinct=True))
+
 
 def find_live_binary_versions_pass_2(sorted_pubs, cache):
     """Find versions out of Published publications that should stay live.
@@ -337,12 +436,7 @@ def find_live_binary_versions_pass_2(sorted_pubs, cache):
     arch_specific_pubs = list(filter(is_arch_specific, sorted_pubs))
     arch_indep_pubs = list(filterfalse(is_arch_specific, sorted_pubs))
 
-    bpbs = load_related(
-        BinaryPackageBuild,
-        [pub.binarypackagerelease for pub in arch_indep_pubs],
-        ["build_id"],
-    )
-    load_related(SourcePackageRelease, bpbs, ["source_package_release_id"])
+    cache.prefetch(arch_indep_pubs)
 
     # XXX cjwatson 2022-05-01: Skip the architecture-specific check for
     # publications from CI builds for now, until we figure out how to
@@ -382,6 +476,15 @@ def __init__(self, logger, archive):
         """
         self.logger = logger
         self.archive = archive
+        # Shared by all the suites that this dominator handles, since
+        # they have many versions in common.
+        self.version_index = VersionIndex()
+
+    def makeGeneralization(self, is_source):
+        """Make a `GeneralizedPublication` using our `VersionIndex`."""
+        return GeneralizedPublication(
+            is_source=is_source, version_index=self.version_index
+        )
 
     def planPackageDomination(
         self, sorted_pubs, live_versions, generalization
@@ -435,7 +538,7 @@ def planPackageDomination(
 
         # Verify that the publications are really sorted properly.
         check_order = OrderingCheck(
-            key=cmp_to_key(generalization.compare), reverse=True
+            key=generalization.getSortKey(), reverse=True
         )
 
         current_dominant = None
@@ -633,26 +736,28 @@ def _judgeSuperseded(self, source_records, binary_records):
             # might have the effect of discarding these updates.
             IStore(pub_record).flush()
 
-    def findBinariesForDomination(self, distroarchseries, pocket):
-        """Find binary publications that need dominating.
+    def _findBinariesForDomination(self, location_clauses, pocket):
+        """Find binary publications that need dominating in a location.
 
-        This is only for traditional domination, where the latest published
-        publication is always kept published.  It will ignore publications
-        that have no other publications competing for the same binary package.
+        :param location_clauses: Clauses restricting publications to one
+            or more architectures.
         """
         BPPH = BinaryPackagePublishingHistory
         BPR = BinaryPackageRelease
 
-        bpph_location_clauses = [
+        bpph_location_clauses = location_clauses + [
             BPPH.status == PackagePublishingStatus.PUBLISHED,
-            BPPH.distroarchseries == distroarchseries,
             BPPH.archive == self.archive,
             BPPH.pocket == pocket,
         ]
         candidate_binary_names = Select(
             BPPH.binarypackagename_id,
             And(*bpph_location_clauses),
-            group_by=(BPPH.binarypackagename_id, BPPH._channel),
+            group_by=(
+                BPPH.binarypackagename_id,
+                BPPH.distroarchseries_id,
+                BPPH._channel,
+            ),
             having=(Count() > 1),
         )
         main_clauses = bpph_location_clauses + [
@@ -671,13 +776,245 @@ def findBinariesForDomination(self, distroarchseries, pocket):
         load_related(BinaryPackageName, bpphs, ["binarypackagename_id"])
         return bpphs
 
+    def findBinariesForDomination(self, distroarchseries, pocket):
+        """Find binary publications that need dominating.
+
+        This is only for traditional domination, where the latest published
+        publication is always kept published.  It will ignore publications
+        that have no other publications competing for the same binary package.
+        """
+        return self._findBinariesForDomination(
+            [
+                BinaryPackagePublishingHistory.distroarchseries
+                == distroarchseries
+            ],
+            pocket,
+        )
+
+    def findSeriesBinariesForDomination(self, distroseries, pocket):
+        """Find binary publications that need dominating in a whole series.
+
+        This is like `findBinariesForDomination`, but covers all the
+        architectures in `distroseries` using a single query.  Publications
+        that have no competition in their own architecture may still be
+        returned if their binary package has competing publications in
+        another architecture.
+
+        :return: A dict mapping `DistroArchSeries` IDs to lists of
+            `BinaryPackagePublishingHistory`.
+        """
+        BPPH = BinaryPackagePublishingHistory
+        bpphs = self._findBinariesForDomination(
+            [
+                BPPH.distroarchseries_id == DistroArchSeries.id,
+                DistroArchSeries.distroseries == distroseries,
+            ],
+            pocket,
+        )
+        bpphs_by_das = defaultdict(list)
+        for bpph in bpphs:
+            bpphs_by_das[bpph.distroarchseries_id].append(bpph)
+        return bpphs_by_das
+
+    def _bulkSupersede(self, publication_class, superseded):
+        """Mark publications as superseded using a single query.
+
+        :param publication_class: `SourcePackagePublishingHistory` or
+            `BinaryPackagePublishingHistory`.
+        :param superseded: A sequence of (publication, ID of the
+            superseding source package release or build) pairs.  The ID may
+            be None.
+        """
+        if not superseded:
+            return
+        store = IStore(publication_class)
+        store.flush()
+        dominated = ClassAlias(publication_class, "dominated")
+        values = [
+            (
+                dbify_value(publication_class.id, pub.id),
+                dbify_value(publication_class.supersededby_id, supersededby),
+            )
+            for pub, supersededby in superseded
+        ]
+        store.execute(
+            BulkUpdate(
+                {
+                    publication_class.status: (
+                        PackagePublishingStatus.SUPERSEDED.value
+                    ),
+                    publication_class.datesuperseded: UTC_NOW,
+                    publication_class.supersededby_id: (
+                        dominated.supersededby_id
+                    ),
+                },
+                table=publication_class,
+                values=Values(
+                    "dominated",
+                    [("id", "integer"), ("supersededby", "integer")],
+                    values,
+                ),
+                where=publication_class.id == dominated.id,
+            )
+        )
+        for pub, _ in superseded:
+            store.invalidate(pub)
+
+    def _supersedeSources(self, supersede):
+        """Supersede source publications in bulk.
+
+        This has the same effect as calling
+        `ISourcePackagePublishingHistory.supersede` on each publication.
+
+        :param supersede: A list of (superseded publication, dominant
+            publication) pairs, as returned by `planPackageDomination`.
+        """
+        for pub, _dominant in supersede:
+            assert pub.status in active_publishing_status, (
+                "Should not dominate unpublished source %s"
+                % pub.sourcepackagerelease.title
+            )
+        self._bulkSupersede(
+            SourcePackagePublishingHistory,
+            [
+                (pub, dominant.sourcepackagerelease_id)
+                for pub, dominant in supersede
+            ],
+        )
+
+    def _supersedeBinaries(self, distroseries, pocket, supersede, keep):
+        """Supersede binary publications in bulk.
+
+        This has the same effect as calling
+        `IBinaryPackagePublishingHistory.supersede` on each publication in
+        turn, and then on each of the other publications of
+        architecture-independent ones (see
+        `IBinaryPackagePublishingHistory.getOtherPublications`) that are not
+        in `keep`, but uses a constant number of queries.
+
+        :param supersede: A list of (superseded publication, dominant
+            publication) pairs, as returned by `planPackageDomination`.
+        :param keep: A set of publications that must not be superseded.
+        """
+        if not supersede:
+            return
+        BPPH = BinaryPackagePublishingHistory
+
+        def get_overrides(bpph):
+            return (
+                bpph.component_id,
+                bpph.section_id,
+                bpph.priority,
+                bpph.phased_update_percentage,
+            )
+
+        # Find the other publications of architecture-independent binaries
+        # with the same overrides in this series.
+        arch_indep_bpr_ids = {
+            pub.binarypackagerelease_id
+            for pub, _ in supersede
+            if not pub.architecture_specific
+        }
+        other_pubs = defaultdict(list)
+        if arch_indep_bpr_ids:
+            for other in IStore(BPPH).find(
+                BPPH,
+                BPPH.status.is_in(active_publishing_status),
+                BPPH.distroarchseries_id.is_in(
+                    [das.id for das in distroseries.architectures]
+                ),
+                BPPH.binarypackagerelease_id.is_in(arch_indep_bpr_ids),
+                BPPH.archive == self.archive,
+                BPPH.pocket == pocket,
+            ):
+                other_pubs[
+                    (other.binarypackagerelease_id,) + get_overrides(other)
+                ].append(other)
+
+        keep_ids = {pub.id for pub in keep}
+        # Map publication IDs to (publication, dominant) pairs, in the order
+        # in which they would have been superseded one by one.
+        superseded = {}
+
+        def supersede_one(pub, dominant):
+            if (
+                pub.id in superseded
+                or pub.status not in active_publishing_status
+            ):
+                assert not pub.binarypackagerelease.architecturespecific, (
+                    "Should not dominate unpublished architecture specific "
+                    "binary %s (%s)"
+                    % (
+                        pub.binarypackagerelease.title,
+                        pub.distroarchseries.architecturetag,
+                    )
+                )
+                return
+            # DDEBs cannot themselves be dominant; they are always
+            # dominated by their corresponding DEB.
+            assert (
+                not dominant.is_debug
+            ), "Should not dominate with %s (%s); DDEBs cannot dominate" % (
+                dominant.binarypackagerelease.title,
+                dominant.distroarchseries.architecturetag,
+            )
+            superseded[pub.id] = (pub, dominant)
+
+        for pub, dominant in supersede:
+            supersede_one(pub, dominant)
+            if not pub.architecture_specific:
+                for other in other_pubs[
+                    (pub.binarypackagerelease_id,) + get_overrides(pub)
+                ]:
+                    if other != pub and other.id not in keep_ids:
+                        supersede_one(other, dominant)
+
+        # Supersede any corresponding debug publications along with their
+        # DEBs.
+        debs = {
+            (
+                pub.binarypackagerelease.debug_package_id,
+                pub.distroarchseries_id,
+            )
+            + get_overrides(pub): dominant
+            for pub, dominant in superseded.values()
+            if pub.binarypackagerelease.debug_package_id is not None
+        }
+        if debs:
+            for debug_pub in getUtility(
+                IPublishingSet
+            ).findCorrespondingDDEBPublications(
+                [pub for pub, _ in superseded.values()]
+            ):
+                dominant = debs.get(
+                    (
+                        debug_pub.binarypackagerelease_id,
+                        debug_pub.distroarchseries_id,
+                    )
+                    + get_overrides(debug_pub)
+                )
+                if dominant is not None:
+                    supersede_one(debug_pub, dominant)
+
+        # Binary publications are superseded by the dominant build, not the
+        # dominant binary package release (see
+        # `IBinaryPackagePublishingHistory.supersede`).  This is None for
+        # CI builds.
+        self._bulkSupersede(
+            BPPH,
+            [
+                (pub, dominant.binarypackagerelease.build_id)
+                for pub, dominant in superseded.values()
+            ],
+        )
+
     def dominateBinaries(self, distroseries, pocket):
         """Perform domination on binary package publications.
 
         Dominates binaries, restricted to `distroseries`, `pocket`, and
         `self.archive`.
         """
-        generalization = GeneralizedPublication(is_source=False)
+        generalization = self.makeGeneralization(is_source=False)
 
         # Domination happens in two passes.  The first tries to
         # supersede architecture-dependent publications; the second
@@ -705,25 +1042,23 @@ def plan(pubs, live_versions):
         def execute_plan():
             if supersede:
                 self.logger.info("Superseding binaries...")
-            for pub, dominant in supersede:
-                pub.supersede(dominant, logger=self.logger)
-                IStore(pub).flush()
-                # If this is architecture-independent, all publications with
-                # the same context and overrides should be dominated
-                # simultaneously, unless one of the plans decided to keep
-                # it.  For this reason, an architecture's plan can't be
-                # executed until all architectures have been planned.
-                if not pub.architecture_specific:
-                    for dominated in pub.getOtherPublications():
-                        if dominated != pub and dominated not in keep:
-                            dominated.supersede(dominant, logger=self.logger)
-                            IStore(dominated).flush()
+            # If a superseded publication is architecture-independent, all
+            # publications with the same context and overrides are dominated
+            # simultaneously, unless one of the plans decided to keep them.
+            # For this reason, an architecture's plan can't be executed
+            # until all architectures have been planned.
+            self._supersedeBinaries(distroseries, pocket, supersede, keep)
             if delete:
                 self.logger.info("Deleting binaries...")
             for pub in delete:
                 pub.requestDeletion(None)
                 IStore(pub).flush()
 
+        # Load the candidates for all architectures at once.
+        self.logger.info("Finding binaries...")
+        bins_by_das = self.findSeriesBinariesForDomination(
+            distroseries, pocket
+        )
         for distroarchseries in distroseries.architectures:
             self.logger.info(
                 "Performing domination across %s/%s (%s)",
@@ -732,9 +1067,9 @@ def execute_plan():
                 distroarchseries.architecturetag,
             )
 
-            self.logger.info("Finding binaries...")
-            bins = self.findBinariesForDomination(distroarchseries, pocket)
-            sorted_packages = self._sortPackages(bins, generalization)
+            sorted_packages = self._sortPackages(
+                bins_by_das[distroarchseries.id], generalization
+            )
             self.logger.info("Planning domination of binaries...")
             for (name, location), pubs in sorted_packages.items():
                 self.logger.debug(
@@ -760,11 +1095,18 @@ def execute_plan():
         # (In maintaining this code, bear in mind that some or all of a
         # source package's binary packages may switch between
         # arch-specific and arch-indep between releases.)
+        self.logger.info("Finding binaries...(2nd pass)")
+        bins_by_das = self.findSeriesBinariesForDomination(
+            distroseries, pocket
+        )
         reprieve_cache = ArchSpecificPublicationsCache()
+        reprieve_cache.prefetch(
+            bpph for bins in bins_by_das.values() for bpph in bins
+        )
         for distroarchseries in distroseries.architectures:
-            self.logger.info("Finding binaries...(2nd pass)")
-            bins = self.findBinariesForDomination(distroarchseries, pocket)
-            sorted_packages = self._sortPackages(bins, generalization)
+            sorted_packages = self._sortPackages(
+                bins_by_das[distroarchseries.id], generalization
+            )
             self.logger.info("Planning domination of binaries...(2nd pass)")
             for name, location in packages_w_arch_indep.intersection(
                 sorted_packages
@@ -844,7 +1186,7 @@ def dominateSources(self, distroseries, pocket):
             pocket.title,
         )
 
-        generalization = GeneralizedPublication(is_source=True)
+        generalization = self.makeGeneralization(is_source=True)
 
         self.logger.debug("Finding sources...")
         sources = self.findSourcesForDomination(distroseries, pocket)
@@ -863,9 +1205,7 @@ def dominateSources(self, distroseries, pocket):
             supersede.extend(cur_supersede)
             delete.extend(cur_delete)
 
-        for pub, dominant in supersede:
-            pub.supersede(dominant, logger=self.logger)
-            IStore(pub).flush()
+        self._supersedeSources(supersede)
         for pub in delete:
             pub.requestDeletion(None)
             IStore(pub).flush()
@@ -928,15 +1268,13 @@ def dominateSourceVersions(
         :param live_versions: Iterable of all version strings that are to
             remain active.
         """
-        generalization = GeneralizedPublication(is_source=True)
+        generalization = self.makeGeneralization(is_source=True)
         pubs = self.findPublishedSPPHs(distroseries, pocket, package_name)
         pubs = generalization.sortPublications(pubs)
         supersede, _, delete = self.planPackageDomination(
             pubs, live_versions, generalization
         )
-        for pub, dominant in supersede:
-            pub.supersede(dominant, logger=self.logger)
-            IStore(pub).flush()
+        self._supersedeSources(supersede)
         for pub in delete:
             pub.requestDeletion(None, immutable_check=immutable_check)
             IStore(pub).flush()
@@ -0,0 +1,134 @@
+# Copyright 2026 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Computing digests of archive files.
+
+While writing Release files, the publisher needs several digests of each
+index file, and some files are checksummed more than once (for example,
+i18n files are listed both in i18n/Index and in Release).  A `FileHasher`
+reads each file once, computes all the digests it needs in a single pass,
+and remembers them for the rest of the publisher run.
+"""
+
+__all__ = [
+    "FileHasher",
+]
+
+import bz2
+import hashlib
+import lzma
+import os
+import zlib
+
+# Factories for decompressors for the compressed files whose uncompressed
+# contents we may be asked to hash, by filename suffix.
+_decompressors = {
+    ".gz": lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    ".bz2": bz2.BZ2Decompressor,
+    ".xz": lambda: lzma.LZMADecompressor(format=lzma.FORMAT_XZ),
+}
+
+
+class _Digester:
+    """Compute several digests of a stream of data."""
+
+    def __init__(self, algorithms):
+        self.algorithms = algorithms
+        self.hashobjs = [hashlib.new(algorithm) for algorithm in algorithms]
+        self.size = 0
+
+    def update(self, data):
+        for hashobj in self.hashobjs:
+            hashobj.update(data)
+        self.size += len(data)
+
+    @property
+    def result(self):
+        return (
+            self.size,
+            {
+                algorithm: hashobj.hexdigest()
+                for algorithm, hashobj in zip(self.algorithms, self.hashobjs)
+            },
+        )
+
+
+class FileHasher:
+    """Compute and remember digests of files.
+
+    Results are keyed by each file's path, inode number, modification time
+    and size, so a file that is replaced or modified is hashed again.
+    """
+
+    # Read files in chunks of this size.
+    chunk_size = 4 * 1024 * 1024
+
+    def __init__(self, algorithms=("md5", "sha1", "sha256")):
+        """Create a hasher.
+
+        :param algorithms: The names of the `hashlib` algorithms to compute
+            for each file.
+        """
+        self.algorithms = tuple(algorithms)
+        self._digests = {}
+        # The number of bytes read in order to compute digests, and the
+        # number of bytes we avoided reading by reusing digests.
+        self.bytes_hashed = 0
+        self.bytes_reused = 0
+
+    def getDigests(self, path, decompress=False):
+        """Return the size and digests of a file.
+
+        :param path: The path to the file.
+        :param decompress: If True, `path` must end in ".gz", ".bz2" or
+            ".xz", and the size and digests are those of its uncompressed
+            contents.  The digests of the compressed file are computed in
+            the same pass and remembered too, since the publisher usually
+            needs both.
+        :return: A tuple of the size of the file's contents and a
+            dictionary mapping algorithm names to hex digests.
+        """
+        path_stat = os.stat(path)
+        key = (
+            os.path.abspath(path),
+            path_stat.st_ino,
+            path_stat.st_mtime_ns,
+            path_stat.st_size,
+        )
+        if (key, decompress) in self._digests:
+            self.bytes_reused += path_stat.st_size
+            return self._digests[(key, decompress)]
+
+        digester = _Digester(self.algorithms)
+        if decompress:
+            decompressed_digester = _Digester(self.algorithms)
+            make_decompressor = _decompressors[os.path.splitext(path)[1]]
+            decompressor = make_decompressor()
+        # Read into a single reusable buffer to avoid allocating a new bytes
+        # object for each chunk.
+        buf = bytearray(self.chunk_size)
+        view = memoryview(buf)
+        with open(path, "rb", buffering=0) as in_file:
+            while True:
+                length = in_file.readinto(buf)
+                if not length:
+                    break
+                digester.update(view[:length])
+                if decompress:
+                    data = bytes(view[:length])
+                    # Compressed files may consist of several concatenated
+                    # streams.
+                    while data:
+                        decompressed_digester.update(
+                            decompressor.decompress(data)
+                        )
+                        if not decompressor.eof:
+                            break
+                        data = decompressor.unused_data
+                        decompressor = make_decompressor()
+        self.bytes_hashed += path_stat.st_size
+
+        self._digests[(key, False)] = digester.result
+        if decompress:
+            self._digests[(key, True)] = decompressed_digester.result
+        return self._digests[(key, decompress)]
@@ -2,6 +2,7 @@
 # GNU Affero General Public License version 3 (see the file LICENSE).
 
 __all__ = [
+    "IndexStanzaCache",
     "IndexStanzaFields",
     "build_binary_stanza_fields",
     "build_source_stanza_fields",
@@ -13,6 +14,10 @@
 import re
 from collections import OrderedDict
 
+from zope.component import getUtility
+
+from lp.services.config import config
+from lp.services.statsd.interfaces.statsd_client import IStatsdClient
 from lp.soyuz.model.publishing import makePoolPath
 
 
@@ -261,3 +266,107 @@ def build_translations_stanza_fields(bpr, packages):
         return fields
     else:
         return None
+
+
+class IndexStanzaCache:
+    """A size-bounded cache of rendered index stanzas.
+
+    Releases are immutable, so a stanza only depends on the release and on
+    the override fields of the publication being rendered.  The same stanza
+    is often needed many times in a single publisher run: architecture-
+    independent binaries appear in every architecture's Packages file, and
+    packages are commonly published in several pockets, series or
+    archives.  This caches the UTF-8-encoded output of
+    `IndexStanzaFields.makeOutput`, evicting the least recently used
+    stanzas once the total size exceeds `max_size` bytes.
+    """
+
+    def __init__(self, max_size=None):
+        if max_size is None:
+            max_size = config.archivepublisher.stanza_cache_size
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._reported = (0, 0, 0)
+        self._stanzas = OrderedDict()
+
+    def __len__(self):
+        return len(self._stanzas)
+
+    def _get(self, key, render):
+        """Return the cached stanza for `key`, rendering it if necessary."""
+        stanza = self._stanzas.get(key)
+        if stanza is not None:
+            self._stanzas.move_to_end(key)
+            self.hits += 1
+            return stanza
+        self.misses += 1
+        stanza = render().makeOutput().encode("utf-8")
+        self._stanzas[key] = stanza
+        self.size += len(stanza)
+        while self.size > self.max_size and self._stanzas:
+            _, evicted = self._stanzas.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+        return stanza
+
+    def getSourceStanza(self, spr, component, section):
+        """Return an encoded Sources stanza.
+
+        This is equivalent to encoding the output of
+        `build_source_stanza_fields`.
+        """
+        return self._get(
+            ("source", spr.id, component.id, section.id),
+            lambda: build_source_stanza_fields(spr, component, section),
+        )
+
+    def getBinaryStanza(
+        self,
+        bpr,
+        component,
+        section,
+        priority,
+        phased_update_percentage,
+        separate_long_descriptions=False,
+    ):
+        """Return an encoded Packages stanza.
+
+        This is equivalent to encoding the output of
+        `build_binary_stanza_fields`.
+        """
+        return self._get(
+            (
+                "binary",
+                bpr.id,
+                component.id,
+                section.id,
+                priority.value,
+                phased_update_percentage,
+                separate_long_descriptions,
+            ),
+            lambda: build_binary_stanza_fields(
+                bpr,
+                component,
+                section,
+                priority,
+                phased_update_percentage,
+                separate_long_descriptions,
+            ),
+        )
+
+    def reportStatsd(self):
+        """Send cache statistics since the last report to statsd."""
+        statsd_client = getUtility(IStatsdClient)
+        counts = (self.hits, self.misses, self.evictions)
+        for name, count, reported in zip(
+            ("hits", "misses", "evictions"), counts, self._reported
+        ):
+            if count > reported:
+                statsd_client.incr(
+                    "publisher.stanza_cache.%s" % name, count - reported
+                )
+        statsd_client.gauge("publisher.stanza_cache.size", self.size)
+        self._reported = counts
@@ -11,10 +11,8 @@
     "getPublisher",
 ]
 
-import bz2
 import gzip
 import hashlib
-import lzma
 import os
 import re
 import shutil
@@ -34,16 +32,21 @@
 from lp.archivepublisher import HARDCODED_COMPONENT_ORDER
 from lp.archivepublisher.config import getPubConfig
 from lp.archivepublisher.domination import Dominator
+from lp.archivepublisher.filehasher import FileHasher
 from lp.archivepublisher.indices import (
-    build_binary_stanza_fields,
-    build_source_stanza_fields,
+    IndexStanzaCache,
     build_translations_stanza_fields,
 )
 from lp.archivepublisher.interfaces.archivegpgsigningkey import (
     ISignableArchive,
 )
 from lp.archivepublisher.model.ftparchive import FTPArchiveHandler
-from lp.archivepublisher.utils import RepositoryIndexFile, get_ppa_reference
+from lp.archivepublisher.stanzastore import IndexStanzaStore, StanzaStoreEntry
+from lp.archivepublisher.utils import (
+    ParallelIndexWriter,
+    RepositoryIndexFile,
+    get_ppa_reference,
+)
 from lp.registry.interfaces.pocket import PackagePublishingPocket, pocketsuffix
 from lp.registry.interfaces.series import SeriesStatus
 from lp.registry.model.distroseries import DistroSeries
@@ -127,11 +130,24 @@ def get_suffixed_indices(path):
     return {path + suffix for suffix in ("", ".gz", ".bz2", ".xz")}
 
 
-def getPublisher(archive, allowed_suites, log, distsroot=None):
+def getPublisher(
+    archive,
+    allowed_suites,
+    log,
+    distsroot=None,
+    index_workers=None,
+    incremental_indexes=False,
+    stanza_cache=None,
+    by_hash_workers=None,
+):
     """Return an initialized Publisher instance for the given context.
 
     The callsites can override the location where the archive indexes will
-    be stored via 'distroot' argument.
+    be stored via 'distroot' argument, can ask for index files to be
+    written by a pool of 'index_workers' processes, can ask for
+    'incremental_indexes' generation, can share a 'stanza_cache' between
+    publishers, and can ask for new by-hash files to be uploaded by a pool
+    of 'by_hash_workers' threads.
     """
     if archive.purpose != ArchivePurpose.PPA:
         log.debug(
@@ -150,7 +166,17 @@ def getPublisher(archive, allowed_suites, log, distsroot=None):
 
     log.debug("Preparing publisher.")
 
-    return Publisher(log, pubconf, disk_pool, archive, allowed_suites)
+    return Publisher(
+        log,
+        pubconf,
+        disk_pool,
+        archive,
+        allowed_suites,
+        index_workers=index_workers,
+        incremental_indexes=incremental_indexes,
+        stanza_cache=stanza_cache,
+        by_hash_workers=by_hash_workers,
+    )
 
 
 def get_sources_path(config, suite_name, component):
@@ -397,7 +423,17 @@ class Publisher:
     """
 
     def __init__(
-        self, log, config, diskpool, archive, allowed_suites=None, library=None
+        self,
+        log,
+        config,
+        diskpool,
+        archive,
+        allowed_suites=None,
+        library=None,
+        index_workers=None,
+        incremental_indexes=False,
+        stanza_cache=None,
+        by_hash_workers=None,
     ):
         """Initialize a publisher.
 
@@ -406,6 +442,20 @@ def __init__(
         Optionally we can pass a list of suite names which will restrict the
         publisher actions; only suites listed in allowed_suites will be
         modified.
+
+        If index_workers is greater than one, `C_writeIndexes` compresses
+        and writes index files using a pool of that many processes.
+
+        If incremental_indexes is True, `C_writeIndexes` keeps rendered
+        index stanzas on disk between runs and only renders those for new
+        publications.
+
+        An `IndexStanzaCache` may be passed in as stanza_cache in order to
+        share it between several publishers.
+
+        If by_hash_workers is greater than one, `D_writeReleaseFiles`
+        uploads new by-hash files to the librarian using a pool of that
+        many threads.
         """
         self.log = log
         self._config = config
@@ -416,6 +466,15 @@ def __init__(
         )
 
         self._diskpool = diskpool
+        self.index_workers = index_workers
+        self.incremental_indexes = incremental_indexes
+        if stanza_cache is None:
+            stanza_cache = IndexStanzaCache()
+        self.stanza_cache = stanza_cache
+        self.by_hash_workers = by_hash_workers or 1
+        self.file_hasher = FileHasher(
+            [archive_hash.lfc_name for archive_hash in archive_hashes]
+        )
 
         if library is None:
             self._library = LibrarianClient()
@@ -756,6 +815,22 @@ def C_writeIndexes(self, is_careful):
         Iterates over all distroseries and its pockets and components.
         """
         self.log.debug("* Step C': write indexes directly from DB")
+        if self.index_workers is not None and self.index_workers > 1:
+            self.log.debug(
+                "Writing indexes using %d worker processes."
+                % self.index_workers
+            )
+            with ParallelIndexWriter(self.index_workers) as index_writer:
+                self._writeIndexes(is_careful, index_writer=index_writer)
+        else:
+            self._writeIndexes(is_careful)
+
+    def _writeIndexes(self, is_careful, index_writer=None):
+        """Write Index files for all relevant suites and components.
+
+        :param index_writer: If not None, a `ParallelIndexWriter` to which
+            compressing and writing the index files is delegated.
+        """
         for distroseries in self.distro:
             for pocket in self.archive.getPockets():
                 if not is_careful:
@@ -772,7 +847,11 @@ def C_writeIndexes(self, is_careful):
                 components = self.archive.getComponentsForSeries(distroseries)
                 for component in components:
                     self._writeComponentIndexes(
-                        distroseries, pocket, component
+                        distroseries,
+                        pocket,
+                        component,
+                        index_writer=index_writer,
+                        is_careful=is_careful,
                     )
 
     def C_updateArtifactoryProperties(self, is_careful):
@@ -983,6 +1062,12 @@ def D_writeReleaseFiles(self, is_careful):
                     }
                     self._updateByHash(suite, "Release", extra_by_hash_files)
 
+        self.log.debug(
+            "Hashed %d bytes of archive files; reused digests instead of "
+            "reading another %d bytes."
+            % (self.file_hasher.bytes_hashed, self.file_hasher.bytes_reused)
+        )
+
     def _allIndexFiles(self, distroseries):
         """Return all index files on disk for a distroseries.
 
@@ -1073,19 +1158,129 @@ def createSeriesAliases(self):
                     pass
                 os.symlink(current_suite, alias_suite_path)
 
-    def _writeComponentIndexes(self, distroseries, pocket, component):
+    def _makeSourceIndexEntry(self, spp):
+        """Render the Sources stanza for a source publication."""
+        stanza = self.stanza_cache.getSourceStanza(
+            spp.sourcepackagerelease, spp.component, spp.section
+        )
+        return StanzaStoreEntry(spp.sourcepackagerelease.name, stanza=stanza)
+
+    def _makeBinaryIndexEntry(self, bpp, separate_long_descriptions):
+        """Render the Packages stanza for a binary publication.
+
+        Publications in subcomponents that we don't generate indices for
+        (eg. ddebs where publish_debug_symbols is disabled) are not
+        rendered, and get an entry with no stanza.
+        """
+        bpr = bpp.binarypackagerelease
+        subcomp = FORMAT_TO_SUBCOMPONENT.get(bpr.binpackageformat)
+        if subcomp is not None and subcomp not in self.subcomponents:
+            return StanzaStoreEntry(bpr.name, subcomp)
+        stanza = self.stanza_cache.getBinaryStanza(
+            bpr,
+            bpp.component,
+            bpp.section,
+            bpp.priority,
+            bpp.phased_update_percentage,
+            separate_long_descriptions,
+        )
+        translation_key = None
+        translation_stanza = None
+        if separate_long_descriptions:
+            # Render the Translation-en stanza unconditionally; duplicates
+            # are skipped when writing the index.
+            packages = set()
+            translation_stanza = (
+                build_translations_stanza_fields(bpr, packages)
+                .makeOutput()
+                .encode("utf-8")
+            )
+            translation_key = packages.pop()
+        return StanzaStoreEntry(
+            bpr.name, subcomp, stanza, translation_key, translation_stanza
+        )
+
+    def _getIndexEntries(
+        self,
+        publications,
+        publication_class,
+        make_entry,
+        store_name,
+        store_parameters,
+        is_careful,
+    ):
+        """Return the rendered index entries for some publications.
+
+        If incremental index generation is enabled, then only publications
+        that are not already in the persistent `IndexStanzaStore` called
+        `store_name` are loaded and rendered, and the updated store is
+        saved.  A careful run rebuilds the store from scratch.
+
+        :param publications: A result set of the publications that should
+            appear in this index, from `IPublishingSet`.
+        :param publication_class: The class of `publications`.
+        :param make_entry: A callable that renders a `StanzaStoreEntry` for
+            a publication.
+        :return: An iterable of `StanzaStoreEntry` objects in index order.
+        """
+        if not self.incremental_indexes:
+            return map(make_entry, publications)
+
+        store = IndexStanzaStore(
+            os.path.join(self._config.stanzaroot, store_name),
+            store_parameters,
+        )
+        if not is_careful:
+            store.load()
+
+        def render(publication_ids):
+            for pub in publications.find(
+                publication_class.id.is_in(publication_ids)
+            ):
+                yield pub.id, make_entry(pub)
+
+        added, removed = store.update(
+            publications.values(publication_class.id), render
+        )
+        self.log.debug(
+            "Updated stanza store %s: %d added, %d removed, %d total"
+            % (store_name, added, removed, len(store.entries))
+        )
+        store.save()
+        return store
+
+    def _writeComponentIndexes(
+        self,
+        distroseries,
+        pocket,
+        component,
+        index_writer=None,
+        is_careful=False,
+    ):
         """Write Index files for single distroseries + pocket + component.
 
         Iterates over all supported architectures and 'sources', no
         support for installer-* yet.
         Write contents using LP info to an extra plain file (Packages.lp
         and Sources.lp .
+
+        If index_writer is given, binary publications for all
+        architectures are fetched using a single query, and the rendered
+        index files are handed over to index_writer to be compressed and
+        written concurrently.
+
+        If incremental index generation is enabled, stanzas are taken
+        from the persistent stanza stores where possible; see
+        `_getIndexEntries`.
         """
+        if index_writer is None:
+            open_index = partial(RepositoryIndexFile, threaded=True)
+        else:
+            open_index = index_writer.open
         suite_name = distroseries.getSuite(pocket)
         self.log.debug(
             "Generate Indexes for %s/%s" % (suite_name, component.name)
         )
-
         self.log.debug("Generating Sources")
 
         separate_long_descriptions = False
@@ -1096,7 +1291,7 @@ def _writeComponentIndexes(self, distroseries, pocket, component):
             # descriptions from the Packages.
             separate_long_descriptions = True
             packages = set()
-            translation_en = RepositoryIndexFile(
+            translation_en = open_index(
                 os.path.join(
                     self._config.distsroot,
                     suite_name,
@@ -1108,25 +1303,63 @@ def _writeComponentIndexes(self, distroseries, pocket, component):
                 distroseries.index_compressors,
             )
 
-        source_index = RepositoryIndexFile(
+        source_index = open_index(
             get_sources_path(self._config, suite_name, component),
             self._config.temproot,
             distroseries.index_compressors,
         )
 
-        for spp in getUtility(IPublishingSet).getSourcesForPublishing(
-            archive=self.archive,
-            distroseries=distroseries,
-            pocket=pocket,
-            component=component,
+        for entry in self._getIndexEntries(
+            getUtility(IPublishingSet).getSourcesForPublishing(
+                archive=self.archive,
+                distroseries=distroseries,
+                pocket=pocket,
+                component=component,
+            ),
+            SourcePackagePublishingHistory,
+            self._makeSourceIndexEntry,
+            os.path.join(suite_name, component.name, "source"),
+            {},
+            is_careful,
         ):
-            stanza = build_source_stanza_fields(
-                spp.sourcepackagerelease, spp.component, spp.section
-            )
-            source_index.write(stanza.makeOutput().encode("utf-8") + b"\n\n")
+            source_index.write(entry.stanza + b"\n\n")
 
         source_index.close()
 
+        if index_writer is None or self.incremental_indexes:
+
+            def get_binaries(arch):
+                return getUtility(IPublishingSet).getBinariesForPublishing(
+                    archive=self.archive,
+                    distroarchseries=arch,
+                    pocket=pocket,
+                    component=component,
+                )
+
+        else:
+            # Fetch publications for all architectures at once; this
+            # preserves the per-architecture ordering by name.
+            binaries_by_arch = defaultdict(list)
+            for bpp in getUtility(IPublishingSet).getBinariesForPublishing(
+                archive=self.archive,
+                pocket=pocket,
+                component=component,
+                distroseries=distroseries,
+            ):
+                binaries_by_arch[bpp.distroarchseries_id].append(bpp)
+
+            def get_binaries(arch):
+                return binaries_by_arch[arch.id]
+
+        make_binary_entry = partial(
+            self._makeBinaryIndexEntry,
+            separate_long_descriptions=separate_long_descriptions,
+        )
+        binary_store_parameters = {
+            "separate_long_descriptions": separate_long_descriptions,
+            "subcomponents": self.subcomponents,
+        }
+
         for arch in distroseries.architectures:
             if not arch.enabled:
                 continue
@@ -1136,14 +1369,14 @@ def _writeComponentIndexes(self, distroseries, pocket, component):
             self.log.debug("Generating Packages for %s" % arch_path)
 
             indices = {}
-            indices[None] = RepositoryIndexFile(
+            indices[None] = open_index(
                 get_packages_path(self._config, suite_name, component, arch),
                 self._config.temproot,
                 distroseries.index_compressors,
             )
 
             for subcomp in self.subcomponents:
-                indices[subcomp] = RepositoryIndexFile(
+                indices[subcomp] = open_index(
                     get_packages_path(
                         self._config, suite_name, component, arch, subcomp
                     ),
@@ -1151,44 +1384,27 @@ def _writeComponentIndexes(self, distroseries, pocket, component):
                     distroseries.index_compressors,
                 )
 
-            for bpp in getUtility(IPublishingSet).getBinariesForPublishing(
-                archive=self.archive,
-                distroarchseries=arch,
-                pocket=pocket,
-                component=component,
+            for entry in self._getIndexEntries(
+                get_binaries(arch),
+                BinaryPackagePublishingHistory,
+                make_binary_entry,
+                os.path.join(suite_name, component.name, arch_path),
+                binary_store_parameters,
+                is_careful,
             ):
-                subcomp = FORMAT_TO_SUBCOMPONENT.get(
-                    bpp.binarypackagerelease.binpackageformat
-                )
-                if subcomp not in indices:
+                if entry.stanza is None:
                     # Skip anything that we're not generating indices
                     # for, eg. ddebs where publish_debug_symbols is
                     # disabled.
                     continue
-                stanza = build_binary_stanza_fields(
-                    bpp.binarypackagerelease,
-                    bpp.component,
-                    bpp.section,
-                    bpp.priority,
-                    bpp.phased_update_percentage,
-                    separate_long_descriptions,
-                )
-                indices[subcomp].write(
-                    stanza.makeOutput().encode("utf-8") + b"\n\n"
-                )
+                indices[entry.subcomponent].write(entry.stanza + b"\n\n")
                 if separate_long_descriptions:
-                    # If the (Package, Description-md5) pair already exists
-                    # in the set, build_translations_stanza_fields will
-                    # return None. Otherwise it will add the pair to
-                    # the set and return a stanza to be written to
-                    # Translation-en.
-                    translation_stanza = build_translations_stanza_fields(
-                        bpp.binarypackagerelease, packages
-                    )
-                    if translation_stanza is not None:
+                    # Only write the first stanza for each (Package,
+                    # Description-md5) pair to Translation-en.
+                    if entry.translation_key not in packages:
+                        packages.add(entry.translation_key)
                         translation_en.write(
-                            translation_stanza.makeOutput().encode("utf-8")
-                            + b"\n\n"
+                            entry.translation_stanza + b"\n\n"
                         )
 
             for index in indices.values():
@@ -1272,6 +1488,17 @@ def _getCurrentFiles(self, suite, release_file_name, extra_files):
                     hashes[archive_hash.deb822_name]
                 )
 
+        # Collect all the digests we already know for each file, so that
+        # we don't have to compute them again when adding files to the
+        # librarian.
+        all_digests = defaultdict(dict)
+        for archive_hash in archive_hashes:
+            entries = release_data.get(archive_hash.apt_name, [])
+            entries = entries + extra_data.get(archive_hash.apt_name, [])
+            for entry in entries:
+                digest = entry[archive_hash.deb822_name]
+                all_digests[entry["name"]][archive_hash.lfc_name] = digest
+
         suite_dir = os.path.relpath(
             os.path.join(self._config.distsroot, suite), self._config.distsroot
         )
@@ -1290,10 +1517,14 @@ def _getCurrentFiles(self, suite, release_file_name, extra_files):
             # result, it's routine that `full_path` may not exist; we skip
             # those cases silently.
             if os.path.exists(full_path):
+                digests = all_digests[current_entry["name"]]
+                if len(digests) != len(archive_hashes):
+                    digests = None
                 current_files[path] = (
                     int(current_entry["size"]),
                     current_entry["sha256"],
                     real_path,
+                    digests,
                 )
         return current_files
 
@@ -1362,7 +1593,7 @@ def strip_dists(path):
             suite, release_file_name, extra_files
         )
         new_live_files = {
-            (path, sha256) for path, (_, sha256, _) in current_files.items()
+            (path, sha256) for path, (_, sha256, _, _) in current_files.items()
         }
 
         # Schedule the deletion of any ArchiveFiles which are current in the
@@ -1386,30 +1617,42 @@ def strip_dists(path):
                     )
                 )
 
-        # Ensure that all the current index files are in by-hash and have
-        # corresponding ArchiveFiles.
-        # XXX cjwatson 2016-03-15: This should possibly use bulk creation,
-        # although we can only avoid about a third of the queries since the
-        # librarian client has no bulk upload methods.
-        for path, (size, sha256, real_path) in current_files.items():
-            file_key = (path, sha256)
+        # Ensure that all the current index files have corresponding
+        # ArchiveFiles.  Any new files are added to the librarian
+        # concurrently, reusing the digests from the Release file rather
+        # than computing them again, and their ArchiveFiles are created in
+        # bulk.
+        new_files = []
+        for path, (size, sha256, real_path, digests) in current_files.items():
             full_path = os.path.join(self._config.distsroot, real_path)
             assert os.path.exists(full_path)  # guaranteed by _getCurrentFiles
-            # If there isn't a matching live ArchiveFile row, create one.
-            if file_key not in existing_live_files:
-                with open(full_path, "rb") as fileobj:
-                    db_file = archive_file_set.newFromFile(
-                        self.archive,
-                        container,
+            if (path, sha256) not in existing_live_files:
+                new_files.append(
+                    (
                         os.path.join("dists", path),
-                        fileobj,
                         size,
+                        partial(open, full_path, "rb"),
                         filenameToContentType(path),
+                        digests,
                     )
-            # And ensure the by-hash links exist on disk.
+                )
+        created_files = {}
+        if new_files:
+            for db_file in archive_file_set.newFromFiles(
+                self.archive,
+                container,
+                new_files,
+                max_workers=self.by_hash_workers,
+            ):
+                created_files[strip_dists(db_file.path)] = db_file
+
+        # And ensure the by-hash links exist on disk.
+        for path, (_, sha256, real_path, _) in current_files.items():
             if not by_hashes.known(path, "SHA256", sha256):
                 by_hashes.add(
-                    path, db_file.library_file, copy_from_path=real_path
+                    path,
+                    created_files[path].library_file,
+                    copy_from_path=real_path,
                 )
 
         # Remove any files from disk that aren't recorded in the database.
@@ -1767,23 +2010,19 @@ def _readIndexFileHashes(
             {"md5sum": {"md5sum": ..., "size": ..., "name": ...}}), or None
             if the file could not be found.
         """
-        open_func = partial(open, mode="rb")
         full_name = os.path.join(
             self._config.distsroot,
             suite,
             subpath or ".",
             real_file_name or file_name,
         )
+        decompress = False
         if not os.path.exists(full_name):
-            if os.path.exists(full_name + ".gz"):
-                open_func = gzip.open
-                full_name = full_name + ".gz"
-            elif os.path.exists(full_name + ".bz2"):
-                open_func = bz2.BZ2File
-                full_name = full_name + ".bz2"
-            elif os.path.exists(full_name + ".xz"):
-                open_func = partial(lzma.LZMAFile, format=lzma.FORMAT_XZ)
-                full_name = full_name + ".xz"
+            for suffix in (".gz", ".bz2", ".xz"):
+                if os.path.exists(full_name + suffix):
+                    decompress = True
+                    full_name = full_name + suffix
+                    break
             else:
                 # The file we were asked to write out doesn't exist.
                 # Most likely we have an incomplete archive (e.g. no sources
@@ -1791,20 +2030,17 @@ def _readIndexFileHashes(
                 self.log.debug("Failed to find " + full_name)
                 return None
 
-        hashes = {
-            archive_hash.deb822_name: archive_hash.hash_factory()
-            for archive_hash in archive_hashes
-        }
-        size = 0
-        with open_func(full_name) as in_file:
-            for chunk in iter(lambda: in_file.read(256 * 1024), b""):
-                for hashobj in hashes.values():
-                    hashobj.update(chunk)
-                size += len(chunk)
+        size, digests = self.file_hasher.getDigests(
+            full_name, decompress=decompress
+        )
         ret = {}
-        for alg, hashobj in hashes.items():
-            digest = hashobj.hexdigest()
-            ret[alg] = {alg: digest, "name": file_name, "size": size}
+        for archive_hash in archive_hashes:
+            alg = archive_hash.deb822_name
+            ret[alg] = {
+                alg: digests[archive_hash.lfc_name],
+                "name": file_name,
+                "size": size,
+            }
             if real_file_name:
                 ret[alg]["real_name"] = real_file_name
         return ret
@@ -1904,6 +2140,9 @@ class DirectoryHash:
     def __init__(self, root, tmpdir):
         self.root = root
         self.tmpdir = tmpdir
+        self.file_hasher = FileHasher(
+            [archive_hash.lfc_name for archive_hash in archive_hashes]
+        )
         self.checksum_hash = []
 
         for usable in self._usable_archive_hashes:
@@ -1935,18 +2174,10 @@ def checksum_paths(self):
 
     def add(self, path):
         """Add a path to be checksummed."""
-        hashes = [
-            (checksum_file, archive_hash.hash_factory())
-            for (_, checksum_file, archive_hash) in self.checksum_hash
-        ]
-        with open(path, "rb") as in_file:
-            for chunk in iter(lambda: in_file.read(256 * 1024), b""):
-                for _, hashobj in hashes:
-                    hashobj.update(chunk)
-
-        for checksum_file, hashobj in hashes:
+        _, digests = self.file_hasher.getDigests(path)
+        for _, checksum_file, archive_hash in self.checksum_hash:
             checksum_line = "%s *%s\n" % (
-                hashobj.hexdigest(),
+                digests[archive_hash.lfc_name],
                 path[len(self.root) + 1 :],
             )
             checksum_file.write(checksum_line.encode("UTF-8"))
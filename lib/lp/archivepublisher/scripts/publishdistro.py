@@ -7,7 +7,12 @@
     "PublishDistro",
 ]
 
+import multiprocessing
 import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
 from filecmp import dircmp
 from optparse import OptionValueError
 from pathlib import Path
@@ -19,11 +24,13 @@
 from shutil import copy
 from subprocess import CalledProcessError, check_call
 
+from storm.expr import Min
 from storm.store import Store
 from zope.component import getUtility
 
 from lp.app.errors import NotFoundError
 from lp.archivepublisher.config import getPubConfig
+from lp.archivepublisher.indices import IndexStanzaCache
 from lp.archivepublisher.publishing import (
     GLOBAL_PUBLISHER_LOCK,
     cannot_modify_suite,
@@ -31,8 +38,11 @@
 )
 from lp.archivepublisher.scripts.base import PublisherScript
 from lp.services.config import config
+from lp.services.database.interfaces import IStore
 from lp.services.limitedlist import LimitedList
+from lp.services.propertycache import cachedproperty
 from lp.services.scripts.base import LaunchpadScriptFailure
+from lp.services.statsd.interfaces.statsd_client import IStatsdClient
 from lp.services.webapp.adapter import (
     clear_request_started,
     set_request_started,
@@ -41,8 +51,13 @@
     ArchivePublishingMethod,
     ArchivePurpose,
     ArchiveStatus,
+    PackagePublishingStatus,
 )
 from lp.soyuz.interfaces.archive import MAIN_ARCHIVE_PURPOSES, IArchiveSet
+from lp.soyuz.model.publishing import (
+    BinaryPackagePublishingHistory,
+    SourcePackagePublishingHistory,
+)
 
 
 def is_ppa_private(ppa):
@@ -68,13 +83,62 @@ def has_oval_data_changed(incoming_dir, published_dir):
     )
 
 
+@contextmanager
+def timed_step(timings, step):
+    """Record the wall-clock time taken by a publisher step in `timings`."""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        timings[step] = time.monotonic() - start
+
+
+# The script instance used by an archive worker process.
+_archive_worker = None
+
+
+def _init_archive_worker(script_class, name, dbuser, args):
+    """Set up an archive worker process.
+
+    Each worker has its own copy of the script, with the same options as
+    the parent, and its own database connection.
+    """
+    global _archive_worker
+    # The parent has already checked cron control.
+    script = script_class(
+        name=name, dbuser=dbuser, test_args=args, ignore_cron_control=True
+    )
+    script._init_zca(use_web_security=False)
+    script._init_db(isolation="read_committed")
+    _archive_worker = script
+
+
+def _process_archive_in_worker(archive_id):
+    """Process a single archive in an archive worker process."""
+    return _archive_worker.processArchive(archive_id)
+
+
 class PublishDistro(PublisherScript):
     """Distro publisher."""
 
+    def __init__(self, name=None, dbuser=None, test_args=None, **kwargs):
+        super().__init__(name, dbuser, test_args=test_args, **kwargs)
+        # Archive worker processes are started with the same arguments.
+        self.script_args = list(
+            sys.argv[1:] if test_args is None else test_args
+        )
+        # Seconds spent on each archive that had work to do, by archive ID.
+        self.archive_timings = {}
+
     @property
     def lockfilename(self):
         return self.options.lockfilename or GLOBAL_PUBLISHER_LOCK
 
+    @cachedproperty
+    def stanza_cache(self):
+        """An `IndexStanzaCache` shared by all archives in this run."""
+        return IndexStanzaCache()
+
     def add_my_options(self):
         self.addDistroOptions()
         self.addBasePublisherOptions()
@@ -230,6 +294,68 @@ def add_my_options(self):
             help="Only run over the copy archives.",
         )
 
+        self.parser.add_option(
+            "--index-workers",
+            dest="index_workers",
+            metavar="N",
+            type="int",
+            default=1,
+            help=(
+                "Compress and write Packages/Sources index files using N "
+                "worker processes (default: 1, i.e. serially)."
+            ),
+        )
+
+        self.parser.add_option(
+            "--by-hash-workers",
+            dest="by_hash_workers",
+            metavar="N",
+            type="int",
+            default=1,
+            help=(
+                "Upload new by-hash files to the librarian using N worker "
+                "threads (default: 1, i.e. serially)."
+            ),
+        )
+
+        self.parser.add_option(
+            "--archive-workers",
+            dest="archive_workers",
+            metavar="N",
+            type="int",
+            default=1,
+            help=(
+                "Process up to N archives at once, each in a separate worker "
+                "process with its own database connection, starting with "
+                "those whose pending publications are oldest (default: 1, "
+                "i.e. serially)."
+            ),
+        )
+
+        self.parser.add_option(
+            "--archive-time-budget",
+            dest="archive_time_budget",
+            metavar="SECONDS",
+            type="float",
+            default=None,
+            help=(
+                "Once an archive has taken more than SECONDS to process, "
+                "leave its remaining suites dirty for the next run rather "
+                "than starting to write its indexes."
+            ),
+        )
+
+        self.parser.add_option(
+            "--incremental-indexes",
+            action="store_true",
+            dest="incremental_indexes",
+            default=False,
+            help=(
+                "Keep rendered Packages/Sources stanzas between runs and "
+                "only render those for new publications."
+            ),
+        )
+
     def isCareful(self, option):
         """Is the given "carefulness" option enabled?
 
@@ -324,6 +450,18 @@ def validateOptions(self):
                 "We should not define 'distsroot' in PPA mode!",
             )
 
+        if self.options.index_workers < 1:
+            raise OptionValueError("--index-workers must be at least 1.")
+        if self.options.by_hash_workers < 1:
+            raise OptionValueError("--by-hash-workers must be at least 1.")
+        if self.options.archive_workers < 1:
+            raise OptionValueError("--archive-workers must be at least 1.")
+        if (
+            self.options.archive_time_budget is not None
+            and self.options.archive_time_budget <= 0
+        ):
+            raise OptionValueError("--archive-time-budget must be positive.")
+
     def findSuite(self, distribution, suite):
         """Find the named `suite` in the selected `Distribution`.
 
@@ -413,7 +551,16 @@ def getPublisher(self, distribution, archive, allowed_suites):
             distsroot = None
 
         self.logger.info("Processing %s", description)
-        return getPublisher(archive, allowed_suites, self.logger, distsroot)
+        return getPublisher(
+            archive,
+            allowed_suites,
+            self.logger,
+            distsroot,
+            index_workers=self.options.index_workers,
+            by_hash_workers=self.options.by_hash_workers,
+            incremental_indexes=self.options.incremental_indexes,
+            stanza_cache=self.stanza_cache,
+        )
 
     def deleteArchive(self, archive, publisher):
         """Ask `publisher` to delete `archive`."""
@@ -480,13 +627,85 @@ def syncOVALDataFilesForSuite(self, archive, suite):
                     updated = True
         return updated
 
-    def publishArchive(self, archive, publisher):
+    def sortArchivesByPendingAge(self, archive_ids):
+        """Sort archives so that those that have waited longest come first.
+
+        Archives are ordered by the creation date of their oldest pending
+        publication.  Archives with no pending publications (for example,
+        those being deleted, or with suites left dirty by an earlier run
+        that ran out of time) come first, since we can't tell how long
+        they have been waiting.  Ties are broken by archive ID.
+        """
+        oldest = {}
+        for pub_class in (
+            SourcePackagePublishingHistory,
+            BinaryPackagePublishingHistory,
+        ):
+            rows = (
+                IStore(pub_class)
+                .find(
+                    (pub_class.archive_id, Min(pub_class.datecreated)),
+                    pub_class.archive_id.is_in(archive_ids),
+                    pub_class.status == PackagePublishingStatus.PENDING,
+                )
+                .group_by(pub_class.archive_id)
+            )
+            for archive_id, datecreated in rows:
+                if (
+                    archive_id not in oldest
+                    or datecreated < oldest[archive_id]
+                ):
+                    oldest[archive_id] = datecreated
+        return sorted(
+            archive_ids,
+            key=lambda archive_id: (
+                archive_id in oldest,
+                oldest.get(archive_id),
+                archive_id,
+            ),
+        )
+
+    def deferRemainingSteps(self, archive, publisher, dirty_suites):
+        """Leave the rest of the work on `archive` to the next run.
+
+        The suites that the publisher has touched so far, and any that
+        were explicitly dirty when we started, are marked dirty again so
+        that the next run dominates them and writes their indexes.
+        """
+        suites = set(publisher.dirty_suites)
+        suites.update(dirty_suites or [])
+        # Another process may have dirtied more suites in the meantime.
+        suites.update(archive.dirty_suites or [])
+        archive.dirty_suites = sorted(suites) or None
+        self.txn.commit()
+        self.logger.info(
+            "Time budget for %s exceeded; deferring %s to the next run.",
+            archive.reference,
+            ", ".join(sorted(suites)) or "remaining steps",
+        )
+
+    def publishArchive(self, archive, publisher, timings=None, deadline=None):
         """Ask `publisher` to publish `archive`.
 
         Commits transactions along the way.
+
+        :param timings: If not None, a dictionary in which to record the
+            wall-clock time taken by each publisher step.
+        :param deadline: If not None, a `time.monotonic` value after which
+            we should stop before starting domination or index writing,
+            and leave the remaining work to the next run.  Once index
+            writing has started, we always finish writing Release files so
+            that the archive is consistent.
+        :return: False if some steps were deferred to the next run,
+            otherwise True.
         """
+        if timings is None:
+            timings = {}
         publishing_method = archive.publishing_method
 
+        def over_budget():
+            return deadline is not None and time.monotonic() >= deadline
+
         for distroseries, pocket in self.findExplicitlyDirtySuites(archive):
             if not cannot_modify_suite(archive, distroseries, pocket):
                 publisher.markSuiteDirty(distroseries, pocket)
@@ -502,39 +721,49 @@ def publishArchive(self, archive, publisher):
 
         publisher.setupArchiveDirs()
         if self.options.enable_publishing:
-            publisher.A_publish(
-                self.isCareful(self.options.careful_publishing)
-            )
-            self.txn.commit()
+            with timed_step(timings, "publish"):
+                publisher.A_publish(
+                    self.isCareful(self.options.careful_publishing)
+                )
+                self.txn.commit()
 
         if self.options.enable_domination:
-            # Flag dirty pockets for any outstanding deletions.
-            publisher.A2_markPocketsWithDeletionsDirty()
-            publisher.B_dominate(
-                self.isCareful(self.options.careful_domination)
-            )
-            self.txn.commit()
+            if over_budget():
+                self.deferRemainingSteps(archive, publisher, dirty_suites)
+                return False
+            with timed_step(timings, "dominate"):
+                # Flag dirty pockets for any outstanding deletions.
+                publisher.A2_markPocketsWithDeletionsDirty()
+                publisher.B_dominate(
+                    self.isCareful(self.options.careful_domination)
+                )
+                self.txn.commit()
+
+        if over_budget():
+            self.deferRemainingSteps(archive, publisher, dirty_suites)
+            return False
 
         if self.options.enable_apt:
-            careful_indexing = self.isCareful(self.options.careful_apt)
-            if publishing_method == ArchivePublishingMethod.LOCAL:
-                # The primary and copy archives use apt-ftparchive to
-                # generate the indexes, everything else uses the newer
-                # internal LP code.
-                if archive.purpose in (
-                    ArchivePurpose.PRIMARY,
-                    ArchivePurpose.COPY,
-                ):
-                    publisher.C_doFTPArchive(careful_indexing)
+            with timed_step(timings, "index"):
+                careful_indexing = self.isCareful(self.options.careful_apt)
+                if publishing_method == ArchivePublishingMethod.LOCAL:
+                    # The primary and copy archives use apt-ftparchive to
+                    # generate the indexes, everything else uses the newer
+                    # internal LP code.
+                    if archive.purpose in (
+                        ArchivePurpose.PRIMARY,
+                        ArchivePurpose.COPY,
+                    ):
+                        publisher.C_doFTPArchive(careful_indexing)
+                    else:
+                        publisher.C_writeIndexes(careful_indexing)
+                elif publishing_method == ArchivePublishingMethod.ARTIFACTORY:
+                    publisher.C_updateArtifactoryProperties(careful_indexing)
                 else:
-                    publisher.C_writeIndexes(careful_indexing)
-            elif publishing_method == ArchivePublishingMethod.ARTIFACTORY:
-                publisher.C_updateArtifactoryProperties(careful_indexing)
-            else:
-                raise AssertionError(
-                    "Unhandled publishing method: %r" % publishing_method
-                )
-            self.txn.commit()
+                    raise AssertionError(
+                        "Unhandled publishing method: %r" % publishing_method
+                    )
+                self.txn.commit()
 
         if (
             self.options.enable_release
@@ -557,11 +786,13 @@ def publishArchive(self, archive, publisher):
                         )
                     # XXX 2023-04-21 jugmac00: evaluate whether the above code
                     # would better fit into the `Publisher` class
-            publisher.D_writeReleaseFiles(
-                self.isCareful(
-                    self.options.careful_apt or self.options.careful_release
+            with timed_step(timings, "release"):
+                publisher.D_writeReleaseFiles(
+                    self.isCareful(
+                        self.options.careful_apt
+                        or self.options.careful_release
+                    )
                 )
-            )
             # The caller will commit this last step.
 
         if (
@@ -569,8 +800,47 @@ def publishArchive(self, archive, publisher):
             and publishing_method == ArchivePublishingMethod.LOCAL
         ):
             publisher.createSeriesAliases()
+        return True
+
+    def reportArchiveTimings(self, archive, elapsed, timings, deferred):
+        """Log and send to statsd the time spent processing `archive`."""
+        self.logger.info(
+            "Processed %s in %.2f seconds (%s)%s",
+            archive.reference,
+            elapsed,
+            ", ".join(
+                "%s: %.2fs" % (step, duration)
+                for step, duration in timings.items()
+            )
+            or "no publisher steps",
+            "; deferred remaining work" if deferred else "",
+        )
+        statsd_client = getUtility(IStatsdClient)
+        labels = {"purpose": archive.purpose.name}
+        statsd_client.timing(
+            "publisher.archive.duration", elapsed * 1000, labels=labels
+        )
+        for step, duration in timings.items():
+            statsd_client.timing(
+                "publisher.archive.step_duration",
+                duration * 1000,
+                labels=dict(labels, step=step),
+            )
+        if deferred:
+            statsd_client.incr("publisher.archive.deferred", labels=labels)
 
     def processArchive(self, archive_id, reset_store=True):
+        """Publish or delete a single archive.
+
+        :return: The number of seconds spent on the archive, or None if
+            there was nothing to do.
+        """
+        start = time.monotonic()
+        deadline = None
+        if self.options.archive_time_budget is not None:
+            deadline = start + self.options.archive_time_budget
+        timings = {}
+        deferred = False
         set_request_started(
             request_statements=LimitedList(10000),
             txn=self.txn,
@@ -590,21 +860,29 @@ def processArchive(self, archive_id, reset_store=True):
                 publisher = self.getPublisher(
                     distribution, archive, allowed_suites
                 )
-                self.publishArchive(archive, publisher)
+                completed = self.publishArchive(
+                    archive, publisher, timings=timings, deadline=deadline
+                )
+                deferred = completed is False
                 work_done = True
             else:
                 work_done = False
         finally:
             clear_request_started()
 
-        if work_done:
-            self.txn.commit()
-            if reset_store:
-                # Reset the store after processing each dirty archive, as
-                # otherwise the process of publishing large archives can
-                # accumulate a large number of alive objects in the Storm
-                # store and cause performance problems.
-                Store.of(archive).reset()
+        if not work_done:
+            return None
+        self.txn.commit()
+        elapsed = time.monotonic() - start
+        self.stanza_cache.reportStatsd()
+        self.reportArchiveTimings(archive, elapsed, timings, deferred)
+        if reset_store:
+            # Reset the store after processing each dirty archive, as
+            # otherwise the process of publishing large archives can
+            # accumulate a large number of alive objects in the Storm store
+            # and cause performance problems.
+            Store.of(archive).reset()
+        return elapsed
 
     def _buildRsyncCommand(self, src, dest, extra_options=None):
         if extra_options is None:
@@ -743,6 +1021,62 @@ def checkForUpdatedOVALData(self, distribution):
                             )
                             break
 
+    def processArchivesConcurrently(self, archive_ids):
+        """Process archives in a pool of worker processes.
+
+        Archives are handed to workers in the given order.  Each archive is
+        processed entirely by a single worker, and a failure to process one
+        archive doesn't stop the others from being processed.
+        """
+        # Make anything we've done so far (such as marking suites dirty
+        # for updated OVAL data) visible to the workers.
+        self.txn.commit()
+        start = time.monotonic()
+        # Spawn fresh interpreters rather than forking, so that no worker
+        # inherits this process's database connection.
+        mp_context = multiprocessing.get_context("spawn")
+        failed = []
+        with ProcessPoolExecutor(
+            max_workers=self.options.archive_workers,
+            mp_context=mp_context,
+            initializer=_init_archive_worker,
+            initargs=(
+                self.__class__,
+                self.name,
+                self.dbuser,
+                self.script_args,
+            ),
+        ) as executor:
+            futures = {
+                executor.submit(
+                    _process_archive_in_worker, archive_id
+                ): archive_id
+                for archive_id in archive_ids
+            }
+            for future in as_completed(futures):
+                archive_id = futures[future]
+                try:
+                    elapsed = future.result()
+                except Exception:
+                    self.logger.exception(
+                        "Failed to process archive %d", archive_id
+                    )
+                    failed.append(archive_id)
+                else:
+                    if elapsed is not None:
+                        self.archive_timings[archive_id] = elapsed
+        self.logger.info(
+            "Processed %d archives with %d workers in %.2f seconds",
+            len(archive_ids),
+            self.options.archive_workers,
+            time.monotonic() - start,
+        )
+        if failed:
+            raise LaunchpadScriptFailure(
+                "Failed to process %d archives: %s"
+                % (len(failed), ", ".join(map(str, sorted(failed))))
+            )
+
     def main(self, reset_store_between_archives=True):
         """See `LaunchpadScript`."""
         self.validateOptions()
@@ -768,9 +1102,16 @@ def main(self, reset_store_between_archives=True):
                     )
                 archive_ids.append(archive.id)
 
-        for archive_id in archive_ids:
-            self.processArchive(
-                archive_id, reset_store=reset_store_between_archives
+        if self.options.archive_workers > 1 and len(archive_ids) > 1:
+            self.processArchivesConcurrently(
+                self.sortArchivesByPendingAge(archive_ids)
             )
+        else:
+            for archive_id in archive_ids:
+                elapsed = self.processArchive(
+                    archive_id, reset_store=reset_store_between_archives
+                )
+                if elapsed is not None:
+                    self.archive_timings[archive_id] = elapsed
 
         self.logger.debug("Ciao")
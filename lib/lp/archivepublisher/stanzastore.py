@@ -0,0 +1,165 @@
+# Copyright 2026 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Persistent stores of rendered archive index stanzas.
+
+Rendering a Packages or Sources stanza requires loading a publication's
+release, files and related objects from the database, which is by far the
+most expensive part of writing an index.  The rendered stanza for a given
+publication never changes, since any override change creates a new
+publication, so we keep the stanzas from the previous publisher run on disk
+and only render those for publications that have appeared since then.
+"""
+
+__all__ = [
+    "IndexStanzaStore",
+    "StanzaStoreEntry",
+]
+
+import json
+import os
+import tempfile
+from collections import namedtuple
+
+from lp.services.osutils import ensure_directory_exists
+
+# A rendered stanza for a single publication, as UTF-8-encoded bytes.
+# `subcomponent` and the `translation_*` fields only apply to binary
+# publications; `translation_key` is the (Package, Description-md5) pair
+# used to avoid duplicate entries in Translation-en.
+StanzaStoreEntry = namedtuple(
+    "StanzaStoreEntry",
+    [
+        "name",
+        "subcomponent",
+        "stanza",
+        "translation_key",
+        "translation_stanza",
+    ],
+    defaults=(None, None, None),
+)
+
+
+def _encode(stanza):
+    return None if stanza is None else stanza.encode("utf-8")
+
+
+def _decode(stanza):
+    return None if stanza is None else stanza.decode("utf-8")
+
+
+class IndexStanzaStore:
+    """The rendered stanzas for one index context.
+
+    An index context is a suite, component and either "source" or an
+    architecture.  Entries are keyed by publication ID.
+    """
+
+    # Bump this if the on-disk format or the way stanzas are rendered
+    # changes, so that existing stores are discarded.
+    format_version = 1
+
+    def __init__(self, path, parameters=None):
+        """Create a store.
+
+        :param path: The file in which to persist this store.
+        :param parameters: A JSON-serialisable dictionary of any other
+            parameters that affect rendering of stanzas in this context.
+            If these differ from those of the persisted store, it is
+            discarded.
+        """
+        self.path = path
+        self.parameters = parameters or {}
+        self.entries = {}
+
+    def load(self):
+        """Load this store from disk.
+
+        :return: True if a usable store was loaded, otherwise False.
+        """
+        self.entries = {}
+        try:
+            with open(self.path) as store_file:
+                data = json.load(store_file)
+        except (FileNotFoundError, ValueError):
+            # A missing or damaged store just means starting from scratch.
+            return False
+        if (
+            data.get("format_version") != self.format_version
+            or data.get("parameters") != self.parameters
+        ):
+            return False
+        for publication_id, entry in data["entries"]:
+            entry = StanzaStoreEntry(*entry)
+            self.entries[publication_id] = entry._replace(
+                stanza=_encode(entry.stanza),
+                translation_key=(
+                    None
+                    if entry.translation_key is None
+                    else tuple(entry.translation_key)
+                ),
+                translation_stanza=_encode(entry.translation_stanza),
+            )
+        return True
+
+    def save(self):
+        """Atomically write this store to disk."""
+        directory = os.path.dirname(self.path)
+        ensure_directory_exists(directory)
+        data = {
+            "format_version": self.format_version,
+            "parameters": self.parameters,
+            "entries": [
+                (
+                    publication_id,
+                    entry._replace(
+                        stanza=_decode(entry.stanza),
+                        translation_stanza=_decode(entry.translation_stanza),
+                    ),
+                )
+                for publication_id, entry in sorted(self.entries.items())
+            ],
+        }
+        fd, temp_path = tempfile.mkstemp(
+            dir=directory, prefix="%s_" % os.path.basename(self.path)
+        )
+        try:
+            with os.fdopen(fd, "w") as store_file:
+                json.dump(data, store_file)
+            os.rename(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def update(self, current_ids, render):
+        """Bring this store up to date with the current publications.
+
+        :param current_ids: The IDs of all the publications that should
+            currently appear in this index.
+        :param render: A callable which takes a set of publication IDs not
+            already in the store and returns an iterable of
+            (publication ID, `StanzaStoreEntry`) pairs for them.
+        :return: A tuple of the numbers of added and removed entries.
+        """
+        current_ids = set(current_ids)
+        removed_ids = set(self.entries) - current_ids
+        for publication_id in removed_ids:
+            del self.entries[publication_id]
+        added_ids = current_ids - set(self.entries)
+        if added_ids:
+            for publication_id, entry in render(added_ids):
+                self.entries[publication_id] = entry
+        return len(added_ids), len(removed_ids)
+
+    def __iter__(self):
+        """Iterate over entries in index order.
+
+        This is the order in which `IPublishingSet.getSourcesForPublishing`
+        and `IPublishingSet.getBinariesForPublishing` return publications:
+        by package name.  Ties, which the database returns in an arbitrary
+        order, are broken by publication ID.
+        """
+        for _, entry in sorted(
+            self.entries.items(), key=lambda item: (item[1].name, item[0])
+        ):
+            yield entry
@@ -59,6 +59,11 @@ def test_primary_config(self):
         self.assertFalse(primary_config.signingautokey)
         self.assertIs(None, primary_config.metaroot)
         self.assertEqual(archiveroot + "-staging", primary_config.stagingroot)
+        self.assertEqual(
+            "%s/ubuntutest-stanzas/%d"
+            % (self.root, self.ubuntutest.main_archive.id),
+            primary_config.stanzaroot,
+        )
 
     def test_primary_config_compat(self):
         # Primary archive configuration is correct.
@@ -243,6 +248,10 @@ def test_ppa_config(self):
         self.assertTrue(self.ppa_config.signingautokey)
         self.assertIs(None, self.ppa_config.metaroot)
         self.assertIs(None, self.ppa_config.stagingroot)
+        self.assertEqual(
+            "/var/tmp/archive/ubuntutest-stanzas/%d" % self.ppa.id,
+            self.ppa_config.stanzaroot,
+        )
 
     def test_private_ppa_separate_root(self):
         # Private PPAs are published to a different location.
@@ -359,3 +368,4 @@ def test_config(self):
             self.ppa_config.temproot,
         )
         self.assertIsNone(self.ppa_config.metaroot)
+        self.assertIsNone(self.ppa_config.stanzaroot)
@@ -5,13 +5,17 @@
 
 # These tests came from sourcerer.
 
+import random
 import unittest
 
+import apt_pkg
+
 from lp.archivepublisher.debversion import (
     BadInputError,
     BadUpstreamError,
     Version,
     VersionError,
+    version_sort_key,
 )
 
 
@@ -131,3 +135,83 @@ def notestNullRevisionIsZero(self):
         """Version should treat an omitted revision as being equal to zero."""
         self.assertEqual(Version("1.0"), Version("1.0-0"))
         self.assertTrue(Version("1.0") == Version("1.0-0"))
+
+
+class VersionSortKeyTests(unittest.TestCase):
+    # Characters from which random versions are built, weighted towards the
+    # ones with interesting ordering behaviour.
+    ALPHABET = "0000111999abzAZ~~~..++--:"
+
+    def setUp(self):
+        super().setUp()
+        apt_pkg.init_system()
+
+    def assertSameOrder(self, x, y):
+        """Sort keys for x and y should compare as apt_pkg does."""
+        expected = apt_pkg.version_compare(x, y)
+        key_x, key_y = version_sort_key(x), version_sort_key(y)
+        observed = (key_x > key_y) - (key_x < key_y)
+        self.assertEqual(
+            (expected > 0) - (expected < 0),
+            observed,
+            "%r vs. %r" % (x, y),
+        )
+
+    def makeVersion(self, rng):
+        """Make a random valid version string."""
+        version = str(rng.randrange(10)) + "".join(
+            rng.choice(self.ALPHABET) for _ in range(rng.randrange(8))
+        )
+        if rng.random() < 0.3:
+            version = "%d:%s" % (rng.randrange(3), version)
+        else:
+            # Colons are only allowed if there is an epoch.
+            version = version.replace(":", ".")
+        if rng.random() < 0.6:
+            version += "-" + "".join(
+                rng.choice(self.ALPHABET.replace(":", ""))
+                for _ in range(rng.randrange(6))
+            )
+        return version
+
+    def mutate(self, rng, version):
+        """Make a small change to the upstream part of a version string."""
+        position = rng.randrange(version.find(":") + 1, len(version) + 1)
+        return version[:position] + rng.choice("0~a.+") + version[position:]
+
+    def testComparisons(self):
+        """Sort keys should order sample versions correctly."""
+        for x, y in VersionTests.COMPARISONS:
+            self.assertLess(version_sort_key(x), version_sort_key(y))
+
+    def testEqualVersions(self):
+        """Versions that compare equal should have equal sort keys."""
+        for x, y in (
+            ("1.0", "1.00"),
+            ("1.0", "0:1.0"),
+            ("1.0", "1.0-0"),
+            ("1.0", "00:1.0-00"),
+        ):
+            self.assertEqual(version_sort_key(x), version_sort_key(y))
+
+    def testLongNumbers(self):
+        """Arbitrarily long numbers should sort numerically."""
+        for x, y in (("9" * 300, "1" * 301), ("1" * 255, "2" * 255)):
+            self.assertLess(version_sort_key(x), version_sort_key(y))
+
+    def testNonASCII(self):
+        """Non-ASCII characters have no defined order."""
+        self.assertRaises(BadInputError, version_sort_key, "1.0\xe9")
+
+    def testMatchesAptRandom(self):
+        """Sort keys should agree with apt_pkg on random versions."""
+        rng = random.Random(0)
+        for _ in range(5000):
+            self.assertSameOrder(self.makeVersion(rng), self.makeVersion(rng))
+
+    def testMatchesAptNearlyEqual(self):
+        """Sort keys should agree with apt_pkg on nearly-equal versions."""
+        rng = random.Random(1)
+        for _ in range(5000):
+            version = self.makeVersion(rng)
+            self.assertSameOrder(version, self.mutate(rng, version))
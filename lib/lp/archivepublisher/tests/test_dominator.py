@@ -9,15 +9,17 @@
 
 import apt_pkg
 import transaction
-from testtools.matchers import GreaterThan, LessThan
+from testtools.matchers import Equals, GreaterThan, LessThan
 from zope.component import getUtility
 from zope.security.proxy import removeSecurityProxy
 
+from lp.archivepublisher.debversion import version_sort_key
 from lp.archivepublisher.domination import (
     STAY_OF_EXECUTION,
     ArchSpecificPublicationsCache,
     Dominator,
     GeneralizedPublication,
+    VersionIndex,
     contains_arch_indep,
     find_live_binary_versions_pass_1,
     find_live_binary_versions_pass_2,
@@ -26,6 +28,7 @@
 from lp.archivepublisher.publishing import Publisher
 from lp.registry.interfaces.pocket import PackagePublishingPocket
 from lp.registry.interfaces.series import SeriesStatus
+from lp.services.database.interfaces import IStore
 from lp.services.log.logger import DevNullLogger
 from lp.soyuz.adapters.packagelocation import PackageLocation
 from lp.soyuz.enums import BinaryPackageFormat, PackagePublishingStatus
@@ -33,9 +36,11 @@
     IPublishingSet,
     ISourcePackagePublishingHistory,
 )
+from lp.soyuz.model.publishing import BinaryPackagePublishingHistory
 from lp.soyuz.tests.test_publishing import TestNativePublishingBase
 from lp.testing import (
     StormStatementRecorder,
+    TestCase,
     TestCaseWithFactory,
     monkey_patch,
 )
@@ -485,6 +490,55 @@ def test_atomic_domination_respects_overrides(self):
                 super_bins, PackagePublishingStatus.PUBLISHED
             )
 
+    def test_dominate_query_count_is_constant(self):
+        # Domination loads, plans and supersedes publications in bulk, so
+        # the number of queries it issues doesn't depend on the number of
+        # packages being dominated.
+        def dominate_packages(count):
+            archive = self.factory.makeArchive(distribution=self.ubuntutest)
+            sources = []
+            binaries = []
+            for i in range(count):
+                for version in ("1.0", "1.1"):
+                    source = self.getPubSource(
+                        sourcename="foo%d" % i,
+                        version=version,
+                        archive=archive,
+                        status=PackagePublishingStatus.PUBLISHED,
+                    )
+                    sources.append(source)
+                    binaries.append(
+                        self.getPubBinaries(
+                            binaryname="foo%d-bin" % i,
+                            pub_source=source,
+                            with_debug=True,
+                            status=PackagePublishingStatus.PUBLISHED,
+                        )
+                    )
+            dominator = Dominator(self.logger, archive)
+            IStore(BinaryPackagePublishingHistory).invalidate()
+            with StormStatementRecorder() as recorder:
+                dominator.dominateBinaries(
+                    self.distroseries, PackagePublishingPocket.RELEASE
+                )
+                dominator.dominateSources(
+                    self.distroseries, PackagePublishingPocket.RELEASE
+                )
+            # The older versions were dominated, along with their DDEBs.
+            self.checkPublications(
+                sources[0::2] + sum(binaries[0::2], []),
+                PackagePublishingStatus.SUPERSEDED,
+            )
+            self.checkPublications(
+                sources[1::2] + sum(binaries[1::2], []),
+                PackagePublishingStatus.PUBLISHED,
+            )
+            return recorder
+
+        recorder1 = dominate_packages(2)
+        recorder2 = dominate_packages(4)
+        self.assertThat(recorder2, HasQueryCount.byEquality(recorder1))
+
     def test_dominateBinaries_handles_double_arch_indep_override(self):
         # If there are multiple identical publications of an
         # architecture-independent binary, dominateBinaries leaves the most
@@ -810,11 +864,57 @@ def alter_creation_dates(spphs, ages):
         spph.datecreated -= age
 
 
+class TestVersionIndex(TestCase):
+    """Test the shared `VersionIndex`."""
+
+    def test_keys_in_debian_order(self):
+        versions = ["1.10", "1.1~rc1", "1.1", "1.1.0", "1:0.9", "1.1ubuntu0"]
+        index = VersionIndex()
+        self.assertEqual(
+            sorted(versions, key=cmp_to_key(apt_pkg.version_compare)),
+            sorted(versions, key=index.__getitem__),
+        )
+        self.assertEqual(
+            len(versions), len({index[version] for version in versions})
+        )
+
+    def test_equal_versions_have_equal_keys(self):
+        # Versions that are spelt differently but compare equal have equal
+        # keys.
+        index = VersionIndex()
+        self.assertEqual(index["1.0"], index["1.00"])
+        self.assertEqual(index["1.0"], index["0:1.0"])
+        self.assertLess(index["1.0"], index["1.1"])
+
+    def test_memoises_keys(self):
+        # Keys are computed on first use and then remembered.
+        index = VersionIndex()
+        self.assertNotIn("1.0", index)
+        self.assertEqual(version_sort_key("1.0"), index["1.0"])
+        self.assertIn("1.0", index)
+        self.assertNotIn("2.0", index)
+
+
 class TestGeneralizedPublication(TestCaseWithFactory):
     """Test publication generalization helpers."""
 
     layer = ZopelessDatabaseLayer
 
+    def test_sortPublications_with_version_index(self):
+        # Sorting using a VersionIndex gives the same order as sorting
+        # using `compare`, including ties broken by creation date.
+        versions = ["1.1.0", "1.10", "1.1", "1.1ubuntu0", "1.1", "1.01"]
+        spphs = make_spphs_for_versions(self.factory, versions)
+        alter_creation_dates(
+            spphs, [datetime.timedelta(age) for age in range(len(spphs))]
+        )
+        self.assertEqual(
+            GeneralizedPublication().sortPublications(spphs),
+            GeneralizedPublication(
+                version_index=VersionIndex()
+            ).sortPublications(spphs),
+        )
+
     def test_getPackageVersion_gets_source_version(self):
         spph = self.factory.makeSourcePackagePublishingHistory()
         self.assertEqual(
@@ -1813,6 +1913,39 @@ def test_hasArchSpecificPublications_is_consistent_and_correct(self):
             ],
         )
 
+    def test_prefetch(self):
+        # prefetch looks up the answers for many publications at once, so
+        # that hasArchSpecificPublications doesn't need to query the
+        # database.
+        spr1 = self.makeSPR()
+        dependent = self.makeBPPH(spr1, arch_specific=True)
+        bpph1 = self.makeBPPH(
+            spr1,
+            arch_specific=False,
+            archive=dependent.archive,
+            distroseries=dependent.distroseries,
+        )
+        bpph2 = self.makeBPPH(
+            arch_specific=False,
+            archive=dependent.archive,
+            distroseries=dependent.distroseries,
+        )
+        cache = self.makeCache()
+        with StormStatementRecorder() as recorder:
+            cache.prefetch([bpph1, bpph2])
+        self.assertThat(recorder, HasQueryCount(LessThan(4)))
+        with StormStatementRecorder() as recorder:
+            self.assertEqual(
+                [True, False],
+                [
+                    cache.hasArchSpecificPublications(bpph1),
+                    cache.hasArchSpecificPublications(bpph2),
+                ],
+            )
+            # Prefetching the same publications again does nothing.
+            cache.prefetch([bpph1, bpph2])
+        self.assertThat(recorder, HasQueryCount(Equals(0)))
+
     def test_hasArchSpecificPublications_caches_results(self):
         # Results are cached, so once the presence of archive-specific
         # publications has been looked up in the database, the query is
@@ -0,0 +1,144 @@
+# Copyright 2026 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for computing digests of archive files."""
+
+import bz2
+import gzip
+import hashlib
+import lzma
+import os.path
+
+from lp.archivepublisher.filehasher import FileHasher
+from lp.testing import TestCase
+
+
+class TestFileHasher(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = self.makeTemporaryDirectory()
+
+    def makeFile(self, name, content):
+        path = os.path.join(self.root, name)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def expectedDigests(self, content):
+        return {
+            "md5": hashlib.md5(content).hexdigest(),
+            "sha1": hashlib.sha1(content).hexdigest(),
+            "sha256": hashlib.sha256(content).hexdigest(),
+        }
+
+    def test_getDigests(self):
+        # All the requested digests are computed in one pass.
+        content = b"Package: foo\n" * 1000
+        path = self.makeFile("Packages", content)
+        hasher = FileHasher()
+        hasher.chunk_size = 1000
+        self.assertEqual(
+            (len(content), self.expectedDigests(content)),
+            hasher.getDigests(path),
+        )
+        self.assertEqual(len(content), hasher.bytes_hashed)
+        self.assertEqual(0, hasher.bytes_reused)
+
+    def test_getDigests_algorithms(self):
+        # The hasher only computes the algorithms it was asked for.
+        path = self.makeFile("Packages", b"foo")
+        self.assertEqual(
+            (3, {"sha256": hashlib.sha256(b"foo").hexdigest()}),
+            FileHasher(["sha256"]).getDigests(path),
+        )
+
+    def test_getDigests_empty(self):
+        path = self.makeFile("Packages", b"")
+        self.assertEqual(
+            (0, self.expectedDigests(b"")), FileHasher().getDigests(path)
+        )
+
+    def test_getDigests_decompress(self):
+        # The hasher can compute digests of decompressed files.
+        content = b"Package: foo\n" * 1000
+        hasher = FileHasher()
+        for suffix, compress in (
+            (".gz", gzip.compress),
+            (".bz2", bz2.compress),
+            (".xz", lzma.compress),
+        ):
+            path = self.makeFile("Packages" + suffix, compress(content))
+            self.assertEqual(
+                (len(content), self.expectedDigests(content)),
+                hasher.getDigests(path, decompress=True),
+            )
+            self.assertEqual(
+                (
+                    os.path.getsize(path),
+                    self.expectedDigests(compress(content)),
+                ),
+                hasher.getDigests(path),
+            )
+
+    def test_getDigests_decompress_multiple_streams(self):
+        # Concatenated compressed streams are decompressed in full.
+        path = self.makeFile(
+            "Packages.gz", gzip.compress(b"foo") + gzip.compress(b"bar")
+        )
+        hasher = FileHasher()
+        hasher.chunk_size = 10
+        self.assertEqual(
+            (6, self.expectedDigests(b"foobar")),
+            hasher.getDigests(path, decompress=True),
+        )
+
+    def test_getDigests_decompress_remembers_compressed(self):
+        # Decompressing a file also computes the digests of the compressed
+        # file, so it doesn't need to be read again.
+        compressed = gzip.compress(b"foo")
+        path = self.makeFile("Packages.gz", compressed)
+        hasher = FileHasher()
+        hasher.getDigests(path, decompress=True)
+        self.assertEqual(
+            (len(compressed), self.expectedDigests(compressed)),
+            hasher.getDigests(path),
+        )
+        self.assertEqual(len(compressed), hasher.bytes_hashed)
+        self.assertEqual(len(compressed), hasher.bytes_reused)
+
+    def test_getDigests_memoised(self):
+        # Digests of an unchanged file are reused.
+        path = self.makeFile("Packages", b"foo")
+        hasher = FileHasher()
+        digests = hasher.getDigests(path)
+        os.chmod(path, 0)
+        self.assertEqual(digests, hasher.getDigests(path))
+        self.assertEqual(3, hasher.bytes_hashed)
+        self.assertEqual(3, hasher.bytes_reused)
+
+    def test_getDigests_replaced(self):
+        # A file that is replaced is hashed again, even if its size and
+        # modification time are unchanged.
+        path = self.makeFile("Packages", b"foo")
+        hasher = FileHasher()
+        hasher.getDigests(path)
+        path_stat = os.stat(path)
+        new_path = self.makeFile("Packages.new", b"bar")
+        os.utime(new_path, ns=(path_stat.st_atime_ns, path_stat.st_mtime_ns))
+        os.rename(new_path, path)
+        self.assertEqual(
+            (3, self.expectedDigests(b"bar")), hasher.getDigests(path)
+        )
+        self.assertEqual(6, hasher.bytes_hashed)
+        self.assertEqual(0, hasher.bytes_reused)
+
+    def test_getDigests_modified(self):
+        # A file that is modified in place is hashed again.
+        path = self.makeFile("Packages", b"foo")
+        hasher = FileHasher()
+        hasher.getDigests(path)
+        with open(path, "ab") as f:
+            f.write(b"bar")
+        self.assertEqual(
+            (6, self.expectedDigests(b"foobar")), hasher.getDigests(path)
+        )
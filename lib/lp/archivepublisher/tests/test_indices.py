@@ -8,12 +8,16 @@
 import unittest
 
 import apt_pkg
+from testtools.matchers import Equals, MatchesListwise
 
 from lp.archivepublisher.indices import (
+    IndexStanzaCache,
     IndexStanzaFields,
     build_binary_stanza_fields,
     build_source_stanza_fields,
 )
+from lp.services.statsd.tests import StatsMixin
+from lp.soyuz.enums import PackagePublishingPriority
 from lp.soyuz.tests.test_publishing import TestNativePublishingBase
 
 
@@ -496,6 +500,133 @@ def test_source_with_correct_dsc_binaries(self):
         self.assertEqual("foo_bin,\n bar_bin,\n zed_bin", section["Binary"])
 
 
+class TestIndexStanzaCache(StatsMixin, TestNativePublishingBase):
+    """Tests for caching rendered index stanzas."""
+
+    def getBinaryStanza(self, cache, bpph, **kwargs):
+        args = {
+            "component": bpph.component,
+            "section": bpph.section,
+            "priority": bpph.priority,
+            "phased_update_percentage": bpph.phased_update_percentage,
+        }
+        args.update(kwargs)
+        return cache.getBinaryStanza(bpph.binarypackagerelease, **args)
+
+    def test_source_stanza(self):
+        # The cache returns the encoded output of
+        # build_source_stanza_fields, and renders it only once.
+        pub_source = self.getPubSource()
+        cache = IndexStanzaCache()
+        expected = build_spph_stanza(pub_source).makeOutput().encode("utf-8")
+        for _ in range(2):
+            self.assertEqual(
+                expected,
+                cache.getSourceStanza(
+                    pub_source.sourcepackagerelease,
+                    pub_source.component,
+                    pub_source.section,
+                ),
+            )
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    def test_binary_stanza_shared_between_architectures(self):
+        # Architecture-independent binaries are rendered once for all
+        # architectures.
+        pub_binaries = self.getPubBinaries()
+        self.assertEqual(2, len(pub_binaries))
+        cache = IndexStanzaCache()
+        for pub_binary in pub_binaries:
+            self.assertEqual(
+                build_bpph_stanza(pub_binary).makeOutput().encode("utf-8"),
+                self.getBinaryStanza(cache, pub_binary),
+            )
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    def test_binary_stanza_overrides(self):
+        # Stanzas are cached separately for each set of overrides.
+        pub_binary = self.getPubBinaries()[0]
+        cache = IndexStanzaCache()
+        default = self.getBinaryStanza(cache, pub_binary)
+        phased = self.getBinaryStanza(
+            cache, pub_binary, phased_update_percentage=50
+        )
+        extra = self.getBinaryStanza(
+            cache, pub_binary, priority=PackagePublishingPriority.EXTRA
+        )
+        short = self.getBinaryStanza(
+            cache, pub_binary, separate_long_descriptions=True
+        )
+        self.assertEqual(4, len({default, phased, extra, short}))
+        self.assertIn(b"Phased-Update-Percentage: 50", phased)
+        self.assertIn(b"Priority: extra", extra)
+        self.assertIn(b"Description-md5:", short)
+        self.assertEqual((0, 4), (cache.hits, cache.misses))
+
+    def test_eviction(self):
+        # Once the cache is full, the least recently used stanzas are
+        # evicted.
+        pub_sources = [
+            self.getPubSource(sourcename="foo%d" % i) for i in range(3)
+        ]
+        stanzas = [
+            build_spph_stanza(pub_source).makeOutput().encode("utf-8")
+            for pub_source in pub_sources
+        ]
+        cache = IndexStanzaCache(
+            max_size=len(stanzas[0]) + len(stanzas[1]) + 1
+        )
+
+        def get(i):
+            return cache.getSourceStanza(
+                pub_sources[i].sourcepackagerelease,
+                pub_sources[i].component,
+                pub_sources[i].section,
+            )
+
+        get(0)
+        get(1)
+        get(0)
+        get(2)
+        self.assertEqual(2, len(cache))
+        self.assertEqual(1, cache.evictions)
+        self.assertLessEqual(cache.size, cache.max_size)
+        # foo1 was the least recently used, so it was evicted.
+        get(0)
+        self.assertEqual(2, cache.hits)
+        get(1)
+        self.assertEqual(4, cache.misses)
+
+    def test_reportStatsd(self):
+        # Hits, misses and evictions since the last report are sent to
+        # statsd.
+        self.setUpStats()
+        pub_binaries = self.getPubBinaries()
+        cache = IndexStanzaCache()
+        for pub_binary in pub_binaries:
+            self.getBinaryStanza(cache, pub_binary)
+        cache.reportStatsd()
+        self.assertThat(
+            [call[0] for call in self.stats_client.incr.call_args_list],
+            MatchesListwise(
+                [
+                    Equals(("publisher.stanza_cache.hits,env=test", 1)),
+                    Equals(("publisher.stanza_cache.misses,env=test", 1)),
+                ]
+            ),
+        )
+        self.stats_client.gauge.assert_called_once_with(
+            "publisher.stanza_cache.size,env=test", cache.size
+        )
+
+        self.stats_client.incr.reset_mock()
+        self.getBinaryStanza(cache, pub_binaries[0])
+        cache.reportStatsd()
+        self.stats_client.incr.assert_called_once_with(
+            "publisher.stanza_cache.hits,env=test", 1
+        )
+
+
 class TestIndexStanzaFieldsHelper(unittest.TestCase):
     """Check how this auxiliary class works...
 
@@ -6,6 +6,8 @@
 import os
 import shutil
 import subprocess
+import time
+from datetime import datetime, timedelta, timezone
 from optparse import OptionValueError
 from pathlib import Path
 from unittest.mock import call
@@ -79,6 +81,7 @@ def runPublishDistro(self, extra_args=None, distribution="ubuntutest"):
         switch_dbuser(config.archivepublisher.dbuser)
         publish_distro.main()
         switch_dbuser("launchpad")
+        return publish_distro
 
     def runPublishDistroScript(self):
         """Run publish-distro.py, returning the result and output."""
@@ -773,6 +776,52 @@ def testForPPA(self):
         with open(bar_path) as bar:
             self.assertEqual("bar", bar.read().strip())
 
+    def testArchiveWorkers(self):
+        """With --archive-workers, archives are published concurrently.
+
+        Each archive is published by one of a pool of spawned worker
+        processes, and the time spent on it is reported back.
+        """
+        archives = [
+            getUtility(IPersonSet).getByName(name).archive
+            for name in ("cprov", "name16")
+        ]
+        pub_source_ids = []
+        for archive in archives:
+            removeSecurityProxy(archive).distribution = self.ubuntutest
+            pub_source_ids.append(
+                self.getPubSource(
+                    sourcename=archive.owner.name,
+                    filecontent=archive.owner.name.encode(),
+                    archive=archive,
+                ).id
+            )
+        archive_ids = [archive.id for archive in archives]
+        self.layer.txn.commit()
+
+        script = self.runPublishDistro(["--ppa", "--archive-workers=2"])
+
+        for pub_source_id in pub_source_ids:
+            self.assertEqual(
+                PackagePublishingStatus.PUBLISHED,
+                self.loadPubSource(pub_source_id).status,
+            )
+        for name in ("cprov", "name16"):
+            path = os.path.join(
+                config.personalpackagearchive.root,
+                name,
+                "ppa/ubuntutest/pool/main/%s/%s/%s_666.dsc"
+                % (name[0], name, name),
+            )
+            with open(path) as dsc:
+                self.assertEqual(name, dsc.read().strip())
+        self.assertEqual(sorted(archive_ids), sorted(script.archive_timings))
+        for elapsed in script.archive_timings.values():
+            self.assertGreater(elapsed, 0)
+        self.assertIn(
+            "Processed 2 archives with 2 workers", self.logger.getLogBuffer()
+        )
+
     @defer.inlineCallbacks
     def testForPrivatePPA(self):
         """Run publish-distro in private PPA mode.
@@ -1125,6 +1174,7 @@ def __init__(self, distribution, purpose=ArchivePurpose.PRIMARY):
         self.status = ArchiveStatus.ACTIVE
         self.dirty_suites = []
         self.publishing_method = ArchivePublishingMethod.LOCAL
+        self.reference = "fake-archive"
 
 
 class FakePublisher:
@@ -1140,6 +1190,7 @@ def __init__(self):
         self.D_writeReleaseFiles = FakeMethod()
         self.createSeriesAliases = FakeMethod()
         self.markSuiteDirty = FakeMethod()
+        self.dirty_suites = set()
 
 
 class TestPublishDistroMethods(TestCaseWithFactory):
@@ -1269,6 +1320,26 @@ def test_validateOptions_does_not_accept_distsroot_for_private_ppa(self):
         script = self.makeScript(args=["--private-ppa", "--distsroot=/tmp"])
         self.assertRaises(OptionValueError, script.validateOptions)
 
+    def test_validateOptions_rejects_nonpositive_index_workers(self):
+        # At least one index worker is required.
+        script = self.makeScript(args=["--index-workers=0"])
+        self.assertRaises(OptionValueError, script.validateOptions)
+
+    def test_validateOptions_rejects_nonpositive_by_hash_workers(self):
+        # At least one by-hash worker is required.
+        script = self.makeScript(args=["--by-hash-workers=0"])
+        self.assertRaises(OptionValueError, script.validateOptions)
+
+    def test_validateOptions_rejects_nonpositive_archive_workers(self):
+        # At least one archive worker is required.
+        script = self.makeScript(args=["--archive-workers=0"])
+        self.assertRaises(OptionValueError, script.validateOptions)
+
+    def test_validateOptions_rejects_nonpositive_archive_time_budget(self):
+        # An archive time budget must be positive.
+        script = self.makeScript(args=["--archive-time-budget=0"])
+        self.assertRaises(OptionValueError, script.validateOptions)
+
     def test_validateOptions_accepts_all_derived_without_distro(self):
         # If --all-derived is given, the --distribution option is not
         # required.
@@ -1702,6 +1773,45 @@ def test_getPublisher_returns_publisher(self):
         publisher = script.getPublisher(distro, distro.main_archive, None)
         self.assertIsInstance(publisher, Publisher)
 
+    def test_getPublisher_passes_index_workers(self):
+        # getPublisher configures the Publisher with the number of index
+        # workers requested on the command line.
+        distro = self.makeDistro()
+        script = self.makeScript(distro, ["--index-workers=4"])
+        publisher = script.getPublisher(distro, distro.main_archive, None)
+        self.assertEqual(4, publisher.index_workers)
+
+    def test_getPublisher_passes_by_hash_workers(self):
+        # getPublisher configures the Publisher with the number of by-hash
+        # workers requested on the command line.
+        distro = self.makeDistro()
+        script = self.makeScript(distro, ["--by-hash-workers=4"])
+        publisher = script.getPublisher(distro, distro.main_archive, None)
+        self.assertEqual(4, publisher.by_hash_workers)
+
+    def test_getPublisher_shares_stanza_cache(self):
+        # All publishers created by a script share a single stanza cache.
+        distro = self.makeDistro()
+        script = self.makeScript(distro)
+        ppa = self.factory.makeArchive(distro, purpose=ArchivePurpose.PPA)
+        publishers = [
+            script.getPublisher(distro, archive, None)
+            for archive in (distro.main_archive, ppa)
+        ]
+        self.assertIs(script.stanza_cache, publishers[0].stanza_cache)
+        self.assertIs(script.stanza_cache, publishers[1].stanza_cache)
+
+    def test_getPublisher_passes_incremental_indexes(self):
+        # getPublisher configures the Publisher for incremental index
+        # generation if requested on the command line.
+        distro = self.makeDistro()
+        script = self.makeScript(distro)
+        publisher = script.getPublisher(distro, distro.main_archive, None)
+        self.assertFalse(publisher.incremental_indexes)
+        script = self.makeScript(distro, ["--incremental-indexes"])
+        publisher = script.getPublisher(distro, distro.main_archive, None)
+        self.assertTrue(publisher.incremental_indexes)
+
     def test_deleteArchive_deletes_ppa(self):
         # If fed a PPA, deleteArchive will properly delete it (and
         # return True to indicate it's done something that needs
@@ -1809,6 +1919,62 @@ def test_publishArchive_writes_own_indexes_for_ppa(self):
         self.assertEqual(0, publisher.C_doFTPArchive.call_count)
         self.assertEqual(1, publisher.C_writeIndexes.call_count)
 
+    def test_publishArchive_records_step_timings(self):
+        # publishArchive records how long each publisher step took.
+        distro = self.makeDistro()
+        script = self.makeScript(distro)
+        script.txn = FakeTransaction()
+        timings = {}
+        self.assertTrue(
+            script.publishArchive(
+                FakeArchive(distro), FakePublisher(), timings=timings
+            )
+        )
+        self.assertEqual(
+            ["publish", "dominate", "index", "release"], list(timings)
+        )
+
+    def test_publishArchive_defers_work_over_budget(self):
+        # If an archive's time budget runs out after publishing, the
+        # remaining steps are left to the next run by marking the touched
+        # suites dirty.
+        distro = self.makeDistro()
+        script = self.makeScript(distro)
+        script.txn = FakeTransaction()
+        series = self.factory.makeDistroSeries(distribution=distro)
+        archive = FakeArchive(distro, ArchivePurpose.PPA)
+        archive.dirty_suites = [series.name]
+        publisher = FakePublisher()
+        publisher.dirty_suites = {"published"}
+        self.assertFalse(
+            script.publishArchive(
+                archive, publisher, deadline=time.monotonic() - 1
+            )
+        )
+        self.assertEqual(1, publisher.A_publish.call_count)
+        self.assertEqual(0, publisher.B_dominate.call_count)
+        self.assertEqual(0, publisher.C_writeIndexes.call_count)
+        self.assertEqual(0, publisher.D_writeReleaseFiles.call_count)
+        self.assertEqual(
+            sorted([series.name, "published"]), archive.dirty_suites
+        )
+
+    def test_publishArchive_finishes_within_budget(self):
+        # An archive that finishes within its time budget is published as
+        # usual.
+        distro = self.makeDistro()
+        script = self.makeScript(distro)
+        script.txn = FakeTransaction()
+        archive = FakeArchive(distro, ArchivePurpose.PPA)
+        publisher = FakePublisher()
+        self.assertTrue(
+            script.publishArchive(
+                archive, publisher, deadline=time.monotonic() + 3600
+            )
+        )
+        self.assertEqual(1, publisher.D_writeReleaseFiles.call_count)
+        self.assertIsNone(archive.dirty_suites)
+
     def test_processArchive_resets_store(self):
         # The store is reset after processing each archive, as otherwise a
         # large number of alive objects in the store can cause performance
@@ -1850,7 +2016,64 @@ def test_publishes_only_selected_archives(self):
         self.assertEqual(distro, distro_arg)
         self.assertEqual(archive, archive_arg)
         self.assertEqual(
-            [((archive, publisher), {})], script.publishArchive.calls
+            [((archive, publisher), {"timings": {}, "deadline": None})],
+            script.publishArchive.calls,
+        )
+
+    def test_main_processes_archives_concurrently(self):
+        # With --archive-workers, the script hands the archives to a pool
+        # of workers, oldest pending publications first.
+        distro = self.makeDistro()
+        script = self.makeScript(args=["--archive-workers=2"])
+        script.txn = FakeTransaction()
+        script.findDistros = FakeMethod([distro])
+        archives = [
+            self.factory.makeArchive(distribution=distro) for _ in range(2)
+        ]
+        script.getTargetArchives = FakeMethod(archives)
+        script.sortArchivesByPendingAge = FakeMethod(
+            [archives[1].id, archives[0].id]
+        )
+        script.processArchivesConcurrently = FakeMethod()
+        script.processArchive = FakeMethod()
+        script.main()
+        self.assertEqual(
+            [(([archives[1].id, archives[0].id],), {})],
+            script.processArchivesConcurrently.calls,
+        )
+        self.assertEqual(0, script.processArchive.call_count)
+
+    def test_sortArchivesByPendingAge(self):
+        # Archives are sorted by their oldest pending publication.  Those
+        # with no pending publications come first.
+        distro = self.makeDistro()
+        script = self.makeScript(distro)
+        now = datetime.now(timezone.utc)
+        archives = [
+            self.factory.makeArchive(distribution=distro) for _ in range(4)
+        ]
+        for archive, age in ((archives[0], 1), (archives[1], 3)):
+            self.factory.makeSourcePackagePublishingHistory(
+                archive=archive,
+                status=PackagePublishingStatus.PENDING,
+                date_uploaded=now - timedelta(hours=age),
+            )
+        self.factory.makeBinaryPackagePublishingHistory(
+            archive=archives[2],
+            status=PackagePublishingStatus.PENDING,
+            datecreated=now - timedelta(hours=2),
+        )
+        # Published publications don't count.
+        self.factory.makeSourcePackagePublishingHistory(
+            archive=archives[0],
+            status=PackagePublishingStatus.PUBLISHED,
+            date_uploaded=now - timedelta(hours=4),
+        )
+        self.assertEqual(
+            [archives[3].id, archives[1].id, archives[2].id, archives[0].id],
+            script.sortArchivesByPendingAge(
+                [archive.id for archive in archives]
+            ),
         )
 
     def setUpOVALDataRsync(self):
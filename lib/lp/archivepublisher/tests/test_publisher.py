@@ -75,7 +75,7 @@
 from lp.services.database.sqlbase import flush_database_caches
 from lp.services.gpg.interfaces import IGPGHandler
 from lp.services.log.logger import BufferLogger, DevNullLogger
-from lp.services.osutils import open_for_writing
+from lp.services.osutils import open_for_writing, write_file
 from lp.services.utils import file_exists
 from lp.soyuz.enums import (
     ArchivePublishingMethod,
@@ -1971,6 +1971,106 @@ def testPPAArchiveIndexCompressors(self):
                 archive_publisher, uncompressed_file_path, [".xz"]
             )
 
+    def testPPAArchiveIndexParallel(self):
+        # Writing indexes using a pool of worker processes produces exactly
+        # the same files as writing them serially.
+        archive_publisher = self.setupPPAArchiveIndexTest(
+            long_descriptions=False,
+            index_compressors=[
+                IndexCompressionType.UNCOMPRESSED,
+                IndexCompressionType.GZIP,
+                IndexCompressionType.BZIP2,
+                IndexCompressionType.XZ,
+            ],
+        )
+        suite_path = os.path.join(
+            archive_publisher._config.distsroot, "breezy-autotest"
+        )
+
+        def read_indexes():
+            contents = {}
+            for dirpath, _, filenames in os.walk(suite_path):
+                for filename in filenames:
+                    if filename.startswith(("Packages", "Sources", "Trans")):
+                        path = os.path.join(dirpath, filename)
+                        with open(path, "rb") as f:
+                            contents[path] = f.read()
+            return contents
+
+        serial_indexes = read_indexes()
+        self.assertNotEqual({}, serial_indexes)
+        for path in serial_indexes:
+            os.unlink(path)
+
+        archive_publisher.index_workers = 2
+        archive_publisher.C_writeIndexes(False)
+        self.assertEqual(serial_indexes, read_indexes())
+
+        # remove PPA root
+        shutil.rmtree(config.personalpackagearchive.root)
+
+    def testPPAArchiveIndexIncremental(self):
+        # Incremental index generation produces the same files as
+        # generating indexes from scratch, both when building the stanza
+        # stores and when updating them with new publications.
+        archive_publisher = self.setupPPAArchiveIndexTest(
+            long_descriptions=False
+        )
+        suite_path = os.path.join(
+            archive_publisher._config.distsroot, "breezy-autotest"
+        )
+
+        def read_indexes():
+            contents = {}
+            for dirpath, _, filenames in os.walk(suite_path):
+                for filename in filenames:
+                    if filename.startswith(("Packages", "Sources", "Trans")):
+                        path = os.path.join(dirpath, filename)
+                        with open(path, "rb") as f:
+                            contents[path] = f.read()
+            return contents
+
+        full_indexes = read_indexes()
+        archive_publisher.incremental_indexes = True
+        archive_publisher.C_writeIndexes(False)
+        self.assertEqual(full_indexes, read_indexes())
+        store_path = os.path.join(
+            archive_publisher._config.stanzaroot,
+            "breezy-autotest",
+            "main",
+            "binary-i386",
+        )
+        self.assertTrue(os.path.exists(store_path))
+
+        # Publish another package, and check that only its publications
+        # are rendered.
+        archive_publisher.log = BufferLogger()
+        pub_source = self.getPubSource(
+            sourcename="bar",
+            filename="bar_1.dsc",
+            filecontent=b"Hello bar",
+            status=PackagePublishingStatus.PENDING,
+            archive=archive_publisher.archive,
+        )
+        self.getPubBinaries(pub_source=pub_source, binaryname="bar-bin")
+        archive_publisher.A_publish(False)
+        self.layer.txn.commit()
+        archive_publisher.C_writeIndexes(False)
+        self.assertIn(
+            "Updated stanza store breezy-autotest/main/binary-i386: "
+            "1 added, 0 removed",
+            archive_publisher.log.getLogBuffer(),
+        )
+        incremental_indexes = read_indexes()
+        self.assertNotEqual(full_indexes, incremental_indexes)
+
+        archive_publisher.incremental_indexes = False
+        archive_publisher.C_writeIndexes(False)
+        self.assertEqual(read_indexes(), incremental_indexes)
+
+        # remove PPA root
+        shutil.rmtree(config.personalpackagearchive.root)
+
     def testDirtyingPocketsWithDeletedPackages(self):
         """Test that dirtying pockets with deleted packages works.
 
@@ -3201,6 +3301,36 @@ def testReadIndexFileHashesCompression(self):
             )
             os.remove(path + suffix)
 
+    def testReadIndexFileHashesReusesDigests(self):
+        """_readIndexFileHashes only reads an unchanged file once."""
+        publisher = Publisher(
+            self.logger,
+            self.config,
+            self.disk_pool,
+            self.ubuntutest.main_archive,
+        )
+        path = os.path.join(
+            publisher._config.distsroot, "breezy-autotest", "Test"
+        )
+        write_file(path, b"test")
+        hashes = publisher._readIndexFileHashes("breezy-autotest", "Test")
+        self.assertEqual(
+            hashes, publisher._readIndexFileHashes("breezy-autotest", "Test")
+        )
+        self.assertEqual(4, publisher.file_hasher.bytes_hashed)
+        self.assertEqual(4, publisher.file_hasher.bytes_reused)
+
+        # A replaced file is read again.
+        os.unlink(path)
+        write_file(path, b"other")
+        self.assertEqual(
+            hashlib.sha256(b"other").hexdigest(),
+            publisher._readIndexFileHashes("breezy-autotest", "Test")[
+                "sha256"
+            ]["sha256"],
+        )
+        self.assertEqual(9, publisher.file_hasher.bytes_hashed)
+
 
 class TestArchiveIndices(TestPublisherBase):
     """Tests for the native publisher's index generation.
@@ -3365,6 +3495,24 @@ def testWorldAndGroupReadablePackagesAndSources(self):
             )
 
 
+class TestParallelArchiveIndices(TestArchiveIndices):
+    """Tests for index generation using a pool of worker processes."""
+
+    def runStepC(self, publisher):
+        """Run the index generation step of the publisher in parallel."""
+        publisher.index_workers = 2
+        publisher.C_writeIndexes(False)
+
+
+class TestIncrementalArchiveIndices(TestArchiveIndices):
+    """Tests for incremental index generation using stanza stores."""
+
+    def runStepC(self, publisher):
+        """Run the incremental index generation step of the publisher."""
+        publisher.incremental_indexes = True
+        publisher.C_writeIndexes(False)
+
+
 class TestFtparchiveIndices(TestArchiveIndices):
     """Tests for the apt-ftparchive publisher's index generation."""
 
@@ -3572,6 +3720,51 @@ def test_initial(self):
             ],
         )
 
+    def test_initial_by_hash_workers(self):
+        # New by-hash files may be uploaded to the librarian concurrently.
+        # The digests recorded for them are those of the files on disk.
+        self.breezy_autotest.publish_by_hash = True
+        self.breezy_autotest.advertise_by_hash = True
+        publisher = Publisher(
+            self.logger,
+            self.config,
+            self.disk_pool,
+            self.ubuntutest.main_archive,
+            by_hash_workers=4,
+        )
+        self.getPubSource(filecontent=b"Source: foo\n")
+        self.runSteps(publisher, step_a=True, step_c=True, step_d=True)
+        flush_database_caches()
+
+        suite_path = partial(
+            os.path.join, self.config.distsroot, "breezy-autotest"
+        )
+        main_contents = set()
+        for name in ("Release", "Sources.gz", "Sources.bz2"):
+            with open(suite_path("main", "source", name), "rb") as f:
+                main_contents.add(f.read())
+        self.assertThat(
+            suite_path("main", "source", "by-hash"),
+            ByHashHasContents(main_contents),
+        )
+
+        archive_files = list(
+            getUtility(IArchiveFileSet).getByArchive(
+                self.ubuntutest.main_archive
+            )
+        )
+        self.assertNotEqual([], archive_files)
+        for archive_file in archive_files:
+            path = os.path.join(
+                self.config.distsroot, archive_file.path[len("dists/") :]
+            )
+            with open(path, "rb") as f:
+                content = f.read()
+            lfc = archive_file.library_file.content
+            self.assertEqual(hashlib.md5(content).hexdigest(), lfc.md5)
+            self.assertEqual(hashlib.sha1(content).hexdigest(), lfc.sha1)
+            self.assertEqual(hashlib.sha256(content).hexdigest(), lfc.sha256)
+
     def test_subsequent(self):
         # A subsequent publisher run updates by-hash directories where
         # necessary, and marks inactive index files for later deletion.
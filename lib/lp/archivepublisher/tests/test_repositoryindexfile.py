@@ -12,7 +12,7 @@
 import tempfile
 import unittest
 
-from lp.archivepublisher.utils import RepositoryIndexFile
+from lp.archivepublisher.utils import ParallelIndexWriter, RepositoryIndexFile
 from lp.soyuz.enums import IndexCompressionType
 
 
@@ -31,7 +31,7 @@ def tearDown(self):
         for path in [self.root, self.temp_root]:
             shutil.rmtree(path)
 
-    def getRepoFile(self, filename, compressors=None):
+    def getRepoFile(self, filename, compressors=None, threaded=False):
         """Return a `RepositoryIndexFile` for the given filename.
 
         The `RepositoryIndexFile` is created with the test 'root' and
@@ -44,7 +44,10 @@ def getRepoFile(self, filename, compressors=None):
                 IndexCompressionType.XZ,
             ]
         return RepositoryIndexFile(
-            os.path.join(self.root, filename), self.temp_root, compressors
+            os.path.join(self.root, filename),
+            self.temp_root,
+            compressors,
+            threaded=threaded,
         )
 
     def testWorkflow(self):
@@ -140,6 +143,65 @@ def testUnreferencing(self):
         self.assertEqual(0, len(os.listdir(self.root)))
         self.assertEqual(0, len(os.listdir(self.temp_root)))
 
+    def testThreaded(self):
+        """Threaded `RepositoryIndexFile` output matches unthreaded output.
+
+        Content is handed over to the writer threads in chunks, so write
+        enough to need several of them.
+        """
+        compressors = [
+            IndexCompressionType.UNCOMPRESSED,
+            IndexCompressionType.GZIP,
+            IndexCompressionType.BZIP2,
+            IndexCompressionType.XZ,
+        ]
+        chunks = [b"Package: foo%d\nVersion: 1.0\n\n" % i for i in range(100)]
+        for name, threaded in (("serial", False), ("threaded", True)):
+            repo_file = self.getRepoFile(
+                os.path.join(name, "boing"), compressors, threaded=threaded
+            )
+            repo_file.chunk_size = 256
+            for chunk in chunks:
+                repo_file.write(chunk)
+            repo_file.close()
+
+        self.assertEqual(0, len(os.listdir(self.temp_root)))
+        for filename in ("boing", "boing.bz2", "boing.gz", "boing.xz"):
+            with open(os.path.join(self.root, "serial", filename), "rb") as f:
+                serial = f.read()
+            with open(
+                os.path.join(self.root, "threaded", filename), "rb"
+            ) as f:
+                self.assertEqual(serial, f.read())
+
+    def testThreadedWriteError(self):
+        """Errors in writer threads are raised on close."""
+        repo_file = self.getRepoFile("boing", threaded=True)
+
+        def broken_write(content):
+            raise OSError("No space left on device")
+
+        repo_file.index_files[1].write = broken_write
+        repo_file.write(b"hello")
+        self.assertRaisesRegex(
+            OSError, "No space left on device", repo_file.close
+        )
+        self.assertEqual(0, len(os.listdir(self.root)))
+
+    def testThreadedUnreferencing(self):
+        """Unreferencing a threaded `RepositoryIndexFile` cleans up."""
+        repo_file = self.getRepoFile("boing", threaded=True)
+        repo_file.write(b"hello")
+        writers = repo_file._writers
+
+        del repo_file
+        for writer in writers:
+            writer.join()
+        del writers, writer
+
+        self.assertEqual(0, len(os.listdir(self.root)))
+        self.assertEqual(0, len(os.listdir(self.temp_root)))
+
     def testRootCreation(self):
         """`RepositoryIndexFile` creates given 'root' path if necessary."""
         missing_root = os.path.join(self.root, "donotexist")
@@ -184,3 +246,67 @@ def testRemoveOld(self):
             ["boing.bz2", "boing.gz", "boing.xz"],
             sorted(os.listdir(self.root)),
         )
+
+
+class TestParallelIndexWriter(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.temp_root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for path in [self.root, self.temp_root]:
+            shutil.rmtree(path)
+
+    def testMatchesRepositoryIndexFile(self):
+        """`ParallelIndexWriter` output matches `RepositoryIndexFile`."""
+        compressors = [
+            IndexCompressionType.UNCOMPRESSED,
+            IndexCompressionType.GZIP,
+            IndexCompressionType.BZIP2,
+            IndexCompressionType.XZ,
+        ]
+        chunks = [b"Package: foo%d\nVersion: 1.0\n\n" % i for i in range(100)]
+        with RepositoryIndexFile(
+            os.path.join(self.root, "serial", "boing"),
+            self.temp_root,
+            compressors,
+        ) as repo_file:
+            for chunk in chunks:
+                repo_file.write(chunk)
+        with ParallelIndexWriter(2) as writer:
+            for name in ("boing", "bang"):
+                with writer.open(
+                    os.path.join(self.root, "parallel", name),
+                    self.temp_root,
+                    compressors,
+                ) as repo_file:
+                    for chunk in chunks:
+                        repo_file.write(chunk)
+
+        self.assertEqual(
+            ["bang", "bang.bz2", "bang.gz", "bang.xz"]
+            + ["boing", "boing.bz2", "boing.gz", "boing.xz"],
+            sorted(os.listdir(os.path.join(self.root, "parallel"))),
+        )
+        self.assertEqual([], os.listdir(self.temp_root))
+        for filename in ("boing", "boing.bz2", "boing.gz", "boing.xz"):
+            with open(os.path.join(self.root, "serial", filename), "rb") as f:
+                serial = f.read()
+            for name in ("boing", "bang"):
+                path = os.path.join(
+                    self.root, "parallel", filename.replace("boing", name)
+                )
+                with open(path, "rb") as f:
+                    self.assertEqual(serial, f.read())
+
+    def testMissingTempRoot(self):
+        """`ParallelIndexWriter` cannot be given a missing 'temp_root'."""
+        missing_temp_root = os.path.join(self.temp_root, "donotexist")
+        with ParallelIndexWriter(1) as writer:
+            self.assertRaises(
+                AssertionError,
+                writer.open,
+                os.path.join(self.root, "boing"),
+                missing_temp_root,
+                [IndexCompressionType.UNCOMPRESSED],
+            )
@@ -0,0 +1,131 @@
+# Copyright 2026 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for persistent index stanza stores."""
+
+import os.path
+
+from lp.archivepublisher.stanzastore import IndexStanzaStore, StanzaStoreEntry
+from lp.testing import TestCase
+
+
+class TestIndexStanzaStore(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(
+            self.makeTemporaryDirectory(), "suite", "main", "binary-i386"
+        )
+
+    def makeRenderer(self, rendered):
+        """Return a renderer that records which IDs it was asked for."""
+
+        def render(publication_ids):
+            rendered.append(set(publication_ids))
+            for publication_id in publication_ids:
+                yield publication_id, StanzaStoreEntry(
+                    "pkg%d" % publication_id,
+                    stanza=b"Package: pkg%d" % publication_id,
+                )
+
+        return render
+
+    def test_load_missing(self):
+        # A store that has never been saved loads as empty.
+        store = IndexStanzaStore(self.path)
+        self.assertFalse(store.load())
+        self.assertEqual({}, store.entries)
+
+    def test_update_from_scratch(self):
+        # Initially, all publications are rendered.
+        rendered = []
+        store = IndexStanzaStore(self.path)
+        self.assertEqual(
+            (3, 0), store.update([1, 2, 3], self.makeRenderer(rendered))
+        )
+        self.assertEqual([{1, 2, 3}], rendered)
+
+    def test_update_incremental(self):
+        # Saved entries are reused, and only new publications are rendered.
+        store = IndexStanzaStore(self.path)
+        store.update([1, 2, 3], self.makeRenderer([]))
+        store.save()
+
+        rendered = []
+        store = IndexStanzaStore(self.path)
+        self.assertTrue(store.load())
+        self.assertEqual(
+            (1, 1), store.update([2, 3, 4], self.makeRenderer(rendered))
+        )
+        self.assertEqual([{4}], rendered)
+        self.assertEqual(
+            ["pkg2", "pkg3", "pkg4"], [entry.name for entry in store]
+        )
+
+    def test_update_nothing_new(self):
+        # The renderer isn't called if there are no new publications.
+        store = IndexStanzaStore(self.path)
+        store.update([1, 2], self.makeRenderer([]))
+        rendered = []
+        self.assertEqual(
+            (0, 1), store.update([1], self.makeRenderer(rendered))
+        )
+        self.assertEqual([], rendered)
+
+    def test_iteration_order(self):
+        # Entries are returned by name, then by publication ID.
+        store = IndexStanzaStore(self.path)
+        store.entries = {
+            3: StanzaStoreEntry("b", stanza=b"b3"),
+            1: StanzaStoreEntry("b", stanza=b"b1"),
+            2: StanzaStoreEntry("a", stanza=b"a2"),
+        }
+        self.assertEqual(
+            [b"a2", b"b1", b"b3"], [entry.stanza for entry in store]
+        )
+
+    def test_round_trip(self):
+        # All fields survive saving and loading.
+        entry = StanzaStoreEntry(
+            "foo-bin",
+            "debug",
+            "Package: foo-bin\nDescription: \u00e9".encode("utf-8"),
+            ("foo-bin", "0123456789abcdef"),
+            b"Package: foo-bin\nDescription-md5: 0123456789abcdef",
+        )
+        store = IndexStanzaStore(self.path)
+        store.entries = {1: entry}
+        store.save()
+        store = IndexStanzaStore(self.path)
+        self.assertTrue(store.load())
+        self.assertEqual({1: entry}, store.entries)
+
+    def test_parameters_mismatch(self):
+        # A store saved with different rendering parameters is discarded.
+        store = IndexStanzaStore(
+            self.path, {"separate_long_descriptions": False}
+        )
+        store.update([1], self.makeRenderer([]))
+        store.save()
+        store = IndexStanzaStore(
+            self.path, {"separate_long_descriptions": True}
+        )
+        self.assertFalse(store.load())
+        self.assertEqual({}, store.entries)
+
+    def test_format_version_mismatch(self):
+        # A store saved in a different format is discarded.
+        store = IndexStanzaStore(self.path)
+        store.update([1], self.makeRenderer([]))
+        store.save()
+        store = IndexStanzaStore(self.path)
+        store.format_version += 1
+        self.assertFalse(store.load())
+
+    def test_damaged(self):
+        # A damaged store is discarded.
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w") as f:
+            f.write("{not json")
+        store = IndexStanzaStore(self.path)
+        self.assertFalse(store.load())
+        self.assertEqual({}, store.entries)
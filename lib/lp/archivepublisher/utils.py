@@ -4,6 +4,7 @@
 """Miscellaneous functions for publisher."""
 
 __all__ = [
+    "ParallelIndexWriter",
     "RepositoryIndexFile",
     "get_ppa_reference",
 ]
@@ -12,9 +13,13 @@
 import bz2
 import gzip
 import lzma
+import multiprocessing
 import os
+import queue
 import stat
 import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
 
 from lp.soyuz.enums import ArchivePurpose, IndexCompressionType
 from lp.soyuz.interfaces.archive import default_name_by_purpose
@@ -100,6 +105,61 @@ def _buildFile(self, fd):
         return lzma.LZMAFile(self.path, mode="wb", format=lzma.FORMAT_XZ)
 
 
+class TempFileWriterThread(threading.Thread):
+    """Write chunks of content to a temporary index file.
+
+    Compressing index files is CPU-intensive, but zlib, bz2 and lzma all
+    release the GIL while compressing, so handing each compressed file to
+    its own thread lets all the codecs (and the caller generating the
+    content) run concurrently.
+    """
+
+    # Number of chunks that may be waiting to be written before `put`
+    # blocks, so that a slow codec limits memory use.
+    max_queued = 8
+
+    def __init__(self, temp_file):
+        super().__init__(
+            name="index-writer-%s" % temp_file.filename, daemon=True
+        )
+        self.temp_file = temp_file
+        self.error = None
+        self._queue = queue.Queue(maxsize=self.max_queued)
+        self.start()
+
+    def run(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                break
+            if self.error is not None:
+                # Keep draining the queue so that the caller doesn't block.
+                continue
+            try:
+                self.temp_file.write(chunk)
+            except Exception as e:
+                self.error = e
+
+    def put(self, chunk):
+        """Queue a chunk of content to be written."""
+        if self.error is not None:
+            raise self.error
+        self._queue.put(chunk)
+
+    def stop(self):
+        """Tell the thread to exit once all queued content is written."""
+        self._queue.put(None)
+
+    def finish(self):
+        """Wait for all queued content to be written.
+
+        `stop` must have been called first.
+        """
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+
 class RepositoryIndexFile:
     """Facilitates the publication of repository index files.
 
@@ -107,7 +167,13 @@ class RepositoryIndexFile:
     formats (plain, gzip, bzip2, and xz) transparently and atomically.
     """
 
-    def __init__(self, path, temp_root, compressors=None):
+    # When writing using threads, content is handed over to the writer
+    # threads in chunks of about this many bytes.
+    chunk_size = 1024 * 1024
+
+    _writers = None
+
+    def __init__(self, path, temp_root, compressors=None, threaded=False):
         """Store repositories destinations and filename.
 
         The given 'temp_root' needs to exist; on the other hand, the
@@ -116,6 +182,10 @@ def __init__(self, path, temp_root, compressors=None):
 
         Additionally creates the needed temporary files in the given
         'temp_root'.
+
+        If 'threaded' is True, content is buffered and each target file is
+        written and compressed by a separate `TempFileWriterThread`.  The
+        resulting files are identical either way.
         """
         if compressors is None:
             compressors = [IndexCompressionType.UNCOMPRESSED]
@@ -133,6 +203,24 @@ def __init__(self, path, temp_root, compressors=None):
                     cls(temp_root, filename, auto_open=False)
                 )
 
+        self._buffer = []
+        self._buffer_size = 0
+        if threaded:
+            self._writers = [
+                TempFileWriterThread(index_file)
+                for index_file in self.index_files
+            ]
+        else:
+            self._writers = None
+
+    def __del__(self):
+        """Stop any writer threads if this file was never closed.
+
+        This lets them release their temporary files, which then remove
+        themselves.
+        """
+        self._stopWriters()
+
     def __enter__(self):
         return self
 
@@ -141,8 +229,32 @@ def __exit__(self, type, value, traceback):
 
     def write(self, content):
         """Write contents to all target files."""
-        for index_file in self.index_files:
-            index_file.write(content)
+        if self._writers is None:
+            for index_file in self.index_files:
+                index_file.write(content)
+        else:
+            self._buffer.append(content)
+            self._buffer_size += len(content)
+            if self._buffer_size >= self.chunk_size:
+                self._flush()
+
+    def _flush(self):
+        """Hand buffered content over to the writer threads."""
+        if self._buffer:
+            chunk = b"".join(self._buffer)
+            self._buffer = []
+            self._buffer_size = 0
+            for writer in self._writers:
+                writer.put(chunk)
+
+    def _stopWriters(self):
+        """Tell any writer threads to exit once their queues are empty."""
+        if self._writers is not None:
+            writers, self._writers = self._writers, None
+            for writer in writers:
+                writer.stop()
+            return writers
+        return []
 
     def close(self):
         """Close temporary files and atomically publish them.
@@ -159,6 +271,14 @@ def close(self):
         else:
             os.makedirs(self.root)
 
+        if self._writers is not None:
+            try:
+                self._flush()
+            finally:
+                writers = self._stopWriters()
+            for writer in writers:
+                writer.finish()
+
         for index_file in self.index_files:
             index_file.close()
             root_path = os.path.join(self.root, index_file.filename)
@@ -179,3 +299,120 @@ def close(self):
             root_path = os.path.join(self.root, index_file.filename)
             if os.path.exists(root_path):
                 os.remove(root_path)
+
+
+def _write_index_file(path, temp_root, compressor_values, content):
+    """Write and compress a complete repository index file.
+
+    This runs in a `ParallelIndexWriter` worker process, so it only deals
+    with picklable arguments and must not touch the database.
+    """
+    compressors = [
+        IndexCompressionType.items[value] for value in compressor_values
+    ]
+    with RepositoryIndexFile(
+        path, temp_root, compressors, threaded=True
+    ) as index_file:
+        index_file.write(content)
+
+
+class PooledIndexFile:
+    """A `RepositoryIndexFile` whose contents are written by a worker pool.
+
+    Content is buffered in memory until `close`, at which point the whole
+    file is handed to the `ParallelIndexWriter` to be compressed and
+    published.
+    """
+
+    def __init__(self, writer, path, temp_root, compressors=None):
+        if compressors is None:
+            compressors = [IndexCompressionType.UNCOMPRESSED]
+        assert os.path.exists(temp_root), "Temporary root does not exist."
+        self.writer = writer
+        self.path = path
+        self.temp_root = temp_root
+        self.compressors = compressors
+        self._chunks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def write(self, content):
+        """Buffer contents for all target files."""
+        self._chunks.append(content)
+
+    def close(self):
+        """Submit the buffered contents to the worker pool."""
+        content = b"".join(self._chunks)
+        self._chunks = []
+        self.writer.submit(
+            self.path, self.temp_root, self.compressors, content
+        )
+
+
+class ParallelIndexWriter:
+    """Write repository index files concurrently in worker processes.
+
+    Callers build each index file's stanzas in the current process (which
+    is the only one allowed to talk to the database), then hand the
+    rendered contents to a pool of worker processes which do the
+    comparatively expensive compression and publication.  Since each index
+    file is still written from a single ordered stream of stanzas, the
+    output is identical to that of writing it with `RepositoryIndexFile`
+    directly.
+    """
+
+    def __init__(self, workers):
+        # Fork rather than spawning fresh interpreters: the workers only
+        # need this module, and must not open database connections of
+        # their own.
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("fork")
+        )
+        self._futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.wait()
+        else:
+            for future in self._futures:
+                future.cancel()
+            self._futures = []
+            self._executor.shutdown(wait=True)
+
+    def open(self, path, temp_root, compressors=None):
+        """Return a new index file to be written by this pool.
+
+        This takes the same arguments as `RepositoryIndexFile`.
+        """
+        return PooledIndexFile(self, path, temp_root, compressors)
+
+    def submit(self, path, temp_root, compressors, content):
+        """Schedule writing `content` to the index file at `path`."""
+        self._futures.append(
+            self._executor.submit(
+                _write_index_file,
+                path,
+                temp_root,
+                [compressor.value for compressor in compressors],
+                content,
+            )
+        )
+
+    def wait(self):
+        """Wait for all submitted index files to be published.
+
+        Any exception raised while writing an index file is re-raised here.
+        """
+        try:
+            for future in self._futures:
+                future.result()
+        finally:
+            self._futures = []
+            self._executor.shutdown(wait=True)
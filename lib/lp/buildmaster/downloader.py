@@ -9,16 +9,20 @@
 
 __all__ = [
     "DownloadCommand",
+    "DownloadVerificationError",
     "EndFetchServiceSessionCommand",
     "RemoveResourcesFetchServiceSessionCommand",
     "RequestFetchServiceSessionCommand",
     "RequestProcess",
     "RequestProxyTokenCommand",
     "RetrieveFetchServiceSessionCommand",
+    "get_partial_download_path",
 ]
 
+import hashlib
 import os.path
 import tempfile
+import time
 from typing import List, Tuple
 
 from ampoule.child import AMPChild
@@ -27,15 +31,37 @@
 from requests_toolbelt.exceptions import StreamingError
 from twisted.protocols import amp
 
+# The size of the chunks in which downloads are written to disk.
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class DownloadVerificationError(Exception):
+    """A downloaded file did not have the expected SHA-1 checksum."""
+
+
+def get_partial_download_path(path_to_write):
+    """Return the path where a download to `path_to_write` is kept until
+    it is complete.
+
+    If a download fails part-way through, the part of the file that was
+    downloaded is left here so that a later attempt can resume it.
+    """
+    return path_to_write + ".part"
+
 
 class DownloadCommand(amp.Command):
     arguments = [
         (b"file_url", amp.Unicode()),
         (b"path_to_write", amp.Unicode()),
         (b"timeout", amp.Integer()),
+        # If given, the download fails unless the file has this SHA-1.
+        (b"sha1", amp.Unicode(optional=True)),
+        # If given, the download is throttled to this rate.
+        (b"max_bytes_per_second", amp.Integer(optional=True)),
     ]
     response: List[Tuple[bytes, amp.Argument]] = []
     errors = {
+        DownloadVerificationError: b"VERIFICATION_ERROR",
         RequestException: b"REQUEST_ERROR",
         StreamingError: b"STREAMING_ERROR",
     }
@@ -164,12 +190,67 @@ def _saveResponseToFile(streamed_response, path_to_write):
         return {}
 
     @DownloadCommand.responder
-    def downloadCommand(self, file_url, path_to_write, timeout):
+    def downloadCommand(
+        self,
+        file_url,
+        path_to_write,
+        timeout,
+        sha1=None,
+        max_bytes_per_second=None,
+    ):
+        os.makedirs(os.path.dirname(path_to_write), exist_ok=True)
+        partial_path = get_partial_download_path(path_to_write)
+        hasher = hashlib.sha1()
+        headers = {}
+        # Resume an earlier attempt if there is one.
+        try:
+            with open(partial_path, "rb") as partial:
+                for chunk in iter(
+                    lambda: partial.read(DOWNLOAD_CHUNK_SIZE), b""
+                ):
+                    hasher.update(chunk)
+                offset = partial.tell()
+        except FileNotFoundError:
+            offset = 0
+        if offset:
+            headers["Range"] = "bytes=%d-" % offset
         with Session() as session:
             session.trust_env = False
-            response = session.get(file_url, timeout=timeout, stream=True)
+            response = session.get(
+                file_url, headers=headers, timeout=timeout, stream=True
+            )
+            if offset and response.status_code != 206:
+                # The server can't resume the download, perhaps because
+                # the partial file is already complete or is stale; start
+                # again from the beginning.
+                response.close()
+                response = session.get(file_url, timeout=timeout, stream=True)
+                hasher = hashlib.sha1()
+                offset = 0
             response.raise_for_status()
-            return self._saveResponseToFile(response, path_to_write)
+            start = time.monotonic()
+            received = 0
+            with open(partial_path, "ab" if offset else "wb") as f:
+                for chunk in response.iter_content(
+                    chunk_size=DOWNLOAD_CHUNK_SIZE
+                ):
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    received += len(chunk)
+                    if max_bytes_per_second:
+                        elapsed = time.monotonic() - start
+                        delay = received / max_bytes_per_second - elapsed
+                        if delay > 0:
+                            time.sleep(delay)
+        if sha1 and hasher.hexdigest() != sha1:
+            # There's no point resuming a corrupt download.
+            os.unlink(partial_path)
+            raise DownloadVerificationError(
+                "%s has SHA-1 %s, expected %s"
+                % (file_url, hasher.hexdigest(), sha1)
+            )
+        os.rename(partial_path, path_to_write)
+        return {}
 
     @RequestProxyTokenCommand.responder
     def requestProxyTokenCommand(self, url, auth_header, proxy_username):
@@ -9,6 +9,7 @@
 
 import logging
 import os.path
+import re
 import sys
 import traceback
 from collections import OrderedDict, namedtuple
@@ -20,12 +21,14 @@
 from twisted.internet import defer
 from twisted.internet import reactor as default_reactor
 from twisted.internet.interfaces import IReactorCore
-from twisted.web import xmlrpc
-from twisted.web.client import HTTPConnectionPool
 from zope.security.proxy import isinstance as zope_isinstance
 from zope.security.proxy import removeSecurityProxy
 
-from lp.buildmaster.downloader import DownloadCommand, RequestProcess
+from lp.buildmaster.downloader import (
+    DownloadCommand,
+    RequestProcess,
+    get_partial_download_path,
+)
 from lp.buildmaster.enums import BuilderCleanStatus, BuilderResetProtocol
 from lp.buildmaster.interfaces.builder import (
     BuildDaemonError,
@@ -36,18 +39,20 @@
 from lp.buildmaster.interfaces.buildfarmjobbehaviour import (
     IBuildFarmJobBehaviour,
 )
+from lp.buildmaster.prewarm import default_prewarmer
 from lp.services.config import config
 from lp.services.job.runner import QuietAMPConnector, VirtualEnvProcessStarter
 from lp.services.twistedsupport import cancel_on_timeout, gatherResults
 from lp.services.twistedsupport.processmonitor import ProcessWithTimeout
+from lp.services.twistedsupport.xmlrpc import (
+    PersistentProxy,
+    make_persistent_pool,
+)
 from lp.services.webapp import urlappend
 
-
-class QuietQueryFactory(xmlrpc._QueryFactory):
-    """XMLRPC client factory that doesn't splatter the log with junk."""
-
-    noisy = False
-
+# Worker XML-RPC methods that have no side-effects, and so may safely be
+# retried if a call fails on a stale keep-alive connection.
+IDEMPOTENT_WORKER_METHODS = ("echo", "info", "proxy_info", "status")
 
 _default_pool = None
 _default_process_pool = None
@@ -55,14 +60,34 @@ class QuietQueryFactory(xmlrpc._QueryFactory):
 
 
 def default_pool(reactor=None):
+    """Return the pool of persistent HTTP connections to builders.
+
+    This is shared by all `BuilderWorker`s, and so persists across scans;
+    the pool keeps a few idle connections open to each builder.
+    """
     global _default_pool
     if reactor is None:
         reactor = default_reactor
     if _default_pool is None:
-        _default_pool = HTTPConnectionPool(reactor)
+        _default_pool = make_persistent_pool(
+            reactor,
+            max_persistent_per_host=(
+                config.builddmaster.rpc_connections_per_builder
+            ),
+            cached_connection_timeout=config.builddmaster.rpc_idle_timeout,
+        )
     return _default_pool
 
 
+@defer.inlineCallbacks
+def shut_down_default_pool():
+    """Close connections in the default pool.  Used in test cleanup."""
+    global _default_pool
+    if _default_pool is not None:
+        yield _default_pool.closeCachedConnections()
+        _default_pool = None
+
+
 def make_download_process_pool(**kwargs):
     """Make a pool of processes for downloading files."""
     env = {"PATH": os.environ["PATH"]}
@@ -153,6 +178,12 @@ def __init__(
         if process_pool is None:
             process_pool = default_process_pool(reactor=reactor)
         self.process_pool = process_pool
+        # Limit the share of the download process pool that a single
+        # builder can take up, so that collecting many large files from
+        # one builder doesn't hold up collection from others.
+        self._download_semaphore = defer.DeferredSemaphore(
+            config.builddmaster.download_connections_per_builder
+        )
 
     @classmethod
     def makeBuilderWorker(
@@ -172,16 +203,22 @@ def makeBuilderWorker(
         :param vm_host: If the worker is virtual, specify its host machine
             here.
         :param reactor: Used by tests to override the Twisted reactor.
-        :param proxy: Used By tests to override the xmlrpc.Proxy.
+        :param proxy: Used By tests to override the XML-RPC proxy.
         :param pool: Used by tests to override the HTTPConnectionPool.
         :param process_pool: Used by tests to override the ProcessPool.
         """
         rpc_url = urlappend(builder_url, "rpc")
+        if pool is None:
+            pool = default_pool(reactor=reactor)
         if proxy is None:
-            server_proxy = xmlrpc.Proxy(
-                rpc_url.encode("UTF-8"), allowNone=True, connectTimeout=timeout
+            # Connections are made using the global reactor even if tests
+            # override the reactor used for timeouts.
+            server_proxy = PersistentProxy(
+                rpc_url.encode("UTF-8"),
+                pool,
+                connect_timeout=timeout,
+                idempotent_methods=IDEMPOTENT_WORKER_METHODS,
             )
-            server_proxy.queryFactory = QuietQueryFactory
         else:
             server_proxy = proxy
         return cls(
@@ -242,13 +279,25 @@ def getFile(self, sha_sum, path_to_write, logger=None):
         """Fetch a file from the builder.
 
         :param sha_sum: The sha of the file (which is also its name on the
-            builder)
+            builder), or the name of a file such as the build log that
+            isn't named after its SHA-1.
         :param path_to_write: A file name to write the file to
         :param logger: An optional logger.
         :return: A Deferred that calls back when the download is done, or
             errback with the error string.
         """
         file_url = self.getURL(sha_sum)
+        sha1 = sha_sum if re.fullmatch(r"[0-9a-f]{40}", sha_sum) else None
+        # The builder's bandwidth cap is shared between its concurrent
+        # downloads.  A cap smaller than the number of connections must
+        # still limit them.
+        max_bytes_per_second = None
+        if config.builddmaster.download_bandwidth_per_builder:
+            max_bytes_per_second = max(
+                1,
+                config.builddmaster.download_bandwidth_per_builder
+                // config.builddmaster.download_connections_per_builder,
+            )
         for attempt in range(config.builddmaster.download_attempts):
             try:
                 # Download the file in a subprocess.  We used to download it
@@ -257,11 +306,18 @@ def getFile(self, sha_sum, path_to_write, logger=None):
                 # that it struggled to keep up with incoming packets in time
                 # to avoid TCP timeouts (perhaps because of too much
                 # synchronous work being done on the reactor thread).
-                yield self.process_pool.doWork(
+                # Most files in the builder's cache are named after their
+                # SHA-1, so the subprocess can verify them as they arrive.
+                # A failed attempt leaves a partial file behind, which the
+                # next attempt resumes.
+                yield self._download_semaphore.run(
+                    self.process_pool.doWork,
                     DownloadCommand,
                     file_url=file_url,
                     path_to_write=path_to_write,
                     timeout=self.timeout,
+                    sha1=sha1,
+                    max_bytes_per_second=max_bytes_per_second,
                 )
                 if logger is not None:
                     logger.info("Grabbed %s" % file_url)
@@ -279,6 +335,10 @@ def getFile(self, sha_sum, path_to_write, logger=None):
                         )
                     )
                 if attempt == config.builddmaster.download_attempts - 1:
+                    try:
+                        os.unlink(get_partial_download_path(path_to_write))
+                    except FileNotFoundError:
+                        pass
                     raise
 
     def getFiles(self, files, logger=None):
@@ -327,7 +387,11 @@ def resume(self, clock=None):
     def sendFileToWorker(
         self, sha1, url, username="", password="", logger=None
     ):
-        """Helper to send the file at 'url' with 'sha1' to this builder."""
+        """Helper to send the file at 'url' with 'sha1' to this builder.
+
+        :return: A Deferred that fires with the information returned by the
+            builder, which is "Download" if it had to fetch the file.
+        """
         if logger is not None:
             logger.info(
                 "Asking %s to ensure it has %s (%s%s)"
@@ -341,6 +405,7 @@ def sendFileToWorker(
         present, info = yield self.ensurepresent(sha1, url, username, password)
         if not present:
             raise CannotFetchFile(url, info)
+        return info
 
     def build(self, buildid, builder_type, chroot_sha1, filemap, args):
         """Build a thing on this build worker.
@@ -452,6 +517,8 @@ def resumeWorkerHost(cls, vitals, worker):
         logger = cls._getWorkerScannerLogger()
         logger.info("Resuming %s (%s)" % (vitals.name, vitals.url))
 
+        # Resetting a virtual builder empties its file cache.
+        default_prewarmer().forgetBuilder(vitals.name)
         d = worker.resume()
 
         def got_resume_ok(args):
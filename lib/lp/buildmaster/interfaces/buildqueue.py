@@ -183,3 +183,16 @@ def findBuildCandidates(
             the given values of `virtualized`, `open_resources`, and
             `restricted_resources`.
         """
+
+    def findAllBuildCandidates(limit):
+        """Find candidate jobs for dispatch to any idle builders.
+
+        This uses a single query, and leaves it to the caller to match
+        candidates against builders' processors and resources.
+
+        :param limit: The largest number of candidates to return for any
+            given combination of processor, virtualization, and builder
+            constraints; typically the number of builders.
+        :return: A sequence of `IBuildQueue` items with scores at least the
+            minimum for their processors, in descending order of score.
+        """
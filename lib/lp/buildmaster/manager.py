@@ -6,15 +6,18 @@
 __all__ = [
     "BuilddManager",
     "BUILDD_MANAGER_LOG_NAME",
+    "BuildDispatchPlanner",
+    "DispatchCandidate",
     "PrefetchedBuilderFactory",
     "WorkerScanner",
+    "WorkerStatusPoller",
 ]
 
 import datetime
 import logging
 import os.path
 import shutil
-from collections import defaultdict
+from collections import Counter, defaultdict, deque, namedtuple
 
 import six
 import transaction
@@ -44,6 +47,7 @@
 from lp.buildmaster.interfaces.processor import IProcessorSet
 from lp.buildmaster.model.builder import Builder
 from lp.buildmaster.model.buildqueue import BuildQueue
+from lp.buildmaster.prewarm import default_prewarmer
 from lp.services.config import config
 from lp.services.database.bulk import dbify_value
 from lp.services.database.interfaces import IStore
@@ -168,6 +172,207 @@ def pop(self, vitals):
             return None
 
 
+# The properties of a build candidate that determine which builders can
+# take it.
+DispatchCandidate = namedtuple(
+    "DispatchCandidate",
+    (
+        "id",
+        "lastscore",
+        "processor_name",
+        "virtualized",
+        "builder_constraints",
+    ),
+)
+
+
+class BuildDispatchPlanner:
+    """A plan for dispatching build candidates to builders.
+
+    Rather than querying for candidates separately for each group of
+    builders with the same properties, this fetches candidates for all
+    builders in a single query on first use, and assigns them to the
+    builders that are idle at that point in memory.  Candidates are
+    assigned in descending order of score, each to the least versatile
+    idle builder that can take it, so that builders that can handle other
+    kinds of work remain available for it.
+
+    Candidates that weren't assigned are kept for builders that become
+    idle later in the same cycle.  A candidate assigned to a builder that
+    doesn't then ask for it stays waiting until the next cycle.
+
+    `pop` doesn't touch the DB directly, apart from fetching the
+    `BuildQueue` it returns.
+    """
+
+    def __init__(self, all_vitals):
+        self.all_vitals = list(all_vitals)
+        # Builder names mapped to the IDs of the candidates planned for
+        # them.
+        self.assignments = None
+        # Unassigned candidates, grouped by the properties that determine
+        # which builders can take them and in descending order of score.
+        self.spare_candidates = None
+
+    @staticmethod
+    def isIdle(vitals):
+        """Is this builder ready to be dispatched a job?"""
+        return (
+            vitals.builderok
+            and not vitals.manual
+            and vitals.build_queue is None
+            and vitals.clean_status == BuilderCleanStatus.CLEAN
+        )
+
+    @staticmethod
+    def _getSortKey(candidate):
+        # This must match the ordering used in
+        # BuildQueueSet.findAllBuildCandidates.
+        return -candidate.lastscore, candidate.id
+
+    @staticmethod
+    def _getSignature(candidate):
+        return (
+            candidate.processor_name,
+            candidate.virtualized,
+            frozenset(candidate.builder_constraints or ()),
+        )
+
+    @staticmethod
+    def _canBuild(vitals, signature):
+        """Can this builder take candidates with this signature?
+
+        This must match the conditions used in
+        `BuildQueueSet.findBuildCandidates`.
+        """
+        processor_name, virtualized, constraints = signature
+        if (
+            processor_name is not None
+            and processor_name not in vitals.processor_names
+        ):
+            return False
+        if virtualized != vitals.virtualized:
+            return False
+        restricted_resources = set(vitals.restricted_resources or ())
+        # All constraints on the candidate must be satisfied by the
+        # builder's resources.
+        if not constraints <= (
+            set(vitals.open_resources or ()) | restricted_resources
+        ):
+            return False
+        # If the builder has any restricted resources, then the candidate
+        # must specify all of them.
+        return restricted_resources <= constraints
+
+    def prefetch(self):
+        """Fetch candidates and plan their dispatch, if not already done."""
+        if self.assignments is not None:
+            return
+        candidates = getUtility(IBuildQueueSet).findAllBuildCandidates(
+            limit=max(1, len(self.all_vitals))
+        )
+        self.plan(
+            DispatchCandidate(
+                candidate.id,
+                candidate.lastscore,
+                (
+                    candidate.processor.name
+                    if candidate.processor is not None
+                    else None
+                ),
+                candidate.virtualized,
+                candidate.builder_constraints,
+            )
+            for candidate in candidates
+        )
+
+    def plan(self, candidates):
+        """Assign candidates to idle builders.
+
+        :param candidates: An iterable of `DispatchCandidate`s, in
+            descending order of score and then ascending order of ID.
+        """
+        idle_vitals = [
+            vitals for vitals in self.all_vitals if self.isIdle(vitals)
+        ]
+        candidates_by_signature = defaultdict(list)
+        for candidate in candidates:
+            candidates_by_signature[self._getSignature(candidate)].append(
+                candidate
+            )
+        eligible_builders = {
+            signature: [
+                vitals.name
+                for vitals in idle_vitals
+                if self._canBuild(vitals, signature)
+            ]
+            for signature in candidates_by_signature
+        }
+        versatility = Counter(
+            name for names in eligible_builders.values() for name in names
+        )
+        for names in eligible_builders.values():
+            names.sort(key=lambda name: (versatility[name], name))
+
+        # Walk through all the candidates in the global order, which means
+        # merging the per-signature lists.
+        ordered_candidates = sorted(
+            (
+                (signature, candidate)
+                for signature, signature_candidates in (
+                    candidates_by_signature.items()
+                )
+                for candidate in signature_candidates
+            ),
+            key=lambda item: self._getSortKey(item[1]),
+        )
+        self.assignments = {}
+        self.spare_candidates = defaultdict(deque)
+        positions = dict.fromkeys(eligible_builders, 0)
+        for signature, candidate in ordered_candidates:
+            names = eligible_builders[signature]
+            position = positions[signature]
+            while (
+                position < len(names) and names[position] in self.assignments
+            ):
+                position += 1
+            positions[signature] = position
+            if position < len(names):
+                self.assignments[names[position]] = candidate.id
+            else:
+                self.spare_candidates[signature].append(candidate)
+
+    def pop(self, vitals):
+        """Return a suitable build candidate for this builder.
+
+        The candidate is removed from the plan, but the caller must ensure
+        that it is marked as building, otherwise it will come back the next
+        time candidates are fetched (typically on the next scan cycle).
+        """
+        self.prefetch()
+        candidate_id = self.assignments.pop(vitals.name, None)
+        if candidate_id is None:
+            # Nothing was planned for this builder, perhaps because it
+            # wasn't idle when we planned, or because it didn't accept the
+            # candidate it was given.  Fall back to the best unassigned
+            # candidate that it can take.
+            best_signature = None
+            for signature, spare in self.spare_candidates.items():
+                if not spare or not self._canBuild(vitals, signature):
+                    continue
+                if best_signature is None or self._getSortKey(
+                    spare[0]
+                ) < self._getSortKey(self.spare_candidates[best_signature][0]):
+                    best_signature = signature
+            if best_signature is not None:
+                candidate_id = (
+                    self.spare_candidates[best_signature].popleft().id
+                )
+        if candidate_id is None:
+            return None
+        return getUtility(IBuildQueueSet).get(candidate_id)
+
+
 class BaseBuilderFactory:
     date_updated = None
 
@@ -288,9 +493,7 @@ def update(self):
             b.name: extract_vitals_from_db(b, bq)
             for b, bq in builders_and_current_bqs
         }
-        self.candidates = PrefetchedBuildCandidates(
-            list(self.vitals_map.values())
-        )
+        self.candidates = BuildDispatchPlanner(self.vitals_map.values())
         transaction.abort()
         self.date_updated = datetime.datetime.utcnow()
 
@@ -312,7 +515,6 @@ def iterVitals(self):
 
     def findBuildCandidate(self, vitals):
         """See `BaseBuilderFactory`."""
-        self.candidates.prefetchForBuilder(vitals)
         return self.candidates.pop(vitals)
 
 
@@ -472,6 +674,49 @@ def recover_failure(logger, vitals, builder, retry, exception):
         builder.setCleanStatus(BuilderCleanStatus.DIRTY)
 
 
+class WorkerStatusPoller:
+    """Poll the status of many workers together.
+
+    Scanners whose cycles are aligned ask for their workers' statuses at
+    around the same time.  Rather than each scanner making its own call
+    as soon as it asks, requests made during the same reactor iteration
+    are collected into a batch, which is sent out in one go on the next
+    iteration with at most `concurrency` calls in flight at once.  This
+    bounds the number of connections that buildd-manager has open to
+    builders, however many of them there are.
+    """
+
+    def __init__(self, clock=None, concurrency=None):
+        if clock is None:
+            clock = reactor
+        if concurrency is None:
+            concurrency = config.builddmaster.status_poll_concurrency
+        self._clock = clock
+        self._semaphore = defer.DeferredSemaphore(concurrency)
+        self._pending = []
+        self._delayed_call = None
+        self.statsd_client = getUtility(IStatsdClient)
+
+    def getStatus(self, worker):
+        """Get a worker's status as part of the next batch.
+
+        :return: A Deferred that fires with the result of `worker.status()`.
+        """
+        d = defer.Deferred()
+        self._pending.append((worker, d))
+        if self._delayed_call is None:
+            self._delayed_call = self._clock.callLater(0, self._sendBatch)
+        return d
+
+    def _sendBatch(self):
+        self._delayed_call = None
+        pending = self._pending
+        self._pending = []
+        self.statsd_client.gauge("builders.status_batch_size", len(pending))
+        for worker, d in pending:
+            self._semaphore.run(worker.status).chainDeferred(d)
+
+
 class WorkerScanner:
     """A manager for a single builder."""
 
@@ -501,6 +746,7 @@ def __init__(
         interactor_factory=BuilderInteractor,
         worker_factory=BuilderInteractor.makeWorkerFromVitals,
         behaviour_factory=BuilderInteractor.getBuildBehaviour,
+        status_poller=None,
     ):
         self.builder_name = builder_name
         self.builder_factory = builder_factory
@@ -509,6 +755,7 @@ def __init__(
         self.interactor_factory = interactor_factory
         self.worker_factory = worker_factory
         self.behaviour_factory = behaviour_factory
+        self.status_poller = status_poller
         # Use the clock if provided, so that tests can advance it.  Use the
         # reactor by default.
         if clock is None:
@@ -710,14 +957,26 @@ def getExpectedCookie(self, vitals):
             self._cached_build_queue = vitals.build_queue
         return self._cached_build_cookie
 
+    def getWorkerStatus(self, worker):
+        """Get the worker's status, batched with other workers if possible.
+
+        :return: A Deferred that fires with the worker's status.
+        """
+        if self.status_poller is not None:
+            return self.status_poller.getStatus(worker)
+        return worker.status()
+
     def updateVersion(self, vitals, worker_status):
-        """Update the DB's record of the worker version if necessary."""
+        """Update the DB's record of the worker version if necessary.
+
+        The update is queued on the manager, which writes it to the
+        database along with any other pending updates.
+        """
         version = worker_status.get("builder_version")
         if version is not None:
             version = six.ensure_text(version)
         if version != vitals.version:
-            self.builder_factory[self.builder_name].version = version
-            transaction.commit()
+            self.manager.addBuilderVersion(vitals.name, version)
 
     @defer.inlineCallbacks
     def scan(self):
@@ -731,6 +990,16 @@ def scan(self):
         worker = self.worker_factory(vitals)
         self.can_retry = True
 
+        if vitals.build_queue is None and default_prewarmer().isPending(
+            vitals.name
+        ):
+            # The builder can't answer until it has fetched the chroot, so
+            # polling it now would only time out and count as a failure.
+            self.logger.debug(
+                "%s is pre-seeding a chroot, not scanning.", vitals.name
+            )
+            return
+
         if vitals.build_queue is not None:
             if vitals.clean_status != BuilderCleanStatus.DIRTY:
                 # This is probably a grave bug with security implications,
@@ -743,7 +1012,7 @@ def scan(self):
             if not vitals.builderok:
                 lost_reason = "%s is disabled" % vitals.name
             else:
-                worker_status = yield worker.status()
+                worker_status = yield self.getWorkerStatus(worker)
                 # Ensure that the worker has the job that we think it
                 # should.
                 worker_cookie = worker_status.get("build_id")
@@ -788,7 +1057,7 @@ def scan(self):
             # We think the builder is idle. If it's clean, dispatch. If
             # it's dirty, clean.
             if vitals.clean_status == BuilderCleanStatus.CLEAN:
-                worker_status = yield worker.status()
+                worker_status = yield self.getWorkerStatus(worker)
                 if worker_status.get("builder_status") != "BuilderStatus.IDLE":
                     raise BuildDaemonIsolationError(
                         "Allegedly clean worker not idle (%r instead)"
@@ -815,6 +1084,13 @@ def scan(self):
                     # failure_count.
                     builder.resetFailureCount()
                     transaction.commit()
+                elif config.builddmaster.prewarm_chroots:
+                    # Nothing to do right now, so fetch a chroot that the
+                    # next dispatch to this builder is likely to need.  This
+                    # may take a while, so don't wait for it here.
+                    default_prewarmer().startPrewarm(
+                        vitals, worker, self.logger
+                    )
             else:
                 # Ask the BuilderInteractor to clean the worker. It might
                 # be immediately cleaned on return, in which case we go
@@ -836,7 +1112,7 @@ class BuilddManager(service.Service):
     # How often to check for new builders, in seconds.
     SCAN_BUILDERS_INTERVAL = 15
 
-    # How often to flush logtail updates, in seconds.
+    # How often to flush logtail and builder version updates, in seconds.
     FLUSH_LOGTAILS_INTERVAL = 15
 
     def __init__(self, clock=None, builder_factory=None):
@@ -850,6 +1126,8 @@ def __init__(self, clock=None, builder_factory=None):
         self.logger = self._setupLogger()
         self.current_builders = []
         self.pending_logtails = {}
+        self.pending_builder_versions = {}
+        self.status_poller = WorkerStatusPoller(clock=clock)
         self.statsd_client = getUtility(IStatsdClient)
 
     def _setupLogger(self):
@@ -897,12 +1175,21 @@ def scanBuilders(self):
     def addLogTail(self, build_queue_id, logtail):
         self.pending_logtails[build_queue_id] = logtail
 
+    def addBuilderVersion(self, builder_name, version):
+        self.pending_builder_versions[builder_name] = version
+
     def flushLogTails(self):
-        """Flush any pending log tail updates to the database."""
+        """Flush any pending log tail and builder version updates.
+
+        All the updates are applied in a single transaction.
+        """
         self.logger.debug("Flushing log tail updates.")
         try:
             pending_logtails = self.pending_logtails
             self.pending_logtails = {}
+            pending_builder_versions = self.pending_builder_versions
+            self.pending_builder_versions = {}
+            store = IStore(BuildQueue)
             if pending_logtails:
                 new_logtails = Table("new_logtails")
                 new_logtails_expr = Values(
@@ -916,7 +1203,6 @@ def flushLogTails(self):
                         for buildqueue_id, logtail in pending_logtails.items()
                     ],
                 )
-                store = IStore(BuildQueue)
                 store.execute(
                     BulkUpdate(
                         {BuildQueue.logtail: Column("logtail", new_logtails)},
@@ -927,6 +1213,30 @@ def flushLogTails(self):
                         ),
                     )
                 )
+            if pending_builder_versions:
+                new_versions = Table("new_versions")
+                new_versions_expr = Values(
+                    new_versions.name,
+                    [("name", "text"), ("version", "text")],
+                    [
+                        [
+                            dbify_value(Builder.name, builder_name),
+                            dbify_value(Builder.version, version),
+                        ]
+                        for builder_name, version in (
+                            pending_builder_versions.items()
+                        )
+                    ],
+                )
+                store.execute(
+                    BulkUpdate(
+                        {Builder.version: Column("version", new_versions)},
+                        table=Builder,
+                        values=new_versions_expr,
+                        where=(Builder.name == Column("name", new_versions)),
+                    )
+                )
+            if pending_logtails or pending_builder_versions:
                 transaction.commit()
         except Exception:
             self.logger.exception("Failure while flushing log tail updates:\n")
@@ -987,7 +1297,12 @@ def addScanForBuilders(self, builders):
         """Set up scanner objects for the builders specified."""
         for builder in builders:
             worker_scanner = WorkerScanner(
-                builder, self.builder_factory, self, self.logger
+                builder,
+                self.builder_factory,
+                self,
+                self.logger,
+                clock=self._clock,
+                status_poller=self.status_poller,
             )
             self.workers.append(worker_scanner)
             worker_scanner.startCycle()
@@ -28,6 +28,7 @@
 )
 from lp.buildmaster.interfaces.builder import BuildDaemonError, CannotBuild
 from lp.buildmaster.interfaces.buildfarmjobbehaviour import BuildArgs
+from lp.buildmaster.prewarm import default_prewarmer
 from lp.registry.interfaces.pocket import PackagePublishingPocket
 from lp.services.config import config
 from lp.services.helpers import filenameToContentType
@@ -189,7 +190,10 @@ def dispatchBuildToWorker(self, logger):
         for filename, params in files.items():
             filename_to_sha1[filename] = params["sha1"]
             dl.append(self._worker.sendFileToWorker(logger=logger, **params))
-        yield defer.gatherResults(dl)
+        fetch_infos = yield defer.gatherResults(dl)
+        default_prewarmer().recordDispatch(
+            self._builder, chroot.content.sha1, chroot.http_url
+        )
 
         combined_args = {
             "builder_type": builder_type,
@@ -223,6 +227,17 @@ def dispatchBuildToWorker(self, logger):
                 "region": self._builder.region,
             },
         )
+        # Record whether the builder already had each file in its cache.
+        for file_type, info in zip(
+            ["chroot"] + ["other"] * len(files), fetch_infos
+        ):
+            statsd_client.incr(
+                "builders.file_cache",
+                labels={
+                    "file_type": file_type,
+                    "result": "miss" if info == "Download" else "hit",
+                },
+            )
 
         logger.info(
             "Job %s (%s) started on %s: %s %s"
@@ -12,7 +12,19 @@
 from itertools import groupby
 from operator import attrgetter
 
-from storm.expr import SQL, Cast, Coalesce, Desc, Exists, Or
+from storm.expr import (
+    SQL,
+    And,
+    Cast,
+    Coalesce,
+    Column,
+    Desc,
+    Exists,
+    Or,
+    Select,
+    Table,
+    With,
+)
 from storm.properties import Bool, DateTime, Int, TimeDelta, Unicode
 from storm.references import Reference
 from storm.store import Store
@@ -296,20 +308,11 @@ def _getWorkerScannerLogger(self):
         logger = logging.getLogger("worker-scanner")
         return logger
 
-    def findBuildCandidates(
-        self,
-        processor,
-        virtualized,
-        limit,
-        open_resources=None,
-        restricted_resources=None,
-    ):
-        """See `IBuildQueueSet`."""
+    def _getJobTypeConditions(self):
+        """Return conditions imposed on candidates by specific job types."""
         # Circular import.
         from lp.buildmaster.model.buildfarmjob import BuildFarmJob
 
-        logger = self._getWorkerScannerLogger()
-
         job_type_conditions = []
         job_sources = specific_build_farm_job_sources()
         for job_type, job_source in job_sources.items():
@@ -318,6 +321,14 @@ def findBuildCandidates(
                 job_type_conditions.append(
                     Or(BuildFarmJob.job_type != job_type, Exists(SQL(query)))
                 )
+        return job_type_conditions
+
+    def _getMinimumScore(self, processor_name):
+        """Return the minimum score for candidates for a processor.
+
+        :return: The minimum score, or None if there is no minimum.
+        """
+        logger = self._getWorkerScannerLogger()
 
         def get_int_feature_flag(flag):
             value_str = getFeatureFlag(flag)
@@ -327,12 +338,11 @@ def get_int_feature_flag(flag):
                 except ValueError:
                     logger.error("invalid %s: %s", flag, value_str)
 
-        score_conditions = []
         minimum_scores = set()
-        if processor is not None:
+        if processor_name is not None:
             minimum_scores.add(
                 get_int_feature_flag(
-                    "buildmaster.minimum_score.%s" % processor.name
+                    "buildmaster.minimum_score.%s" % processor_name
                 )
             )
         minimum_scores.add(get_int_feature_flag("buildmaster.minimum_score"))
@@ -341,10 +351,27 @@ def get_int_feature_flag(flag):
         # supported by this builder, use the highest of them.  This is a bit
         # weird and not completely ideal, but it's a safe conservative
         # option and avoids substantially complicating the candidate query.
-        if minimum_scores:
-            score_conditions.append(
-                BuildQueue.lastscore >= max(minimum_scores)
-            )
+        return max(minimum_scores) if minimum_scores else None
+
+    def findBuildCandidates(
+        self,
+        processor,
+        virtualized,
+        limit,
+        open_resources=None,
+        restricted_resources=None,
+    ):
+        """See `IBuildQueueSet`."""
+        # Circular import.
+        from lp.buildmaster.model.buildfarmjob import BuildFarmJob
+
+        job_type_conditions = self._getJobTypeConditions()
+        score_conditions = []
+        minimum_score = self._getMinimumScore(
+            processor.name if processor is not None else None
+        )
+        if minimum_score is not None:
+            score_conditions.append(BuildQueue.lastscore >= minimum_score)
 
         builder_constraints = Coalesce(
             BuildQueue.builder_constraints, Cast("[]", "jsonb")
@@ -389,3 +416,69 @@ def get_int_feature_flag(flag):
             # PrefetchedBuildCandidates._getSortKey.
             .order_by(Desc(BuildQueue.lastscore), BuildQueue.id)[:limit]
         )
+
+    def findAllBuildCandidates(self, limit):
+        """See `IBuildQueueSet`."""
+        # Circular imports.
+        from lp.buildmaster.model.buildfarmjob import BuildFarmJob
+        from lp.buildmaster.model.processor import Processor
+
+        # Rank waiting jobs within each set of jobs that would be suitable
+        # for exactly the same builders.  No more than `limit` builders can
+        # take jobs from any one of these sets, so there's no point in
+        # looking any further down each of them.
+        ranked_candidates_cte = With(
+            "RankedCandidates",
+            Select(
+                (
+                    BuildQueue.id,
+                    SQL(
+                        "row_number() OVER ("
+                        "PARTITION BY BuildQueue.processor, "
+                        "BuildQueue.virtualized, "
+                        "COALESCE("
+                        "BuildQueue.builder_constraints, '[]'::jsonb) "
+                        "ORDER BY BuildQueue.lastscore DESC, BuildQueue.id"
+                        ") AS rank"
+                    ),
+                ),
+                tables=(BuildQueue, BuildFarmJob),
+                where=And(
+                    BuildFarmJob.id == BuildQueue._build_farm_job_id,
+                    BuildQueue.status == BuildQueueStatus.WAITING,
+                    BuildQueue.builder == None,
+                    *self._getJobTypeConditions(),
+                ),
+            ),
+        )
+        RankedCandidates = Table("RankedCandidates")
+        candidates = list(
+            IStore(BuildQueue)
+            .with_(ranked_candidates_cte)
+            .using(BuildQueue, RankedCandidates)
+            .find(
+                BuildQueue,
+                BuildQueue.id == Column("id", RankedCandidates),
+                Column("rank", RankedCandidates) <= limit,
+            )
+            # This must match the ordering used in
+            # BuildDispatchPlanner._getSortKey.
+            .order_by(Desc(BuildQueue.lastscore), BuildQueue.id)
+        )
+        load_related(Processor, candidates, ["processor_id"])
+        minimum_scores = {}
+        eligible_candidates = []
+        for candidate in candidates:
+            processor_name = (
+                candidate.processor.name
+                if candidate.processor is not None
+                else None
+            )
+            if processor_name not in minimum_scores:
+                minimum_scores[processor_name] = self._getMinimumScore(
+                    processor_name
+                )
+            minimum_score = minimum_scores[processor_name]
+            if minimum_score is None or candidate.lastscore >= minimum_score:
+                eligible_candidates.append(candidate)
+        return eligible_candidates
@@ -0,0 +1,206 @@
+# Copyright 2026 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Pre-seeding builders' file caches with the chroots they will need.
+
+Builders keep a cache of files keyed by SHA-1, and `ensurepresent` only
+makes a builder download a file if it isn't already in that cache.
+Dispatching a build needs a chroot or base image, which is typically
+hundreds of megabytes, so dispatching to a builder that doesn't already
+have it waits while the builder fetches it from the librarian.
+
+A `ChrootPrewarmer` remembers which chroots were recently dispatched to
+each kind of builder (that is, builders with the same processors and
+virtualization), and which chroots each builder is known to hold.  When a
+builder is idle with nothing to dispatch to it, buildd-manager asks it to
+fetch the most popular chroot for its kind that it doesn't already have,
+so that it is ready for the next dispatch.
+
+launchpad-buildd fetches files synchronously, so a builder can't answer
+any other requests until the fetch is finished.  The builder's scans are
+skipped until then rather than counting its silence as a failure.
+"""
+
+__all__ = [
+    "ChrootPrewarmer",
+    "default_prewarmer",
+]
+
+from collections import defaultdict
+
+from twisted.internet import defer
+from zope.component import getUtility
+
+from lp.services.statsd.interfaces.statsd_client import IStatsdClient
+
+
+class ChrootPrewarmer:
+    """Predict the chroots that idle builders will need, and pre-seed them.
+
+    This state lives only in buildd-manager's memory, so it starts empty
+    when buildd-manager is restarted.
+    """
+
+    # Idle builders try to hold this many of the chroots most recently
+    # dispatched to builders of their kind.
+    max_chroots = 3
+
+    # Each dispatch to a kind of builder multiplies the popularity of the
+    # chroots previously dispatched to that kind by this factor.
+    decay = 0.95
+
+    # Chroots whose popularity falls below this are forgotten.
+    min_popularity = 0.01
+
+    def __init__(self):
+        # {(processor names, virtualized): {(sha1, url): popularity}}
+        self._popularity = defaultdict(dict)
+        # {builder name: {sha1}}; the chroots each builder is known to
+        # hold, or has already been asked to fetch.
+        self._present = defaultdict(set)
+        # {builder name: Deferred}; pre-seeding requests in progress.
+        self._pending = {}
+
+    @staticmethod
+    def _getKind(processor_names, virtualized):
+        return frozenset(processor_names), bool(virtualized)
+
+    def recordDispatch(self, builder, sha1, url):
+        """Record that a chroot has been sent to a builder for a build.
+
+        :param builder: The `IBuilder` that the build was dispatched to.
+        :param sha1: The SHA-1 of the chroot.
+        :param url: The URL from which the builder fetched the chroot.
+        """
+        kind = self._getKind(
+            [processor.name for processor in builder.processors],
+            builder.virtualized,
+        )
+        popularity = self._popularity[kind]
+        for key in list(popularity):
+            popularity[key] *= self.decay
+            if popularity[key] < self.min_popularity:
+                del popularity[key]
+        popularity[(sha1, url)] = popularity.get((sha1, url), 0) + 1
+        self._present[builder.name].add(sha1)
+
+    def forgetBuilder(self, builder_name):
+        """Forget the chroots that a builder holds.
+
+        Call this when a builder's file cache has been emptied, such as
+        when a virtual builder is reset.
+        """
+        self._present.pop(builder_name, None)
+
+    def predict(self, vitals):
+        """Return the chroots that an idle builder should fetch.
+
+        :param vitals: The builder's `BuilderVitals`.
+        :return: A list of (sha1, url) pairs, most popular first, of the
+            chroots that the builder isn't known to hold.
+        """
+        popularity = self._popularity.get(
+            self._getKind(vitals.processor_names, vitals.virtualized), {}
+        )
+        ranked = sorted(popularity, key=popularity.get, reverse=True)
+        present = self._present.get(vitals.name, set())
+        return [
+            (sha1, url)
+            for sha1, url in ranked[: self.max_chroots]
+            if sha1 not in present
+        ]
+
+    @defer.inlineCallbacks
+    def prewarm(self, vitals, worker, logger):
+        """Ask an idle builder to fetch the chroot it most likely needs next.
+
+        At most one chroot is fetched per call.  The returned Deferred
+        doesn't fire until the builder has fetched it; see `startPrewarm`.
+
+        :param vitals: The builder's `BuilderVitals`.
+        :param worker: The builder's `BuilderWorker`.
+        :param logger: A logger.
+        :return: A Deferred that fires with True if the builder was asked
+            to fetch a chroot, otherwise False.
+        """
+        predicted = self.predict(vitals)
+        if not predicted:
+            return False
+        sha1, url = predicted[0]
+        # Don't ask again even if this fails; the chroot will be fetched
+        # in the usual way when a build needs it.
+        self._present[vitals.name].add(sha1)
+        logger.debug("Asking %s to pre-seed %s (%s)", vitals.name, sha1, url)
+        try:
+            present, info = yield worker.ensurepresent(sha1, url, "", "")
+        except Exception as e:
+            # Pre-seeding is only an optimization, so it mustn't count as a
+            # failure of the builder's scan.
+            present, info = False, str(e)
+        if not present:
+            logger.info(
+                "%s failed to pre-seed %s (%s): %s",
+                vitals.name,
+                sha1,
+                url,
+                info,
+            )
+            result = "failed"
+        elif info == "Download":
+            result = "miss"
+        else:
+            result = "hit"
+        getUtility(IStatsdClient).incr(
+            "builders.chroot_prewarm", labels={"result": result}
+        )
+        return True
+
+    def isPending(self, builder_name):
+        """Is a builder still fetching a chroot that it was asked for?"""
+        return builder_name in self._pending
+
+    def startPrewarm(self, vitals, worker, logger):
+        """Start pre-seeding an idle builder, without waiting for it.
+
+        `ensurepresent` doesn't return until the builder has downloaded the
+        file, so the builder's scan must not wait for it; see `isPending`.
+        No new request is made while one is still in progress for the same
+        builder.
+
+        :param vitals: The builder's `BuilderVitals`.
+        :param worker: The builder's `BuilderWorker`.
+        :param logger: A logger.
+        :return: A Deferred that fires when the request is finished, or
+            None if a request was already in progress.
+        """
+        if vitals.name in self._pending:
+            return None
+
+        def finished(result):
+            self._pending.pop(vitals.name, None)
+            return result
+
+        def failed(failure):
+            logger.error(
+                "Failed to pre-seed %s: %s",
+                vitals.name,
+                failure.getErrorMessage(),
+            )
+            return False
+
+        d = self.prewarm(vitals, worker, logger)
+        self._pending[vitals.name] = d
+        d.addBoth(finished)
+        d.addErrback(failed)
+        return d
+
+
+_default_prewarmer = None
+
+
+def default_prewarmer():
+    """Return the `ChrootPrewarmer` shared by this process."""
+    global _default_prewarmer
+    if _default_prewarmer is None:
+        _default_prewarmer = ChrootPrewarmer()
+    return _default_prewarmer
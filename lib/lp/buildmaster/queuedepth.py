@@ -1,360 +1,421 @@
-# Copyright 2009-2013 Canonical Ltd.  This software is licensed under the
+# Copyright 2009-2026 Canonical Ltd.  This software is licensed under the
 # GNU Affero General Public License version 3 (see the file LICENSE).
 
 __all__ = [
+    "QueueDepthModel",
     "estimate_job_start_time",
+    "get_queue_depth_model",
 ]
 
+from bisect import bisect_left
 from collections import defaultdict
 from datetime import datetime, timedelta, timezone
+from itertools import accumulate
 
-from storm.databases.postgres import Case
-from storm.expr import (
-    And,
-    Cast,
-    Count,
-    Desc,
-    Func,
-    Is,
-    IsNot,
-    Min,
-    Not,
-    Or,
-    Select,
-    Sum,
-)
+from storm.expr import Desc, Is, IsNot
 
 from lp.buildmaster.enums import BuildQueueStatus
 from lp.buildmaster.model.builder import Builder, BuilderProcessor
 from lp.buildmaster.model.buildqueue import BuildQueue
+from lp.services.config import config
 from lp.services.database.interfaces import IStore
 
+# Assume that jobs that have overdrawn their estimated duration time budget
+# will complete within 2 minutes.  This is a wild guess but has worked well
+# so far.
+#
+# Please note that this is entirely innocuous, i.e. if our guess is off
+# nothing bad will happen but our estimate will not be as good as it could
+# be.
+OVERDRAWN_JOB_DELAY = 120
 
-def get_builder_data():
-    """How many working builders are there, how are they configured?"""
-    # XXX: This is broken with multi-Processor buildds, as it only
-    # considers competition from the same processor.
-    per_arch_totals = list(
-        IStore(Builder)
-        .find(
-            (
-                BuilderProcessor.processor_id,
-                Builder.virtualized,
-                Count(Builder.id),
-            ),
-            BuilderProcessor.builder_id == Builder.id,
-            Builder._builderok == True,
-            Builder.manual == False,
-        )
-        .group_by(BuilderProcessor.processor_id, Builder.virtualized)
-    )
-    per_virt_totals = list(
-        IStore(Builder)
-        .find(
-            (Builder.virtualized, Count(Builder.id)),
-            Builder._builderok == True,
-            Builder.manual == False,
-        )
-        .group_by(Builder.virtualized)
-    )
+_one_second = timedelta(seconds=1)
+_one_microsecond = timedelta(microseconds=1)
 
-    builder_stats = defaultdict(int)
-    for virtualized, count in per_virt_totals:
-        builder_stats[(None, virtualized)] = count
-    for processor, virtualized, count in per_arch_totals:
-        builder_stats[(processor, virtualized)] = count
-    return builder_stats
 
+class _PendingJobs:
+    """The pending jobs for one (processor, virtualized) platform.
 
-def get_free_builders_count(processor, virtualized):
-    """How many builders capable of running jobs for the given processor
-    and virtualization combination are idle/free at present?"""
-    clauses = [
-        Is(Builder._builderok, True),
-        Is(Builder.manual, False),
-        Not(
-            Builder.id.is_in(
-                Select(
-                    BuildQueue.builder_id,
-                    where=IsNot(BuildQueue.builder_id, None),
-                )
-            )
-        ),
-        Is(Builder.virtualized, virtualized),
-    ]
-    if processor is not None:
-        clauses.append(
-            Builder.id.is_in(
-                Select(
-                    BuilderProcessor.builder_id,
-                    where=(BuilderProcessor.processor == processor),
-                )
+    Jobs are held in dispatch order, so the jobs ahead of any given job
+    and the sum of their estimated durations can be found by bisection.
+    """
+
+    def __init__(self, jobs):
+        """Construct a set of pending jobs.
+
+        :param jobs: A sequence of (lastscore, id, estimated_duration)
+            tuples, in dispatch order.
+        """
+        self.keys = [(-lastscore, job_id) for lastscore, job_id, _ in jobs]
+        # Durations are summed in microseconds to avoid rounding errors.
+        self.duration_sums = [0] + list(
+            accumulate(
+                (duration or timedelta()) // _one_microsecond
+                for _, _, duration in jobs
             )
         )
-    return IStore(Builder).find(Builder.id, *clauses).count()
 
+    @staticmethod
+    def getKey(bq):
+        return -bq.lastscore, bq.id
 
-def get_head_job_platform(bq):
-    """Find the processor and virtualization setting for the head job.
+    def countAhead(self, bq):
+        """Return the number of jobs that are dispatched before `bq`."""
+        return bisect_left(self.keys, self.getKey(bq))
 
-    Among the jobs that compete with the job of interest (JOI) for
-    builders and are queued ahead of it the head job is the one in pole
-    position i.e. the one to be dispatched to a builder next.
+    def getDelay(self, count):
+        """Return the estimated duration of the first `count` jobs.
 
-    :return: A (processor, virtualized) tuple which is the head job's
-    platform or None if the JOI is the head job.
-    """
-    my_platform = (getattr(bq.processor, "id", None), bq.virtualized)
-    result = (
-        IStore(BuildQueue)
-        .find(
-            (BuildQueue.processor_id, BuildQueue.virtualized),
-            *get_pending_jobs_clauses(bq),
-        )
-        .order_by(Desc(BuildQueue.lastscore), BuildQueue.id)
-        .first()
-    )
-    return my_platform if result is None else result
+        :return: A whole number of seconds.
+        """
+        return round(self.duration_sums[count] / 1000000)
 
 
-def estimate_time_to_next_builder(bq, now=None):
-    """Estimate time until next builder becomes available.
+class _RunningJobs:
+    """The running jobs on the builders that can serve one platform."""
+
+    def __init__(self):
+        self.finish_times = []
+        # Jobs whose finish time can't be estimated count as overdrawn.
+        self.unknown = 0
 
-    For the purpose of estimating the dispatch time of the job of interest
-    (JOI) we need to know how long it will take until the job at the head
-    of JOI's queue is dispatched.
+    def add(self, date_started, estimated_duration):
+        if date_started is None or estimated_duration is None:
+            self.unknown += 1
+        else:
+            self.finish_times.append(date_started + estimated_duration)
+
+    def getTimeToNextFinish(self, now):
+        """Return the estimated number of seconds until one of these jobs
+        finishes, or 0 if there are none.
+        """
+        overdrawn = bisect_left(self.finish_times, now)
+        delays = []
+        if overdrawn < len(self.finish_times):
+            delays.append(
+                int((self.finish_times[overdrawn] - now) / _one_second)
+            )
+        if overdrawn > 0 or self.unknown > 0:
+            delays.append(OVERDRAWN_JOB_DELAY)
+        return min(delays, default=0)
 
-    There are two cases to consider here: the head job is
 
-        - processor dependent: only builders with the matching
-            processor/virtualization combination should be considered.
-        - *not* processor dependent: all builders with the matching
-            virtualization setting should be considered.
+class QueueDepthModel:
+    """A snapshot of the build farm used to estimate job start times.
 
-    :return: The estimated number of seconds until a builder capable of
-        running the head job becomes available.
+    Loading a model takes a fixed number of queries; after that, any
+    pending job's start time can be estimated without further queries, in
+    time logarithmic in the length of the queue.  Platforms are
+    (processor ID, virtualized) pairs; a processor ID of None stands for
+    all builders with that virtualization setting.
+
+    XXX: This is broken with multi-Processor buildds, as it only considers
+    competition from the same processor.
     """
-    head_job_platform = get_head_job_platform(bq)
-
-    # Return a zero delay if we still have free builders available for the
-    # given platform/virtualization combination.
-    free_builders = get_free_builders_count(*head_job_platform)
-    if free_builders > 0:
-        return 0
-
-    head_job_processor, head_job_virtualized = head_job_platform
-
-    now = now or datetime.now(timezone.utc)
-    delay_clauses = [
-        BuildQueue.builder_id == Builder.id,
-        Is(Builder.manual, False),
-        Is(Builder._builderok, True),
-        BuildQueue.status == BuildQueueStatus.RUNNING,
-        Is(Builder.virtualized, head_job_virtualized),
-    ]
-    if head_job_processor is not None:
-        # Only look at builders with specific processor types.
-        delay_clauses.append(
-            Builder.id.is_in(
-                Select(
-                    BuilderProcessor.builder_id,
-                    where=(BuilderProcessor.processor == head_job_processor),
-                )
+
+    def __init__(
+        self,
+        date_created,
+        builders,
+        busy_builder_ids,
+        running_jobs,
+        pending_jobs,
+    ):
+        """Construct a model.  Use `load` rather than calling this directly.
+
+        :param date_created: When the snapshot was taken.
+        :param builders: A sequence of (builder ID, virtualized, processor
+            IDs) tuples for the builders that can take jobs.
+        :param busy_builder_ids: The IDs of builders that have a job.
+        :param running_jobs: A sequence of (builder ID, date_started,
+            estimated_duration) tuples for running jobs.
+        :param pending_jobs: A sequence of (processor ID, virtualized,
+            lastscore, id, estimated_duration) tuples for pending jobs, in
+            dispatch order.
+        """
+        self.date_created = date_created
+        self.builder_stats = defaultdict(int)
+        self._free_builders = defaultdict(int)
+        self._running = defaultdict(_RunningJobs)
+        builder_platforms = {}
+        for builder_id, virtualized, processor_ids in builders:
+            platforms = [(None, virtualized)] + [
+                (processor_id, virtualized) for processor_id in processor_ids
+            ]
+            builder_platforms[builder_id] = platforms
+            for platform in platforms:
+                self.builder_stats[platform] += 1
+                if builder_id not in busy_builder_ids:
+                    self._free_builders[platform] += 1
+        for builder_id, date_started, estimated_duration in running_jobs:
+            for platform in builder_platforms.get(builder_id, []):
+                self._running[platform].add(date_started, estimated_duration)
+        for running in self._running.values():
+            running.finish_times.sort()
+
+        jobs_by_platform = defaultdict(list)
+        for processor_id, virtualized, *job in pending_jobs:
+            jobs_by_platform[(processor_id, virtualized)].append(job)
+        self._pending = {
+            platform: _PendingJobs(jobs)
+            for platform, jobs in jobs_by_platform.items()
+        }
+
+    @classmethod
+    def load(cls):
+        """Load a snapshot of the build farm from the database."""
+        store = IStore(BuildQueue)
+        date_created = datetime.now(timezone.utc)
+        builders = {
+            builder_id: (builder_id, virtualized, [])
+            for builder_id, virtualized in store.find(
+                (Builder.id, Builder.virtualized),
+                Is(Builder._builderok, True),
+                Is(Builder.manual, False),
+            )
+        }
+        for builder_id, processor_id in store.find(
+            (BuilderProcessor.builder_id, BuilderProcessor.processor_id),
+            BuilderProcessor.builder_id.is_in(list(builders)),
+        ):
+            builders[builder_id][2].append(processor_id)
+        busy_builder_ids = set(
+            store.find(
+                BuildQueue.builder_id, IsNot(BuildQueue.builder_id, None)
             )
         )
-    estimated_remaining = Func(
-        "date_part",
-        "epoch",
-        BuildQueue.date_started + BuildQueue.estimated_duration - now,
-    )
-    head_job_delay = (
-        IStore(BuildQueue)
-        .find(
-            Min(
-                Case(
-                    cases=((estimated_remaining >= 0, estimated_remaining),),
-                    # Assume that jobs that have overdrawn their estimated
-                    # duration time budget will complete within 2 minutes.
-                    # This is a wild guess but has worked well so far.
-                    #
-                    # Please note that this is entirely innocuous, i.e. if
-                    # our guess is off nothing bad will happen but our
-                    # estimate will not be as good as it could be.
-                    default=120,
-                )
+        running_jobs = store.find(
+            (
+                BuildQueue.builder_id,
+                BuildQueue.date_started,
+                BuildQueue.estimated_duration,
+            ),
+            BuildQueue.status == BuildQueueStatus.RUNNING,
+            BuildQueue.builder_id.is_in(list(builders)),
+        )
+        pending_jobs = store.find(
+            (
+                BuildQueue.processor_id,
+                BuildQueue.virtualized,
+                BuildQueue.lastscore,
+                BuildQueue.id,
+                BuildQueue.estimated_duration,
             ),
-            *delay_clauses,
+            BuildQueue.status == BuildQueueStatus.WAITING,
+        ).order_by(Desc(BuildQueue.lastscore), BuildQueue.id)
+        return cls(
+            date_created,
+            builders.values(),
+            busy_builder_ids,
+            list(running_jobs),
+            list(pending_jobs),
         )
-        .one()
+
+    @staticmethod
+    def getPlatform(bq):
+        return getattr(bq.processor, "id", None), bq.virtualized
+
+    def getFreeBuildersCount(self, processor_id, virtualized):
+        """How many builders capable of running jobs for the given
+        processor and virtualization combination are idle/free?"""
+        return self._free_builders[(processor_id, virtualized)]
+
+    def _getCompetingPlatforms(self, bq):
+        """Return the platforms whose jobs compete with `bq` for builders.
+
+        Jobs compete for builders if their virtualization settings match
+        and either their processors match or one of them is
+        processor-independent.
+        """
+        processor_id, virtualized = self.getPlatform(bq)
+        return [
+            platform
+            for platform in self._pending
+            if platform[1] == virtualized
+            and (
+                processor_id is None
+                or platform[0] is None
+                or platform[0] == processor_id
+            )
+        ]
+
+    def getHeadJobPlatform(self, bq):
+        """Find the processor and virtualization setting for the head job.
+
+        Among the jobs that compete with the job of interest (JOI) for
+        builders and are queued ahead of it the head job is the one in
+        pole position i.e. the one to be dispatched to a builder next.
+
+        :return: A (processor, virtualized) tuple which is the head job's
+            platform, or the JOI's own platform if it is the head job.
+        """
+        head_platform = self.getPlatform(bq)
+        head_key = _PendingJobs.getKey(bq)
+        for platform in self._getCompetingPlatforms(bq):
+            keys = self._pending[platform].keys
+            if keys and keys[0] < head_key:
+                head_platform, head_key = platform, keys[0]
+        return head_platform
+
+    def estimateTimeToNextBuilder(self, bq, now=None):
+        """Estimate time until next builder becomes available.
+
+        For the purpose of estimating the dispatch time of the job of
+        interest (JOI) we need to know how long it will take until the job
+        at the head of JOI's queue is dispatched.  If the head job is
+        processor-independent then all builders with the matching
+        virtualization setting are considered; otherwise only builders
+        with the matching processor/virtualization combination are.
+
+        :return: The estimated number of seconds until a builder capable
+            of running the head job becomes available.
+        """
+        head_job_platform = self.getHeadJobPlatform(bq)
+        # Return a zero delay if we still have free builders available for
+        # the given platform/virtualization combination.
+        if self._free_builders[head_job_platform] > 0:
+            return 0
+        running = self._running.get(head_job_platform)
+        if running is None:
+            return 0
+        return running.getTimeToNextFinish(now or datetime.now(timezone.utc))
+
+    def estimateJobDelay(self, bq):
+        """Sum of estimated durations for *pending* jobs ahead in queue.
+
+        For the purpose of estimating the dispatch time of the job of
+        interest (JOI) we need to know the delay caused by all the pending
+        jobs that are ahead of the JOI in the queue and that compete with
+        it for builders.
+
+        :return: An integer value holding the sum of delays (in seconds)
+            caused by the jobs that are ahead of and competing with the
+            JOI.
+        """
+        sum_of_delays = 0
+        # Divide the estimated duration of the jobs as follows:
+        #   - if a job is tied to a processor TP then divide the estimated
+        #     duration of that job by the number of builders that target TP
+        #     since only these can build the job.
+        #   - if the job is processor-independent then divide its estimated
+        #     duration by the total number of builders with the same
+        #     virtualization setting because any one of them may run it.
+        for platform in self._getCompetingPlatforms(bq):
+            builders = self.builder_stats.get(platform, 0)
+            if builders == 0:
+                # There is no builder that can run these jobs, ignore them
+                # for the purpose of dispatch time estimation.
+                continue
+            pending = self._pending[platform]
+            jobs = pending.countAhead(bq)
+            if jobs == 0:
+                continue
+            duration = pending.getDelay(jobs)
+            # If there are less jobs than builders that can take them on,
+            # the delays should be averaged/divided by the number of jobs.
+            denominator = jobs if jobs < builders else builders
+            if denominator > 1:
+                duration = int(duration / float(denominator))
+            sum_of_delays += duration
+        return sum_of_delays
+
+    def estimateJobStartTime(self, bq, now=None):
+        """Estimate the start time of the given pending `IBuildQueue`.
+
+        The estimated dispatch time for the build farm job at hand is
+        calculated from the following ingredients:
+            * the start time for the head job (job at the
+                head of the respective build queue)
+            * the estimated build durations of all jobs that
+                precede the job of interest (JOI) in the build queue
+                (divided by the number of machines in the respective
+                build pool)
+
+        :return: A datetime, or None if no builders can run the job.
+        """
+        if self.builder_stats[self.getPlatform(bq)] == 0:
+            # No builders that can run the job at hand
+            #   -> no dispatch time estimation available.
+            return None
+        now = now or datetime.now(timezone.utc)
+        sum_of_delays = self.estimateJobDelay(bq)
+        min_wait_time = self.estimateTimeToNextBuilder(bq, now=now)
+        # A job will not get dispatched in less than 5 seconds no matter
+        # what.
+        start_time = max(5, min_wait_time + sum_of_delays)
+        return now + timedelta(seconds=start_time)
+
+
+_model = None
+
+
+def get_queue_depth_model():
+    """Return a recent `QueueDepthModel`.
+
+    Models are shared by all threads in this process, and reloaded once
+    they are older than `[builddmaster]queue_depth_model_lifetime`
+    seconds.
+    """
+    global _model
+    lifetime = timedelta(
+        seconds=config.builddmaster.queue_depth_model_lifetime
+    )
+    model = _model
+    if (
+        model is None
+        or datetime.now(timezone.utc) - model.date_created >= lifetime
+    ):
+        model = _model = QueueDepthModel.load()
+    return model
+
+
+def get_builder_data():
+    """How many working builders are there, how are they configured?"""
+    return QueueDepthModel.load().builder_stats
+
+
+def get_free_builders_count(processor, virtualized):
+    """How many builders capable of running jobs for the given processor
+    and virtualization combination are idle/free at present?"""
+    return QueueDepthModel.load().getFreeBuildersCount(
+        getattr(processor, "id", processor), virtualized
     )
 
-    return 0 if head_job_delay is None else int(head_job_delay)
 
+def estimate_time_to_next_builder(bq, now=None):
+    """Estimate time until next builder becomes available.
 
-def get_pending_jobs_clauses(bq):
-    """Storm clauses for pending job queries, used for dispatch time
-    estimation.
+    See `QueueDepthModel.estimateTimeToNextBuilder`.
     """
-    clauses = [
-        BuildQueue.status == BuildQueueStatus.WAITING,
-        # Either the score must be above my score, or the job must be older
-        # than me in cases where the score is equal.
-        Or(
-            BuildQueue.lastscore > bq.lastscore,
-            And(BuildQueue.lastscore == bq.lastscore, BuildQueue.id < bq.id),
-        ),
-        Is(BuildQueue.virtualized, bq.virtualized),
-    ]
-    # We don't care about processors if the estimation is for a
-    # processor-independent job.
-    if bq.processor is not None:
-        # Either the processor values match, or the candidate job is
-        # processor-independent.
-        clauses.append(
-            Or(
-                BuildQueue.processor == bq.processor,
-                Is(BuildQueue.processor_id, None),
-            )
-        )
-    return clauses
+    return QueueDepthModel.load().estimateTimeToNextBuilder(bq, now=now)
 
 
 def estimate_job_delay(bq, builder_stats):
     """Sum of estimated durations for *pending* jobs ahead in queue.
 
-    For the purpose of estimating the dispatch time of the job of
-    interest (JOI) we need to know the delay caused by all the pending
-    jobs that are ahead of the JOI in the queue and that compete with it
-    for builders.
+    See `QueueDepthModel.estimateJobDelay`.
 
     :param builder_stats: A dictionary with builder counts where the
         key is a (processor, virtualized) combination (aka "platform") and
         the value is the number of builders that can take on jobs
         requiring that combination.
-    :return: An integer value holding the sum of delays (in seconds)
-        caused by the jobs that are ahead of and competing with the JOI.
     """
+    model = QueueDepthModel.load()
+    model.builder_stats = builder_stats
+    return model.estimateJobDelay(bq)
 
-    # XXX: This is broken with multi-Processor buildds, as it only
-    # considers competition from the same processor.
-    def jobs_compete_for_builders(a, b):
-        """True if the two jobs compete for builders."""
-        a_processor, a_virtualized = a
-        b_processor, b_virtualized = b
-        if a_processor is None or b_processor is None:
-            # If either of the jobs is platform-independent then the two
-            # jobs compete for the same builders if the virtualization
-            # settings match.
-            if a_virtualized == b_virtualized:
-                return True
-        else:
-            # Neither job is platform-independent, match processor and
-            # virtualization settings.
-            return a == b
-
-    my_platform = (getattr(bq.processor, "id", None), bq.virtualized)
-    delays_by_platform = (
-        IStore(BuildQueue)
-        .find(
-            (
-                BuildQueue.processor_id,
-                BuildQueue.virtualized,
-                Count(BuildQueue.id),
-                Cast(
-                    Func(
-                        "date_part",
-                        "epoch",
-                        Sum(BuildQueue.estimated_duration),
-                    ),
-                    "integer",
-                ),
-            ),
-            *get_pending_jobs_clauses(bq),
-        )
-        .group_by(BuildQueue.processor_id, BuildQueue.virtualized)
-    )
 
-    # This will be used to capture per-platform delay totals.
-    delays = defaultdict(int)
-    # This will be used to capture per-platform job counts.
-    job_counts = defaultdict(int)
-
-    # Divide the estimated duration of the jobs as follows:
-    #   - if a job is tied to a processor TP then divide the estimated
-    #     duration of that job by the number of builders that target TP
-    #     since only these can build the job.
-    #   - if the job is processor-independent then divide its estimated
-    #     duration by the total number of builders with the same
-    #     virtualization setting because any one of them may run it.
-    for processor, virtualized, job_count, delay in delays_by_platform:
-        platform = (processor, virtualized)
-        builder_count = builder_stats.get(platform, 0)
-        if builder_count == 0:
-            # There is no builder that can run this job, ignore it
-            # for the purpose of dispatch time estimation.
-            continue
-
-        if jobs_compete_for_builders(my_platform, platform):
-            # The jobs that target the platform at hand compete with
-            # the JOI for builders, add their delays.
-            delays[platform] += delay
-            job_counts[platform] += job_count
-
-    sum_of_delays = 0
-    # Now divide the delays based on a jobs/builders comparison.
-    for platform, duration in delays.items():
-        jobs = job_counts[platform]
-        builders = builder_stats[platform]
-        # If there are less jobs than builders that can take them on,
-        # the delays should be averaged/divided by the number of jobs.
-        denominator = jobs if jobs < builders else builders
-        if denominator > 1:
-            duration = int(duration / float(denominator))
-
-        sum_of_delays += duration
-
-    return sum_of_delays
-
-
-def estimate_job_start_time(bq, now=None):
+def estimate_job_start_time(bq, now=None, model=None):
     """Estimate the start time of the given `IBuildQueue`.
 
-    The estimated dispatch time for the build farm job at hand is
-    calculated from the following ingredients:
-        * the start time for the head job (job at the
-            head of the respective build queue)
-        * the estimated build durations of all jobs that
-            precede the job of interest (JOI) in the build queue
-            (divided by the number of machines in the respective
-            build pool)
+    :param model: The `QueueDepthModel` to use; defaults to a recent model
+        shared by this process.
     """
     # This method may only be invoked for pending jobs.
     if bq.status != BuildQueueStatus.WAITING:
         raise AssertionError(
             "The start time is only estimated for pending jobs."
         )
-
-    # XXX: This is broken with multi-Processor buildds, as it only
-    # considers competition from the same processor.
-
-    builder_stats = get_builder_data()
-    platform = (getattr(bq.processor, "id", None), bq.virtualized)
-    if builder_stats[platform] == 0:
-        # No builders that can run the job at hand
-        #   -> no dispatch time estimation available.
-        return None
-
-    # Get the sum of the estimated run times for *pending* jobs that are
-    # ahead of us in the queue.
-    sum_of_delays = estimate_job_delay(bq, builder_stats)
-
-    # Get the minimum time duration until the next builder becomes
-    # available.
-    min_wait_time = estimate_time_to_next_builder(bq, now=now)
-
-    # A job will not get dispatched in less than 5 seconds no matter what.
-    start_time = max(5, min_wait_time + sum_of_delays)
-    result = (now or datetime.now(timezone.utc)) + timedelta(
-        seconds=start_time
-    )
-    return result
+    if model is None:
+        model = get_queue_depth_model()
+    return model.estimateJobStartTime(bq, now=now)
@@ -92,6 +92,9 @@ def failBuilder(self, reason):
         self.builderok = False
         self.failnotes = reason
 
+    def resetFailureCount(self):
+        self.failure_count = 0
+
     @property
     def region(self):
         region_match = region_re.match(self.name)
@@ -170,6 +173,7 @@ def sendFileToWorker(
         present, info = yield self.ensurepresent(sha1, url, username, password)
         if not present:
             raise CannotFetchFile(url, info)
+        return info
 
     def getURL(self, sha1):
         return urlappend("http://localhost:8221/filecache/", sha1).encode(
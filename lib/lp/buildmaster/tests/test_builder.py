@@ -415,6 +415,70 @@ def test_findBuildCandidates_honours_minimum_score(self):
                 logger.output,
             )
 
+    def test_findAllBuildCandidates(self):
+        # BuildQueueSet.findAllBuildCandidates returns candidates for all
+        # processors at once, with the highest score first, and no more
+        # than `limit` candidates for each combination of processor,
+        # virtualization, and builder constraints.
+        processors = [self.factory.makeProcessor() for _ in range(2)]
+        bqs = []
+        for processor in processors:
+            for score in (3000, 2000, 1000):
+                bq = self.factory.makeBinaryPackageBuild(
+                    processor=processor
+                ).queueBuild()
+                bq.manualScore(score)
+                bqs.append(bq)
+        nonvirt_bq = self.factory.makeBinaryPackageBuild(
+            archive=self.factory.makeArchive(virtualized=False),
+            processor=processors[0],
+        ).queueBuild()
+        nonvirt_bq.manualScore(1500)
+
+        def find_candidates(limit):
+            return [
+                bq
+                for bq in self.bq_set.findAllBuildCandidates(limit)
+                if bq.processor in processors
+            ]
+
+        self.assertEqual(
+            [bqs[0], bqs[3], bqs[1], bqs[4], nonvirt_bq],
+            find_candidates(2),
+        )
+        self.assertEqual(
+            [bqs[0], bqs[3], bqs[1], bqs[4], nonvirt_bq, bqs[2], bqs[5]],
+            find_candidates(3),
+        )
+
+    def test_findAllBuildCandidates_honours_minimum_score(self):
+        # BuildQueueSet.findAllBuildCandidates applies global and
+        # per-processor minimum scores.
+        processors = [self.factory.makeProcessor() for _ in range(2)]
+        bqs = []
+        for processor in processors:
+            for score in (100000, 99999):
+                bq = self.factory.makeBinaryPackageBuild(
+                    processor=processor
+                ).queueBuild()
+                bq.manualScore(score)
+                bqs.append(bq)
+
+        def find_candidates():
+            return [
+                bq
+                for bq in self.bq_set.findAllBuildCandidates(3)
+                if bq.processor in processors
+            ]
+
+        self.assertEqual([bqs[0], bqs[2], bqs[1], bqs[3]], find_candidates())
+        with FeatureFixture({"buildmaster.minimum_score": "100000"}):
+            self.assertEqual([bqs[0], bqs[2]], find_candidates())
+        with FeatureFixture(
+            {"buildmaster.minimum_score.%s" % processors[0].name: "100000"}
+        ):
+            self.assertEqual([bqs[0], bqs[2], bqs[3]], find_candidates())
+
 
 class TestFindBuildCandidatesPPABase(TestFindBuildCandidatesBase):
     ppa_joe_private = False
@@ -14,6 +14,7 @@
 import tempfile
 import xmlrpc.client
 from functools import partial
+from itertools import chain
 
 import six
 import treq
@@ -30,6 +31,11 @@
 from twisted.internet.task import Clock
 from twisted.python.failure import Failure
 
+from lp.buildmaster.downloader import (
+    DownloadCommand,
+    DownloadVerificationError,
+    get_partial_download_path,
+)
 from lp.buildmaster.enums import (
     BuilderCleanStatus,
     BuilderResetProtocol,
@@ -41,6 +47,7 @@
     BuilderWorker,
     extract_vitals_from_db,
     make_download_process_pool,
+    shut_down_default_pool,
     shut_down_default_process_pool,
 )
 from lp.buildmaster.interfaces.builder import (
@@ -111,6 +118,7 @@ class TestBuilderInteractor(TestCase):
     def setUp(self):
         super().setUp()
         self.addCleanup(shut_down_default_process_pool)
+        self.addCleanup(shut_down_default_pool)
 
     def resumeWorkerHost(self, builder):
         vitals = extract_vitals_from_db(builder)
@@ -558,6 +566,7 @@ def setUp(self):
         super().setUp()
         self.worker_helper = self.useFixture(WorkerTestHelpers())
         self.addCleanup(shut_down_default_process_pool)
+        self.addCleanup(shut_down_default_pool)
 
     @defer.inlineCallbacks
     def test_abort(self):
@@ -596,6 +605,24 @@ def test_echo(self):
         response = yield worker.echo("foo", "bar", 42)
         self.assertEqual(["foo", "bar", 42], response)
 
+    @defer.inlineCallbacks
+    def test_connection_reused(self):
+        # Calls to a worker reuse a persistent connection, even across
+        # separate BuilderWorker instances such as those made for each scan.
+        self.worker_helper.getServerWorker()
+        worker = self.worker_helper.getClientWorker()
+        yield worker.echo("foo")
+        connections = list(
+            chain.from_iterable(worker.pool._connections.values())
+        )
+        self.assertEqual(1, len(connections))
+        yield worker.status()
+        yield self.worker_helper.getClientWorker().echo("bar")
+        self.assertEqual(
+            connections,
+            list(chain.from_iterable(worker.pool._connections.values())),
+        )
+
     @defer.inlineCallbacks
     def test_info(self):
         # Calling 'info' gets some information about the worker.
@@ -769,6 +796,7 @@ def setUp(self):
             reactor=self.clock, proxy=self.proxy
         )
         self.addCleanup(shut_down_default_process_pool)
+        self.addCleanup(shut_down_default_pool)
 
     def assertCancelled(self, d, timeout=None):
         self.clock.advance((timeout or config.builddmaster.socket_timeout) + 1)
@@ -815,6 +843,7 @@ def setUp(self):
         self.worker_helper = self.useFixture(WorkerTestHelpers())
         self.clock = Clock()
         self.addCleanup(shut_down_default_process_pool)
+        self.addCleanup(shut_down_default_pool)
 
     def test_connection_timeout(self):
         # The default timeout of 30 seconds should not cause a timeout,
@@ -847,6 +876,7 @@ def setUp(self):
         super().setUp()
         self.worker_helper = self.useFixture(WorkerTestHelpers())
         self.addCleanup(shut_down_default_process_pool)
+        self.addCleanup(shut_down_default_pool)
 
     def test_ensurepresent_librarian(self):
         # ensurepresent, when given an http URL for a file will download the
@@ -1045,3 +1075,134 @@ def test_getFiles_limited_retries(self):
         self.worker_helper.makeCacheFile(tachandler, sha1, contents=b"log")
         with ExpectedException(RuntimeError, r"^Boom$"):
             yield worker.getFiles([(sha1, temp_name)])
+
+    @defer.inlineCallbacks
+    def test_getFiles_verifies_sha1(self):
+        # getFiles fails if a file doesn't have the SHA-1 it was named
+        # after, and doesn't leave the corrupt download behind.
+        self.pushConfig("builddmaster", download_attempts=1)
+        tachandler = self.worker_helper.getServerWorker()
+        worker = self.worker_helper.getClientWorker()
+        temp_dir = self.makeTemporaryDirectory()
+        temp_name = os.path.join(temp_dir, "log")
+        sha1 = hashlib.sha1(b"log").hexdigest()
+        self.worker_helper.makeCacheFile(tachandler, sha1, contents=b"bad")
+        with ExpectedException(DownloadVerificationError):
+            yield worker.getFiles([(sha1, temp_name)])
+        self.assertEqual([], os.listdir(temp_dir))
+
+    @defer.inlineCallbacks
+    def test_getFile_not_named_after_sha1(self):
+        # Files that aren't named after their SHA-1, such as the build
+        # log, are downloaded without being verified.
+        self.pushConfig("builddmaster", download_attempts=1)
+        tachandler = self.worker_helper.getServerWorker()
+        worker = self.worker_helper.getClientWorker()
+        temp_dir = self.makeTemporaryDirectory()
+        temp_name = os.path.join(temp_dir, "log")
+        self.worker_helper.makeCacheFile(
+            tachandler, "buildlog", contents=b"log"
+        )
+        yield worker.getFile("buildlog", temp_name)
+        with open(temp_name, "rb") as f:
+            self.assertEqual(b"log", f.read())
+        self.assertEqual(["log"], os.listdir(temp_dir))
+
+    @defer.inlineCallbacks
+    def test_download_resumes_partial_file(self):
+        # A download resumes from a partial file left by an earlier
+        # attempt.
+        tachandler = self.worker_helper.getServerWorker()
+        worker = self.worker_helper.getClientWorker()
+        temp_dir = self.makeTemporaryDirectory()
+        temp_name = os.path.join(temp_dir, "log")
+        sha1 = hashlib.sha1(b"contents").hexdigest()
+        self.worker_helper.makeCacheFile(
+            tachandler, sha1, contents=b"contents"
+        )
+        # The server only sends the rest of the file, so this prefix is
+        # kept even though it doesn't match.
+        with open(get_partial_download_path(temp_name), "wb") as f:
+            f.write(b"CONT")
+        yield worker.process_pool.doWork(
+            DownloadCommand,
+            file_url=worker.getURL(sha1),
+            path_to_write=temp_name,
+            timeout=worker.timeout,
+        )
+        with open(temp_name, "rb") as f:
+            self.assertEqual(b"CONTents", f.read())
+        self.assertEqual(["log"], os.listdir(temp_dir))
+
+    @defer.inlineCallbacks
+    def test_getFiles_limits_downloads_per_builder(self):
+        # getFiles only downloads the configured number of files from each
+        # builder at once.
+        self.pushConfig("builddmaster", download_connections_per_builder=2)
+        tachandler = self.worker_helper.getServerWorker()
+        worker = self.worker_helper.getClientWorker()
+        in_flight = []
+        max_in_flight = 0
+
+        @defer.inlineCallbacks
+        def count_in_flight(original, *args, **kwargs):
+            nonlocal max_in_flight
+            in_flight.append(None)
+            max_in_flight = max(max_in_flight, len(in_flight))
+            try:
+                result = yield original(*args, **kwargs)
+            finally:
+                in_flight.pop()
+            return result
+
+        self.useFixture(
+            MockPatchObject(
+                worker.process_pool,
+                "doWork",
+                side_effect=partial(
+                    count_in_flight, worker.process_pool.doWork
+                ),
+            )
+        )
+        temp_dir = self.makeTemporaryDirectory()
+        files = []
+        for i in range(5):
+            contents = ("content%d" % i).encode()
+            sha1 = hashlib.sha1(contents).hexdigest()
+            self.worker_helper.makeCacheFile(
+                tachandler, sha1, contents=contents
+            )
+            files.append((sha1, os.path.join(temp_dir, str(i))))
+        yield worker.getFiles(files)
+        self.assertEqual(2, max_in_flight)
+        self.assertEqual(5, len(os.listdir(temp_dir)))
+
+    @defer.inlineCallbacks
+    def test_getFiles_shares_bandwidth_between_downloads(self):
+        # Each download gets an equal share of the builder's bandwidth cap,
+        # but never less than one byte per second.
+        tachandler = self.worker_helper.getServerWorker()
+        worker = self.worker_helper.getClientWorker()
+        do_work = self.useFixture(
+            MockPatchObject(
+                worker.process_pool,
+                "doWork",
+                side_effect=worker.process_pool.doWork,
+            )
+        ).mock
+        temp_dir = self.makeTemporaryDirectory()
+        # An empty file is never throttled, so the test doesn't wait.
+        sha1 = hashlib.sha1(b"").hexdigest()
+        self.worker_helper.makeCacheFile(tachandler, sha1, contents=b"")
+        for bandwidth, expected in ((0, None), (4000, 500), (4, 1)):
+            self.pushConfig(
+                "builddmaster",
+                download_connections_per_builder=8,
+                download_bandwidth_per_builder=bandwidth,
+            )
+            yield worker.getFiles(
+                [(sha1, os.path.join(temp_dir, str(bandwidth)))]
+            )
+            self.assertEqual(
+                expected, do_work.call_args.kwargs["max_bytes_per_second"]
+            )
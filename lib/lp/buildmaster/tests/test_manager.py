@@ -20,6 +20,7 @@
 from zope.component import getUtility
 from zope.security.proxy import removeSecurityProxy
 
+from lp.buildmaster import prewarm
 from lp.buildmaster.enums import (
     BuilderCleanStatus,
     BuildQueueStatus,
@@ -27,6 +28,7 @@
 )
 from lp.buildmaster.interactor import (
     BuilderInteractor,
+    BuilderVitals,
     BuilderWorker,
     extract_vitals_from_db,
     shut_down_default_process_pool,
@@ -41,13 +43,17 @@
     BUILDER_FAILURE_THRESHOLD,
     JOB_RESET_THRESHOLD,
     SCAN_FAILURE_THRESHOLD,
+    BuildDispatchPlanner,
     BuilddManager,
     BuilderFactory,
+    DispatchCandidate,
     PrefetchedBuilderFactory,
     WorkerScanner,
+    WorkerStatusPoller,
     judge_failure,
     recover_failure,
 )
+from lp.buildmaster.prewarm import ChrootPrewarmer
 from lp.buildmaster.tests.harness import BuilddManagerTestSetup
 from lp.buildmaster.tests.mock_workers import (
     BrokenWorker,
@@ -63,10 +69,12 @@
     FakeBuildQueue,
     MockBuilderFactory,
 )
+from lp.buildmaster.tests.test_prewarm import SlowDownloadingWorker
 from lp.registry.interfaces.distribution import IDistributionSet
 from lp.services.config import config
 from lp.services.log.logger import BufferLogger
 from lp.services.statsd.tests import StatsMixin
+from lp.services.twistedsupport import extract_result
 from lp.soyuz.interfaces.binarypackagebuild import IBinaryPackageBuildSet
 from lp.soyuz.model.binarypackagebuildbehaviour import (
     BinaryPackageBuildBehaviour,
@@ -740,6 +748,11 @@ def test_update_worker_version(self):
         self.patch(BuilderWorker, "makeBuilderWorker", FakeMethod(worker))
         scanner = self._getScanner()
         yield scanner.scan()
+        # The update is applied along with other pending updates.
+        self.assertEqual(
+            {builder.name: "100"}, scanner.manager.pending_builder_versions
+        )
+        scanner.manager.flushLogTails()
         self.assertEqual("100", builder.version)
 
     def test_updateVersion_no_op(self):
@@ -1095,21 +1108,79 @@ def test_findBuildCandidate_honours_resources(self):
         pbf = PrefetchedBuilderFactory()
         pbf.update()
 
-        # PrefetchedBuilderFactory.findBuildCandidate finds the next build
-        # candidate and removes it from its prefetched list for that
-        # builder's "vitals" (identical for each group of builders with the
-        # same properties), but it doesn't mark the candidate as building;
-        # that's left to PrefetchedBuilderFactory.acquireBuildCandidate.  We
-        # can thus determine the effective queue of builds for each group by
-        # repeatedly calling findBuildCandidate for each of a group of
-        # builders, even if some of those queues overlap.
+        # PrefetchedBuilderFactory.findBuildCandidate finds the best build
+        # candidate that each builder can take and removes it from its
+        # prefetched candidates, but it doesn't mark the candidate as
+        # building; that's left to
+        # PrefetchedBuilderFactory.acquireBuildCandidate.  Each candidate
+        # is only returned once, even if it is suitable for several groups
+        # of builders.
         for builder, bq in zip(
-            builders, [bq_plain, None, bq_plain, bq_large, None, bq_gpu, None]
+            builders, [bq_plain, None, bq_large, None, None, bq_gpu, None]
         ):
             self.assertEqual(
                 bq, pbf.findBuildCandidate(pbf.getVitals(builder.name))
             )
 
+    def test_findBuildCandidate_plans_for_idle_builders(self):
+        # Candidates are planned for all idle builders at once.  The
+        # highest-scoring candidate goes to the least versatile builder
+        # that can take it, even if a more versatile builder asks first.
+        processors = [self.factory.makeProcessor() for _ in range(2)]
+        versatile_builder = self.factory.makeBuilder(processors=processors)
+        specific_builder = self.factory.makeBuilder(processors=processors[:1])
+        for builder in versatile_builder, specific_builder:
+            removeSecurityProxy(builder).clean_status = (
+                BuilderCleanStatus.CLEAN
+            )
+        bqs = [
+            self.factory.makeBinaryPackageBuild(
+                processor=processor
+            ).queueBuild()
+            for processor in processors
+        ]
+        bqs[0].manualScore(2000)
+        bqs[1].manualScore(1000)
+        transaction.commit()
+        pbf = PrefetchedBuilderFactory()
+        pbf.update()
+
+        self.assertEqual(
+            bqs[1],
+            pbf.findBuildCandidate(pbf.getVitals(versatile_builder.name)),
+        )
+        self.assertEqual(
+            bqs[0],
+            pbf.findBuildCandidate(pbf.getVitals(specific_builder.name)),
+        )
+
+    def test_findBuildCandidate_query_count(self):
+        # Planning candidates for all builders takes a constant number of
+        # queries, regardless of how many kinds of builder there are.
+        def make_builder_and_build():
+            processor = self.factory.makeProcessor()
+            builder = self.factory.makeBuilder(processors=[processor])
+            removeSecurityProxy(builder).clean_status = (
+                BuilderCleanStatus.CLEAN
+            )
+            self.factory.makeBinaryPackageBuild(
+                processor=processor
+            ).queueBuild()
+
+        def count_queries():
+            transaction.commit()
+            pbf = PrefetchedBuilderFactory()
+            pbf.update()
+            with StormStatementRecorder() as recorder:
+                pbf.candidates.prefetch()
+            return recorder.count
+
+        make_builder_and_build()
+        expected_count = count_queries()
+        for _ in range(4):
+            make_builder_and_build()
+        self.assertEqual(expected_count, count_queries())
+
     def test_acquireBuildCandidate_marks_building(self):
         # acquireBuildCandidate calls findBuildCandidate and marks the build
         # as building.
@@ -1125,14 +1196,219 @@ def test_acquireBuildCandidate_marks_building(self):
         self.assertEqual(BuildQueueStatus.RUNNING, candidate.status)
 
 
+class TestBuildDispatchPlanner(TestCase):
+    """Tests for planning dispatch in memory, without a database."""
+
+    def makeVitals(
+        self,
+        name,
+        processor_names=("amd64",),
+        virtualized=True,
+        open_resources=None,
+        restricted_resources=None,
+        clean_status=BuilderCleanStatus.CLEAN,
+        build_queue=None,
+    ):
+        return BuilderVitals(
+            name=name,
+            url="http://%s.example/" % name,
+            processor_names=list(processor_names),
+            virtualized=virtualized,
+            vm_host=None,
+            vm_reset_protocol=None,
+            open_resources=open_resources,
+            restricted_resources=restricted_resources,
+            builderok=True,
+            manual=False,
+            build_queue=build_queue,
+            version=None,
+            clean_status=clean_status,
+            active=True,
+            failure_count=0,
+            region=None,
+        )
+
+    def makeCandidate(
+        self,
+        id,
+        lastscore,
+        processor_name="amd64",
+        virtualized=True,
+        builder_constraints=None,
+    ):
+        return DispatchCandidate(
+            id, lastscore, processor_name, virtualized, builder_constraints
+        )
+
+    def test_assigns_highest_scores_first(self):
+        planner = BuildDispatchPlanner(
+            [self.makeVitals("a"), self.makeVitals("b")]
+        )
+        planner.plan(
+            [
+                self.makeCandidate(2, 300),
+                self.makeCandidate(1, 200),
+                self.makeCandidate(3, 200),
+            ]
+        )
+        self.assertEqual({"a": 2, "b": 1}, planner.assignments)
+        [spare_candidates] = planner.spare_candidates.values()
+        self.assertEqual([3], [candidate.id for candidate in spare_candidates])
+
+    def test_prefers_least_versatile_builder(self):
+        planner = BuildDispatchPlanner(
+            [
+                self.makeVitals("a", processor_names=("amd64", "i386")),
+                self.makeVitals("b", processor_names=("i386",)),
+            ]
+        )
+        planner.plan(
+            [
+                self.makeCandidate(1, 200, processor_name="i386"),
+                self.makeCandidate(2, 100, processor_name="amd64"),
+            ]
+        )
+        self.assertEqual({"a": 2, "b": 1}, planner.assignments)
+
+    def test_honours_virtualized(self):
+        planner = BuildDispatchPlanner(
+            [self.makeVitals("a", virtualized=False)]
+        )
+        planner.plan([self.makeCandidate(1, 100)])
+        self.assertEqual({}, planner.assignments)
+
+    def test_honours_resources(self):
+        planner = BuildDispatchPlanner(
+            [
+                self.makeVitals("plain"),
+                self.makeVitals("large", open_resources=["large"]),
+                self.makeVitals("gpu", restricted_resources=["gpu"]),
+            ]
+        )
+        planner.plan(
+            [
+                self.makeCandidate(1, 300, builder_constraints=["gpu"]),
+                self.makeCandidate(2, 200, builder_constraints=["large"]),
+                self.makeCandidate(3, 100),
+            ]
+        )
+        self.assertEqual(
+            {"gpu": 1, "large": 2, "plain": 3}, planner.assignments
+        )
+
+    def test_processor_independent_candidates(self):
+        # Candidates with no processor can go to any builder.
+        planner = BuildDispatchPlanner(
+            [self.makeVitals("a", processor_names=("riscv64",))]
+        )
+        planner.plan([self.makeCandidate(1, 100, processor_name=None)])
+        self.assertEqual({"a": 1}, planner.assignments)
+
+    def test_ignores_busy_builders(self):
+        planner = BuildDispatchPlanner(
+            [
+                self.makeVitals(
+                    "dirty", clean_status=BuilderCleanStatus.DIRTY
+                ),
+                self.makeVitals("busy", build_queue=FakeBuildQueue("busy")),
+                self.makeVitals("idle"),
+            ]
+        )
+        planner.plan([self.makeCandidate(1, 200), self.makeCandidate(2, 100)])
+        self.assertEqual({"idle": 1}, planner.assignments)
+
+
 class FakeBuilddManager:
     """A minimal fake version of `BuilddManager`."""
 
     pending_logtails: Dict[int, str] = {}
+    pending_builder_versions: Dict[str, str] = {}
 
     def addLogTail(self, build_queue_id, logtail):
         self.pending_logtails[build_queue_id] = logtail
 
+    def addBuilderVersion(self, builder_name, version):
+        self.pending_builder_versions[builder_name] = version
+
+
+class DeferredStatusWorker(OkWorker):
+    """A worker whose status calls only return when told to."""
+
+    def __init__(self):
+        super().__init__()
+        self.pending = []
+
+    def status(self):
+        self.call_log.append("status")
+        d = defer.Deferred()
+        self.pending.append(d)
+        return d
+
+
+class TestWorkerStatusPoller(StatsMixin, TestCase):
+    layer = ZopelessDatabaseLayer
+
+    def setUp(self):
+        super().setUp()
+        self.setUpStats()
+        self.clock = task.Clock()
+
+    def test_batches_requests(self):
+        # Requests made during one reactor iteration are sent together on
+        # the next.
+        poller = WorkerStatusPoller(clock=self.clock)
+        workers = [OkWorker() for _ in range(3)]
+        deferreds = [poller.getStatus(worker) for worker in workers]
+        for worker in workers:
+            self.assertEqual([], worker.call_log)
+        self.clock.advance(0)
+        for worker, d in zip(workers, deferreds):
+            self.assertEqual(["status"], worker.call_log)
+            self.assertEqual(
+                {"builder_status": "BuilderStatus.IDLE"}, extract_result(d)
+            )
+        self.stats_client.gauge.assert_called_once_with(
+            "builders.status_batch_size,env=test", 3
+        )
+
+        # Later requests form a new batch.
+        d = poller.getStatus(workers[0])
+        self.clock.advance(0)
+        self.assertEqual(["status", "status"], workers[0].call_log)
+        self.assertTrue(d.called)
+
+    def test_concurrency(self):
+        # At most `concurrency` requests are in flight at once.
+        poller = WorkerStatusPoller(clock=self.clock, concurrency=2)
+        workers = [DeferredStatusWorker() for _ in range(3)]
+        deferreds = [poller.getStatus(worker) for worker in workers]
+        self.clock.advance(0)
+        self.assertEqual(
+            [["status"], ["status"], []],
+            [worker.call_log for worker in workers],
+        )
+        workers[1].pending[0].callback({"builder_status": "1"})
+        self.assertEqual({"builder_status": "1"}, extract_result(deferreds[1]))
+        self.assertEqual(["status"], workers[2].call_log)
+        workers[0].pending[0].callback({"builder_status": "0"})
+        workers[2].pending[0].callback({"builder_status": "2"})
+        self.assertEqual(
+            [{"builder_status": "0"}, {"builder_status": "2"}],
+            [extract_result(deferreds[0]), extract_result(deferreds[2])],
+        )
+
+    def test_failure(self):
+        # A failure to get one worker's status is passed on to whoever
+        # asked for it, and doesn't affect other workers.
+        poller = WorkerStatusPoller(clock=self.clock)
+        d_broken = poller.getStatus(BrokenWorker())
+        d_ok = poller.getStatus(OkWorker())
+        self.clock.advance(0)
+        self.assertRaises(xmlrpc.client.Fault, extract_result, d_broken)
+        self.assertEqual(
+            {"builder_status": "BuilderStatus.IDLE"}, extract_result(d_ok)
+        )
+
 
 class TestWorkerScannerWithoutDB(TestCase):
     layer = ZopelessDatabaseLayer
@@ -1148,6 +1424,7 @@ def getScanner(
         interactor=None,
         worker=None,
         behaviour=None,
+        status_poller=None,
     ):
         if builder_factory is None:
             builder_factory = MockBuilderFactory(
@@ -1168,6 +1445,7 @@ def getScanner(
             interactor_factory=FakeMethod(interactor),
             worker_factory=FakeMethod(worker),
             behaviour_factory=FakeMethod(behaviour),
+            status_poller=status_poller,
         )
 
     @defer.inlineCallbacks
@@ -1187,6 +1465,85 @@ def test_scan_with_job(self):
         )
         self.assertEqual(0, bq.reset.call_count)
 
+    def test_scan_uses_status_poller(self):
+        # If the scanner has a status poller, it gets the worker's status as
+        # part of the poller's next batch.
+        clock = task.Clock()
+        worker = BuildingWorker("trivial")
+        scanner = self.getScanner(
+            builder_factory=MockBuilderFactory(
+                MockBuilder(), FakeBuildQueue("trivial")
+            ),
+            worker=worker,
+            status_poller=WorkerStatusPoller(clock=clock),
+        )
+
+        d = scanner.scan()
+        self.assertEqual([], worker.call_log)
+        self.assertFalse(d.called)
+        clock.advance(0)
+        self.assertEqual(["status"], worker.call_log)
+        self.assertEqual(
+            1, scanner.interactor_factory.result.updateBuild.call_count
+        )
+        return d
+
+    @defer.inlineCallbacks
+    def test_scan_skips_builder_while_prewarming(self):
+        # Pre-seeding an idle builder's chroot doesn't hold up its scan.
+        # The builder can't answer status requests until it has fetched
+        # the chroot, so it isn't scanned again until then.
+        self.pushConfig("builddmaster", prewarm_chroots=True)
+        prewarmer = ChrootPrewarmer()
+        self.patch(prewarm, "_default_prewarmer", prewarmer)
+        prewarmer.recordDispatch(
+            MockBuilder(name="other"), "sha1", "http://a/"
+        )
+        builder = MockBuilder(clean_status=BuilderCleanStatus.CLEAN)
+        worker = SlowDownloadingWorker()
+        interactor = BuilderInteractor()
+        dispatches = []
+
+        def findAndStartJob(vitals, builder, worker, builder_factory):
+            dispatches.append(vitals.name)
+            if len(dispatches) > 1:
+                builder.currentjob = FakeBuildQueue("trivial")
+            return defer.succeed(None)
+
+        interactor.findAndStartJob = findAndStartJob
+        scanner = self.getScanner(
+            builder_factory=MockBuilderFactory(builder, None),
+            interactor=interactor,
+            worker=worker,
+        )
+
+        # Nothing is ready, so the builder is asked to fetch a chroot.  The
+        # scan finishes without waiting for it.
+        yield scanner.scan()
+        self.assertEqual(
+            ["status", ("ensurepresent", "http://a/", "", "")],
+            worker.call_log,
+        )
+        self.assertEqual(1, len(worker.pending))
+        self.assertFalse(worker.pending[0].called)
+
+        # While the fetch is in progress, the builder's status isn't
+        # polled, so its silence doesn't count as a failure.
+        d = scanner.singleCycle()
+        self.assertTrue(d.called)
+        yield d
+        self.assertEqual(2, len(worker.call_log))
+        self.assertEqual(0, scanner.scan_failure_count)
+        self.assertEqual([builder.name], dispatches)
+
+        # Once the fetch has finished, a build is dispatched on the next
+        # scan.
+        worker.pending[0].callback((True, "Download"))
+        yield scanner.scan()
+        self.assertEqual("status", worker.call_log[-1])
+        self.assertEqual([builder.name, builder.name], dispatches)
+        self.assertIsNotNone(builder.currentjob)
+
     @defer.inlineCallbacks
     def test_scan_recovers_lost_worker_with_job(self):
         # WorkerScanner.scan identifies workers that aren't building what
@@ -1969,6 +2326,28 @@ def test_flushLogTails(self):
         self.assertEqual("Another log tail", bqs[1].logtail)
         self.assertIsNone(bqs[2].logtail)
 
+    def test_flushLogTails_builder_versions(self):
+        # flushLogTails also flushes pending builder version updates, in
+        # the same transaction as log tail updates.
+        manager = self._getManager()
+        builders = [self.factory.makeBuilder() for _ in range(3)]
+        for builder in builders:
+            removeSecurityProxy(builder).version = "1"
+        bq = self.factory.makeBinaryPackageBuild().queueBuild()
+        manager.addLogTail(bq.id, "A log tail")
+        manager.addBuilderVersion(builders[0].name, "2")
+        manager.addBuilderVersion(builders[1].name, None)
+        transaction.commit()
+
+        with StormStatementRecorder() as recorder:
+            manager.flushLogTails()
+        self.assertThat(recorder, HasQueryCount(Equals(2)))
+        self.assertEqual(
+            ["2", None, "1"], [builder.version for builder in builders]
+        )
+        self.assertEqual("A log tail", bq.logtail)
+        self.assertEqual({}, manager.pending_builder_versions)
+
     def test_flushLogTails_swallows_exceptions(self):
         # flushLogTails swallows exceptions so the LoopingCall always
         # retries.
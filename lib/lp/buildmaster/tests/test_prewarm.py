@@ -0,0 +1,197 @@
+# Copyright 2026 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for pre-seeding builders' file caches."""
+
+import xmlrpc.client
+
+from twisted.internet import defer
+
+from lp.buildmaster.interactor import extract_vitals_from_db
+from lp.buildmaster.prewarm import ChrootPrewarmer
+from lp.buildmaster.tests.mock_workers import OkWorker
+from lp.services.log.logger import BufferLogger
+from lp.services.statsd.tests import StatsMixin
+from lp.services.twistedsupport import extract_result
+from lp.testing import TestCaseWithFactory
+from lp.testing.layers import ZopelessDatabaseLayer
+
+
+class DownloadingWorker(OkWorker):
+    """A worker that has to download every file it is asked for."""
+
+    def ensurepresent(self, sha1, url, user=None, password=None):
+        self.call_log.append(("ensurepresent", url, user, password))
+        return defer.succeed((True, "Download"))
+
+
+class FailingEnsurePresentWorker(OkWorker):
+    """A worker whose ensurepresent calls fail."""
+
+    def ensurepresent(self, sha1, url, user=None, password=None):
+        self.call_log.append(("ensurepresent", url, user, password))
+        return defer.fail(xmlrpc.client.Fault(8001, "Broken worker"))
+
+
+class SlowDownloadingWorker(OkWorker):
+    """A worker whose ensurepresent calls finish when the test says so.
+
+    Like launchpad-buildd, it doesn't answer status requests while it is
+    downloading.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.pending = []
+
+    def status(self):
+        if any(not d.called for d in self.pending):
+            self.call_log.append("status")
+            return defer.Deferred()
+        return super().status()
+
+    def ensurepresent(self, sha1, url, user=None, password=None):
+        self.call_log.append(("ensurepresent", url, user, password))
+        d = defer.Deferred()
+        self.pending.append(d)
+        return d
+
+
+class TestChrootPrewarmer(StatsMixin, TestCaseWithFactory):
+    layer = ZopelessDatabaseLayer
+
+    def setUp(self):
+        super().setUp()
+        self.setUpStats()
+        self.processor = self.factory.makeProcessor()
+
+    def makeBuilder(self, virtualized=True, **kwargs):
+        return self.factory.makeBuilder(
+            processors=[self.processor], virtualized=virtualized, **kwargs
+        )
+
+    def test_predict_empty(self):
+        # With no dispatch history, there is nothing to pre-seed.
+        prewarmer = ChrootPrewarmer()
+        vitals = extract_vitals_from_db(self.makeBuilder())
+        self.assertEqual([], prewarmer.predict(vitals))
+
+    def test_predict_by_popularity(self):
+        # Chroots dispatched to builders of the same kind are predicted,
+        # most popular first, omitting those the builder already holds.
+        prewarmer = ChrootPrewarmer()
+        builder = self.makeBuilder()
+        other = self.makeBuilder()
+        prewarmer.recordDispatch(other, "sha1-a", "http://a/")
+        prewarmer.recordDispatch(other, "sha1-b", "http://b/")
+        prewarmer.recordDispatch(other, "sha1-b", "http://b/")
+        prewarmer.recordDispatch(builder, "sha1-c", "http://c/")
+        self.assertEqual(
+            [("sha1-b", "http://b/"), ("sha1-a", "http://a/")],
+            prewarmer.predict(extract_vitals_from_db(builder)),
+        )
+
+    def test_predict_ignores_other_kinds(self):
+        # Chroots dispatched to builders with different processors or
+        # virtualization aren't predicted.
+        prewarmer = ChrootPrewarmer()
+        prewarmer.recordDispatch(
+            self.makeBuilder(virtualized=False), "sha1-a", "http://a/"
+        )
+        prewarmer.recordDispatch(
+            self.factory.makeBuilder(), "sha1-b", "http://b/"
+        )
+        vitals = extract_vitals_from_db(self.makeBuilder())
+        self.assertEqual([], prewarmer.predict(vitals))
+
+    def test_predict_limited(self):
+        # Only the `max_chroots` most popular chroots are considered.
+        prewarmer = ChrootPrewarmer()
+        prewarmer.max_chroots = 1
+        other = self.makeBuilder()
+        prewarmer.recordDispatch(other, "sha1-a", "http://a/")
+        prewarmer.recordDispatch(other, "sha1-a", "http://a/")
+        prewarmer.recordDispatch(other, "sha1-b", "http://b/")
+        vitals = extract_vitals_from_db(self.makeBuilder())
+        self.assertEqual([("sha1-a", "http://a/")], prewarmer.predict(vitals))
+
+    def test_forgetBuilder(self):
+        # After a builder is reset, it needs its chroots again.
+        prewarmer = ChrootPrewarmer()
+        builder = self.makeBuilder()
+        prewarmer.recordDispatch(builder, "sha1-a", "http://a/")
+        vitals = extract_vitals_from_db(builder)
+        self.assertEqual([], prewarmer.predict(vitals))
+        prewarmer.forgetBuilder(builder.name)
+        self.assertEqual([("sha1-a", "http://a/")], prewarmer.predict(vitals))
+
+    def test_prewarm(self):
+        # An idle builder is asked to fetch the most popular chroot it
+        # doesn't have, and isn't asked again.
+        prewarmer = ChrootPrewarmer()
+        prewarmer.recordDispatch(self.makeBuilder(), "sha1-a", "http://a/")
+        vitals = extract_vitals_from_db(self.makeBuilder())
+        worker = DownloadingWorker()
+        self.assertTrue(
+            extract_result(prewarmer.prewarm(vitals, worker, BufferLogger()))
+        )
+        self.assertEqual(
+            [("ensurepresent", "http://a/", "", "")], worker.call_log
+        )
+        self.stats_client.incr.assert_called_once_with(
+            "builders.chroot_prewarm,env=test,result=miss"
+        )
+        self.assertFalse(
+            extract_result(prewarmer.prewarm(vitals, worker, BufferLogger()))
+        )
+        self.assertEqual(1, len(worker.call_log))
+
+    def test_prewarm_already_present(self):
+        # A builder that already had the chroot counts as a hit.
+        prewarmer = ChrootPrewarmer()
+        prewarmer.recordDispatch(self.makeBuilder(), "sha1-a", "http://a/")
+        vitals = extract_vitals_from_db(self.makeBuilder())
+        extract_result(prewarmer.prewarm(vitals, OkWorker(), BufferLogger()))
+        self.stats_client.incr.assert_called_once_with(
+            "builders.chroot_prewarm,env=test,result=hit"
+        )
+
+    def test_prewarm_failure(self):
+        # A failure to pre-seed a chroot is logged but not raised.
+        prewarmer = ChrootPrewarmer()
+        prewarmer.recordDispatch(self.makeBuilder(), "sha1-a", "http://a/")
+        vitals = extract_vitals_from_db(self.makeBuilder())
+        logger = BufferLogger()
+        self.assertTrue(
+            extract_result(
+                prewarmer.prewarm(vitals, FailingEnsurePresentWorker(), logger)
+            )
+        )
+        self.assertIn("failed to pre-seed sha1-a", logger.getLogBuffer())
+        self.stats_client.incr.assert_called_once_with(
+            "builders.chroot_prewarm,env=test,result=failed"
+        )
+
+    def test_startPrewarm(self):
+        # startPrewarm returns before the builder has fetched the chroot,
+        # and doesn't ask again while the fetch is in progress.
+        prewarmer = ChrootPrewarmer()
+        other = self.makeBuilder()
+        prewarmer.recordDispatch(other, "sha1-a", "http://a/")
+        prewarmer.recordDispatch(other, "sha1-b", "http://b/")
+        vitals = extract_vitals_from_db(self.makeBuilder())
+        worker = SlowDownloadingWorker()
+        d = prewarmer.startPrewarm(vitals, worker, BufferLogger())
+        self.assertFalse(d.called)
+        self.assertIsNone(
+            prewarmer.startPrewarm(vitals, worker, BufferLogger())
+        )
+        self.assertEqual(1, len(worker.call_log))
+        worker.pending[0].callback((True, "Download"))
+        self.assertTrue(extract_result(d))
+        # Once the fetch has finished, the builder can be asked for the
+        # next chroot.
+        self.assertIsNotNone(
+            prewarmer.startPrewarm(vitals, worker, BufferLogger())
+        )
+        self.assertEqual(2, len(worker.call_log))
@@ -4,6 +4,7 @@
 
 from datetime import datetime, timedelta, timezone
 
+from testtools.matchers import Equals
 from zope.component import getUtility
 from zope.security.proxy import removeSecurityProxy
 
@@ -12,7 +13,9 @@
 from lp.buildmaster.interfaces.processor import IProcessorSet
 from lp.buildmaster.model.buildqueue import BuildQueue
 from lp.buildmaster.queuedepth import (
+    QueueDepthModel,
     estimate_job_delay,
+    estimate_job_start_time,
     estimate_time_to_next_builder,
     get_builder_data,
     get_free_builders_count,
@@ -22,8 +25,9 @@
 from lp.soyuz.enums import ArchivePurpose, PackagePublishingStatus
 from lp.soyuz.model.binarypackagebuild import BinaryPackageBuild
 from lp.soyuz.tests.test_publishing import SoyuzTestPublisher
-from lp.testing import TestCaseWithFactory
+from lp.testing import StormStatementRecorder, TestCaseWithFactory
 from lp.testing.layers import LaunchpadZopelessLayer
+from lp.testing.matchers import HasQueryCount
 
 
 def check_mintime_to_builder(test, bq, min_time):
@@ -1079,6 +1083,31 @@ def setUp(self):
             if bq.processor == self.x86_proc:
                 removeSecurityProxy(bq).virtualized = True
 
+    def test_model_estimates_without_queries(self):
+        # Once loaded, a QueueDepthModel estimates start times for any
+        # number of jobs without querying the database, and agrees with
+        # an estimate from a freshly-loaded model.
+        now = datetime.now(timezone.utc)
+        jobs = [
+            removeSecurityProxy(find_job(self, name, processor)[1])
+            for name, processor in (
+                ("gcc", "386"),
+                ("vim", "386"),
+                ("gedit", "hppa"),
+                ("xxr-apt-build", None),
+                ("xxr-daptup", None),
+            )
+        ]
+        expected = [estimate_job_start_time(job, now=now) for job in jobs]
+        model = QueueDepthModel.load()
+        with StormStatementRecorder() as recorder:
+            estimates = [
+                estimate_job_start_time(job, now=now, model=model)
+                for job in jobs
+            ]
+        self.assertThat(recorder, HasQueryCount(Equals(0)))
+        self.assertEqual(expected, estimates)
+
     def test_pending_jobs_only(self):
         # Let's see the assertion fail for a job that's not pending any more.
         assign_to_builder(self, "gedit", 1, "hppa")
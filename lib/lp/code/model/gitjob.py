@@ -14,7 +14,7 @@
 from lazr.delegates import delegate_to
 from lazr.enum import DBEnumeratedType, DBItem
 from storm.exceptions import LostObjectError
-from storm.locals import JSON, SQL, Int, Reference, Store
+from storm.locals import JSON, SQL, Int, Reference, Select, Store
 from zope.component import getUtility
 from zope.interface import implementer, provider
 
@@ -165,6 +165,30 @@ def iterReady(cls):
         )
         return (cls(job) for job in jobs)
 
+    @classmethod
+    def claimReady(cls, limit, after_id=None, max_id=None):
+        """Lease up to `limit` ready Git repository jobs of this type.
+
+        Each lease lasts for `lease_duration`, during which no other runner
+        will claim the job; `JobRunner` renews it when the job starts.
+        `after_id` and `max_id` bound the job IDs as in `Job.claimReady`.
+
+        :return: A list of the claimed jobs, ordered by job ID.
+        """
+        job_ids = Job.claimReady(
+            Select(GitJob.job_id, GitJob.job_type == cls.class_job_type),
+            limit,
+            cls.lease_duration.total_seconds(),
+            after_id=after_id,
+            max_id=max_id,
+        )
+        jobs = (
+            IPrimaryStore(GitJob)
+            .find(GitJob, GitJob.job_id.is_in(job_ids))
+            .order_by(GitJob.job_id)
+        )
+        return [cls(job) for job in jobs]
+
     def getOopsVars(self):
         """See `IRunnableJob`."""
         oops_vars = super().getOopsVars()
@@ -114,6 +114,7 @@
 )
 from lp.services.session.model import SessionData
 from lp.services.signing.interfaces.signingkey import IArchiveSigningKeySet
+from lp.services.statsd.interfaces.statsd_client import IStatsdClient
 from lp.services.verification.model.logintoken import LoginToken
 from lp.services.webapp.publisher import canonical_url
 from lp.services.webhooks.interfaces import IWebhookJobSource
@@ -284,21 +285,111 @@ def __call__(self, chunk_size):
         )
         self._num_removed = result.rowcount
         transaction.commit()
+        return self._num_removed
 
     def cleanUp(self):
         """See `ITunableLoop`."""
         self.store.execute("CLOSE %s" % self.cursor_name)
 
 
-class LoginTokenPruner(BulkPruner):
+class KeysetPruner(TunableLoop):
+    """An abstract ITunableLoop base class for pruning large tables.
+
+    Unlike `BulkPruner`, this neither materializes the set of items to
+    remove up front nor holds a cursor, and so a snapshot, open across
+    transactions.  Instead, each iteration walks the next range of the
+    target table in primary key order, bounded by an index scan, and
+    deletes the rows in that range that match `prune_condition`.
+
+    The position reached is saved after each iteration, so an
+    interrupted run resumes where it stopped.  Once a run reaches the end
+    of the table, the next run starts again from the beginning.
+    """
+
+    # The Storm database class for the table we are removing records
+    # from. Must be overridden.
+    target_table_class = None
+
+    # The indexed integer column in target_table that we walk in order.
+    # May be overridden.
+    target_table_key = "id"
+
+    # An SQL condition on the columns of target_table, selecting the rows
+    # to remove. Must be overridden.
+    prune_condition = None
+
+    # See `TunableLoop`. May be overridden.
+    maximum_chunk_size = 10000
+
+    def __init__(self, log, abort_time=None):
+        super().__init__(log, abort_time)
+        self.store = IPrimaryStore(self.target_table_class)
+        self.target_table_name = self.target_table_class.__storm_table__
+        self.job_name = self.__class__.__name__
+        job_data = load_garbo_job_state(self.job_name) or {}
+        self.last_key = job_data.get("last_key", 0)
+        # Rows added after we start are left for the next run.
+        self.maximum_key = self.store.execute(
+            "SELECT max(%s) FROM %s"
+            % (self.target_table_key, self.target_table_name)
+        ).get_one()[0]
+        # Start again if the rows we had not reached have since gone.
+        if self.maximum_key is not None and self.last_key >= self.maximum_key:
+            self.last_key = 0
+
+    def isDone(self):
+        """See `ITunableLoop`."""
+        return self.maximum_key is None or self.last_key >= self.maximum_key
+
+    def __call__(self, chunk_size):
+        """See `ITunableLoop`."""
+        end_key, num_removed = self.store.execute(
+            """
+            WITH batch AS (
+                SELECT max(%(key)s) AS end_key FROM (
+                    SELECT %(key)s FROM %(table)s
+                    WHERE %(key)s > %(last_key)d AND %(key)s <= %(max_key)d
+                    ORDER BY %(key)s
+                    LIMIT %(chunk_size)d
+                    ) AS keys
+                ),
+            deleted AS (
+                DELETE FROM %(table)s
+                WHERE
+                    %(key)s > %(last_key)d
+                    AND %(key)s <= (SELECT end_key FROM batch)
+                    AND (%(condition)s)
+                RETURNING 1
+                )
+            SELECT (SELECT end_key FROM batch), (SELECT count(*) FROM deleted)
+            """
+            % {
+                "key": self.target_table_key,
+                "table": self.target_table_name,
+                "last_key": self.last_key,
+                "max_key": self.maximum_key,
+                "chunk_size": chunk_size,
+                "condition": self.prune_condition,
+            }
+        ).get_one()
+        if end_key is None:
+            end_key = self.maximum_key
+        self.last_key = end_key
+        save_garbo_job_state(
+            self.job_name, {"last_key": 0 if self.isDone() else end_key}
+        )
+        transaction.commit()
+        return num_removed
+
+
+class LoginTokenPruner(KeysetPruner):
     """Remove old LoginToken rows.
 
     After 1 year, they are useless even for archaeology.
     """
 
     target_table_class = LoginToken
-    ids_to_prune_query = """
-        SELECT id FROM LoginToken WHERE
+    prune_condition = """
         created < CURRENT_TIMESTAMP - CAST('1 year' AS interval)
         """
 
@@ -916,6 +1007,7 @@ def __call__(self, chunksize):
         )
         self._num_removed = result.rowcount
         transaction.commit()
+        return self._num_removed
 
     def isDone(self):
         return self._num_removed == 0
@@ -1234,7 +1326,7 @@ class TeamMembershipPruner(BulkPruner):
         """
 
 
-class BugNotificationPruner(BulkPruner):
+class BugNotificationPruner(KeysetPruner):
     """Prune `BugNotificationRecipient` records no longer of interest.
 
     We discard all rows older than 30 days that have been sent. We
@@ -1242,9 +1334,8 @@ class BugNotificationPruner(BulkPruner):
     """
 
     target_table_class = BugNotification
-    ids_to_prune_query = """
-        SELECT BugNotification.id FROM BugNotification
-        WHERE date_emailed < CURRENT_TIMESTAMP AT TIME ZONE 'UTC'
+    prune_condition = """
+        date_emailed < CURRENT_TIMESTAMP AT TIME ZONE 'UTC'
             - CAST('30 days' AS interval)
         """
 
@@ -2333,12 +2424,21 @@ class BaseDatabaseGarbageCollector(LaunchpadCronScript):
     # __call__ are required without creating huge amounts of test data.
     _maximum_chunk_size = None
 
+    # Weight of the latest run in each task's estimated run time.
+    runtime_smoothing = 0.5
+
+    # A task that was aborted is run again if at least this many seconds
+    # of the script's run time remain once other tasks have finished.
+    minimum_rerun_time = 60
+
     def __init__(self, test_args=None):
         super().__init__(
             self.script_name,
             dbuser=self.script_name.replace("-", "_"),
             test_args=test_args,
         )
+        self.loop_history = {}
+        self.loop_history_lock = threading.Lock()
 
     def add_my_options(self):
         self.parser.add_option(
@@ -2395,6 +2495,14 @@ def main(self):
         if self.options.experimental:
             tunable_loops.extend(self.experimental_tunable_loops)
 
+        # Run cheap tasks first, and tasks with a backlog last so that
+        # they can use whatever time is left.
+        self.loop_history = self.load_loop_history()
+        transaction.abort()
+        tunable_loops.sort(key=self.get_loop_priority)
+        # Tasks that have run and been requeued to work on their backlog.
+        self.requeued_loops = set()
+
         threads = set()
         for count in range(0, self.options.threads):
             thread = threading.Thread(
@@ -2422,8 +2530,24 @@ def main(self):
                 "Script aborted after %d seconds.", self.script_timeout
             )
 
-        if tunable_loops:
-            self.logger.warning("%d tasks did not run.", len(tunable_loops))
+        # Requeued tasks have already run once, so it doesn't matter if
+        # there wasn't time to run them again.
+        not_run = [
+            tunable_loop
+            for tunable_loop in tunable_loops
+            if tunable_loop not in self.requeued_loops
+        ]
+        if len(not_run) < len(tunable_loops):
+            self.logger.debug(
+                "%d tasks with a backlog were not run again.",
+                len(tunable_loops) - len(not_run),
+            )
+        if not_run:
+            self.logger.warning("%d tasks did not run.", len(not_run))
+
+        with self.loop_history_lock:
+            save_garbo_job_state(self.loop_history_name, self.loop_history)
+        transaction.commit()
 
         if self.failure_count:
             self.logger.error("%d tasks failed.", self.failure_count)
@@ -2451,8 +2575,55 @@ def get_loop_logger(self, loop_name):
         loop_logger.addFilter(PrefixFilter(loop_name))
         return loop_logger
 
-    def get_loop_abort_time(self, num_remaining_tasks):
-        # How long until the task should abort.
+    @property
+    def loop_history_name(self):
+        """The name of the `GarboJobState` holding the task history."""
+        return "%s-schedule" % self.script_name
+
+    def load_loop_history(self):
+        """Load the run time and backlog recorded for each task.
+
+        The history maps task names to dicts with "runtime" (the
+        smoothed run time in seconds of the task when it completes),
+        "backlog" (True if the task was aborted on its last run) and
+        "items" (how many items the task affected on its last run).
+        """
+        return load_garbo_job_state(self.loop_history_name) or {}
+
+    def get_loop_priority(self, tunable_loop_class):
+        """Return a sort key for running tasks in order of expense.
+
+        Tasks that took under a second are treated alike, so keep their
+        relative order.
+        """
+        history = self.loop_history.get(tunable_loop_class.__name__, {})
+        return (
+            history.get("backlog", False),
+            int(history.get("runtime") or 0),
+        )
+
+    def get_loop_estimate(self, tunable_loop_class):
+        """Return how long a task is expected to take to complete.
+
+        Returns None if that is unknown, or if the task has a backlog and
+        will use as much time as it is given.
+        """
+        history = self.loop_history.get(tunable_loop_class.__name__, {})
+        if history.get("backlog", False):
+            return None
+        return history.get("runtime")
+
+    def get_loop_abort_time(self, tunable_loop_class, remaining_tasks):
+        """Return how long a task may run before it should abort.
+
+        Tasks whose run time is known are expected to take that long.
+        The rest of the time available to all threads is shared evenly
+        among tasks with a backlog or an unknown run time.
+
+        :param tunable_loop_class: The task about to run.
+        :param remaining_tasks: The tasks still waiting to run.
+        """
+        num_remaining_tasks = len(remaining_tasks) + 1
         if self.options.abort_task is not None:
             # Task timeout specified on command line.
             abort_task = self.options.abort_task
@@ -2464,16 +2635,63 @@ def get_loop_abort_time(self, num_remaining_tasks):
             abort_task = self.get_remaining_script_time()
 
         else:
-            # Evenly distribute the remaining time to the
-            # remaining tasks.
-            abort_task = (
-                self.options.threads
-                * self.get_remaining_script_time()
-                / num_remaining_tasks
+            available_time = (
+                self.options.threads * self.get_remaining_script_time()
+            )
+            with self.loop_history_lock:
+                estimates = [
+                    self.get_loop_estimate(loop_class)
+                    for loop_class in remaining_tasks
+                ]
+                loop_estimate = self.get_loop_estimate(tunable_loop_class)
+            reserved_time = sum(
+                estimate for estimate in estimates if estimate is not None
             )
+            num_sharing_tasks = 1 + estimates.count(None)
+            if reserved_time < available_time:
+                abort_task = (loop_estimate or 0) + (
+                    available_time - reserved_time
+                ) / num_sharing_tasks
+            else:
+                # Evenly distribute the remaining time to the
+                # remaining tasks.
+                abort_task = available_time / num_remaining_tasks
 
         return min(abort_task, self.get_remaining_script_time())
 
+    def record_loop_run(self, loop_name, runtime, tuner):
+        """Record and report a task's run for future scheduling.
+
+        :return: True if the task has a backlog.
+        """
+        # Loops not based on `TunableLoop` don't say whether they
+        # completed.
+        completed = tuner is None or tuner.completed
+        items = None if tuner is None else tuner.total_items
+        with self.loop_history_lock:
+            history = self.loop_history.setdefault(loop_name, {})
+            if completed and history.get("runtime") is not None:
+                history["runtime"] = (
+                    self.runtime_smoothing * runtime
+                    + (1 - self.runtime_smoothing) * history["runtime"]
+                )
+            elif completed or history.get("runtime") is None:
+                history["runtime"] = runtime
+            history["backlog"] = not completed
+            history["items"] = items
+
+        labels = {"script": self.script_name, "loop": loop_name}
+        statsd_client = getUtility(IStatsdClient)
+        statsd_client.timing(
+            "garbo.loop.duration", runtime * 1000, labels=labels
+        )
+        statsd_client.gauge(
+            "garbo.loop.backlog", int(not completed), labels=labels
+        )
+        if items is not None:
+            statsd_client.gauge("garbo.loop.items", items, labels=labels)
+        return not completed
+
     def run_tasks_in_thread(self, tunable_loops):
         """Worker thread target to run tasks.
 
@@ -2541,7 +2759,9 @@ def run_tasks_in_thread(self, tunable_loops):
             try:
                 loop_logger.info("Running %s", loop_name)
 
-                abort_time = self.get_loop_abort_time(len(tunable_loops) + 1)
+                abort_time = self.get_loop_abort_time(
+                    tunable_loop_class, list(tunable_loops)
+                )
                 loop_logger.debug2(
                     "Task will be terminated in %0.3f seconds", abort_time
                 )
@@ -2555,8 +2775,24 @@ def run_tasks_in_thread(self, tunable_loops):
                     tunable_loop.maximum_chunk_size = self._maximum_chunk_size
 
                 try:
-                    tunable_loop.run()
+                    loop_start = time.time()
+                    tuner = tunable_loop.run()
                     loop_logger.debug("%s completed successfully.", loop_name)
+                    backlog = self.record_loop_run(
+                        loop_name, time.time() - loop_start, tuner
+                    )
+                    # Give any time freed up by other tasks to tasks that
+                    # still have work to do.
+                    if (
+                        backlog
+                        and self.get_remaining_script_time()
+                        > self.minimum_rerun_time
+                    ):
+                        loop_logger.debug(
+                            "Requeuing %s to work on its backlog.", loop_name
+                        )
+                        self.requeued_loops.add(tunable_loop_class)
+                        tunable_loops.append(tunable_loop_class)
                 except Exception:
                     loop_logger.exception("Unhandled exception")
                     self.failure_count += 1
@@ -77,8 +77,10 @@
     DuplicateSessionPruner,
     FrequentDatabaseGarbageCollector,
     HourlyDatabaseGarbageCollector,
+    KeysetPruner,
     LoginTokenPruner,
     OpenIDConsumerAssociationPruner,
+    OpenIDConsumerNoncePruner,
     ProductVCSPopulator,
     UnusedPOTMsgSetPruner,
     UnusedSessionPruner,
@@ -154,6 +156,14 @@
 _default = object()
 
 
+class FakeLoopTuner:
+    """Just the results of a `LoopTuner` run."""
+
+    def __init__(self, completed, total_items):
+        self.completed = completed
+        self.total_items = total_items
+
+
 class TestGarboScript(TestCase):
     layer = LaunchpadScriptLayer
 
@@ -257,6 +267,53 @@ def test_bulkpruner(self):
             pruner(chunk_size)
 
 
+class KeysetFooPruner(KeysetPruner):
+    target_table_class = BulkFoo
+    prune_condition = "id < 5"
+    maximum_chunk_size = 2
+
+
+class TestKeysetPruner(TestCase):
+    layer = ZopelessDatabaseLayer
+
+    def setUp(self):
+        super().setUp()
+
+        self.store = IPrimaryStore(CommercialSubscription)
+        self.store.execute("CREATE TABLE BulkFoo (id serial PRIMARY KEY)")
+
+        for _ in range(10):
+            self.store.add(BulkFoo())
+
+        self.log = logging.getLogger("garbo")
+
+    def test_keysetpruner(self):
+        pruner = KeysetFooPruner(self.log)
+        self.assertFalse(pruner.isDone())
+
+        # Each iteration covers the next chunk_size rows, removing those
+        # that match. Make sure it committed by throwing away uncommitted
+        # changes.
+        self.assertEqual(2, pruner(2))
+        transaction.abort()
+        self.assertEqual(8, self.store.find(BulkFoo).count())
+
+        # An interrupted run resumes where it stopped.
+        pruner = KeysetFooPruner(self.log)
+        self.assertEqual(2, pruner.last_key)
+        while not pruner.isDone():
+            pruner(3)
+        transaction.abort()
+
+        # Only the targeted rows were removed.
+        self.assertEqual(
+            [5, 6, 7, 8, 9, 10], sorted(self.store.find(BulkFoo.id))
+        )
+
+        # After a complete run, the next one starts from the beginning.
+        self.assertEqual(0, KeysetFooPruner(self.log).last_key)
+
+
 class TestSessionPruner(TestCase):
     layer = ZopelessDatabaseLayer
 
@@ -469,6 +526,120 @@ def test_persist_garbo_state(self):
         data = load_garbo_job_state("job")
         self.assertEqual({"data": 2}, data)
 
+    def test_loop_history_recorded(self):
+        # Each run records how long each task took and that it completed.
+        self.runHourly()
+        history = load_garbo_job_state("garbo-hourly-schedule")
+        for tunable_loop in HourlyDatabaseGarbageCollector.tunable_loops:
+            entry = history[tunable_loop.__name__]
+            self.assertFalse(entry["backlog"])
+            self.assertIsNotNone(entry["runtime"])
+
+    def test_loop_priority(self):
+        # Cheap tasks run first and tasks with a backlog run last.
+        collector = HourlyDatabaseGarbageCollector(test_args=[])
+        collector.loop_history = {
+            "LoginTokenPruner": {"runtime": 1000, "backlog": True},
+            "UnusedSessionPruner": {"runtime": 5, "backlog": False},
+            "AntiqueSessionPruner": {"runtime": 0.5, "backlog": False},
+        }
+        self.assertEqual(
+            [
+                AntiqueSessionPruner,
+                DuplicateSessionPruner,
+                UnusedSessionPruner,
+                LoginTokenPruner,
+            ],
+            sorted(
+                [
+                    LoginTokenPruner,
+                    UnusedSessionPruner,
+                    AntiqueSessionPruner,
+                    DuplicateSessionPruner,
+                ],
+                key=collector.get_loop_priority,
+            ),
+        )
+
+    def test_loop_abort_time(self):
+        # Tasks with a known run time are expected to take that long, and
+        # the rest of the time is shared among the other tasks.
+        collector = HourlyDatabaseGarbageCollector(
+            test_args=["--threads=1", "--abort-script=100"]
+        )
+        collector.start_time = time.time()
+        collector.loop_history = {
+            "LoginTokenPruner": {"runtime": 1000, "backlog": True},
+            "UnusedSessionPruner": {"runtime": 20, "backlog": False},
+        }
+        self.assertAlmostEqual(
+            40,
+            collector.get_loop_abort_time(
+                LoginTokenPruner,
+                [UnusedSessionPruner, OpenIDConsumerNoncePruner],
+            ),
+            delta=1,
+        )
+        self.assertAlmostEqual(
+            20 + 100 / 3,
+            collector.get_loop_abort_time(
+                UnusedSessionPruner,
+                [LoginTokenPruner, OpenIDConsumerNoncePruner],
+            ),
+            delta=1,
+        )
+
+    def test_record_loop_run(self):
+        # Aborted tasks are recorded as having a backlog, and the run times
+        # of completed tasks are smoothed.
+        collector = HourlyDatabaseGarbageCollector(test_args=[])
+        self.assertTrue(
+            collector.record_loop_run(
+                "LoginTokenPruner", 10, FakeLoopTuner(False, 5)
+            )
+        )
+        self.assertEqual(
+            {"runtime": 10, "backlog": True, "items": 5},
+            collector.loop_history["LoginTokenPruner"],
+        )
+        self.assertFalse(
+            collector.record_loop_run(
+                "LoginTokenPruner", 20, FakeLoopTuner(True, 3)
+            )
+        )
+        self.assertEqual(
+            {"runtime": 15, "backlog": False, "items": 3},
+            collector.loop_history["LoginTokenPruner"],
+        )
+
+    def test_requeued_tasks_not_reported_as_not_run(self):
+        # Tasks that ran and were requeued to work on their backlog aren't
+        # counted as tasks that did not run if there's no time to rerun
+        # them.
+        class BacklogLoop:
+            maximum_chunk_size = None
+
+            def __init__(self, abort_time, log):
+                pass
+
+            def run(self):
+                return FakeLoopTuner(False, 1)
+
+        class OtherLoop(BacklogLoop):
+            pass
+
+        switch_dbuser("garbo_hourly")
+        collector = HourlyDatabaseGarbageCollector(test_args=["--threads=1"])
+        collector.tunable_loops = [BacklogLoop, OtherLoop]
+        collector.logger = self.log
+        # Time runs out as soon as BacklogLoop has been requeued.
+        collector.get_remaining_script_time = lambda: (
+            0 if collector.requeued_loops else 3600
+        )
+        collector.main()
+        self.assertEqual({BacklogLoop}, collector.requeued_loops)
+        self.assertIn("1 tasks did not run.", self.log_buffer.getvalue())
+
     def test_OpenIDConsumerNoncePruner(self):
         now = int(time.mktime(time.gmtime()))
         MINUTES = 60
@@ -2652,13 +2823,12 @@ def test_LoginTokenPruner(self):
         store.flush()
         current_token_id = current_token.id
 
-        # Run the pruner. Batching is tested by the BulkPruner tests so
+        # Run the pruner. Batching is tested by the KeysetPruner tests so
         # no need to repeat here.
         switch_dbuser("garbo_daily")
         pruner = LoginTokenPruner(logging.getLogger("garbo"))
         while not pruner.isDone():
             pruner(10)
-        pruner.cleanUp()
 
         # Only the old LoginToken is gone.
         self.assertEqual(store.find(LoginToken, id=old_token_id).count(), 0)
@@ -161,6 +161,9 @@ class IJob(Interface):
     def acquireLease(duration=300):
         """Acquire the lease for this Job, or raise LeaseHeld."""
 
+    def renewLease(duration=300):
+        """Extend a lease on this Job that is already held."""
+
     def getTimeout():
         """Determine how long this job can run before timing out."""
 
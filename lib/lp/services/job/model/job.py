@@ -17,14 +17,16 @@
 
 import transaction
 from lazr.jobrunner.jobrunner import LeaseHeld
-from storm.expr import And, Or, Select
+from storm.databases.postgres import Returning
+from storm.expr import SQL, And, Or, Select, Update
 from storm.locals import JSON, DateTime, Int, Reference, Unicode
 from zope.interface import implementer
 
 from lp.services.database import bulk
 from lp.services.database.constants import DEFAULT, UTC_NOW
 from lp.services.database.enumcol import DBEnum
-from lp.services.database.interfaces import IStore
+from lp.services.database.interfaces import IPrimaryStore, IStore
+from lp.services.database.sqlbase import convert_storm_clause_to_string
 from lp.services.database.stormbase import StormBase
 from lp.services.job.interfaces.job import IJob, JobStatus, JobType
 
@@ -169,6 +171,65 @@ def acquireLease(self, duration=300):
         expiry = datetime.fromtimestamp(time.time() + duration, timezone.utc)
         self.lease_expires = expiry
 
+    def renewLease(self, duration=300):
+        """See `IJob`."""
+        expiry = datetime.fromtimestamp(time.time() + duration, timezone.utc)
+        self.lease_expires = expiry
+
+    @staticmethod
+    def claimReady(
+        candidates, limit, duration=300, after_id=None, max_id=None
+    ):
+        """Lease up to `limit` ready jobs in a single statement.
+
+        Rows that another transaction has locked, for example because it
+        is claiming them at the same time, are skipped rather than waited
+        for, so concurrent runners each get a distinct batch.
+
+        :param candidates: A `Select` of the `Job.id`s to consider.
+        :param limit: The maximum number of jobs to claim.
+        :param duration: The length of the leases to take, in seconds.
+        :param after_id: If not None, only claim jobs with greater IDs.
+        :param max_id: If not None, only claim jobs with IDs up to this.
+        :return: A sorted list of the claimed `Job.id`s.
+        """
+        # The ready conditions must apply to the locked Job rows
+        # themselves, so that PostgreSQL rechecks them against any row
+        # that a concurrent claim has just leased.
+        clauses = [Job.ready_condition, Job.id.is_in(candidates)]
+        if after_id is not None:
+            clauses.append(Job.id > after_id)
+        if max_id is not None:
+            clauses.append(Job.id <= max_id)
+        claimable = Select(
+            Job.id,
+            where=And(*clauses),
+            order_by=Job.id,
+            limit=limit,
+        )
+        expiry = datetime.fromtimestamp(time.time() + duration, timezone.utc)
+        store = IPrimaryStore(Job)
+        claimed = store.execute(
+            Returning(
+                Update(
+                    {Job.lease_expires: expiry},
+                    where=Job.id.is_in(
+                        SQL(
+                            "%s FOR UPDATE OF Job SKIP LOCKED"
+                            % convert_storm_clause_to_string(claimable)
+                        )
+                    ),
+                    table=Job,
+                ),
+                columns=(Job.id,),
+            )
+        )
+        job_ids = sorted(job_id for (job_id,) in claimed)
+        if job_ids:
+            # Cached Job objects don't know about their new leases.
+            store.invalidate()
+        return job_ids
+
     def getTimeout(self):
         """Return the number of seconds until the job should time out.
 
@@ -269,15 +330,14 @@ def makeSubclass(cls, job):
         return cls._subclass[job.job_type](job)
 
 
-Job.ready_jobs = Select(
-    Job.id,
-    And(
-        Job._status == JobStatus.WAITING,
-        Or(Job.lease_expires == None, Job.lease_expires < UTC_NOW),
-        Or(Job.scheduled_start == None, Job.scheduled_start <= UTC_NOW),
-    ),
+Job.ready_condition = And(
+    Job._status == JobStatus.WAITING,
+    Or(Job.lease_expires == None, Job.lease_expires < UTC_NOW),
+    Or(Job.scheduled_start == None, Job.scheduled_start <= UTC_NOW),
 )
 
+Job.ready_jobs = Select(Job.id, Job.ready_condition)
+
 
 class UniversalJobSource:
     """Returns the RunnableJob associated with a Job.id."""
@@ -10,6 +10,7 @@
     "celery_enabled",
     "JobRunner",
     "JobRunnerProcess",
+    "JobRunnerProcessPool",
     "QuietAMPConnector",
     "TwistedJobRunner",
     "VirtualEnvProcessStarter",
@@ -22,7 +23,7 @@
 import sys
 from calendar import timegm
 from datetime import datetime, timedelta, timezone
-from resource import RLIMIT_AS, getrlimit, setrlimit
+from resource import RLIMIT_AS, RUSAGE_SELF, getrlimit, getrusage, setrlimit
 from signal import SIGHUP, signal
 from uuid import uuid4
 
@@ -33,7 +34,12 @@
 from lazr.jobrunner.jobrunner import LeaseHeld
 from storm.exceptions import LostObjectError
 from twisted.internet import reactor
-from twisted.internet.defer import inlineCallbacks, succeed
+from twisted.internet.defer import (
+    DeferredList,
+    DeferredSemaphore,
+    inlineCallbacks,
+    succeed,
+)
 from twisted.protocols import amp
 from twisted.python import failure, log
 from zope.component import getUtility
@@ -45,6 +51,7 @@
 from lp.services.database.policy import DatabaseBlockedPolicy
 from lp.services.features import getFeatureFlag
 from lp.services.job.interfaces.job import IJob, IRunnableJob
+from lp.services.job.model.job import Job
 from lp.services.mail.sendmail import (
     MailController,
     set_immediate_mail_delivery,
@@ -206,6 +213,11 @@ def acquireLease(self, duration=None):
             duration = self.lease_duration.total_seconds()
         self.job.acquireLease(duration)
 
+    def renewLease(self, duration=None):
+        if duration is None:
+            duration = self.lease_duration.total_seconds()
+        self.job.renewLease(duration)
+
     def taskId(self):
         """Return a task ID that gives a clue what this job is about.
 
@@ -357,8 +369,13 @@ def fail(self, manage_transaction=False):
 class BaseJobRunner(LazrJobRunner):
     """Runner of Jobs."""
 
+    # The number of jobs to lease at once from job sources that can claim
+    # a batch of ready jobs.
+    claim_batch_size = 10
+
     def __init__(self, logger=None, error_utility=None):
         self.oops_ids = []
+        self.claimed_leases = {}
         if error_utility is None:
             self.error_utility = errorlog.globalErrorUtility
         else:
@@ -369,7 +386,56 @@ def __init__(self, logger=None, error_utility=None):
             oopsMessage=self.error_utility.oopsMessage,
         )
 
+    def iterReady(self, job_source):
+        """Iterate over the ready jobs provided by `job_source`.
+
+        If the source provides `claimReady`, jobs are leased in batches of
+        `claim_batch_size`, skipping any that a concurrent runner is
+        claiming, rather than one at a time as they are run.  Only the jobs
+        that existed when iteration started are claimed, and each at most
+        once, so jobs that are created or retried in the meantime are left
+        for the next run.
+        """
+        # claimReady isn't part of `IJobSource`, so isn't visible through
+        # the security proxy on a job source utility.
+        claim_ready = getattr(
+            removeSecurityProxy(job_source), "claimReady", None
+        )
+        if claim_ready is None:
+            yield from job_source.iterReady()
+            return
+        max_id = IStore(Job).find(Job).max(Job.id)
+        after_id = None
+        while max_id is not None:
+            jobs = list(
+                claim_ready(
+                    self.claim_batch_size, after_id=after_id, max_id=max_id
+                )
+            )
+            self.claimed_leases.update(
+                (job.job_id, job.lease_expires) for job in jobs
+            )
+            # Commit the leases so that other runners can see them.
+            transaction.commit()
+            if not jobs:
+                break
+            # Batches are claimed in job ID order.
+            after_id = jobs[-1].job_id
+            yield from jobs
+
     def acquireLease(self, job):
+        claimed_lease = self.claimed_leases.pop(job.job_id, None)
+        if (
+            claimed_lease is not None
+            and job.lease_expires == claimed_lease
+            and claimed_lease >= datetime.now(timezone.utc)
+        ):
+            # We leased this job as part of a batch and still hold the
+            # lease, so extend it to cover the job's run.  If the lease
+            # ran out while earlier jobs in the batch ran, another runner
+            # may have taken the job since, so try for it afresh.
+            job.renewLease()
+            return True
         self.logger.debug(
             "Trying to acquire lease for job in state %s" % (job.status.title,)
         )
@@ -434,7 +500,9 @@ def __init__(self, jobs, logger=None):
     @classmethod
     def fromReady(cls, job_class, logger=None):
         """Return a job runner for all ready jobs of a given class."""
-        return cls(job_class.iterReady(), logger)
+        runner = cls((), logger)
+        runner.jobs = runner.iterReady(job_class)
+        return runner
 
     @classmethod
     def runFromSource(cls, job_source, dbuser, logger):
@@ -461,7 +529,12 @@ def runAll(self):
 
 class RunJobCommand(amp.Command):
     arguments = [(b"job_id", amp.Integer())]
-    response = [(b"success", amp.Integer()), (b"oops_id", amp.Unicode())]
+    response = [
+        (b"success", amp.Integer()),
+        (b"oops_id", amp.Unicode()),
+        (b"pid", amp.Integer()),
+        (b"max_rss", amp.Integer()),
+    ]
 
 
 def import_source(job_source_name):
@@ -539,7 +612,13 @@ def runJobCommand(self, job_id):
             oops_id = ""
         else:
             oops_id = oops["id"]
-        return {"success": len(runner.completed_jobs), "oops_id": oops_id}
+        return {
+            "success": len(runner.completed_jobs),
+            "oops_id": oops_id,
+            "pid": os.getpid(),
+            # ru_maxrss is in kilobytes on Linux.
+            "max_rss": getrusage(RUSAGE_SELF).ru_maxrss * 1024,
+        }
 
 
 class VirtualEnvProcessStarter(main.ProcessStarter):
@@ -593,12 +672,46 @@ def errReceived(self, data):
             main.log.info("FROM {n}: {l}", n=self.name, l=line)
 
 
+class JobRunnerProcessPool(pool.ProcessPool):
+    """A `ProcessPool` that can retire particular workers."""
+
+    def retireWorker(self, pid):
+        """Stop the idle worker with this process ID, if it still exists.
+
+        The worker is removed from the pool at once so that it gets no
+        more work, and a replacement is started when next needed.
+        """
+        for worker in self.ready:
+            # The worker's transport is an `AMPConnector`, whose own
+            # transport is the process.
+            if worker.transport.transport.pid == pid:
+                self.ready.discard(worker)
+                self.processes.discard(worker)
+                return self.stopAWorker(worker)
+        return succeed(None)
+
+
 class TwistedJobRunner(BaseJobRunner):
-    """Run Jobs via twisted."""
+    """Run Jobs via twisted.
+
+    Jobs run in a pool of worker processes, each of which loads ZCML once
+    and then runs many jobs.  Up to `concurrency` jobs run at once.  A
+    worker is replaced once it has run `recycle_after` jobs, after a job
+    fails, or once its peak memory use exceeds `recycle_memory` bytes.
+    """
 
     TIMEOUT_CODE = 42
 
-    def __init__(self, job_source, dbuser, logger=None, error_utility=None):
+    def __init__(
+        self,
+        job_source,
+        dbuser,
+        logger=None,
+        error_utility=None,
+        concurrency=1,
+        recycle_after=500,
+        recycle_memory=None,
+    ):
         env = {"PATH": os.environ["PATH"]}
         if "LPCONFIG" in os.environ:
             env["LPCONFIG"] = os.environ["LPCONFIG"]
@@ -610,11 +723,15 @@ def __init__(self, job_source, dbuser, logger=None, error_utility=None):
             removeSecurityProxy(job_source).__module__,
             job_source.__name__,
         )
-        self.pool = pool.ProcessPool(
+        self.concurrency = concurrency
+        self.recycle_memory = recycle_memory
+        self.pool = JobRunnerProcessPool(
             JobRunnerProcess,
             ampChildArgs=[self.import_name, str(dbuser)],
             starter=starter,
             min=0,
+            max=concurrency,
+            recycleAfter=recycle_after,
             timeout_signal=SIGHUP,
         )
 
@@ -650,12 +767,22 @@ def update(response):
             if response["success"]:
                 self.completed_jobs.append(job)
                 self.logger.debug("Finished %s", self.job_str(job))
+                if (
+                    self.recycle_memory is not None
+                    and response["max_rss"] > self.recycle_memory
+                ):
+                    self.logger.debug(
+                        "Recycling worker %d using %d bytes",
+                        response["pid"],
+                        response["max_rss"],
+                    )
+                    self.pool.retireWorker(response["pid"])
             else:
                 self.incomplete_jobs.append(job)
                 self.logger.debug("Incomplete %s", self.job_str(job))
-                # Kill the worker that experienced a failure; this only
-                # works because there's a single worker.
-                self.pool.stopAWorker()
+                # Kill the worker that experienced a failure, since it
+                # may not be safe to reuse it.
+                self.pool.retireWorker(response["pid"])
             if response["oops_id"] != "":
                 self._logOopsId(response["oops_id"])
 
@@ -694,8 +821,15 @@ def runAll(self):
         try:
             try:
                 job = None
-                for job in self.job_source.iterReady():
-                    yield self.runJobInSubprocess(job)
+                # Only take a job's lease once a worker is free to run it.
+                semaphore = DeferredSemaphore(self.concurrency)
+                deferreds = []
+                for job in self.iterReady(self.job_source):
+                    yield semaphore.acquire()
+                    deferred = self.runJobInSubprocess(job)
+                    deferred.addBoth(self._release, semaphore)
+                    deferreds.append(deferred)
+                yield DeferredList(deferreds)
                 if job is None:
                     self.logger.info("No jobs to run.")
                 self.terminated()
@@ -705,6 +839,11 @@ def runAll(self):
             self.terminated()
             raise
 
+    @staticmethod
+    def _release(result, semaphore):
+        semaphore.release()
+        return result
+
     def terminated(self, ignored=None):
         """Callback to stop the processpool and reactor."""
         deferred = self.pool.stop()
@@ -716,12 +855,16 @@ def failed(self, failure):
         self.terminated()
 
     @classmethod
-    def runFromSource(cls, job_source, dbuser, logger, _log_twisted=False):
+    def runFromSource(
+        cls, job_source, dbuser, logger, _log_twisted=False, **kwargs
+    ):
         """Run all ready jobs provided by the specified source.
 
         The dbuser parameter is not ignored.
         :param _log_twisted: For debugging: If True, emit verbose Twisted
             messages to stderr.
+        :param kwargs: Passed to the constructor, to configure the pool of
+            workers.
         """
         logger.info("Running through Twisted.")
         if _log_twisted:
@@ -731,7 +874,7 @@ def runFromSource(cls, job_source, dbuser, logger, _log_twisted=False):
             logger_object.addHandler(handler)
             observer = log.PythonLoggingObserver(loggerName="twistedjobrunner")
             log.startLoggingWithObserver(observer.emit)
-        runner = cls(job_source, dbuser, logger)
+        runner = cls(job_source, dbuser, logger, **kwargs)
         reactor.callWhenRunning(runner.runAll)
         run_reactor()
         return runner
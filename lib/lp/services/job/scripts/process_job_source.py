@@ -112,6 +112,11 @@ def main(self):
         kwargs = {}
         if getattr(self.options, "log_twisted", False):
             kwargs["_log_twisted"] = True
+        # Configure the pool of worker processes, if this runner has one.
+        for name in ("concurrency", "recycle_after", "recycle_memory"):
+            value = getattr(self.config_section, name, None)
+            if value is not None:
+                kwargs[name] = int(value)
         runner = self.runner_class.runFromSource(
             job_source, self.dbuser, self.logger, **kwargs
         )
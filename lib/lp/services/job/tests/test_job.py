@@ -6,7 +6,7 @@
 
 import transaction
 from lazr.jobrunner.jobrunner import LeaseHeld
-from storm.locals import Store
+from storm.locals import Select, Store
 from testtools.matchers import Equals
 
 from lp.code.model.branchmergeproposaljob import CodeReviewCommentEmailJob
@@ -468,6 +468,57 @@ def test_acquireLeaseTimeoutExpired(self):
         job.acquireLease(-300)
         self.assertEqual(0, job.getTimeout())
 
+    def test_renewLease(self):
+        """Job.renewLease extends a lease that is already held."""
+        job = Job()
+        job.acquireLease(10)
+        job.renewLease(300)
+        self.assertTrue(job.getTimeout() > 10)
+
+    def _candidates(self, jobs):
+        return Select(Job.id, Job.id.is_in(job.id for job in jobs))
+
+    def test_claimReady(self):
+        """Job.claimReady leases the ready jobs among its candidates."""
+        future = datetime.fromtimestamp(time.time() + 1000, timezone.utc)
+        jobs = [
+            Job(),
+            Job(status=JobStatus.RUNNING),
+            Job(lease_expires=future),
+            Job(scheduled_start=future),
+            Job(),
+        ]
+        other = Job()
+        claimed = Job.claimReady(self._candidates(jobs), 10)
+        self.assertEqual([jobs[0].id, jobs[4].id], claimed)
+        self.assertTrue(jobs[0].getTimeout() > 0)
+        self.assertTrue(jobs[4].getTimeout() > 0)
+        self.assertIsNone(other.lease_expires)
+        # The claimed jobs are no longer ready.
+        self.assertEqual([], Job.claimReady(self._candidates(jobs), 10))
+
+    def test_claimReady_limit(self):
+        """Job.claimReady claims at most `limit` jobs, oldest first."""
+        jobs = [Job() for _ in range(3)]
+        candidates = self._candidates(jobs)
+        self.assertEqual(
+            [jobs[0].id, jobs[1].id], Job.claimReady(candidates, 2)
+        )
+        self.assertEqual([jobs[2].id], Job.claimReady(candidates, 2))
+
+    def test_claimReady_bounds(self):
+        """Job.claimReady only claims jobs within the given ID range."""
+        jobs = [Job() for _ in range(4)]
+        self.assertEqual(
+            [jobs[1].id, jobs[2].id],
+            Job.claimReady(
+                self._candidates(jobs),
+                10,
+                after_id=jobs[0].id,
+                max_id=jobs[2].id,
+            ),
+        )
+
 
 class TestUniversalJobSource(TestCaseWithFactory):
     layer = ZopelessDatabaseLayer
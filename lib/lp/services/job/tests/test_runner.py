@@ -3,17 +3,21 @@
 
 """Tests for job-running facilities."""
 
+import json
 import logging
+import os
 import re
+import shutil
 import sys
+import tempfile
 from datetime import datetime, timedelta, timezone
 from textwrap import dedent
-from time import sleep
+from time import monotonic, sleep
 
 import transaction
 from lazr.jobrunner.jobrunner import LeaseHeld, SuspendJobException
 from lazr.restful.utils import get_current_browser_request
-from storm.locals import Bool, Int, Reference
+from storm.locals import Bool, Int, Reference, Select
 from testtools.matchers import GreaterThan, LessThan, MatchesAll, MatchesRegex
 from testtools.testcase import ExpectedException
 from zope.interface import implementer
@@ -199,6 +203,89 @@ def test_runAll_skips_lease_failures(self):
         self.assertEqual([job_2], runner.incomplete_jobs)
         self.assertEqual([], self.oopses)
 
+    def test_fromReady_claims_batches(self):
+        """Jobs from sources that can claim them are leased in batches."""
+        jobs = {
+            job.job_id: job for job in self.makeTwoJobs() + (NullJob("3"),)
+        }
+        claims = []
+
+        class ClaimingJobSource:
+            @staticmethod
+            def claimReady(limit, after_id=None, max_id=None):
+                job_ids = Job.claimReady(
+                    Select(Job.id, Job.id.is_in(list(jobs))),
+                    limit,
+                    after_id=after_id,
+                    max_id=max_id,
+                )
+                claims.append(job_ids)
+                return [jobs[job_id] for job_id in job_ids]
+
+        self.patch(JobRunner, "claim_batch_size", 2)
+        runner = JobRunner.fromReady(ClaimingJobSource)
+        runner.runAll()
+        job_ids = sorted(jobs)
+        self.assertEqual([job_ids[:2], job_ids[2:], []], claims)
+        self.assertEqual(
+            [jobs[job_id] for job_id in job_ids], runner.completed_jobs
+        )
+
+    def test_fromReady_claims_only_existing_jobs(self):
+        """Jobs created while claimed jobs run are left for the next run."""
+        jobs = {}
+
+        class SpawningJob(NullJob):
+            def run(self):
+                super().run()
+                spawned = NullJob("spawned by %s" % self.message)
+                jobs[spawned.job_id] = spawned
+
+        for message in ("1", "2", "3"):
+            job = SpawningJob(message)
+            jobs[job.job_id] = job
+        original_jobs = [jobs[job_id] for job_id in sorted(jobs)]
+
+        class ClaimingJobSource:
+            @staticmethod
+            def claimReady(limit, after_id=None, max_id=None):
+                job_ids = Job.claimReady(
+                    Select(Job.id, Job.id.is_in(list(jobs))),
+                    limit,
+                    after_id=after_id,
+                    max_id=max_id,
+                )
+                return [jobs[job_id] for job_id in job_ids]
+
+        self.patch(JobRunner, "claim_batch_size", 2)
+        runner = JobRunner.fromReady(ClaimingJobSource)
+        runner.runAll()
+        self.assertEqual(original_jobs, runner.completed_jobs)
+        self.assertEqual(6, len(jobs))
+        for job in jobs.values():
+            if job not in original_jobs:
+                self.assertEqual(JobStatus.WAITING, job.job.status)
+
+    def test_acquireLease_claimed(self):
+        """A job's lease from a batch claim is extended when it runs."""
+        job = NullJob("job")
+        job.job.acquireLease(10)
+        runner = JobRunner([job])
+        runner.claimed_leases[job.job_id] = job.lease_expires
+        self.assertTrue(runner.acquireLease(job))
+        self.assertThat(job.getTimeout(), GreaterThan(10))
+
+    def test_acquireLease_claimed_elsewhere(self):
+        """A claimed job whose lease ran out may have been taken since."""
+        job = NullJob("job")
+        runner = JobRunner([job])
+        runner.claimed_leases[job.job_id] = datetime.now(
+            timezone.utc
+        ) - timedelta(seconds=1)
+        job.job.acquireLease()
+        self.assertFalse(runner.acquireLease(job))
+        self.assertEqual([job], runner.incomplete_jobs)
+
     def test_runAll_reports_oopses(self):
         """When an error is encountered, report an oops and continue."""
         job_1, job_2 = self.makeTwoJobs()
@@ -709,6 +796,49 @@ def run(self):
         self.x = "*" * (10**6)
 
 
+@implementer(IRunnableJob)
+class RendezvousJob(StaticJobSource):
+    """A job that waits for the other jobs to start before it finishes.
+
+    Each job records its worker's process ID, and whether it saw all the
+    other jobs start while it was running.  If they all did, they must have
+    run at the same time.
+    """
+
+    jobs = [(), ()]
+
+    done = False
+
+    # How long to wait for the other jobs, in seconds.
+    timeout = 30
+
+    def __init__(self, id):
+        self.job = Job()
+        IStore(Job).flush()
+        self.id = id
+
+    @staticmethod
+    def getMarkerDirectory(pid):
+        """Return the directory for the markers of jobs run by `pid`."""
+        return os.path.join(tempfile.gettempdir(), "rendezvous-job-%d" % pid)
+
+    def run(self):
+        # The job runner starts its workers itself, so their parent is the
+        # test.
+        directory = self.getMarkerDirectory(os.getppid())
+        with open(os.path.join(directory, "%d.started" % self.id), "w"):
+            pass
+        started = {"%d.started" % index for index in range(len(self.jobs))}
+        deadline = monotonic() + self.timeout
+        met = False
+        while not met and monotonic() < deadline:
+            met = started.issubset(os.listdir(directory))
+            if not met:
+                sleep(0.1)
+        with open(os.path.join(directory, "%d.json" % self.id), "w") as f:
+            json.dump({"pid": os.getpid(), "met": met}, f)
+
+
 class NoJobs(StaticJobSource):
     done = False
 
@@ -855,6 +985,53 @@ def test_successful_jobs_share_process(self):
             (2, 0), (len(runner.completed_jobs), len(runner.incomplete_jobs))
         )
 
+    def test_recycle_after(self):
+        """Workers are replaced after running recycle_after jobs."""
+        logger = BufferLogger()
+        self.addCleanup(self._attachLog, logger)
+        runner = TwistedJobRunner.runFromSource(
+            ProcessSharingJob, "branchscanner", logger, recycle_after=1
+        )
+        self.assertEqual(
+            (1, 1), (len(runner.completed_jobs), len(runner.incomplete_jobs))
+        )
+
+    def test_recycle_memory(self):
+        """Workers are replaced once they use more than recycle_memory."""
+        logger = BufferLogger()
+        logger.setLevel(logging.DEBUG)
+        self.addCleanup(self._attachLog, logger)
+        runner = TwistedJobRunner.runFromSource(
+            ProcessSharingJob, "branchscanner", logger, recycle_memory=1
+        )
+        self.assertEqual(
+            (1, 1), (len(runner.completed_jobs), len(runner.incomplete_jobs))
+        )
+        self.assertIn("Recycling worker", logger.getLogBuffer())
+
+    def test_concurrency(self):
+        """Several workers may run jobs at once."""
+        logger = BufferLogger()
+        self.addCleanup(self._attachLog, logger)
+        directory = RendezvousJob.getMarkerDirectory(os.getpid())
+        os.mkdir(directory)
+        self.addCleanup(shutil.rmtree, directory)
+        runner = TwistedJobRunner.runFromSource(
+            RendezvousJob, "branchscanner", logger, concurrency=2
+        )
+        self.assertEqual(
+            (2, 0), (len(runner.completed_jobs), len(runner.incomplete_jobs))
+        )
+        self.assertEqual(2, runner.pool.max)
+        results = []
+        for index in range(2):
+            with open(os.path.join(directory, "%d.json" % index)) as f:
+                results.append(json.load(f))
+        # Each job saw the other start before it finished, so they ran at
+        # the same time, in different workers.
+        self.assertEqual([True, True], [result["met"] for result in results])
+        self.assertNotEqual(results[0]["pid"], results[1]["pid"])
+
     def disable_test_memory_hog_job(self):
         """A job with a memory limit will trigger MemoryError on excess."""
         # XXX: frankban 2012-03-29 bug=963455: This test fails intermittently,
@@ -17,6 +17,7 @@
 import socket
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from socket import AF_INET, SOCK_STREAM
 from urllib.error import HTTPError, URLError
 from urllib.parse import quote, urljoin, urlparse, urlunparse
@@ -159,6 +160,118 @@ def addFile(
         """
         if file is None:
             raise TypeError("Bad File Descriptor: %s" % repr(file))
+        self._checkSize(size, allow_zero_length)
+
+        # Import in this method to avoid a circular import
+        from lp.services.librarian.model import LibraryFileAlias
+
+        # Get the name of the database the client is using, so that the
+        # server can check that the client is using the same database as
+        # the server.
+        store = IPrimaryStore(LibraryFileAlias)
+        databaseName = self._getDatabaseName(store)
+
+        # Generate new content and alias IDs.
+        # (we'll create rows with these IDs later, but not yet)
+        [(contentID, aliasID)] = self._allocateIDs(store, 1)
+
+        digests = self._sendFile(
+            name,
+            size,
+            file,
+            databaseName,
+            contentID,
+            aliasID,
+            debugID=debugID,
+        )
+        self._addRows(
+            store,
+            contentID,
+            aliasID,
+            name,
+            size,
+            digests,
+            contentType,
+            expires,
+        )
+        store.flush()
+
+        assert isinstance(aliasID, int), "aliasID %r not an integer" % (
+            aliasID,
+        )
+        return aliasID
+
+    def addFiles(
+        self, files, expires=None, allow_zero_length=False, max_workers=1
+    ):
+        """Add several files to the librarian, uploading them concurrently.
+
+        Only the uploads themselves happen in worker threads: IDs are
+        allocated and database rows are created in bulk by the calling
+        thread, so the result is the same as calling `addFile` for each
+        file in turn.
+
+        :param files: A sequence of (name, size, open_file, contentType,
+            digests) tuples.  `open_file` is a callable that returns a
+            file-like object with the content in it; it is called from a
+            worker thread, and the file is closed once it has been
+            uploaded.  `digests` is either None or a dictionary mapping
+            "md5", "sha1" and "sha256" to hex digests of the content that
+            the caller already knows, in which case the content is not
+            hashed again; the server checks the SHA-1 digest.
+        :param expires: Expiry time of the files.  See `addFile`.
+        :param allow_zero_length: If True permit zero length files.
+        :param max_workers: Upload at most this many files at once.
+        :returns: A list of aliasIDs, in the same order as `files`.
+        :raises UploadFailed: If the server rejects any of the uploads for
+            some reason.
+        """
+        files = list(files)
+        for _, size, _, _, _ in files:
+            self._checkSize(size, allow_zero_length)
+        if not files:
+            return []
+
+        # Import in this method to avoid a circular import
+        from lp.services.librarian.model import LibraryFileAlias
+
+        store = IPrimaryStore(LibraryFileAlias)
+        databaseName = self._getDatabaseName(store)
+        ids = self._allocateIDs(store, len(files))
+
+        def upload(file, ids):
+            name, size, open_file, _, digests = file
+            contentID, aliasID = ids
+            with open_file() as fileobj:
+                return self._sendFile(
+                    name,
+                    size,
+                    fileobj,
+                    databaseName,
+                    contentID,
+                    aliasID,
+                    digests=digests,
+                )
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            uploaded = list(executor.map(upload, files, ids))
+
+        for file, (contentID, aliasID), digests in zip(files, ids, uploaded):
+            name, size, _, contentType, _ = file
+            self._addRows(
+                store,
+                contentID,
+                aliasID,
+                name,
+                size,
+                digests,
+                contentType,
+                expires,
+            )
+        store.flush()
+        return [aliasID for _, aliasID in ids]
+
+    def _checkSize(self, size, allow_zero_length):
         if allow_zero_length:
             min_size = -1
         else:
@@ -166,32 +279,49 @@ def addFile(
         if size <= min_size:
             raise UploadFailed("Invalid length: %d" % size)
 
-        name = six.ensure_binary(name)
+    def _allocateIDs(self, store, count):
+        """Allocate content and alias IDs for new files.
 
-        # Import in this method to avoid a circular import
-        from lp.services.librarian.model import (
-            LibraryFileAlias,
-            LibraryFileContent,
+        :return: A list of `count` (contentID, aliasID) pairs.
+        """
+        return list(
+            store.execute(
+                """
+                SELECT
+                    nextval('libraryfilecontent_id_seq'),
+                    nextval('libraryfilealias_id_seq')
+                FROM generate_series(1, ?)
+                """,
+                (count,),
+            )
         )
 
+    def _sendFile(
+        self,
+        name,
+        size,
+        file,
+        databaseName,
+        contentID,
+        aliasID,
+        debugID=None,
+        digests=None,
+    ):
+        """Send a file to the librarian upload server.
+
+        This does not use the database, so it may be called from any
+        thread.
+
+        :param digests: If not None, a dictionary of the "md5", "sha1" and
+            "sha256" hex digests of the content, which is then not hashed
+            again.
+        :return: A dictionary of the "md5", "sha1" and "sha256" hex digests
+            of the content.
+        """
+        name = six.ensure_binary(name)
         try:
             self._connect()
 
-            # Get the name of the database the client is using, so that
-            # the server can check that the client is using the same
-            # database as the server.
-            store = IPrimaryStore(LibraryFileAlias)
-            databaseName = self._getDatabaseName(store)
-
-            # Generate new content and alias IDs.
-            # (we'll create rows with these IDs later, but not yet)
-            contentID = store.execute(
-                "SELECT nextval('libraryfilecontent_id_seq')"
-            ).get_one()[0]
-            aliasID = store.execute(
-                "SELECT nextval('libraryfilealias_id_seq')"
-            ).get_one()[0]
-
             # Send command
             self._sendLine(b"STORE %d %s" % (size, name))
 
@@ -199,6 +329,9 @@ def addFile(
             self._sendHeader("Database-Name", databaseName)
             self._sendHeader("File-Content-ID", contentID)
             self._sendHeader("File-Alias-ID", aliasID)
+            if digests is not None:
+                # Ask the server to check that the content matches.
+                self._sendHeader("SHA1-Digest", digests["sha1"])
 
             if debugID is not None:
                 self._sendHeader("Debug-ID", debugID)
@@ -210,9 +343,14 @@ def addFile(
             self._sendLine(b"", check_for_error_responses=(size > 0))
 
             # Prepare to the upload the file
-            md5_digester = hashlib.md5()
-            sha1_digester = hashlib.sha1()
-            sha256_digester = hashlib.sha256()
+            if digests is None:
+                digesters = {
+                    "md5": hashlib.md5(),
+                    "sha1": hashlib.sha1(),
+                    "sha256": hashlib.sha256(),
+                }
+            else:
+                digesters = {}
             bytesWritten = 0
 
             # Read in and upload the file 64kb at a time, by using the two-arg
@@ -221,9 +359,8 @@ def addFile(
             for chunk in iter(lambda: file.read(1024 * 64), b""):
                 self.state.f.write(chunk)
                 bytesWritten += len(chunk)
-                md5_digester.update(chunk)
-                sha1_digester.update(chunk)
-                sha256_digester.update(chunk)
+                for digester in digesters.values():
+                    digester.update(chunk)
 
             assert (
                 bytesWritten == size
@@ -240,36 +377,53 @@ def addFile(
             if response != "200":
                 raise UploadFailed("Server said: " + response)
 
-            # Add rows to DB
-            content = LibraryFileContent(
-                id=contentID,
-                filesize=size,
-                sha256=sha256_digester.hexdigest(),
-                sha1=sha1_digester.hexdigest(),
-                md5=md5_digester.hexdigest(),
-            )
-            store.add(content)
-            LibraryFileAlias(
-                id=aliasID,
-                content=content,
-                filename=name.decode("UTF-8"),
-                mimetype=contentType,
-                expires=expires,
-                restricted=self.restricted,
-            )
-
-            store.flush()
-
-            assert isinstance(aliasID, int), "aliasID %r not an integer" % (
-                aliasID,
-            )
-            return aliasID
+            if digests is None:
+                digests = {
+                    key: digester.hexdigest()
+                    for key, digester in digesters.items()
+                }
+            return digests
         except socket.timeout:
             timeout = config.librarian.client_socket_timeout
             raise UploadFailed("Server timed out after %s second(s)" % timeout)
         finally:
             self._close()
 
+    def _addRows(
+        self,
+        store,
+        contentID,
+        aliasID,
+        name,
+        size,
+        digests,
+        contentType,
+        expires,
+    ):
+        """Add database rows for a file that has been uploaded."""
+        # Import in this method to avoid a circular import
+        from lp.services.librarian.model import (
+            LibraryFileAlias,
+            LibraryFileContent,
+        )
+
+        content = LibraryFileContent(
+            id=contentID,
+            filesize=size,
+            sha256=digests["sha256"],
+            sha1=digests["sha1"],
+            md5=digests["md5"],
+        )
+        store.add(content)
+        LibraryFileAlias(
+            id=aliasID,
+            content=content,
+            filename=six.ensure_text(name),
+            mimetype=contentType,
+            expires=expires,
+            restricted=self.restricted,
+        )
+
     def _getDatabaseName(self, store):
         return store.execute("SELECT current_database();").get_one()[0]
 
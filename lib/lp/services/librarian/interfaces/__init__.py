@@ -185,6 +185,17 @@ def create(
         IRestrictedLibrarianClient utility.
         """
 
+    def createMany(
+        files, restricted=False, allow_zero_length=False, max_workers=1
+    ):
+        """Create several files in the Librarian, returning the new aliases.
+
+        The files are uploaded concurrently by up to `max_workers` threads.
+        `files` is a sequence of (name, size, open_file, contentType,
+        digests) tuples as for `IFileUploadClient.addFiles`, and the aliases
+        are returned in the same order.
+        """
+
     def __getitem__(key):
         """Lookup an ILibraryFileAlias by id."""
 
@@ -63,6 +63,28 @@ def addFile(name, size, file, contentType, expires=None):
         Returns the id of the newly added LibraryFileAlias
         """
 
+    def addFiles(files, expires=None, allow_zero_length=False, max_workers=1):
+        """Add several files to the librarian, uploading them concurrently.
+
+        :param files: A sequence of (name, size, open_file, contentType,
+            digests) tuples, where `open_file` is a callable returning a
+            file-like object with the content in it and `digests` is None
+            or a dictionary of already-known "md5", "sha1" and "sha256" hex
+            digests of the content.
+        :param expires: Expiry time of the files, or None to keep until
+            unreferenced.
+        :param allow_zero_length: If True permit zero length files.
+        :param max_workers: Upload at most this many files at once.
+
+        :raises UploadFailed: If the server rejects any of the uploads for
+            some reason.
+
+        As with `addFile`, database insertions are done by the client.
+
+        Returns a list of the ids of the newly added LibraryFileAliases, in
+        the same order as `files`.
+        """
+
     def remoteAddFile(name, size, file, contentType, expires=None):
         """Add a file to the librarian using the remote protocol.
 
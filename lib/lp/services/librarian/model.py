@@ -31,6 +31,7 @@
 from lp.app.errors import NotFoundError
 from lp.registry.errors import InvalidFilename
 from lp.services.config import config
+from lp.services.database.bulk import load
 from lp.services.database.constants import DEFAULT, UTC_NOW
 from lp.services.database.interfaces import IPrimaryStore, IStore
 from lp.services.database.sqlbase import session_store
@@ -281,6 +282,29 @@ def create(
         assert lfa is not None, "client.addFile didn't!"
         return lfa
 
+    def createMany(
+        self, files, restricted=False, allow_zero_length=False, max_workers=1
+    ):
+        """See `ILibraryFileAliasSet`"""
+        if restricted:
+            client = getUtility(IRestrictedLibrarianClient)
+        else:
+            client = getUtility(ILibrarianClient)
+        for name, _, _, _, _ in files:
+            if "/" in name:
+                raise InvalidFilename("Filename cannot contain slashes.")
+        fids = client.addFiles(
+            files, allow_zero_length=allow_zero_length, max_workers=max_workers
+        )
+        lfas = {
+            lfa.id: lfa
+            for lfa in load(
+                LibraryFileAlias, fids, store=IPrimaryStore(LibraryFileAlias)
+            )
+        }
+        assert len(lfas) == len(fids), "client.addFiles didn't!"
+        return [lfas[fid] for fid in fids]
+
     def __getitem__(self, key):
         """See ILibraryFileAliasSet.__getitem__"""
         lfa = IStore(LibraryFileAlias).get(LibraryFileAlias, key)
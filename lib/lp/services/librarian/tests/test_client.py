@@ -11,6 +11,7 @@
 import threading
 import unittest
 from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from urllib.error import HTTPError, URLError
 from urllib.request import urlopen
 
@@ -393,6 +394,83 @@ def test_addFile_hashes(self):
         self.assertEqual(sha1, lfa.content.sha1)
         self.assertEqual(sha256, lfa.content.sha256)
 
+    def test_addFiles(self):
+        # addFiles() uploads several files, possibly concurrently, and
+        # returns their aliases in order.
+        contents = [b"first file", b"second file", b"third file"]
+        client = LibrarianClient()
+        alias_ids = client.addFiles(
+            [
+                (
+                    "file%d" % i,
+                    len(data),
+                    partial(io.BytesIO, data),
+                    "text/plain",
+                    None,
+                )
+                for i, data in enumerate(contents)
+            ],
+            max_workers=2,
+        )
+        transaction.commit()
+        self.assertEqual(len(contents), len(alias_ids))
+        for i, (alias_id, data) in enumerate(zip(alias_ids, contents)):
+            lfa = IStore(LibraryFileAlias).get(LibraryFileAlias, alias_id)
+            self.assertEqual("file%d" % i, lfa.filename)
+            self.assertEqual(
+                hashlib.sha256(data).hexdigest(), lfa.content.sha256
+            )
+            self.assertEqual(data, client.getFileByAlias(alias_id).read())
+
+    def test_addFiles_known_digests(self):
+        # addFiles() uses digests passed by the caller rather than
+        # computing them again.
+        data = b"i am some data"
+        digests = {
+            "md5": hashlib.md5(data).hexdigest(),
+            "sha1": hashlib.sha1(data).hexdigest(),
+            "sha256": hashlib.sha256(data).hexdigest(),
+        }
+        client = LibrarianClient()
+        [alias_id] = client.addFiles(
+            [
+                (
+                    "file",
+                    len(data),
+                    partial(io.BytesIO, data),
+                    "text/plain",
+                    digests,
+                )
+            ]
+        )
+        lfa = IStore(LibraryFileAlias).get(LibraryFileAlias, alias_id)
+        self.assertEqual(digests["md5"], lfa.content.md5)
+        self.assertEqual(digests["sha1"], lfa.content.sha1)
+        self.assertEqual(digests["sha256"], lfa.content.sha256)
+
+    def test_addFiles_wrong_digests(self):
+        # The server checks the SHA-1 digest passed to addFiles().
+        data = b"i am some data"
+        digests = {
+            "md5": hashlib.md5(b"other").hexdigest(),
+            "sha1": hashlib.sha1(b"other").hexdigest(),
+            "sha256": hashlib.sha256(b"other").hexdigest(),
+        }
+        client = LibrarianClient()
+        self.assertRaises(
+            UploadFailed,
+            client.addFiles,
+            [
+                (
+                    "file",
+                    len(data),
+                    partial(io.BytesIO, data),
+                    "text/plain",
+                    digests,
+                )
+            ],
+        )
+
     def test__getURLForDownload(self):
         # This protected method is used by getFileByAlias. It is supposed to
         # use the internal host and port rather than the external, proxied
@@ -4,12 +4,16 @@
 """Librarian garbage collection routines"""
 
 import hashlib
+import mmap
 import multiprocessing.pool
 import os
 import re
 import sys
-from contextlib import ExitStack
+import tempfile
+from collections import deque
 from datetime import datetime, timedelta, timezone
+from functools import partial
+from itertools import islice
 from time import time
 
 import iso8601
@@ -27,7 +31,8 @@
 from lp.services.librarianserver.storage import (
     _relFileLocation as relative_file_path,
 )
-from lp.services.looptuner import DBLoopTuner, ITunableLoop
+from lp.services.librarianserver.storage import remove_cached_file
+from lp.services.looptuner import AdaptiveController, DBLoopTuner, ITunableLoop
 
 log = None  # This is set by cronscripts/librarian-gc.py
 debug = False
@@ -371,15 +376,19 @@ def __call__(self, chunksize):
             """
             % chunksize
         )
-        self.total_expired += cur.rowcount
-        if cur.rowcount == 0:
+        expired = cur.rowcount
+        self.total_expired += expired
+        if expired == 0:
             self._done = True
         self.con.commit()
+        return expired
 
 
 def expire_aliases(con):
     """Invoke ExpireLibraryFileAliases."""
-    loop_tuner = DBLoopTuner(ExpireAliases(con), 5, log=log)
+    loop_tuner = DBLoopTuner(
+        ExpireAliases(con), 5, log=log, controller=AdaptiveController()
+    )
     loop_tuner.run()
 
 
@@ -515,12 +524,16 @@ def __call__(self, chunksize):
         self.total_deleted += deleted_rows
         self.con.commit()
         self.index += chunksize
+        return deleted_rows
 
 
 def delete_unreferenced_aliases(con):
     "Run the UnreferencedLibraryFileAliasPruner."
     loop_tuner = DBLoopTuner(
-        UnreferencedLibraryFileAliasPruner(con), 5, log=log
+        UnreferencedLibraryFileAliasPruner(con),
+        5,
+        log=log,
+        controller=AdaptiveController(),
     )
     loop_tuner.run()
 
@@ -609,6 +622,11 @@ def remove_content(self, content_id):
                                 connection_pool.os_auth_url,
                             )
 
+        # Remove the file from the librarian's Swift cache, so that it
+        # doesn't outlive its content.
+        if remove_cached_file(content_id):
+            removed.append("Swift cache")
+
         if removed:
             log.debug3("Deleted %s from %s", content_id, " & ".join(removed))
 
@@ -660,11 +678,17 @@ def __call__(self, chunksize):
         self.con.rollback()
 
         self.index += chunksize
+        return rows_deleted
 
 
 def delete_unreferenced_content(con):
     """Invoke UnreferencedContentPruner."""
-    loop_tuner = DBLoopTuner(UnreferencedContentPruner(con), 5, log=log)
+    loop_tuner = DBLoopTuner(
+        UnreferencedContentPruner(con),
+        5,
+        log=log,
+        controller=AdaptiveController(),
+    )
     loop_tuner.run()
 
 
@@ -674,65 +698,108 @@ def delete_unwanted_files(con):
     try:
         # Disable autocommit so that we can use named cursors.
         con.autocommit = False
-        delete_unwanted_disk_files(con)
-        swift_enabled = getFeatureFlag("librarian.swift.enabled") or False
-        if swift_enabled:
-            delete_unwanted_swift_files(con)
+        wanted = get_wanted_content_ids(con)
+        try:
+            delete_unwanted_disk_files(con, wanted=wanted)
+            swift_enabled = getFeatureFlag("librarian.swift.enabled") or False
+            if swift_enabled:
+                delete_unwanted_swift_files(con, wanted=wanted)
+        finally:
+            wanted.close()
     finally:
         con.rollback()
         con.autocommit = orig_autocommit
 
 
-def delete_unwanted_disk_files(con):
-    """Delete files found on disk that have no corresponding record in the
-    database.
+# The number of threads used to walk the disk and Swift in parallel.
+SWEEP_WORKERS = 10
 
-    Files will only be deleted if they were created more than one day ago
-    to avoid deleting files that have just been uploaded but have yet to have
-    the database records committed.
+
+class ContentIdSet:
+    """A compact set of LibraryFileContent ids.
+
+    This is a bitmap in a temporary file, so a set of every id in the
+    database costs one bit per id of disk space rather than memory.  Ids
+    greater than `max_id` are never members.
     """
 
-    log.info("Deleting unwanted files from disk.")
+    def __init__(self, max_id):
+        self.max_id = max_id
+        size = max_id // 8 + 1
+        self._file = tempfile.TemporaryFile()
+        self._file.truncate(size)
+        self._bitmap = mmap.mmap(self._file.fileno(), size)
 
-    swift_enabled = getFeatureFlag("librarian.swift.enabled") or False
+    def add(self, content_id):
+        if 0 <= content_id <= self.max_id:
+            self._bitmap[content_id >> 3] |= 1 << (content_id & 7)
 
-    cur = con.cursor(name="librariangc_disk_lfcs")
+    def __contains__(self, content_id):
+        return 0 <= content_id <= self.max_id and bool(
+            self._bitmap[content_id >> 3] & (1 << (content_id & 7))
+        )
 
-    # Calculate all stored LibraryFileContent ids that we want to keep.
-    # Results are ordered so we don't have to suck them all in at once.
-    cur.execute(
-        """
-        SELECT id FROM LibraryFileContent ORDER BY id
-        """
-    )
-    content_id_iter = iter(cur)
+    def difference(self, other):
+        """Generate the ids in this set that are not in other, in order."""
+        chunk_size = 4096
+        for offset in range(0, len(self._bitmap), chunk_size):
+            bits = int.from_bytes(
+                self._bitmap[offset : offset + chunk_size], "little"
+            )
+            bits &= ~int.from_bytes(
+                other._bitmap[offset : offset + chunk_size], "little"
+            )
+            while bits:
+                lowest = bits & -bits
+                yield offset * 8 + lowest.bit_length() - 1
+                bits ^= lowest
 
-    def get_next_wanted_content_id():
-        try:
-            result = next(content_id_iter)
-        except StopIteration:
-            return None
-        else:
-            return result[0]
+    def close(self):
+        self._bitmap.close()
+        self._file.close()
+
+
+def get_wanted_content_ids(con):
+    """Export the ids of all LibraryFileContents to a `ContentIdSet`.
+
+    This lets us compare storage against the database without holding a
+    cursor open while we walk it.
+    """
+    cur = con.cursor()
+    try:
+        cur.execute("SELECT max(id) FROM LibraryFileContent")
+        max_lfc_id = cur.fetchone()[0] or 0
+    finally:
+        cur.close()
+
+    wanted = ContentIdSet(max_lfc_id)
+    cur = con.cursor(name="librariangc_wanted_lfcs")
+    try:
+        cur.execute("SELECT id FROM LibraryFileContent")
+        while True:
+            rows = cur.fetchmany(100000)
+            if not rows:
+                break
+            for (content_id,) in rows:
+                wanted.add(content_id)
+    finally:
+        cur.close()
+        con.rollback()
+    log.debug("Exported LibraryFileContent ids up to %d." % max_lfc_id)
+    return wanted
+
+
+def _delete_unwanted_disk_tree(top, wanted, found):
+    """Delete unwanted files in one top-level directory of the storage area.
 
+    Files found are added to `found`.  Return the number of files deleted.
+    """
     removed_count = 0
-    content_id = next_wanted_content_id = -1
 
     hex_content_id_re = re.compile(r"^([0-9a-f]{8})(\.migrated)?$")
     ONE_DAY = 24 * 60 * 60
 
-    for dirpath, dirnames, filenames in os.walk(
-        get_storage_root(), followlinks=True
-    ):
-        # Ignore known and harmless noise in the Librarian storage area.
-        if "incoming" in dirnames:
-            dirnames.remove("incoming")
-        if "lost+found" in dirnames:
-            dirnames.remove("lost+found")
-        filenames = set(filenames)
-        filenames.discard("librarian.pid")
-        filenames.discard("librarian.log")
-
+    for dirpath, dirnames, filenames in os.walk(top, followlinks=True):
         for dirname in dirnames[:]:
             if len(dirname) != 2:
                 dirnames.remove(dirname)
@@ -746,17 +813,12 @@ def get_next_wanted_content_id():
                 dirnames.remove(dirname)
                 log.warning("Ignoring invalid directory %s" % dirname)
 
-        # We need everything in order to ensure we visit files in the
-        # same order we retrieve wanted files from the database.
-        dirnames.sort()
-        filenames = sorted(filenames)
-
         # Noise in the storage area, or maybe we are looking at the wrong
         # path?
         if dirnames and filenames:
             log.warning(
                 "%s contains both files %r and subdirectories %r. Skipping."
-                % (dirpath, filenames, dirnames)
+                % (dirpath, sorted(filenames), sorted(dirnames))
             )
             continue
 
@@ -769,30 +831,9 @@ def get_next_wanted_content_id():
                 continue
 
             content_id = int(match.groups()[0], 16)
+            found.add(content_id)
 
-            while (
-                next_wanted_content_id is not None
-                and content_id > next_wanted_content_id
-            ):
-                next_wanted_content_id = get_next_wanted_content_id()
-
-                if (
-                    config.librarian_server.upstream_host is None
-                    and not swift_enabled  # Maybe the file is in Swift.
-                    and next_wanted_content_id is not None
-                    and next_wanted_content_id < content_id
-                ):
-                    log.error(
-                        "LibraryFileContent %d exists in the database but "
-                        "was not found on disk." % next_wanted_content_id
-                    )
-
-            file_wanted = (
-                next_wanted_content_id is not None
-                and next_wanted_content_id == content_id
-            )
-
-            if not file_wanted:
+            if content_id not in wanted:
                 if time() - os.path.getctime(path) < ONE_DAY:
                     log.debug3(
                         "File %d not removed - created too recently"
@@ -804,26 +845,140 @@ def get_next_wanted_content_id():
                     log.debug3("Deleted %s" % path)
                     removed_count += 1
 
-    # Report any remaining LibraryFileContent that the database says
-    # should exist but we didn't find on disk.
-    if next_wanted_content_id == content_id:
-        next_wanted_content_id = get_next_wanted_content_id()
-    if not swift_enabled:
-        while next_wanted_content_id is not None:
-            if config.librarian_server.upstream_host is None:
+    return removed_count
+
+
+def delete_unwanted_disk_files(con, wanted=None):
+    """Delete files found on disk that have no corresponding record in the
+    database.
+
+    Files will only be deleted if they were created more than one day ago
+    to avoid deleting files that have just been uploaded but have yet to have
+    the database records committed.
+
+    :param wanted: A `ContentIdSet` of the LibraryFileContent ids in the
+        database.  If None, it is exported from the database first.
+    """
+
+    log.info("Deleting unwanted files from disk.")
+
+    swift_enabled = getFeatureFlag("librarian.swift.enabled") or False
+
+    if wanted is None:
+        wanted = get_wanted_content_ids(con)
+        close_wanted = True
+    else:
+        close_wanted = False
+    found = ContentIdSet(wanted.max_id)
+
+    try:
+        storage_root = get_storage_root()
+        tops = []
+        for entry in sorted(os.listdir(storage_root)):
+            path = os.path.join(storage_root, entry)
+            if not os.path.isdir(path):
+                # Ignore known and harmless noise in the Librarian storage
+                # area.
+                if entry not in ("librarian.pid", "librarian.log"):
+                    log.warning(
+                        "Ignoring file %s that shouldn't be here" % entry
+                    )
+            elif entry in ("incoming", "lost+found"):
+                pass
+            elif len(entry) != 2:
+                log.warning(
+                    "Ignoring directory %s that shouldn't be here" % entry
+                )
+            else:
+                try:
+                    int(entry, 16)
+                except ValueError:
+                    log.warning("Ignoring invalid directory %s" % entry)
+                else:
+                    tops.append(path)
+
+        # Each top-level directory holds its own range of ids, so they can
+        # be walked in parallel.
+        pool = multiprocessing.pool.ThreadPool(SWEEP_WORKERS)
+        try:
+            removed_count = sum(
+                pool.map(
+                    partial(
+                        _delete_unwanted_disk_tree, wanted=wanted, found=found
+                    ),
+                    tops,
+                )
+            )
+        finally:
+            pool.close()
+            pool.join()
+
+        # Report any LibraryFileContent that the database says should
+        # exist but we didn't find on disk.  It is normal to have files in
+        # the database that are not on disk if they have been migrated to
+        # Swift, or if the Librarian has an upstream Librarian, such as on
+        # staging.
+        if not swift_enabled and config.librarian_server.upstream_host is None:
+            for content_id in wanted.difference(found):
                 log.error(
                     "LibraryFileContent %d exists in the database but "
-                    "was not found on disk." % next_wanted_content_id
+                    "was not found on disk." % content_id
                 )
-            next_wanted_content_id = get_next_wanted_content_id()
+    finally:
+        found.close()
+        if close_wanted:
+            wanted.close()
 
-    cur.close()
     log.info(
         "Deleted %d files from disk that were no longer referenced "
         "in the db." % removed_count
     )
 
 
+# The number of Swift containers listed ahead of those being processed.
+SWIFT_LISTING_READAHEAD = 4
+
+
+def _list_swift_container(container):
+    """List a container in all configured Swift instances.
+
+    Return a list of (connection_pool, container, obj).  Results are in
+    numerical order; if the same file is present in multiple Swift
+    instances, all copies of it are listed before moving on to the next
+    file.
+    """
+    objs = []
+    for pool_index, connection_pool in enumerate(swift.connection_pools):
+        with swift.connection(connection_pool) as swift_connection:
+            try:
+                objs.extend(
+                    [
+                        (obj, pool_index)
+                        for obj in swift.quiet_swiftclient(
+                            swift_connection.get_container,
+                            container,
+                            full_listing=True,
+                        )[1]
+                    ]
+                )
+            except swiftclient.ClientException as x:
+                if x.http_status != 404:
+                    raise
+    objs.sort(
+        key=lambda x: (
+            [int(segment) for segment in x[0]["name"].split("/")],
+            x[1],
+        )
+    )
+    seen_names = set()
+    files = []
+    for obj, pool_index in objs:
+        if (obj["name"], pool_index) not in seen_names:
+            files.append((swift.connection_pools[pool_index], container, obj))
+        seen_names.add((obj["name"], pool_index))
+    return files
+
+
 def swift_files(max_lfc_id):
     """Generate all files stored in all configured Swift instances.
 
@@ -831,122 +986,75 @@ def swift_files(max_lfc_id):
     yielded in numerical order; if the same file is present in multiple
     Swift instances, all copies of it are yielded before moving on to the
     next file.
+
+    Containers are listed in parallel, a few ahead of the one whose files
+    are being yielded.
     """
     final_container = swift.swift_location(max_lfc_id)[0]
+    final_container_num = int(
+        final_container[len(swift.SWIFT_CONTAINER_PREFIX) :]
+    )
 
-    with ExitStack() as stack:
-        swift_connections = [
-            stack.enter_context(swift.connection(connection_pool))
-            for connection_pool in swift.connection_pools
-        ]
-        # We generate the container names, rather than query the
-        # server, because the mock Swift implementation doesn't
-        # support that operation.
-        container_num = -1
-        container = None
-        while container != final_container:
-            container_num += 1
-            container = swift.SWIFT_CONTAINER_PREFIX + str(container_num)
-            seen_names = set()
-            objs = []
-            for pool_index, swift_connection in enumerate(swift_connections):
-                try:
-                    objs.extend(
-                        [
-                            (obj, pool_index)
-                            for obj in swift.quiet_swiftclient(
-                                swift_connection.get_container,
-                                container,
-                                full_listing=True,
-                            )[1]
-                        ]
-                    )
-                except swiftclient.ClientException as x:
-                    if x.http_status == 404:
-                        continue
-                    raise
-            objs.sort(
-                key=lambda x: (
-                    [int(segment) for segment in x[0]["name"].split("/")],
-                    x[1],
-                )
+    # We generate the container names, rather than query the
+    # server, because the mock Swift implementation doesn't
+    # support that operation.
+    containers = (
+        swift.SWIFT_CONTAINER_PREFIX + str(container_num)
+        for container_num in range(final_container_num + 1)
+    )
+    pool = multiprocessing.pool.ThreadPool(SWIFT_LISTING_READAHEAD)
+    try:
+        listings = deque()
+        for container in islice(containers, SWIFT_LISTING_READAHEAD):
+            listings.append(
+                pool.apply_async(_list_swift_container, (container,))
             )
-            for obj, pool_index in objs:
-                if (obj["name"], pool_index) not in seen_names:
-                    yield (swift.connection_pools[pool_index], container, obj)
-                seen_names.add((obj["name"], pool_index))
+        while listings:
+            files = listings.popleft().get()
+            for container in islice(containers, 1):
+                listings.append(
+                    pool.apply_async(_list_swift_container, (container,))
+                )
+            yield from files
+    finally:
+        pool.terminate()
+        pool.join()
+
 
+def delete_unwanted_swift_files(con, wanted=None):
+    """Delete files found in Swift that have no corresponding db record.
 
-def delete_unwanted_swift_files(con):
-    """Delete files found in Swift that have no corresponding db record."""
+    :param wanted: A `ContentIdSet` of the LibraryFileContent ids in the
+        database.  If None, it is exported from the database first.
+    """
     assert getFeatureFlag("librarian.swift.enabled")
 
     log.info("Deleting unwanted files from Swift.")
 
-    # Get the largest LibraryFileContent id in the database. This lets
-    # us know when to stop looking in Swift for more files.
-    cur = con.cursor()
-    try:
-        cur.execute("SELECT max(id) FROM LibraryFileContent")
-        max_lfc_id = cur.fetchone()[0]
-    finally:
-        cur.close()
-
-    cur = con.cursor(name="librariangc_swift_lfcs")
-
-    # Calculate all stored LibraryFileContent ids that we want to keep.
-    # Results are ordered so we don't have to suck them all in at once.
-    cur.execute(
-        """
-        SELECT id FROM LibraryFileContent ORDER BY id
-        """
-    )
-    content_id_iter = iter(cur)
-
-    def get_next_wanted_content_id():
-        try:
-            result = next(content_id_iter)
-        except StopIteration:
-            return None
-        else:
-            return result[0]
+    if wanted is None:
+        wanted = get_wanted_content_ids(con)
+        close_wanted = True
+    else:
+        close_wanted = False
+    # The largest LibraryFileContent id in the database lets us know when
+    # to stop looking in Swift for more files.
+    found = ContentIdSet(wanted.max_id)
 
     removed_count = 0
-    content_id = next_wanted_content_id = -1
-
-    for connection_pool, container, obj in swift_files(max_lfc_id):
-        name = obj["name"]
+    try:
+        for connection_pool, container, obj in swift_files(wanted.max_id):
+            name = obj["name"]
 
-        # We may have a segment of a large file.
-        if "/" in name:
-            content_id = int(name.split("/", 1)[0])
-        else:
-            content_id = int(name)
-
-        while (
-            next_wanted_content_id is not None
-            and content_id > next_wanted_content_id
-        ):
-            next_wanted_content_id = get_next_wanted_content_id()
-
-            if (
-                config.librarian_server.upstream_host is None
-                and next_wanted_content_id is not None
-                and next_wanted_content_id < content_id
-                and not os.path.exists(get_file_path(next_wanted_content_id))
-            ):
-                log.error(
-                    "LibraryFileContent %d exists in the database but "
-                    "was not found on disk nor in Swift."
-                    % next_wanted_content_id
-                )
+            # We may have a segment of a large file.
+            if "/" in name:
+                content_id = int(name.split("/", 1)[0])
+            else:
+                content_id = int(name)
+            found.add(content_id)
 
-        file_wanted = (
-            next_wanted_content_id is not None
-            and next_wanted_content_id == content_id
-        )
+            if content_id in wanted:
+                continue
 
-        if not file_wanted:
             mod_time = iso8601.parse_date(obj["last_modified"])
             if mod_time > _utcnow() - timedelta(days=1):
                 log.debug3(
@@ -970,31 +1078,34 @@ def get_next_wanted_content_id():
                                 name,
                                 connection_pool.os_auth_url,
                             )
+                remove_cached_file(content_id)
                 removed_count += 1
 
-    if next_wanted_content_id == content_id:
-        next_wanted_content_id = get_next_wanted_content_id()
-    while next_wanted_content_id is not None:
-        # The entry exists in the database but not in Swift. This is
-        # normal, as there is lag between uploading files to disk and
-        # migrating them into Swift. The important case, where files
-        # are missing and exist neither on disk nor in Swift, is reported
-        # earlier. Still, we should catch if the librarian-feed-swift
-        # has not run recently. Report an error if the file is older
-        # than one week and doesn't exist in Swift.
-        path = get_file_path(next_wanted_content_id)
-        if (
-            config.librarian_server.upstream_host is None
-            and os.path.exists(path)
-            and (os.stat(path).st_ctime < time() - (7 * 24 * 60 * 60))
-        ):
-            log.error(
-                "LibraryFileContent {} exists in the database and disk "
-                "but was not found in Swift.".format(next_wanted_content_id)
-            )
-        next_wanted_content_id = get_next_wanted_content_id()
+        if config.librarian_server.upstream_host is None:
+            for content_id in wanted.difference(found):
+                # The entry exists in the database but not in Swift. This
+                # is normal, as there is lag between uploading files to
+                # disk and migrating them into Swift.  The important case
+                # is where files exist neither on disk nor in Swift.
+                # Still, we should catch if the librarian-feed-swift has
+                # not run recently. Report an error if the file is older
+                # than one week and doesn't exist in Swift.
+                path = get_file_path(content_id)
+                if not os.path.exists(path):
+                    log.error(
+                        "LibraryFileContent %d exists in the database but "
+                        "was not found on disk nor in Swift." % content_id
+                    )
+                elif os.stat(path).st_ctime < time() - (7 * 24 * 60 * 60):
+                    log.error(
+                        "LibraryFileContent {} exists in the database and "
+                        "disk but was not found in Swift.".format(content_id)
+                    )
+    finally:
+        found.close()
+        if close_wanted:
+            wanted.close()
 
-    cur.close()
     log.info(
         "Deleted {} files from Swift that were no longer referenced "
         "in the db.".format(removed_count)
@@ -1,10 +1,11 @@
-# Copyright 2009-2021 Canonical Ltd.  This software is licensed under the
+# Copyright 2009-2026 Canonical Ltd.  This software is licensed under the
 # GNU Affero General Public License version 3 (see the file LICENSE).
 
 import hashlib
 import os
 import shutil
 import tempfile
+from collections import OrderedDict
 
 from swiftclient import client as swiftclient
 from twisted.internet import defer
@@ -13,7 +14,7 @@
 from twisted.web.static import StaticProducer
 from zope.component import getUtility
 
-from lp.services.config import dbconfig
+from lp.services.config import config, dbconfig
 from lp.services.database import write_transaction
 from lp.services.database.interfaces import (
     DEFAULT_FLAVOR,
@@ -29,7 +30,10 @@
     "LibrarianStorage",
     "LibraryFileUpload",
     "DuplicateFileIDError",
+    "SwiftCache",
     "WrongDatabaseError",
+    "get_swift_cache",
+    "remove_cached_file",
     # _relFileLocation needed by other modules in this package.
     # Listed here to keep the import pedant happy
     "_relFileLocation",
@@ -109,6 +113,14 @@ def hasFile(self, fileid):
     @defer.inlineCallbacks
     def open(self, fileid):
         if getFeatureFlag("librarian.swift.enabled"):
+            # Serve hot files from the local cache rather than fetching
+            # them from Swift again.
+            cache = get_swift_cache()
+            if cache is not None:
+                cached_file = cache.open(fileid)
+                if cached_file is not None:
+                    return cached_file
+
             # Log our attempt.
             self.swift_download_attempts += 1
 
@@ -133,9 +145,12 @@ def open(self, fileid):
                         name,
                         resp_chunk_size=self.CHUNK_SIZE,
                     )
-                    return TxSwiftStream(
+                    stream = TxSwiftStream(
                         connection_pool, swift_connection, chunks
                     )
+                    if cache is not None:
+                        stream = cache.wrapStream(fileid, stream, headers)
+                    return stream
                 except swiftclient.ClientException as x:
                     if x.http_status == 404:
                         connection_pool.put(swift_connection)
@@ -156,6 +171,47 @@ def open(self, fileid):
         if os.path.exists(path):
             return open(path, "rb")
 
+    @defer.inlineCallbacks
+    def openRange(self, fileid, first, last):
+        """Open a byte range of a file.
+
+        :param first: The offset of the first byte to read.
+        :param last: The offset of the last byte to read.
+        :return: A Deferred that fires with a stream that reads from
+            `first` and that holds at least the bytes up to `last`, or with
+            None if the file isn't found.
+        """
+        if getFeatureFlag("librarian.swift.enabled"):
+            # Ask Swift for just the bytes we need.
+            container, name = swift.swift_location(fileid)
+            for connection_pool in reversed(swift.connection_pools):
+                swift_connection = connection_pool.get()
+                try:
+                    headers, chunks = yield deferToThread(
+                        swift.quiet_swiftclient,
+                        swift_connection.get_object,
+                        container,
+                        name,
+                        resp_chunk_size=self.CHUNK_SIZE,
+                        headers={"Range": "bytes=%d-%d" % (first, last)},
+                    )
+                    return TxSwiftStream(
+                        connection_pool, swift_connection, chunks
+                    )
+                except swiftclient.ClientException as x:
+                    if x.http_status == 404:
+                        connection_pool.put(swift_connection)
+                    else:
+                        log.err(x)
+                except Exception as x:
+                    log.err(x)
+
+        path = self._fileLocation(fileid)
+        if os.path.exists(path):
+            f = open(path, "rb")
+            f.seek(first)
+            return f
+
     def _fileLocation(self, fileid):
         return os.path.join(self.directory, _relFileLocation(str(fileid)))
 
@@ -196,6 +252,264 @@ def read(self, size):
         return return_chunk
 
 
+class SwiftCache:
+    """A bounded cache on local disk of files read from Swift.
+
+    Files are stored under their LibraryFileContent IDs, which always
+    refer to the same content, using the same layout as the librarian's
+    storage area.  When the cache grows beyond `max_size` bytes, the least
+    recently used files are evicted.
+
+    librarian-gc removes files from the cache directories of all librarian
+    processes when it deletes their content; a cache notices that on its
+    next lookup of the file.  Each librarian process needs its own cache
+    directory.
+    """
+
+    # Log metrics after this many lookups.
+    log_interval = 1000
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.incoming = os.path.join(self.directory, "incoming")
+        # File IDs and sizes, from least to most recently used.
+        self._entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self._load()
+
+    def _path(self, fileid):
+        return os.path.join(self.directory, _relFileLocation(fileid))
+
+    def _load(self):
+        """Index the files left in the cache by a previous process."""
+        # Partially-written files are of no use to us.
+        shutil.rmtree(self.incoming, ignore_errors=True)
+        os.makedirs(self.incoming)
+        found = []
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            if dirpath == self.directory:
+                dirnames.remove("incoming")
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                relpath = os.path.relpath(path, self.directory)
+                try:
+                    fileid = int("".join(relpath.split(os.sep)), 16)
+                except ValueError:
+                    continue
+                stat = os.stat(path)
+                found.append((stat.st_mtime, fileid, stat.st_size))
+        for _, fileid, size in sorted(found):
+            self._entries[fileid] = size
+            self.size += size
+        self._evict()
+
+    @property
+    def hit_ratio(self):
+        """The proportion of lookups that found their file in the cache."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def _recordLookup(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        if (self.hits + self.misses) % self.log_interval == 0:
+            log.msg(
+                "Swift cache: {} lookups, {:.1%} hit ratio, {} evictions "
+                "({} bytes), {} of {} bytes used".format(
+                    self.hits + self.misses,
+                    self.hit_ratio,
+                    self.evictions,
+                    self.evicted_bytes,
+                    self.size,
+                    self.max_size,
+                )
+            )
+
+    def _discard(self, fileid):
+        self.size -= self._entries.pop(fileid)
+
+    def _evict(self):
+        while self.size > self.max_size and self._entries:
+            fileid, size = self._entries.popitem(last=False)
+            self.size -= size
+            try:
+                os.unlink(self._path(fileid))
+            except FileNotFoundError:
+                pass
+            self.evictions += 1
+            self.evicted_bytes += size
+
+    def open(self, fileid):
+        """Open a cached file.
+
+        :return: A file object, or None if the file isn't in the cache.
+        """
+        if fileid in self._entries:
+            path = self._path(fileid)
+            try:
+                f = open(path, "rb")
+            except FileNotFoundError:
+                # librarian-gc deleted it.
+                self._discard(fileid)
+            else:
+                self._entries.move_to_end(fileid)
+                # Keep the order of use for the next process.
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+                self._recordLookup(True)
+                return f
+        self._recordLookup(False)
+        return None
+
+    def add(self, fileid, path, size):
+        """Move a complete file into the cache."""
+        target = self._path(fileid)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.rename(path, target)
+        if fileid in self._entries:
+            self._discard(fileid)
+        self._entries[fileid] = size
+        self.size += size
+        self._evict()
+
+    def wrapStream(self, fileid, stream, headers):
+        """Copy a stream from Swift into the cache as it is read.
+
+        :return: A stream that reads from `stream`, or `stream` itself if
+            its file can't be cached.
+        """
+        try:
+            size = int(headers["content-length"])
+        except (KeyError, ValueError):
+            return stream
+        if size > self.max_size:
+            return stream
+        try:
+            return CachingStream(self, fileid, stream, size)
+        except OSError as e:
+            log.err(e)
+            return stream
+
+
+class CachingStream:
+    """A stream from Swift that copies what is read into a `SwiftCache`.
+
+    The copy is only added to the cache once the whole file has been read;
+    closing the stream early discards it.
+    """
+
+    def __init__(self, cache, fileid, stream, size):
+        self._cache = cache
+        self._fileid = fileid
+        self._stream = stream
+        self._size = size
+        self._written = 0
+        fd, self._tmppath = tempfile.mkstemp(dir=cache.incoming)
+        self._tmpfile = os.fdopen(fd, "wb")
+
+    @property
+    def closed(self):
+        return self._stream.closed
+
+    @defer.inlineCallbacks
+    def read(self, size):
+        data = yield self._stream.read(size)
+        if self._tmpfile is not None and size:
+            if data:
+                try:
+                    self._tmpfile.write(data)
+                    self._written += len(data)
+                except OSError as e:
+                    log.err(e)
+                    self._discard()
+            else:
+                self._store()
+        return data
+
+    def _store(self):
+        tmpfile, self._tmpfile = self._tmpfile, None
+        try:
+            tmpfile.close()
+            if self._written == self._size:
+                self._cache.add(self._fileid, self._tmppath, self._size)
+                return
+        except OSError as e:
+            log.err(e)
+        try:
+            os.unlink(self._tmppath)
+        except OSError:
+            pass
+
+    def _discard(self):
+        tmpfile, self._tmpfile = self._tmpfile, None
+        if tmpfile is not None:
+            tmpfile.close()
+            try:
+                os.unlink(self._tmppath)
+            except OSError:
+                pass
+
+    def close(self):
+        self._discard()
+        self._stream.close()
+
+
+_swift_cache = None
+
+
+def get_swift_cache():
+    """Return this process's `SwiftCache`, or None if it is disabled."""
+    global _swift_cache
+    directory = config.librarian_server.swift_cache_directory
+    max_size = config.librarian_server.swift_cache_size
+    if not directory or not max_size:
+        return None
+    if _swift_cache is None or (
+        _swift_cache.directory,
+        _swift_cache.max_size,
+    ) != (directory, max_size):
+        _swift_cache = SwiftCache(directory, max_size)
+    return _swift_cache
+
+
+def get_swift_cache_directories():
+    """Return the Swift cache directories that librarian-gc cleans up."""
+    directories = []
+    if config.librarian_server.swift_cache_directory:
+        directories.append(config.librarian_server.swift_cache_directory)
+    other_directories = config.librarian_gc.swift_cache_directories
+    if other_directories:
+        for directory in other_directories.split(","):
+            directory = directory.strip()
+            if directory and directory not in directories:
+                directories.append(directory)
+    return directories
+
+
+def remove_cached_file(fileid):
+    """Remove a file from all the Swift cache directories it is in.
+
+    :return: True if the file was removed from any of them.
+    """
+    removed = False
+    for directory in get_swift_cache_directories():
+        try:
+            os.unlink(os.path.join(directory, _relFileLocation(fileid)))
+        except FileNotFoundError:
+            continue
+        removed = True
+    return removed
+
+
 class LibraryFileUpload:
     """A file upload from a client."""
 
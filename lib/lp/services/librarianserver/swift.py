@@ -15,12 +15,15 @@
 ]
 
 import hashlib
+import multiprocessing.pool
 import os.path
 import re
+import threading
 import time
 from contextlib import contextmanager
 from urllib.parse import quote
 
+import transaction
 from swiftclient import client as swiftclient
 
 from lp.services.config import config
@@ -29,6 +32,10 @@
 
 SWIFT_CONTAINER_PREFIX = "librarian_"
 MAX_SWIFT_OBJECT_SIZE = 5 * 1024**3  # 5GB Swift limit.
+# The number of LibraryFileContent IDs in each shard migrated by
+# `to_swift`.  This must divide 0x10000, the number of IDs stored in each
+# directory two levels below the root.
+SHARD_SIZE = 0x10000
 
 ONE_DAY = 24 * 60 * 60
 
@@ -58,6 +65,9 @@ def to_swift(
     instance_id=None,
     num_instances=None,
     remove_func=False,
+    num_workers=1,
+    checkpoint_path=None,
+    max_bytes_per_second=None,
 ):
     """Copy a range of Librarian files from disk into Swift.
 
@@ -70,8 +80,18 @@ def to_swift(
 
     If remove_func is set, it is called for every file after being copied into
     Swift.
+
+    The range is split into shards of `SHARD_SIZE` IDs, which are migrated
+    by num_workers threads in parallel.
+
+    If checkpoint_path is set, the start of the first shard that has not
+    been completely migrated is recorded in that file, and a later call
+    resumes from there.  The file is removed once the whole range has been
+    migrated.
+
+    If max_bytes_per_second is set, uploads by all workers together are
+    throttled to that rate.
     """
-    swift_connection = connection_pools[-1].get()
     fs_root = os.path.abspath(config.librarian_server.root)
 
     if start_lfc_id is None:
@@ -80,6 +100,17 @@ def to_swift(
         # Maximum id capable of being stored on the filesystem - ffffffff
         end_lfc_id = 0xFFFFFFFF
 
+    if checkpoint_path is not None:
+        try:
+            with open(checkpoint_path) as checkpoint:
+                checkpoint_lfc_id = int(checkpoint.read())
+        except FileNotFoundError:
+            pass
+        else:
+            if checkpoint_lfc_id > start_lfc_id:
+                log.info(f"Resuming from checkpoint at {checkpoint_lfc_id}")
+                start_lfc_id = checkpoint_lfc_id
+
     log.info(
         "Walking disk store {} from {} to {}, inclusive".format(
             fs_root, start_lfc_id, end_lfc_id
@@ -92,13 +123,102 @@ def to_swift(
             )
         )
 
+    throttle = None
+    if max_bytes_per_second:
+        throttle = Throttle(max_bytes_per_second)
+
+    # Shards are aligned so that each one is stored within a single
+    # directory two levels below the root.
+    shards = (
+        (
+            max(shard_start, start_lfc_id),
+            min(shard_start + SHARD_SIZE - 1, end_lfc_id),
+        )
+        for shard_start in range(
+            start_lfc_id - start_lfc_id % SHARD_SIZE,
+            end_lfc_id + 1,
+            SHARD_SIZE,
+        )
+    )
+    connection_pool = connection_pools[-1]
+
+    def migrate_shard(shard):
+        try:
+            swift_connection = connection_pool.get()
+            _to_swift_shard(
+                log,
+                swift_connection,
+                fs_root,
+                shard[0],
+                shard[1],
+                instance_id=instance_id,
+                num_instances=num_instances,
+                remove_func=remove_func,
+                throttle=throttle,
+            )
+            connection_pool.put(swift_connection)
+        finally:
+            if num_workers > 1:
+                # Don't leave this thread's transaction open.
+                transaction.abort()
+        return shard
+
+    if num_workers > 1:
+        log.info(f"Migrating with {num_workers} workers")
+        pool = multiprocessing.pool.ThreadPool(num_workers)
+        migrated_shards = pool.imap(migrate_shard, shards)
+    else:
+        pool = None
+        migrated_shards = map(migrate_shard, shards)
+    try:
+        # Shards are yielded in order, so everything before the next one
+        # has been migrated.
+        for _, shard_end in migrated_shards:
+            if checkpoint_path is not None:
+                _write_checkpoint(checkpoint_path, shard_end + 1)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    if checkpoint_path is not None:
+        os.unlink(checkpoint_path)
+
+
+def _write_checkpoint(checkpoint_path, lfc_id):
+    """Atomically record the first LibraryFileContent.id to migrate."""
+    new_path = checkpoint_path + ".new"
+    with open(new_path, "w") as checkpoint:
+        checkpoint.write(f"{lfc_id}\n")
+    os.replace(new_path, checkpoint_path)
+
+
+def _to_swift_shard(
+    log,
+    swift_connection,
+    fs_root,
+    start_lfc_id,
+    end_lfc_id,
+    instance_id=None,
+    num_instances=None,
+    remove_func=False,
+    throttle=None,
+):
+    """Copy a shard of Librarian files from disk into Swift.
+
+    The shard must be stored within a single directory two levels below
+    fs_root.
+    """
     start_fs_path = filesystem_path(start_lfc_id)
     end_fs_path = filesystem_path(end_lfc_id)
+    shard_root = os.path.dirname(os.path.dirname(start_fs_path))
+    if not os.path.isdir(shard_root):
+        return
 
     # Walk the Librarian on disk file store, searching for matching
     # files that may need to be copied into Swift. We need to follow
     # symlinks as they are being used span disk partitions.
-    for dirpath, dirnames, filenames in os.walk(fs_root, followlinks=True):
+    for dirpath, dirnames, filenames in os.walk(shard_root, followlinks=True):
         # Don't recurse if we know this directory contains no matching
         # files.
         if (
@@ -161,15 +281,15 @@ def to_swift(
                 log.info(f"{lfc} exists on disk but not in the db")
                 continue
 
-            _to_swift_file(log, swift_connection, lfc, fs_path)
+            _to_swift_file(
+                log, swift_connection, lfc, fs_path, throttle=throttle
+            )
 
             if remove_func:
                 remove_func(fs_path)
 
-    connection_pools[-1].put(swift_connection)
-
 
-def _to_swift_file(log, swift_connection, lfc_id, fs_path):
+def _to_swift_file(log, swift_connection, lfc_id, fs_path, throttle=None):
     """Copy a single file into Swift.
 
     This is separate for the benefit of tests; production code should use
@@ -213,7 +333,15 @@ def _to_swift_file(log, swift_connection, lfc_id, fs_path):
                 lfc_id, container, obj_name
             )
         )
-        _put(log, swift_connection, lfc_id, container, obj_name, fs_path)
+        _put(
+            log,
+            swift_connection,
+            lfc_id,
+            container,
+            obj_name,
+            fs_path,
+            throttle=throttle,
+        )
 
 
 def rename(path):
@@ -223,9 +351,14 @@ def rename(path):
     os.rename(path, path + ".migrated")
 
 
-def _put(log, swift_connection, lfc_id, container, obj_name, fs_path):
+def _put(
+    log, swift_connection, lfc_id, container, obj_name, fs_path, throttle=None
+):
     fs_size = os.path.getsize(fs_path)
-    fs_file = HashStream(open(fs_path, "rb"))
+    fs_file = open(fs_path, "rb")
+    if throttle is not None:
+        fs_file = ThrottledStream(fs_file, throttle)
+    fs_file = HashStream(fs_file)
 
     db_md5_hash = (
         IStandbyStore(LibraryFileContent).get(LibraryFileContent, lfc_id).md5
@@ -416,6 +549,45 @@ def seek(self, offset):
         return self._stream.seek(offset)
 
 
+class Throttle:
+    """Limit the combined rate at which several threads transfer data."""
+
+    def __init__(self, max_bytes_per_second):
+        self.max_bytes_per_second = max_bytes_per_second
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._transferred = 0
+
+    def __call__(self, size):
+        """Account for transferring size bytes, sleeping if necessary."""
+        with self._lock:
+            self._transferred += size
+            delay = self._transferred / self.max_bytes_per_second - (
+                time.monotonic() - self._start
+            )
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ThrottledStream:
+    """Read a file no faster than a `Throttle` allows."""
+
+    def __init__(self, stream, throttle):
+        self._stream = stream
+        self._throttle = throttle
+
+    def read(self, size=-1):
+        chunk = self._stream.read(size)
+        self._throttle(len(chunk))
+        return chunk
+
+    def tell(self):
+        return self._stream.tell()
+
+    def seek(self, offset):
+        return self._stream.seek(offset)
+
+
 class ConnectionPool:
     MAX_POOL_SIZE = 10
 
@@ -92,6 +92,17 @@ def addFile(self, name, size, file, contentType, expires=None):
             name, size, file, contentType, expires=expires
         ).id
 
+    def addFiles(
+        self, files, expires=None, allow_zero_length=False, max_workers=1
+    ):
+        """See `IFileUploadClient`."""
+        return [
+            alias.id
+            for alias in self.createMany(
+                files, allow_zero_length=allow_zero_length
+            )
+        ]
+
     def _storeFile(self, name, size, file, contentType, expires=None):
         """Like `addFile`, but returns the `LibraryFileAlias`."""
         content = file.read()
@@ -179,6 +190,16 @@ def create(
         "See `ILibraryFileAliasSet`." ""
         return self._storeFile(name, size, file, contentType, expires=expires)
 
+    def createMany(
+        self, files, restricted=False, allow_zero_length=False, max_workers=1
+    ):
+        "See `ILibraryFileAliasSet`." ""
+        aliases = []
+        for name, size, open_file, contentType, _ in files:
+            with open_file() as file:
+                aliases.append(self._storeFile(name, size, file, contentType))
+        return aliases
+
     def __getitem__(self, key):
         "See `ILibraryFileAliasSet`." ""
         alias = self.aliases.get(key)
@@ -32,11 +32,14 @@
 from lp.services.librarian.client import LibrarianClient
 from lp.services.librarian.model import LibraryFileAlias, LibraryFileContent
 from lp.services.librarianserver import librariangc, swift
+from lp.services.librarianserver.storage import (
+    _relFileLocation as relative_file_path,
+)
 from lp.services.log.logger import BufferLogger
 from lp.services.utils import utc_now
 from lp.testing import TestCase, monkey_patch
 from lp.testing.dbuser import switch_dbuser
-from lp.testing.layers import LaunchpadZopelessLayer
+from lp.testing.layers import BaseLayer, LaunchpadZopelessLayer
 from lp.testing.swift.fixture import SwiftFixture
 
 
@@ -607,6 +610,33 @@ def test_confirm_no_clock_skew(self):
             )
 
 
+class TestContentIdSet(TestCase):
+    layer = BaseLayer
+
+    def test_membership(self):
+        ids = librariangc.ContentIdSet(100)
+        self.addCleanup(ids.close)
+        for content_id in (0, 7, 8, 100, 101):
+            ids.add(content_id)
+        self.assertEqual(
+            [0, 7, 8, 100],
+            [content_id for content_id in range(-1, 102) if content_id in ids],
+        )
+
+    def test_difference(self):
+        # The difference of two sets is generated in order, even if the
+        # other set is smaller.
+        wanted = librariangc.ContentIdSet(100000)
+        self.addCleanup(wanted.close)
+        found = librariangc.ContentIdSet(50)
+        self.addCleanup(found.close)
+        for content_id in (1, 2, 40, 99999, 100000):
+            wanted.add(content_id)
+        for content_id in (2, 3, 40):
+            found.add(content_id)
+        self.assertEqual([1, 99999, 100000], list(wanted.difference(found)))
+
+
 class TestDiskLibrarianGarbageCollection(
     TestLibrarianGarbageCollectionBase, TestCase
 ):
@@ -659,6 +689,19 @@ def test_delete_unwanted_files_handles_migrated(self):
         self.assertFalse(os.path.exists(path_aborted + ".migrated"))
         self.assertTrue(os.path.exists(path_committed + ".migrated"))
 
+    def test_delete_unwanted_files_reports_missing(self):
+        # Files that the database wants but that are not on disk are
+        # reported.
+        content_id = self.store.get(LibraryFileAlias, self.f1_id).content_id
+        self.ztm.abort()
+        self.remove_file(content_id)
+        librariangc.delete_unwanted_files(self.con)
+        self.assertIn(
+            "ERROR LibraryFileContent %d exists in the database but was not "
+            "found on disk." % content_id,
+            librariangc.log.getLogBuffer(),
+        )
+
     def test_deleteUnwantedFilesIgnoresNoise(self):
         # Directories with invalid names in the storage area are
         # ignored. They are reported as warnings though.
@@ -807,6 +850,37 @@ def test_DeleteUnreferencedContent_handles_timeout(self):
             ),
         )
 
+    def test_DeleteUnreferencedContent_removes_cached_file(self):
+        # Deleting unreferenced content also removes it from the
+        # librarian's Swift cache.
+        cache_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_directory)
+        self.pushConfig(
+            "librarian_server", swift_cache_directory=cache_directory
+        )
+        content_ids = [
+            self.store.get(LibraryFileAlias, alias_id).content_id
+            for alias_id in (self.f1_id, self.f2_id)
+        ]
+        self.ztm.abort()
+        cached_paths = [
+            os.path.join(cache_directory, relative_file_path(content_id))
+            for content_id in content_ids
+        ]
+        for path in cached_paths:
+            os.makedirs(os.path.dirname(path))
+            with open(path, "wb") as f:
+                f.write(b"This is some content")
+
+        # Merging the duplicates leaves one LibraryFileContent
+        # unreferenced, which is then deleted.
+        librariangc.merge_duplicates(self.con)
+        librariangc.delete_unreferenced_content(self.con)
+
+        self.assertEqual(
+            1, len([path for path in cached_paths if os.path.exists(path)])
+        )
+
     def test_delete_unwanted_files_handles_segments(self):
         # Large files are handled by Swift as multiple segments joined
         # by a manifest. GC treats the segments like the original file.
@@ -2,6 +2,7 @@
 # GNU Affero General Public License version 3 (see the file LICENSE).
 
 import hashlib
+import io
 import os.path
 
 import transaction
@@ -20,6 +21,10 @@
     DuplicateFileIDError,
     LibrarianStorage,
     LibraryFileUpload,
+    SwiftCache,
+    get_swift_cache,
+    get_swift_cache_directories,
+    remove_cached_file,
 )
 from lp.services.log.logger import DevNullLogger
 from lp.testing import TestCase
@@ -314,3 +319,156 @@ def test_multiple_swift_instances(self):
                 break
             chunks.append(chunk)
         self.assertEqual(b"".join(chunks), new_data)
+
+
+class LibrarianStorageSwiftCacheTests(TestCase):
+    layer = LaunchpadZopelessLayer
+    run_tests_with = AsynchronousDeferredRunTest.make_factory(timeout=30)
+
+    def setUp(self):
+        super().setUp()
+        switch_dbuser("librarian")
+        self.swift_fixture = self.useFixture(SwiftFixture())
+        self.useFixture(FeatureFixture({"librarian.swift.enabled": True}))
+        self.directory = self.useFixture(TempDir()).path
+        self.cache_directory = self.useFixture(TempDir()).path
+        self.pushConfig(
+            "librarian_server",
+            root=self.directory,
+            swift_cache_directory=self.cache_directory,
+            swift_cache_size=LibrarianStorage.CHUNK_SIZE * 10,
+        )
+        self.storage = LibrarianStorage(self.directory, db.Library())
+        transaction.commit()
+
+    def addSwiftFile(self, data):
+        # Add a file that can only be retrieved from Swift.
+        newfile = self.storage.startAddFile("file", len(data))
+        newfile.mimetype = "text/plain"
+        newfile.append(data)
+        lfc_id, _ = newfile.store()
+        path = swift.filesystem_path(lfc_id)
+        swift_connection = self.swift_fixture.connect()
+        try:
+            swift._to_swift_file(
+                DevNullLogger(), swift_connection, lfc_id, path
+            )
+        finally:
+            swift_connection.close()
+        os.unlink(path)
+        return lfc_id
+
+    @defer.inlineCallbacks
+    def readAll(self, stream):
+        chunks = []
+        while True:
+            chunk = yield stream.read(self.storage.CHUNK_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        stream.close()
+        return b"".join(chunks)
+
+    @defer.inlineCallbacks
+    def test_cache_populated_by_complete_read(self):
+        # Once a file has been read in full from Swift, it is served from
+        # the cache.
+        data = b"x" * (self.storage.CHUNK_SIZE * 2 + 1)
+        lfc_id = self.addSwiftFile(data)
+        stream = yield self.storage.open(lfc_id)
+        self.assertNotIsInstance(stream, io.IOBase)
+        self.assertEqual(data, (yield self.readAll(stream)))
+        cached = yield self.storage.open(lfc_id)
+        self.assertIsInstance(cached, io.IOBase)
+        with cached:
+            self.assertEqual(data, cached.read())
+        cache = get_swift_cache()
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+        self.assertEqual(0.5, cache.hit_ratio)
+        self.assertEqual(len(data), cache.size)
+
+    @defer.inlineCallbacks
+    def test_cache_not_populated_by_partial_read(self):
+        # A file that is only partly read isn't cached.
+        data = b"x" * (self.storage.CHUNK_SIZE * 2 + 1)
+        lfc_id = self.addSwiftFile(data)
+        stream = yield self.storage.open(lfc_id)
+        yield stream.read(self.storage.CHUNK_SIZE)
+        stream.close()
+        stream = yield self.storage.open(lfc_id)
+        self.assertNotIsInstance(stream, io.IOBase)
+        stream.close()
+        cache = get_swift_cache()
+        self.assertEqual((0, 2), (cache.hits, cache.misses))
+        self.assertEqual(0, cache.size)
+        self.assertEqual([], os.listdir(cache.incoming))
+
+    @defer.inlineCallbacks
+    def test_cache_evicts_least_recently_used(self):
+        # When the cache is full, the least recently used files are
+        # evicted.
+        data = b"x" * (self.storage.CHUNK_SIZE * 4)
+        lfc_ids = [self.addSwiftFile(data) for _ in range(3)]
+        for lfc_id in lfc_ids[:2]:
+            yield self.readAll((yield self.storage.open(lfc_id)))
+        (yield self.storage.open(lfc_ids[0])).close()
+        yield self.readAll((yield self.storage.open(lfc_ids[2])))
+        cache = get_swift_cache()
+        self.assertEqual(1, cache.evictions)
+        self.assertEqual(len(data), cache.evicted_bytes)
+        self.assertEqual(len(data) * 2, cache.size)
+        for lfc_id, cached in zip(lfc_ids, (True, False, True)):
+            stream = yield self.storage.open(lfc_id)
+            self.assertEqual(cached, isinstance(stream, io.IOBase))
+            stream.close()
+
+    @defer.inlineCallbacks
+    def test_cache_notices_removed_file(self):
+        # If librarian-gc removes a cached file, the cache forgets it.
+        data = b"x" * self.storage.CHUNK_SIZE
+        lfc_id = self.addSwiftFile(data)
+        yield self.readAll((yield self.storage.open(lfc_id)))
+        self.assertTrue(remove_cached_file(lfc_id))
+        self.assertFalse(remove_cached_file(lfc_id))
+        stream = yield self.storage.open(lfc_id)
+        self.assertNotIsInstance(stream, io.IOBase)
+        stream.close()
+        self.assertEqual(0, get_swift_cache().size)
+
+    @defer.inlineCallbacks
+    def test_remove_cached_file_from_other_caches(self):
+        # librarian-gc also removes files from the caches of the other
+        # librarian processes that it is configured with.
+        other_directory = self.useFixture(TempDir()).path
+        self.pushConfig(
+            "librarian_gc",
+            swift_cache_directories="%s, %s"
+            % (self.cache_directory, other_directory),
+        )
+        data = b"x" * self.storage.CHUNK_SIZE
+        lfc_id = self.addSwiftFile(data)
+        yield self.readAll((yield self.storage.open(lfc_id)))
+        other_cache = SwiftCache(other_directory, len(data))
+        other_path = os.path.join(other_directory, "incoming", "file")
+        with open(other_path, "wb") as f:
+            f.write(data)
+        other_cache.add(lfc_id, other_path, len(data))
+        self.assertEqual(
+            [self.cache_directory, other_directory],
+            get_swift_cache_directories(),
+        )
+        self.assertTrue(remove_cached_file(lfc_id))
+        self.assertIsNone(get_swift_cache().open(lfc_id))
+        self.assertIsNone(other_cache.open(lfc_id))
+        self.assertFalse(remove_cached_file(lfc_id))
+
+    @defer.inlineCallbacks
+    def test_cache_survives_restart(self):
+        # A new cache indexes the files left by its predecessor.
+        data = b"x" * self.storage.CHUNK_SIZE
+        lfc_id = self.addSwiftFile(data)
+        yield self.readAll((yield self.storage.open(lfc_id)))
+        cache = SwiftCache(self.cache_directory, self.storage.CHUNK_SIZE * 10)
+        self.assertEqual(len(data), cache.size)
+        with cache.open(lfc_id) as cached:
+            self.assertEqual(data, cached.read())
@@ -7,10 +7,13 @@
 import io
 import os.path
 import time
-from unittest.mock import patch
+from unittest.mock import call, patch
 
+import requests
 import transaction
+from fixtures import TempDir
 from swiftclient import client as swiftclient
+from testtools.matchers import StartsWith
 
 from lp.services.database import write_transaction
 from lp.services.database.interfaces import IStore
@@ -287,6 +290,34 @@ def test_largish_binary_files_from_swift_offset(self):
         self.assertFalse(os.path.exists(swift.filesystem_path(lfc.id)))
         self.assertEqual(expected_content, lfa.read())
 
+    def test_librarian_serves_ranges_from_swift(self):
+        # Ranges of files in Swift are fetched from Swift with ranged
+        # requests.
+        content = bytes(range(256)) * 4
+        lfa_id = self.add_file("ranged", content)
+        swift.to_swift(BufferLogger(), remove_func=os.unlink)
+        url = self.librarian_client.getURLForAlias(lfa_id)
+
+        response = requests.get(url, headers={"Range": "bytes=10-19"})
+        self.assertEqual(206, response.status_code)
+        self.assertEqual("bytes", response.headers["Accept-Ranges"])
+        self.assertEqual("bytes 10-19/1024", response.headers["Content-Range"])
+        self.assertEqual(content[10:20], response.content)
+
+        response = requests.get(url, headers={"Range": "bytes=0-3,-4"})
+        self.assertEqual(206, response.status_code)
+        self.assertThat(
+            response.headers["Content-Type"],
+            StartsWith("multipart/byteranges; boundary="),
+        )
+        self.assertEqual(
+            int(response.headers["Content-Length"]), len(response.content)
+        )
+        self.assertIn(b"Content-Range: bytes 0-3/1024", response.content)
+        self.assertIn(content[:4], response.content)
+        self.assertIn(b"Content-Range: bytes 1020-1023/1024", response.content)
+        self.assertIn(content[-4:], response.content)
+
     def test_large_file_to_swift(self):
         # Generate a blob large enough that Swift requires us to store
         # it as multiple objects plus a manifest.
@@ -434,6 +465,78 @@ def remove_this_and_others(path):
         finally:
             swift_client.close()
 
+    def test_multiple_workers(self):
+        # Files can be migrated by several workers, each handling shards of
+        # content IDs.
+        self.patch(swift, "SHARD_SIZE", 2)
+        swift.to_swift(
+            BufferLogger(),
+            end_lfc_id=max(lfc.id for lfc in self.lfcs),
+            remove_func=os.unlink,
+            num_workers=3,
+        )
+
+        # Confirm that all the files have gone from disk and are in Swift.
+        swift_client = self.swift_fixture.connect()
+        try:
+            for lfc, contents in zip(self.lfcs, self.contents):
+                self.assertFalse(os.path.exists(swift.filesystem_path(lfc.id)))
+                container, name = swift.swift_location(lfc.id)
+                headers, obj = swift_client.get_object(container, name)
+                self.assertEqual(contents, obj, "Did not round trip")
+        finally:
+            swift_client.close()
+
+    def test_checkpoint(self):
+        # An interrupted migration records its progress in a checkpoint,
+        # and the next migration resumes from there.
+        self.patch(swift, "SHARD_SIZE", 1)
+        checkpoint_path = os.path.join(
+            self.useFixture(TempDir()).path, "checkpoint"
+        )
+        end_lfc_id = max(lfc.id for lfc in self.lfcs)
+        failing_lfc_id = self.lfcs[2].id
+        real_to_swift_file = swift._to_swift_file
+
+        def to_swift_file(log, swift_connection, lfc_id, *args, **kwargs):
+            if lfc_id == failing_lfc_id:
+                raise swiftclient.ClientException("Interrupted")
+            return real_to_swift_file(
+                log, swift_connection, lfc_id, *args, **kwargs
+            )
+
+        log = BufferLogger()
+        with patch.object(swift, "_to_swift_file", to_swift_file):
+            self.assertRaises(
+                swiftclient.ClientException,
+                swift.to_swift,
+                log,
+                end_lfc_id=end_lfc_id,
+                remove_func=os.unlink,
+                checkpoint_path=checkpoint_path,
+            )
+        with open(checkpoint_path) as checkpoint:
+            self.assertEqual(failing_lfc_id, int(checkpoint.read()))
+        for i, lfc in enumerate(self.lfcs):
+            self.assertEqual(
+                i >= 2, os.path.exists(swift.filesystem_path(lfc.id))
+            )
+
+        swift.to_swift(
+            log,
+            end_lfc_id=end_lfc_id,
+            remove_func=os.unlink,
+            checkpoint_path=checkpoint_path,
+        )
+        self.assertIn(
+            "Resuming from checkpoint at %d" % failing_lfc_id,
+            log.getLogBuffer(),
+        )
+        for lfc in self.lfcs:
+            self.assertFalse(os.path.exists(swift.filesystem_path(lfc.id)))
+        # The checkpoint is removed once the migration is complete.
+        self.assertFalse(os.path.exists(checkpoint_path))
+
     def test_swift_timeout(self):
         # The librarian's Swift connections honour the configured timeout.
         self.pushConfig(
@@ -448,6 +551,32 @@ def test_swift_timeout(self):
         )
 
 
+class TestThrottle(TestCase):
+    layer = BaseLayer
+
+    def test_throttle(self):
+        # A throttle sleeps for long enough to keep the total amount
+        # transferred within its rate.
+        with patch.object(swift.time, "monotonic", return_value=10.0):
+            with patch.object(swift.time, "sleep") as mock_sleep:
+                throttle = swift.Throttle(100)
+                throttle(50)
+                throttle(50)
+        self.assertEqual([call(0.5), call(1.0)], mock_sleep.call_args_list)
+
+    def test_throttled_stream(self):
+        # A throttled stream accounts for everything read from it.
+        sizes = []
+        s = swift.ThrottledStream(
+            io.BytesIO(b"make me a coffee"), sizes.append
+        )
+        self.assertEqual(b"make", s.read(4))
+        self.assertEqual(b" me a coffee", s.read())
+        self.assertEqual([4, 12], sizes)
+        s.seek(5)
+        self.assertEqual(5, s.tell())
+
+
 class TestHashStream(TestCase):
     layer = BaseLayer
 
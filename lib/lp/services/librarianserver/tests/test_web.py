@@ -1,6 +1,7 @@
 # Copyright 2009-2018 Canonical Ltd.  This software is licensed under the
 # GNU Affero General Public License version 3 (see the file LICENSE).
 
+import email
 import hashlib
 import http.client
 import os
@@ -14,7 +15,7 @@
 import transaction
 from lazr.uri import URI
 from storm.expr import SQL
-from testtools.matchers import EndsWith
+from testtools.matchers import EndsWith, StartsWith
 from zope.component import getUtility
 from zope.security.proxy import removeSecurityProxy
 
@@ -312,6 +313,101 @@ def test_headers(self):
         # And we should have a correct Last-Modified header too.
         self.assertEqual(last_modified_header, "Tue, 30 Jan 2001 13:45:59 GMT")
 
+    def makeRangeTestFile(self):
+        client = LibrarianClient()
+        sample_data = b"0123456789"
+        file_alias_id = client.addFile(
+            "sample",
+            len(sample_data),
+            BytesIO(sample_data),
+            contentType="text/plain",
+        )
+        self.commit()
+        return client.getURLForAlias(file_alias_id)
+
+    def test_range(self):
+        # Files on disk can be fetched in parts.
+        url = self.makeRangeTestFile()
+        response = requests.get(url)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("bytes", response.headers["Accept-Ranges"])
+        for range_header, content_range, content in (
+            ("bytes=2-5", "bytes 2-5/10", b"2345"),
+            ("bytes=7-", "bytes 7-9/10", b"789"),
+            ("bytes=8-100", "bytes 8-9/10", b"89"),
+            ("bytes=-3", "bytes 7-9/10", b"789"),
+        ):
+            response = requests.get(url, headers={"Range": range_header})
+            self.assertEqual(206, response.status_code)
+            self.assertEqual(content_range, response.headers["Content-Range"])
+            self.assertEqual(
+                str(len(content)), response.headers["Content-Length"]
+            )
+            self.assertEqual(content, response.content)
+
+    def test_multiple_ranges(self):
+        # Several ranges can be fetched at once, as a multipart response.
+        url = self.makeRangeTestFile()
+        response = requests.get(url, headers={"Range": "bytes=0-1,5-6,20-"})
+        self.assertEqual(206, response.status_code)
+        content_type = response.headers["Content-Type"]
+        self.assertThat(
+            content_type, StartsWith("multipart/byteranges; boundary=")
+        )
+        self.assertEqual(
+            int(response.headers["Content-Length"]), len(response.content)
+        )
+        message = email.message_from_bytes(
+            b"Content-Type: %s\r\n\r\n%s"
+            % (content_type.encode("ASCII"), response.content)
+        )
+        # The unsatisfiable range is left out.
+        self.assertEqual(
+            [
+                ("bytes 0-1/10", b"01"),
+                ("bytes 5-6/10", b"56"),
+            ],
+            [
+                (part["Content-Range"], part.get_payload(decode=True))
+                for part in message.get_payload()
+            ],
+        )
+
+    def test_range_not_satisfiable(self):
+        # Ranges that start beyond the end of the file can't be satisfied.
+        url = self.makeRangeTestFile()
+        response = requests.get(url, headers={"Range": "bytes=10-"})
+        self.assertEqual(416, response.status_code)
+        self.assertEqual("bytes */10", response.headers["Content-Range"])
+
+    def test_range_ignored(self):
+        # Invalid ranges are ignored, and the whole file is sent.
+        url = self.makeRangeTestFile()
+        for range_header in ("bytes=5-2", "lines=1-2", "bytes=1"):
+            response = requests.get(url, headers={"Range": range_header})
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(b"0123456789", response.content)
+
+    def test_if_range(self):
+        # A range is only sent if If-Range matches the file's
+        # Last-Modified date.
+        url = self.makeRangeTestFile()
+        last_modified = requests.head(url).headers["Last-Modified"]
+        response = requests.get(
+            url, headers={"Range": "bytes=2-5", "If-Range": last_modified}
+        )
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(b"2345", response.content)
+        response = requests.get(
+            url,
+            headers={
+                "Range": "bytes=2-5",
+                "If-Range": "Tue, 30 Jan 2001 13:45:59 GMT",
+            },
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(b"0123456789", response.content)
+
     def test_missing_storage(self):
         # When a file exists in the DB but is missing from disk, a 404
         # is just confusing. It's an internal error, so 500 instead.
@@ -1,8 +1,11 @@
-# Copyright 2009-2023 Canonical Ltd.  This software is licensed under the
+# Copyright 2009-2026 Canonical Ltd.  This software is licensed under the
 # GNU Affero General Public License version 3 (see the file LICENSE).
 
+import io
 import time
+import uuid
 from datetime import datetime
+from functools import partial
 from urllib.parse import urlparse
 
 import six
@@ -44,6 +47,10 @@ class NotFound(Exception):
     pass
 
 
+class UnsatisfiableRange(Exception):
+    """None of the requested byte ranges overlap the file."""
+
+
 class LibraryFileResource(resource.Resource):
     def __init__(self, storage, upstreamHost, upstreamPort):
         resource.Resource.__init__(self)
@@ -178,7 +185,14 @@ def _cb_getFileAlias(self, results, filename, request):
             # XXX: Brad Crittenden 2007-12-05 bug=174204: When encodings are
             # stored as part of a file's metadata this logic will be replaced.
             encoding, mimetype = guess_librarian_encoding(dbfilename, mimetype)
-            file = File(mimetype, encoding, date_created, stream, size)
+            file = File(
+                mimetype,
+                encoding,
+                date_created,
+                stream,
+                size,
+                open_range=partial(self.storage.openRange, dbcontentID),
+            )
             # Set our caching headers. Public Librarian files can be
             # cached forever, while private ones mustn't be at all.
             request.setHeader(
@@ -206,7 +220,30 @@ def render_GET(self, request):
 class File(resource.Resource):
     isLeaf = True
 
-    def __init__(self, contentType, encoding, modification_time, stream, size):
+    # Requests for more byte ranges than this are answered with the whole
+    # file, since serving many small ranges is inefficient and can be
+    # abused.
+    max_ranges = 64
+
+    def __init__(
+        self,
+        contentType,
+        encoding,
+        modification_time,
+        stream,
+        size,
+        open_range=None,
+    ):
+        """Construct a File.
+
+        :param stream: A file-like object from which to read the content;
+            its `read` method may return a Deferred.
+        :param size: The size of the content.
+        :param open_range: If not None, a callable that takes an inclusive
+            (first, last) pair of byte offsets and returns a Deferred that
+            fires with a stream for that range of the content.  This is
+            needed to serve ranges of content that isn't in a local file.
+        """
         resource.Resource.__init__(self)
         # Have to convert the UTC datetime to POSIX timestamp (localtime)
         offset = datetime.utcnow() - datetime.now()
@@ -218,9 +255,12 @@ def __init__(self, contentType, encoding, modification_time, stream, size):
         self.encoding = encoding
         self.stream = stream
         self.size = size
+        self.open_range = open_range
 
-    def _setContentHeaders(self, request):
-        request.setHeader(b"content-length", intToBytes(self.size))
+    def _setContentHeaders(self, request, size=None):
+        if size is None:
+            size = self.size
+        request.setHeader(b"content-length", intToBytes(size))
         if self.type:
             request.setHeader(
                 b"content-type", six.ensure_binary(self.type, "ASCII")
@@ -230,9 +270,126 @@ def _setContentHeaders(self, request):
                 b"content-encoding", six.ensure_binary(self.encoding, "ASCII")
             )
 
+    def _isLocalFile(self):
+        """Is our stream a file on local disk, rather than from Swift?"""
+        return isinstance(self.stream, io.IOBase)
+
+    def _supportsRanges(self):
+        return self._isLocalFile() or self.open_range is not None
+
+    def _parseRange(self, spec):
+        """Parse one byte-range-spec or suffix-byte-range-spec.
+
+        :raises ValueError: if the range is syntactically invalid.
+        :return: An inclusive (first, last) pair of byte offsets, or None
+            if the range doesn't overlap the file.
+        """
+        first, sep, last = spec.strip().partition(b"-")
+        if not sep:
+            raise ValueError("Invalid byte range: %r" % spec)
+        if first:
+            first = int(first)
+            last = int(last) if last else self.size - 1
+            if first < 0 or last < first:
+                raise ValueError("Invalid byte range: %r" % spec)
+        else:
+            # A suffix range: the last N bytes.
+            suffix_length = int(last)
+            if suffix_length < 0:
+                raise ValueError("Invalid byte range: %r" % spec)
+            if suffix_length == 0:
+                return None
+            first = max(0, self.size - suffix_length)
+            last = self.size - 1
+        if first >= self.size:
+            return None
+        return first, min(last, self.size - 1)
+
+    def _getRequestedRanges(self, request):
+        """Return the byte ranges that the client asked for.
+
+        :raises UnsatisfiableRange: if none of the ranges overlap the file.
+        :return: A list of inclusive (first, last) pairs of byte offsets,
+            or None to send the whole file.
+        """
+        range_header = request.getHeader(b"range")
+        if range_header is None:
+            return None
+        # Only honour the range if the client's copy is still current.
+        # We don't send ETags, so If-Range can only hold a date.
+        if_range = request.getHeader(b"if-range")
+        if if_range is not None and if_range != http.datetimeToString(
+            request.lastModified
+        ):
+            return None
+        unit, _, specs = range_header.partition(b"=")
+        if unit.strip().lower() != b"bytes":
+            return None
+        specs = [spec for spec in specs.split(b",") if spec.strip()]
+        if not specs or len(specs) > self.max_ranges:
+            return None
+        # A multipart response would have to be wrapped in the content
+        # encoding as a whole, which isn't what the client asked for.
+        if len(specs) > 1 and self.encoding:
+            return None
+        try:
+            ranges = [self._parseRange(spec) for spec in specs]
+        except ValueError:
+            # Syntactically invalid, so ignore it.
+            return None
+        ranges = [byte_range for byte_range in ranges if byte_range]
+        if not ranges:
+            raise UnsatisfiableRange
+        return ranges
+
+    def _setPartialContentHeaders(self, request, ranges):
+        """Set the headers for a response containing `ranges` of the file.
+
+        :return: A list of (separator, offset, size) tuples, as used by
+            `static.MultipleRangeStaticProducer`; the response consists of
+            each separator followed by `size` bytes of the file starting at
+            `offset`.
+        """
+        request.setResponseCode(http.PARTIAL_CONTENT)
+        if len(ranges) == 1:
+            [(first, last)] = ranges
+            self._setContentHeaders(request, size=last - first + 1)
+            request.setHeader(
+                b"content-range", b"bytes %d-%d/%d" % (first, last, self.size)
+            )
+            return [(b"", first, last - first + 1)]
+
+        boundary = uuid.uuid4().hex.encode("ASCII")
+        content_type = six.ensure_binary(
+            self.type or "application/octet-stream", "ASCII"
+        )
+        range_info = []
+        for first, last in ranges:
+            separator = (
+                b"\r\n--%s\r\n"
+                b"Content-Type: %s\r\n"
+                b"Content-Range: bytes %d-%d/%d\r\n"
+                b"\r\n" % (boundary, content_type, first, last, self.size)
+            )
+            range_info.append((separator, first, last - first + 1))
+        range_info.append((b"\r\n--%s--\r\n" % boundary, 0, 0))
+        request.setHeader(
+            b"content-type",
+            b'multipart/byteranges; boundary="%s"' % boundary,
+        )
+        request.setHeader(
+            b"content-length",
+            intToBytes(
+                sum(len(separator) + size for separator, _, size in range_info)
+            ),
+        )
+        return range_info
+
     def render_GET(self, request):
         """See `Resource`."""
-        request.setHeader(b"accept-ranges", b"none")
+        request.setHeader(
+            b"accept-ranges", b"bytes" if self._supportsRanges() else b"none"
+        )
 
         if request.setLastModified(self._modification_time) is http.CACHED:
             # `setLastModified` also sets the response code for us, so if
@@ -248,18 +405,40 @@ def render_GET(self, request):
             self.stream.close()
             return b""
 
-        # static.File has HTTP range support, which would be nice to have.
-        # Unfortunately, static.File isn't a good match for producing data
-        # dynamically by fetching it from Swift. The librarian used to sit
-        # behind Squid, which took care of this, but it no longer does. I
-        # think we will need to cargo-cult the byte-range support and three
-        # Producer implementations from static.File, making the small
-        # modifications to cope with self.fileObject.read maybe returning a
-        # Deferred, and the static.File.makeProducer method to return the
-        # correct producer.
-        self._setContentHeaders(request)
-        request.setResponseCode(http.OK)
-        producer = FileProducer(request, self.stream)
+        ranges = None
+        if self._supportsRanges():
+            try:
+                ranges = self._getRequestedRanges(request)
+            except UnsatisfiableRange:
+                request.setResponseCode(http.REQUESTED_RANGE_NOT_SATISFIABLE)
+                request.setHeader(b"content-range", b"bytes */%d" % self.size)
+                request.setHeader(b"content-length", b"0")
+                self.stream.close()
+                return b""
+
+        if ranges is None:
+            self._setContentHeaders(request)
+            request.setResponseCode(http.OK)
+            if self._isLocalFile():
+                # Files on local disk can be read synchronously, so we use
+                # Twisted's static file producers, which read each chunk
+                # only when the transport is ready for it.
+                producer = static.NoRangeStaticProducer(request, self.stream)
+            else:
+                producer = FileProducer(request, self.stream)
+        else:
+            range_info = self._setPartialContentHeaders(request, ranges)
+            if self._isLocalFile():
+                producer = static.MultipleRangeStaticProducer(
+                    request, self.stream, range_info
+                )
+            else:
+                # The stream we were given is for the whole file, so we
+                # have no use for it.
+                self.stream.close()
+                producer = RangeFileProducer(
+                    request, self.open_range, range_info
+                )
         producer.start()
 
         return server.NOT_DONE_YET
@@ -273,6 +452,7 @@ def __init__(self, request, stream):
         self.request = request
         self.stream = stream
         self.producing = True
+        self._running = False
 
     def start(self):
         self.request.registerProducer(self, True)
@@ -282,6 +462,13 @@ def pauseProducing(self):
         """See `IPushProducer`."""
         self.producing = False
 
+    @defer.inlineCallbacks
+    def _produce(self):
+        try:
+            yield self._produceFromStream()
+        finally:
+            self._running = False
+
     @defer.inlineCallbacks
     def _produceFromStream(self):
         """Read data from our stream and write it to our consumer."""
@@ -294,23 +481,100 @@ def _produceFromStream(self):
             if data:
                 self.request.write(data)
             else:
-                self.request.unregisterProducer()
-                self.request.finish()
-                self.stopProducing()
+                self._finish()
+
+    def _finish(self):
+        self.request.unregisterProducer()
+        self.request.finish()
+        self.stopProducing()
 
     def resumeProducing(self):
         """See `IPushProducer`."""
         self.producing = True
-        if self.request:
-            reactor.callLater(0, self._produceFromStream)
+        # If we were paused while waiting for data, the loop that was
+        # waiting carries on; don't start another one alongside it.
+        if self.request and not self._running:
+            self._running = True
+            reactor.callLater(0, self._produce)
 
     def stopProducing(self):
         """See `IProducer`."""
         self.producing = False
-        self.stream.close()
+        if self.stream is not None:
+            self.stream.close()
         self.request = None
 
 
+class RangeFileProducer(FileProducer):
+    """Produce ranges of a file, opening a new stream for each range.
+
+    This is the counterpart of `static.MultipleRangeStaticProducer` for
+    content that isn't in a local file.
+    """
+
+    def __init__(self, request, open_range, range_info):
+        """Construct a RangeFileProducer.
+
+        :param open_range: See `File`.
+        :param range_info: See `File._setPartialContentHeaders`.
+        """
+        super().__init__(request, None)
+        self.open_range = open_range
+        self.range_info = list(range_info)
+        self._remaining = 0
+
+    @defer.inlineCallbacks
+    def _produceFromStream(self):
+        """Read each range from a new stream and write it to our consumer."""
+        while self.request and self.producing:
+            if self._remaining == 0:
+                if self.stream is not None:
+                    self.stream.close()
+                    self.stream = None
+                if not self.range_info:
+                    self._finish()
+                    return
+                separator, offset, self._remaining = self.range_info.pop(0)
+                if separator:
+                    self.request.write(separator)
+                if self._remaining:
+                    stream = yield self.open_range(
+                        offset, offset + self._remaining - 1
+                    )
+                    if self.request is None:
+                        # stopProducing was called while we were waiting.
+                        if stream is not None:
+                            stream.close()
+                        return
+                    if stream is None:
+                        self._abort("Content for %s went missing")
+                        return
+                    self.stream = stream
+                continue
+            data = yield self.stream.read(
+                min(self.buffer_size, self._remaining)
+            )
+            # pauseProducing or stopProducing may have been called while we
+            # were waiting.
+            if not self.producing:
+                return
+            if not data:
+                self._abort("Content for %s ended early")
+                return
+            self._remaining -= len(data)
+            self.request.write(data)
+
+    def _abort(self, message):
+        """Give up on a response that we can't complete.
+
+        We've already promised the client more data than we can send, so
+        all we can do is drop the connection.
+        """
+        log.msg(message % six.ensure_str(self.request.path))
+        self.request.loseConnection()
+        self.stopProducing()
+
+
 class DigestSearchResource(resource.Resource):
     def __init__(self, storage):
         self.storage = storage
@@ -2,9 +2,13 @@
 # GNU Affero General Public License version 3 (see the file LICENSE).
 
 __all__ = [
+    "AdaptiveController",
+    "ChunkSizeController",
     "DBLoopTuner",
     "ITunableLoop",
+    "LoopSample",
     "LoopTuner",
+    "TimeController",
     "TunableLoop",
 ]
 
@@ -15,10 +19,12 @@
 
 import transaction
 from six import reraise
+from zope.component import queryUtility
 from zope.interface import Interface, implementer
 
 import lp.services.scripts
 from lp.services.database.interfaces import IPrimaryStore
+from lp.services.statsd.interfaces.statsd_client import IStatsdClient
 
 
 class ITunableLoop(Interface):
@@ -44,6 +50,10 @@ def __call__(chunk_size):
 
         Note that chunk_size is a float, so, for example, if you use it to
         slice a list, be careful to round it to an int first.
+
+        This may return the number of items (such as database rows)
+        actually affected, which some controllers use to limit the rate
+        of work and which is reported in the loop's telemetry.
         """
 
     def cleanUp(self):
@@ -57,6 +67,137 @@ def cleanUp(self):
         """
 
 
+class LoopSample:
+    """Observations of one iteration of a `LoopTuner`.
+
+    Signals that the tuner could not observe are None.
+    """
+
+    def __init__(
+        self, time_taken, items=None, wal_bytes=None, lock_waits=None
+    ):
+        # Seconds taken by the iteration.
+        self.time_taken = time_taken
+        # Items (such as rows) that the iteration reported affecting.
+        self.items = items
+        # WAL bytes written by the database cluster since the last sample.
+        self.wal_bytes = wal_bytes
+        # Backends waiting for locks in our database.
+        self.lock_waits = lock_waits
+
+
+class ChunkSizeController:
+    """Decides how much work a `LoopTuner` does in each iteration."""
+
+    # Set if the controller uses the database signals gathered by
+    # `DBLoopTuner`, which cost a query per iteration.
+    wants_database_signals = False
+
+    def nextChunkSize(self, tuner, chunk_size, sample):
+        """Return the chunk size for the next iteration.
+
+        The tuner clamps the result to its minimum and maximum chunk size.
+
+        :param tuner: The `LoopTuner`, for its `goal_seconds`.
+        :param chunk_size: The chunk size of the iteration just done.
+        :param sample: A `LoopSample` describing that iteration.
+        """
+        raise NotImplementedError(self.nextChunkSize)
+
+
+class TimeController(ChunkSizeController):
+    """Tune chunk sizes using the time taken by each iteration alone."""
+
+    def nextChunkSize(self, tuner, chunk_size, sample):
+        """See `ChunkSizeController`."""
+        # The new value is the average of two numbers: the previous
+        # value, and an estimate of how many rows would take us to
+        # exactly goal_seconds seconds. The weight in this estimate of
+        # any given historic measurement decays exponentially with an
+        # exponent of 1/2. This softens the blows from spikes and dips in
+        # processing time. Set a reasonable minimum for time_taken, just
+        # in case we get weird values for whatever reason and destabilize
+        # the algorithm.
+        time_taken = max(tuner.goal_seconds / 10, sample.time_taken)
+        return chunk_size * (1 + tuner.goal_seconds / time_taken) / 2
+
+
+class AdaptiveController(ChunkSizeController):
+    """Tune chunk sizes to the available headroom.
+
+    While the database shows no signs of strain, the chunk size heads
+    straight for the size that the smoothed throughput says would take
+    `goal_seconds`, growing by at most `increase_factor` per iteration.
+    If an iteration overshoots its goal by more than `overshoot`, affects
+    more than `max_items_per_second` items, coincides with more than
+    `max_wal_bytes_per_second` of WAL or with more than `max_lock_waits`
+    backends waiting for locks, the chunk size is multiplied by
+    `decrease_factor` instead.
+    """
+
+    wants_database_signals = True
+
+    increase_factor = 2.0
+    decrease_factor = 0.5
+    overshoot = 1.5
+    # The weight of the latest iteration in the smoothed throughput.
+    smoothing = 0.5
+
+    def __init__(
+        self,
+        max_items_per_second=None,
+        max_wal_bytes_per_second=None,
+        max_lock_waits=5,
+    ):
+        self.max_items_per_second = max_items_per_second
+        self.max_wal_bytes_per_second = max_wal_bytes_per_second
+        self.max_lock_waits = max_lock_waits
+        # Smoothed chunk size units processed per second.
+        self._throughput = None
+
+    def _isStrained(self, tuner, sample, time_taken):
+        if sample.time_taken > tuner.goal_seconds * self.overshoot:
+            return True
+        if (
+            self.max_items_per_second is not None
+            and sample.items is not None
+            and sample.items / time_taken > self.max_items_per_second
+        ):
+            return True
+        if (
+            self.max_wal_bytes_per_second is not None
+            and sample.wal_bytes is not None
+            and sample.wal_bytes / time_taken > self.max_wal_bytes_per_second
+        ):
+            return True
+        if (
+            self.max_lock_waits is not None
+            and sample.lock_waits is not None
+            and sample.lock_waits > self.max_lock_waits
+        ):
+            return True
+        return False
+
+    def nextChunkSize(self, tuner, chunk_size, sample):
+        """See `ChunkSizeController`."""
+        # Guard against dividing by tiny or zero times.
+        time_taken = max(tuner.goal_seconds / 100, sample.time_taken)
+        if self._isStrained(tuner, sample, time_taken):
+            return chunk_size * self.decrease_factor
+        throughput = chunk_size / time_taken
+        if self._throughput is None:
+            self._throughput = throughput
+        else:
+            self._throughput = (
+                self.smoothing * throughput
+                + (1 - self.smoothing) * self._throughput
+            )
+        return min(
+            self._throughput * tuner.goal_seconds,
+            chunk_size * self.increase_factor,
+        )
+
+
 class LoopTuner:
     """A loop that tunes itself to approximate an ideal time per iteration.
 
@@ -82,8 +223,17 @@ class LoopTuner:
     more work for the next batch.  If a batch takes too much time, the next
     batch will be smaller.  There is also some cushioning for one-off spikes
     and troughs in processing speed.
+
+    How the batch size is tuned is up to a `ChunkSizeController`; by
+    default, a `TimeController` considers only the time taken by each
+    batch.
     """
 
+    # Set by `run`: whether the operation was completed rather than
+    # aborted, and how many items it reported affecting.
+    completed = None
+    total_items = None
+
     def __init__(
         self,
         operation,
@@ -93,6 +243,7 @@ def __init__(
         abort_time=None,
         cooldown_time=None,
         log=None,
+        controller=None,
     ):
         """Initialize a loop, to be run to completion at most once.
 
@@ -121,6 +272,9 @@ def __init__(
 
         log: The log object to use. DEBUG level messages are logged
             giving iteration statistics.
+
+        controller: the `ChunkSizeController` that tunes the chunk size.
+            Defaults to a `TimeController`.
         """
         assert ITunableLoop.providedBy(operation)
         self.operation = operation
@@ -133,6 +287,9 @@ def __init__(
             self.log = lp.services.scripts.log
         else:
             self.log = log
+        if controller is None:
+            controller = TimeController()
+        self.controller = controller
 
     # True if this task has timed out. Set by _isTimedOut().
     _has_timed_out = False
@@ -160,21 +317,33 @@ def run(self):
             chunk_size = self.minimum_chunk_size
             iteration = 0
             total_size = 0
+            total_items = 0
+            total_wal_bytes = 0
+            backoffs = 0
             self.start_time = self._time()
             last_clock = self.start_time
+            self.completed = True
+            self._measure()
             while not self.operation.isDone():
                 if self._isTimedOut():
                     self.log.info(
                         "Task aborted after %d seconds.", self.abort_time
                     )
+                    self.completed = False
                     break
 
-                self.operation(chunk_size)
+                items = self.operation(chunk_size)
 
                 new_clock = self._time()
                 time_taken = new_clock - last_clock
                 last_clock = new_clock
 
+                if not isinstance(items, int) or isinstance(items, bool):
+                    items = None
+                sample = LoopSample(time_taken, items=items, **self._measure())
+                total_items += items or 0
+                total_wal_bytes += sample.wal_bytes or 0
+
                 self.log.debug2(
                     "Iteration %d (size %.1f): %.3f seconds",
                     iteration,
@@ -187,21 +356,16 @@ def run(self):
                 total_size += chunk_size
 
                 # Adjust parameter value to approximate goal_seconds.
-                # The new value is the average of two numbers: the
-                # previous value, and an estimate of how many rows would
-                # take us to exactly goal_seconds seconds. The weight in
-                # this estimate of any given historic measurement decays
-                # exponentially with an exponent of 1/2. This softens
-                # the blows from spikes and dips in processing time. Set
-                # a reasonable minimum for time_taken, just in case we
-                # get weird values for whatever reason and destabilize
-                # the algorithm.
-                time_taken = max(self.goal_seconds / 10, time_taken)
-                chunk_size *= (1 + self.goal_seconds / time_taken) / 2
-                chunk_size = max(chunk_size, self.minimum_chunk_size)
+                new_chunk_size = self.controller.nextChunkSize(
+                    self, chunk_size, sample
+                )
+                if new_chunk_size < chunk_size:
+                    backoffs += 1
+                chunk_size = max(new_chunk_size, self.minimum_chunk_size)
                 chunk_size = min(chunk_size, self.maximum_chunk_size)
                 iteration += 1
 
+            self.total_items = total_items
             total_time = last_clock - self.start_time
             average_size = total_size / max(1, iteration)
             average_speed = total_size / max(1, total_time)
@@ -214,6 +378,14 @@ def run(self):
                 average_size,
                 average_speed,
             )
+            self._emitTelemetry(
+                iteration,
+                total_size,
+                total_time,
+                total_items,
+                total_wal_bytes,
+                backoffs,
+            )
         except Exception:
             exc_info = sys.exc_info()
             try:
@@ -232,6 +404,49 @@ def run(self):
         else:
             cleanup()
 
+    def _measure(self):
+        """Observe signals for the controller after an iteration.
+
+        This is also called once before the first iteration, so that
+        signals can be measured relative to the start.
+
+        :return: A dict of keyword arguments for `LoopSample`.
+        """
+        return {}
+
+    def _emitTelemetry(
+        self, iterations, total_size, total_time, items, wal_bytes, backoffs
+    ):
+        """Report how this loop performed, to compare tuning strategies."""
+        loop_name = self.operation.__class__.__name__
+        if items or wal_bytes:
+            self.log.debug2(
+                "%s affected %d items, %d WAL bytes written, "
+                "%d chunk size reductions",
+                loop_name,
+                items,
+                wal_bytes,
+                backoffs,
+            )
+        statsd_client = queryUtility(IStatsdClient)
+        if statsd_client is None or iterations == 0:
+            return
+        labels = {
+            "loop": loop_name,
+            "controller": self.controller.__class__.__name__,
+        }
+        statsd_client.timing(
+            "looptuner.duration", total_time * 1000, labels=labels
+        )
+        statsd_client.gauge("looptuner.iterations", iterations, labels=labels)
+        statsd_client.gauge(
+            "looptuner.items_per_second",
+            (items or total_size) / max(total_time, 0.001),
+            labels=labels,
+        )
+        statsd_client.gauge("looptuner.wal_bytes", wal_bytes, labels=labels)
+        statsd_client.gauge("looptuner.backoffs", backoffs, labels=labels)
+
     def _coolDown(self, bedtime):
         """Sleep for `self.cooldown_time` seconds, if set.
 
@@ -286,8 +501,14 @@ class DBLoopTuner(LoopTuner):
 
     INFO level messages are logged when the DBLoopTuner blocks in addition
     to the DEBUG level messages emitted by the standard LoopTuner.
+
+    If its controller wants them, the DBLoopTuner also observes the WAL
+    written and the lock waits in the database after each iteration.
     """
 
+    # The WAL position when last measured.
+    _wal_position = None
+
     # We block until replication lag is under this threshold.
     acceptable_replication_lag = timedelta(seconds=30)  # In seconds.
 
@@ -367,6 +588,30 @@ def _blockForLongRunningTransactions(self):
             transaction.abort()
             self._sleep(10)
 
+    def _measure(self):
+        """See `LoopTuner`."""
+        if not self.controller.wants_database_signals:
+            return {}
+        from lp.services.librarian.model import LibraryFileAlias
+
+        store = IPrimaryStore(LibraryFileAlias)
+        wal_position, lock_waits = store.execute(
+            """
+            SELECT
+                pg_current_wal_lsn() - '0/0'::pg_lsn,
+                (SELECT count(*) FROM activity()
+                 WHERE datname = current_database()
+                     AND wait_event_type = 'Lock')
+            """
+        ).get_one()
+        wal_position = int(wal_position)
+        if self._wal_position is None:
+            wal_bytes = None
+        else:
+            wal_bytes = wal_position - self._wal_position
+        self._wal_position = wal_position
+        return {"wal_bytes": wal_bytes, "lock_waits": lock_waits}
+
     def _coolDown(self, bedtime):
         """As per LoopTuner._coolDown, except we always wait until there
         is no replication lag.
@@ -389,6 +634,10 @@ class TunableLoop:
     # LoopTuner.
     tuner_class = DBLoopTuner
 
+    # Called with no arguments to make the `ChunkSizeController` for each
+    # run.  May be overridden, for example to limit the rate of work.
+    controller_factory = AdaptiveController
+
     goal_seconds = 2
     minimum_chunk_size = 1
     maximum_chunk_size: int = None
@@ -403,10 +652,15 @@ def isDone(self):
         raise NotImplementedError(self.isDone)
 
     def run(self):
+        """Run this loop until it is done or aborted.
+
+        :return: The `LoopTuner` that ran it, which records whether it
+            completed.
+        """
         assert (
             self.maximum_chunk_size is not None
         ), "Did not override maximum_chunk_size."
-        self.tuner_class(
+        tuner = self.tuner_class(
             self,
             self.goal_seconds,
             minimum_chunk_size=self.minimum_chunk_size,
@@ -414,4 +668,7 @@ def run(self):
             cooldown_time=self.cooldown_time,
             abort_time=self.abort_time,
             log=self.log,
-        ).run()
+            controller=self.controller_factory(),
+        )
+        tuner.run()
+        return tuner
@@ -11,7 +11,14 @@
 from zope.interface import implementer
 
 from lp.services.log.logger import FakeLogger
-from lp.services.looptuner import ITunableLoop, LoopTuner
+from lp.services.looptuner import (
+    AdaptiveController,
+    ChunkSizeController,
+    ITunableLoop,
+    LoopSample,
+    LoopTuner,
+    TimeController,
+)
 from lp.testing import TestCase
 from lp.testing.layers import BaseLayer
 
@@ -72,3 +79,174 @@ def test_cleanup_exception_on_failure(self):
         self.assertEqual(
             log_file.getvalue().strip(), "ERROR Unhandled exception in cleanUp"
         )
+
+
+@implementer(ITunableLoop)
+class CountingLoop:
+    """A loop that reports affecting as many items as its chunk size."""
+
+    def __init__(self, iterations, result=int):
+        self.iterations = iterations
+        self.result = result
+
+    def isDone(self):
+        return self.iterations == 0
+
+    def __call__(self, chunk_size):
+        self.iterations -= 1
+        return self.result(chunk_size)
+
+    def cleanUp(self):
+        pass
+
+
+class RecordingController(ChunkSizeController):
+    """A controller that records its samples and doubles the chunk size."""
+
+    def __init__(self):
+        self.samples = []
+
+    def nextChunkSize(self, tuner, chunk_size, sample):
+        self.samples.append(sample)
+        return chunk_size * 2
+
+
+class TestLoopTunerController(TestCase):
+    layer = BaseLayer
+
+    def test_default_controller(self):
+        tuner = LoopTuner(CountingLoop(1), 5, log=FakeLogger(io.StringIO()))
+        self.assertIsInstance(tuner.controller, TimeController)
+
+    def test_controller_tunes_chunk_size(self):
+        # The controller's chunk sizes are used, within the tuner's limits,
+        # and it is told how many items each iteration affected.
+        controller = RecordingController()
+        tuner = LoopTuner(
+            CountingLoop(4),
+            5,
+            minimum_chunk_size=10,
+            maximum_chunk_size=50,
+            log=FakeLogger(io.StringIO()),
+            controller=controller,
+        )
+        tuner.run()
+        self.assertEqual(
+            [10, 20, 40, 50], [sample.items for sample in controller.samples]
+        )
+        self.assertIsNone(controller.samples[0].wal_bytes)
+        self.assertIsNone(controller.samples[0].lock_waits)
+
+    def test_items_ignored_unless_integer(self):
+        # Loops that don't return how many items they affected are fine.
+        controller = RecordingController()
+        LoopTuner(
+            CountingLoop(2, result=lambda chunk_size: None),
+            5,
+            log=FakeLogger(io.StringIO()),
+            controller=controller,
+        ).run()
+        self.assertEqual(
+            [None, None], [sample.items for sample in controller.samples]
+        )
+
+
+class FakeTuner:
+    goal_seconds = 10.0
+
+
+class TestTimeController(TestCase):
+    layer = BaseLayer
+
+    def test_converges_on_goal(self):
+        # The next chunk size averages the current one with an estimate of
+        # the size that would take exactly the goal time.
+        controller = TimeController()
+        self.assertEqual(
+            150,
+            controller.nextChunkSize(FakeTuner(), 100, LoopSample(5.0)),
+        )
+        self.assertEqual(
+            75, controller.nextChunkSize(FakeTuner(), 100, LoopSample(20.0))
+        )
+
+    def test_minimum_time(self):
+        # Very short iterations are treated as taking a tenth of the goal.
+        controller = TimeController()
+        self.assertEqual(
+            550, controller.nextChunkSize(FakeTuner(), 100, LoopSample(0.0))
+        )
+
+
+class TestAdaptiveController(TestCase):
+    layer = BaseLayer
+
+    def test_grows_towards_goal(self):
+        # Without strain, the chunk size heads for the size that would take
+        # the goal time, but grows by at most the increase factor.
+        controller = AdaptiveController()
+        self.assertEqual(
+            200, controller.nextChunkSize(FakeTuner(), 100, LoopSample(1.0))
+        )
+        controller = AdaptiveController()
+        self.assertEqual(
+            125, controller.nextChunkSize(FakeTuner(), 100, LoopSample(8.0))
+        )
+
+    def test_smooths_throughput(self):
+        # A single fast iteration only partly raises the estimated
+        # throughput.
+        controller = AdaptiveController()
+        controller.nextChunkSize(FakeTuner(), 100, LoopSample(10.0))
+        self.assertEqual(
+            150, controller.nextChunkSize(FakeTuner(), 100, LoopSample(5.0))
+        )
+
+    def test_backs_off_on_overshoot(self):
+        controller = AdaptiveController()
+        self.assertEqual(
+            50, controller.nextChunkSize(FakeTuner(), 100, LoopSample(16.0))
+        )
+        # Moderately slow iterations shrink the chunk size gradually.
+        self.assertEqual(
+            80, controller.nextChunkSize(FakeTuner(), 100, LoopSample(12.5))
+        )
+
+    def test_backs_off_on_lock_waits(self):
+        controller = AdaptiveController(max_lock_waits=2)
+        self.assertEqual(
+            200,
+            controller.nextChunkSize(
+                FakeTuner(), 100, LoopSample(1.0, lock_waits=2)
+            ),
+        )
+        self.assertEqual(
+            100,
+            controller.nextChunkSize(
+                FakeTuner(), 200, LoopSample(1.0, lock_waits=3)
+            ),
+        )
+
+    def test_backs_off_on_wal_rate(self):
+        controller = AdaptiveController(max_wal_bytes_per_second=1000)
+        self.assertEqual(
+            200,
+            controller.nextChunkSize(
+                FakeTuner(), 100, LoopSample(2.0, wal_bytes=2000)
+            ),
+        )
+        self.assertEqual(
+            100,
+            controller.nextChunkSize(
+                FakeTuner(), 200, LoopSample(2.0, wal_bytes=2001)
+            ),
+        )
+
+    def test_backs_off_on_item_rate(self):
+        controller = AdaptiveController(max_items_per_second=10)
+        self.assertEqual(
+            50,
+            controller.nextChunkSize(
+                FakeTuner(), 100, LoopSample(5.0, items=100)
+            ),
+        )
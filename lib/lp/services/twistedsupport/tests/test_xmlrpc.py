@@ -3,16 +3,28 @@
 
 """Tests for Twisted XML-RPC support."""
 
+from testtools.twistedsupport import (
+    AsynchronousDeferredRunTestForBrokenTwisted,
+    assert_fails_with,
+)
+from twisted.internet import defer, reactor
+from twisted.internet.error import ConnectionDone
 from twisted.python.failure import Failure
+from twisted.web import server, xmlrpc
+from twisted.web.client import RequestNotSent, ResponseNeverReceived
+from twisted.web.resource import Resource
 
 from lp.services.twistedsupport import extract_result
 from lp.services.twistedsupport.xmlrpc import (
     BlockingProxy,
     DeferredBlockingProxy,
+    PersistentProxy,
+    make_persistent_pool,
     trap_fault,
 )
 from lp.services.xmlrpc import LaunchpadFault
 from lp.testing import TestCase
+from lp.testing.layers import TwistedLayer
 
 
 class TestFaultOne(LaunchpadFault):
@@ -128,3 +140,144 @@ def not_ok(self, a, b, c=None):
         d = proxy.callRemote("not_ok", 2, 3, c=8)
         error = self.assertRaises(RuntimeError, extract_result, d)
         self.assertEqual(str(error), str((8, 3, 2)))
+
+
+class ExampleXMLRPCServer(xmlrpc.XMLRPC):
+    """An XML-RPC server that records the connections it is called on."""
+
+    def __init__(self):
+        super().__init__(allowNone=True)
+        self.channels = []
+
+    @xmlrpc.withRequest
+    def xmlrpc_echo(self, request, *args):
+        self.channels.append(request.channel)
+        return args
+
+    def xmlrpc_fail(self):
+        raise xmlrpc.Fault(1, "Boom")
+
+
+class TestPersistentProxy(TestCase):
+    layer = TwistedLayer
+    run_tests_with = AsynchronousDeferredRunTestForBrokenTwisted.make_factory(
+        timeout=30
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.rpc_server = ExampleXMLRPCServer()
+        root = Resource()
+        root.putChild(b"rpc", self.rpc_server)
+        listening_port = reactor.listenTCP(
+            0, server.Site(root), interface="127.0.0.1"
+        )
+        self.addCleanup(listening_port.stopListening)
+        self.base_url = b"http://127.0.0.1:%d" % listening_port.getHost().port
+        self.pool = make_persistent_pool(reactor)
+        self.addCleanup(self.pool.closeCachedConnections)
+
+    def makeProxy(self, path=b"/rpc", failures=(), **kwargs):
+        """Make a `PersistentProxy` for the test server.
+
+        :param failures: Exceptions with which to fail the first few
+            requests made by the proxy, simulating stale connections.
+        """
+        proxy = PersistentProxy(self.base_url + path, self.pool, **kwargs)
+        failures = list(failures)
+        real_request = proxy._agent.request
+
+        def request(*args, **kwargs):
+            if failures:
+                return defer.fail(failures.pop(0))
+            return real_request(*args, **kwargs)
+
+        proxy._agent.request = request
+        return proxy
+
+    @defer.inlineCallbacks
+    def test_callRemote(self):
+        proxy = self.makeProxy()
+        result = yield proxy.callRemote("echo", "foo", None, 42)
+        self.assertEqual(["foo", None, 42], result)
+
+    def test_callRemote_fault(self):
+        # Faults raised by the server are passed on to the caller.
+        proxy = self.makeProxy()
+        return assert_fails_with(proxy.callRemote("fail"), xmlrpc.Fault)
+
+    def test_callRemote_bad_status(self):
+        # Unsuccessful HTTP responses raise ValueError, as with
+        # twisted.web.xmlrpc.Proxy.
+        proxy = self.makeProxy(path=b"/nonexistent")
+        return assert_fails_with(proxy.callRemote("echo"), ValueError)
+
+    @defer.inlineCallbacks
+    def test_callRemote_reuses_connection(self):
+        # Consecutive calls, even through different proxies, reuse the same
+        # keep-alive connection.
+        proxy = self.makeProxy()
+        yield proxy.callRemote("echo", 1)
+        yield proxy.callRemote("echo", 2)
+        yield self.makeProxy().callRemote("echo", 3)
+        self.assertEqual(3, len(self.rpc_server.channels))
+        self.assertEqual(1, len(set(self.rpc_server.channels)))
+
+    def test_callRemote_cancel(self):
+        # Cancelling a call fails it with CancelledError, as with
+        # twisted.web.xmlrpc.Proxy.
+        d = self.makeProxy().callRemote("echo", 1)
+        d.cancel()
+        return assert_fails_with(d, defer.CancelledError)
+
+    @defer.inlineCallbacks
+    def test_callRemote_retries_unsent_request(self):
+        # A request that could not be sent on a cached connection is
+        # retried, regardless of the method.
+        proxy = self.makeProxy(failures=[RequestNotSent()])
+        result = yield proxy.callRemote("echo", 1)
+        self.assertEqual([1], result)
+
+    @defer.inlineCallbacks
+    def test_callRemote_retries_idempotent_method(self):
+        # A call to an idempotent method whose connection was lost before
+        # a response was received is retried.
+        proxy = self.makeProxy(
+            failures=[ResponseNeverReceived([Failure(ConnectionDone())])],
+            idempotent_methods=["echo"],
+        )
+        result = yield proxy.callRemote("echo", 1)
+        self.assertEqual([1], result)
+
+    @defer.inlineCallbacks
+    def test_callRemote_retries_each_cached_connection(self):
+        # Each cached connection to the server may be stale, so a call may
+        # be retried once for each of them before using a fresh connection.
+        stale = ResponseNeverReceived([Failure(ConnectionDone())])
+        proxy = self.makeProxy(
+            failures=[stale] * self.pool.maxPersistentPerHost,
+            idempotent_methods=["echo"],
+        )
+        result = yield proxy.callRemote("echo", 1)
+        self.assertEqual([1], result)
+
+    def test_callRemote_retries_limited(self):
+        stale = ResponseNeverReceived([Failure(ConnectionDone())])
+        proxy = self.makeProxy(
+            failures=[stale] * (self.pool.maxPersistentPerHost + 1),
+            idempotent_methods=["echo"],
+        )
+        return assert_fails_with(
+            proxy.callRemote("echo", 1), ResponseNeverReceived
+        )
+
+    def test_callRemote_does_not_retry_other_methods(self):
+        # Other calls may have reached the server, so are not retried.
+        proxy = self.makeProxy(
+            failures=[ResponseNeverReceived([Failure(ConnectionDone())])]
+        )
+        d = assert_fails_with(
+            proxy.callRemote("echo", 1), ResponseNeverReceived
+        )
+        d.addCallback(lambda _: self.assertEqual([], self.rpc_server.channels))
+        return d
@@ -6,11 +6,27 @@
 __all__ = [
     "BlockingProxy",
     "DeferredBlockingProxy",
+    "make_persistent_pool",
+    "PersistentProxy",
     "trap_fault",
 ]
 
+import io
+import xmlrpc.client as xmlrpc_client
+
 from twisted.internet import defer
 from twisted.web import xmlrpc
+from twisted.web.client import (
+    Agent,
+    FileBodyProducer,
+    HTTPConnectionPool,
+    RequestNotSent,
+    RequestTransmissionFailed,
+    ResponseNeverReceived,
+    _HTTP11ClientFactory,
+    readBody,
+)
+from twisted.web.http_headers import Headers
 
 
 class BlockingProxy:
@@ -50,6 +66,146 @@ def callRemote(self, method_name, *args, **kwargs):
         )
 
 
+class QuietHTTP11ClientFactory(_HTTP11ClientFactory):
+    """HTTP client factory that doesn't splatter the log with junk."""
+
+    noisy = False
+
+
+def make_persistent_pool(
+    reactor, max_persistent_per_host=2, cached_connection_timeout=240
+):
+    """Make an `HTTPConnectionPool` that keeps connections alive.
+
+    :param max_persistent_per_host: The maximum number of idle connections
+        to keep open to each server.
+    :param cached_connection_timeout: The number of seconds after which an
+        idle connection is closed.
+    """
+    pool = HTTPConnectionPool(reactor, persistent=True)
+    pool.maxPersistentPerHost = max_persistent_per_host
+    pool.cachedConnectionTimeout = cached_connection_timeout
+    pool._factory = QuietHTTP11ClientFactory
+    return pool
+
+
+class PersistentProxy:
+    """A Twisted XML-RPC proxy that reuses HTTP/1.1 connections.
+
+    `twisted.web.xmlrpc.Proxy` opens a new connection for every call.  This
+    proxy instead makes its calls through an `Agent` using the given
+    `HTTPConnectionPool`, so consecutive calls to the same server reuse an
+    idle keep-alive connection.  The pool closes connections that have
+    been idle for too long, and discards any that the server closes.
+
+    A cached connection may have been closed by the server without us
+    having noticed yet, in which case a call fails before any response is
+    received.  Calls that were never sent are retried on another
+    connection, as are calls to methods in `idempotent_methods` that failed
+    in this way; other calls might have had side-effects, so those
+    failures are passed on to the caller.
+    """
+
+    def __init__(
+        self,
+        url,
+        pool,
+        connect_timeout=None,
+        reactor=None,
+        idempotent_methods=(),
+    ):
+        """Construct a `PersistentProxy`.
+
+        :param url: The URL of the XML-RPC server, as bytes.
+        :param pool: An `HTTPConnectionPool`, typically persistent.
+        :param connect_timeout: The number of seconds to wait before giving
+            up on connecting to the server.
+        :param reactor: The reactor to use; defaults to the global reactor.
+        :param idempotent_methods: Names of remote methods that are safe to
+            call again if a call may already have reached the server.
+        """
+        if reactor is None:
+            # Import this lazily, to avoid installing the default reactor
+            # when this module is imported.
+            from twisted.internet import reactor
+        self.url = url
+        self.pool = pool
+        self.idempotent_methods = frozenset(idempotent_methods)
+        self._agent = Agent(reactor, connectTimeout=connect_timeout, pool=pool)
+
+    def _request(self, body):
+        d = self._agent.request(
+            b"POST",
+            self.url,
+            Headers({b"Content-Type": [b"text/xml"]}),
+            FileBodyProducer(io.BytesIO(body)),
+        )
+
+        def got_response(response):
+            d = readBody(response)
+            if response.code != 200:
+                # Match twisted.web.xmlrpc.Proxy's behaviour, but only once
+                # the body has been read so that the connection can be
+                # reused.
+                def bad_status(_):
+                    raise ValueError(
+                        str(response.code).encode("ASCII"), response.phrase
+                    )
+
+                d.addCallback(bad_status)
+            return d
+
+        return d.addCallback(got_response)
+
+    def callRemote(self, method, *args):
+        body = xmlrpc_client.dumps(
+            args, methodname=method, allow_none=True
+        ).encode("UTF-8")
+        if method in self.idempotent_methods:
+            retryable = (
+                RequestNotSent,
+                RequestTransmissionFailed,
+                ResponseNeverReceived,
+            )
+        else:
+            retryable = (RequestNotSent,)
+        # Each failed connection is discarded from the pool, so if all the
+        # cached connections to the server are stale then the last attempt
+        # uses a fresh connection.
+        retries = [self.pool.maxPersistentPerHost]
+
+        def retry(failure):
+            failure.trap(*retryable)
+            if not retries[0]:
+                return failure
+            retries[0] -= 1
+            return self._request(body).addErrback(retry)
+
+        d = self._request(body)
+        d.addErrback(retry)
+        # A fault raised by loads() is passed on to the caller.
+        d.addCallback(lambda data: xmlrpc_client.loads(data)[0][0])
+
+        # Cancelling a request fails it with any of several wrapped
+        # exceptions depending on how far it got, but callers expect
+        # CancelledError as with twisted.web.xmlrpc.Proxy.  Cancel the
+        # request but leave the Deferred we return to fail with that.
+        cancelled = []
+
+        def cancel(result):
+            cancelled.append(True)
+            d.cancel()
+
+        result = defer.Deferred(cancel)
+
+        def fire(value):
+            if not cancelled:
+                result.callback(value)
+
+        d.addBoth(fire)
+        return result
+
+
 def trap_fault(failure, *fault_classes):
     """Trap a fault, based on fault code.
 
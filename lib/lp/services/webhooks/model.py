@@ -21,7 +21,7 @@
 import transaction
 from lazr.delegates import delegate_to
 from lazr.enum import DBEnumeratedType, DBItem
-from storm.expr import And, Desc
+from storm.expr import And, Desc, Select
 from storm.properties import JSON, Bool, DateTime, Int, Unicode
 from storm.references import Reference
 from storm.store import Store
@@ -535,6 +535,32 @@ def iterReady(cls):
         )
         return (cls(job) for job in jobs)
 
+    @classmethod
+    def claimReady(cls, limit, after_id=None, max_id=None):
+        """Lease up to `limit` webhook jobs of this type that are ready.
+
+        The jobs are leased for `lease_duration`, so other runners leave
+        them alone until they have been run or the leases have expired.
+        `after_id` and `max_id` limit the job IDs as in `Job.claimReady`.
+
+        :return: A list of the claimed jobs in job ID order.
+        """
+        job_ids = Job.claimReady(
+            Select(
+                WebhookJob.job_id, WebhookJob.job_type == cls.class_job_type
+            ),
+            limit,
+            cls.lease_duration.total_seconds(),
+            after_id=after_id,
+            max_id=max_id,
+        )
+        jobs = (
+            IPrimaryStore(WebhookJob)
+            .find(WebhookJob, WebhookJob.job_id.is_in(job_ids))
+            .order_by(WebhookJob.job_id)
+        )
+        return [cls(job) for job in jobs]
+
 
 def _redact_payload(event_type, payload):
     """Redact a webhook payload for logging.
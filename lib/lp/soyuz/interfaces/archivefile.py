@@ -107,6 +107,26 @@ def newFromFile(archive, container, path, fileobj, size, content_type):
         :param content_type: The MIME type of the file.
         """
 
+    def newFromFiles(archive, container, files, max_workers=1):
+        """Create new `IArchiveFile`s from files on the file system.
+
+        The files are uploaded to the librarian concurrently, and the new
+        `IArchiveFile` rows are created in bulk.
+
+        :param archive: The `IArchive` containing the new files.
+        :param container: An identifier for the component that manages
+            these files.
+        :param files: A sequence of (path, size, open_file, content_type,
+            digests) tuples.  `path` is the path to the new file within its
+            archive, `open_file` is a callable returning a file-like object
+            to read the data from, and `digests` is None or a dictionary of
+            the "md5", "sha1" and "sha256" hex digests of the data if they
+            are already known.
+        :param max_workers: Upload at most this many files at once.
+        :return: A list of the new `IArchiveFile`s.  This is in no
+            particular order.
+        """
+
     def getByArchive(
         archive,
         container=None,
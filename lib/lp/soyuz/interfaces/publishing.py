@@ -1364,7 +1364,11 @@ def getSourcesForPublishing(
         """
 
     def getBinariesForPublishing(
-        archive, distroarchseries=None, pocket=None, component=None
+        archive,
+        distroarchseries=None,
+        pocket=None,
+        component=None,
+        distroseries=None,
     ):
         """Get binary publications which are published in a given context.
 
@@ -1372,6 +1376,8 @@ def getBinariesForPublishing(
         :param distroarchseries: The `DistroArchSeries` to search, or None.
         :param pocket: The `PackagePublishingPocket` to search, or None.
         :param component: The `Component` to search, or None.
+        :param distroseries: The `DistroSeries` to search across all of its
+            architectures, or None.
         :return: A result set of `BinaryPackagePublishingHistory` objects in
             the given context and with the `PUBLISHED` status, ordered by
             binary package name, with associated publisher-relevant objects
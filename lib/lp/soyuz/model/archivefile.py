@@ -17,7 +17,7 @@
 from zope.interface import implementer
 
 from lp.app.errors import IncompatibleArguments
-from lp.services.database.bulk import load_related
+from lp.services.database.bulk import create, load_related
 from lp.services.database.constants import UTC_NOW
 from lp.services.database.decoratedresultset import DecoratedResultSet
 from lp.services.database.interfaces import IPrimaryStore, IStore
@@ -113,6 +113,42 @@ def newFromFile(
         )
         return cls.new(archive, container, path, library_file)
 
+    @staticmethod
+    def newFromFiles(archive, container, files, max_workers=1):
+        """See `IArchiveFileSet`."""
+        files = list(files)
+        library_files = getUtility(ILibraryFileAliasSet).createMany(
+            [
+                (
+                    os.path.basename(path),
+                    size,
+                    open_file,
+                    content_type,
+                    digests,
+                )
+                for path, size, open_file, content_type, digests in files
+            ],
+            restricted=archive.private,
+            allow_zero_length=True,
+            max_workers=max_workers,
+        )
+        return create(
+            (
+                ArchiveFile.archive,
+                ArchiveFile.container,
+                ArchiveFile.path,
+                ArchiveFile.library_file,
+                ArchiveFile.date_created,
+            ),
+            [
+                (archive, container, path, library_file, _now())
+                for (path, _, _, _, _), library_file in zip(
+                    files, library_files
+                )
+            ],
+            get_objects=True,
+        )
+
     @staticmethod
     def getByArchive(
         archive,
@@ -2160,7 +2160,12 @@ def eager_load(spphs):
         return DecoratedResultSet(spphs, pre_iter_hook=eager_load)
 
     def getBinariesForPublishing(
-        self, archive, distroarchseries=None, pocket=None, component=None
+        self,
+        archive,
+        distroarchseries=None,
+        pocket=None,
+        component=None,
+        distroseries=None,
     ):
         """See `IPublishingSet`."""
         clauses = [
@@ -2181,6 +2186,14 @@ def getBinariesForPublishing(
             clauses.append(
                 BinaryPackagePublishingHistory.component == component
             )
+        if distroseries is not None:
+            clauses.extend(
+                [
+                    BinaryPackagePublishingHistory.distroarchseries
+                    == DistroArchSeries.id,
+                    DistroArchSeries.distroseries == distroseries,
+                ]
+            )
         bpphs = (
             IStore(BinaryPackagePublishingHistory)
             .find(BinaryPackagePublishingHistory, *clauses)
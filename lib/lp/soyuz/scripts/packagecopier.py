@@ -11,12 +11,12 @@
     "update_files_privacy",
 ]
 
-import apt_pkg
 from lazr.delegates import delegate_to
 from zope.component import getAdapter, getUtility
 from zope.security.proxy import removeSecurityProxy
 
 from lp.app.interfaces.security import IAuthorization
+from lp.archivepublisher.debversion import version_sort_key
 from lp.registry.interfaces.role import IPersonRoles
 from lp.registry.model.person import Person
 from lp.services.database.bulk import load_related
@@ -545,8 +545,9 @@ def checkCopy(
         if ancestry is not None:
             ancestry_version = ancestry.sourcepackagerelease.version
             copy_version = source.sourcepackagerelease.version
-            apt_pkg.init_system()
-            if apt_pkg.version_compare(copy_version, ancestry_version) < 0:
+            if version_sort_key(copy_version) < version_sort_key(
+                ancestry_version
+            ):
                 raise CannotCopy(
                     "version older than the %s published in %s"
                     % (ancestry.displayname, ancestry.distroseries.name)
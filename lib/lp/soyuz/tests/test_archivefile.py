@@ -5,10 +5,18 @@
 
 import os
 from datetime import datetime, timedelta, timezone
+from functools import partial
+from operator import attrgetter
 
 import transaction
 from storm.store import Store
-from testtools.matchers import AfterPreprocessing, Equals, Is, MatchesStructure
+from testtools.matchers import (
+    AfterPreprocessing,
+    Equals,
+    Is,
+    MatchesListwise,
+    MatchesStructure,
+)
 from zope.component import getUtility
 from zope.security.proxy import removeSecurityProxy
 
@@ -82,6 +90,51 @@ def test_newFromFile(self):
             ),
         )
 
+    def test_newFromFiles(self):
+        root = self.makeTemporaryDirectory()
+        contents = {"dists/foo": "abc\n", "dists/bar": "defg\n"}
+        for path, content in contents.items():
+            with open_for_writing(os.path.join(root, path), "w") as f:
+                f.write(content)
+        archive = self.factory.makeArchive()
+        archive_files = getUtility(IArchiveFileSet).newFromFiles(
+            archive,
+            "foo",
+            [
+                (
+                    path,
+                    len(content),
+                    partial(open, os.path.join(root, path), "rb"),
+                    "text/plain",
+                    None,
+                )
+                for path, content in contents.items()
+            ],
+            max_workers=2,
+        )
+        now = get_transaction_timestamp(Store.of(archive_files[0]))
+        transaction.commit()
+        self.assertThat(
+            sorted(archive_files, key=attrgetter("path")),
+            MatchesListwise(
+                [
+                    MatchesStructure(
+                        archive=Equals(archive),
+                        container=Equals("foo"),
+                        path=Equals(path),
+                        library_file=AfterPreprocessing(
+                            read_library_file,
+                            Equals(contents[path].encode("UTF-8")),
+                        ),
+                        date_created=Equals(now),
+                        date_superseded=Is(None),
+                        scheduled_deletion_date=Is(None),
+                    )
+                    for path in sorted(contents)
+                ]
+            ),
+        )
+
     def test_getByArchive(self):
         archives = [self.factory.makeArchive(), self.factory.makeArchive()]
         archive_files = []
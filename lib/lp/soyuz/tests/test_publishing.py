@@ -1550,6 +1550,37 @@ def test_getBinariesForPublishing(self):
                 archive=warty.main_archive
             ).count(),
         )
+        # Publications can be fetched for all architectures of a series at
+        # once.
+        self.assertContentEqual(
+            [
+                bpph
+                for das in warty.architectures
+                for bpph in publishing_set.getBinariesForPublishing(
+                    archive=warty.main_archive,
+                    distroarchseries=das,
+                    pocket=PackagePublishingPocket.RELEASE,
+                    component=component_main,
+                )
+            ],
+            publishing_set.getBinariesForPublishing(
+                archive=warty.main_archive,
+                pocket=PackagePublishingPocket.RELEASE,
+                component=component_main,
+                distroseries=warty,
+            ),
+        )
+        self.assertEqual(
+            0,
+            publishing_set.getBinariesForPublishing(
+                archive=warty.main_archive,
+                pocket=PackagePublishingPocket.RELEASE,
+                component=component_main,
+                distroseries=self.factory.makeDistroSeries(
+                    distribution=ubuntu
+                ),
+            ).count(),
+        )
 
     def test_getBinariesForPublishing_query_count(self):
         # Check that the number of queries required to publish binary
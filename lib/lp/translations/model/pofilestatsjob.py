@@ -10,12 +10,12 @@
 
 import logging
 
-from storm.locals import And, Int, Reference
+from storm.locals import And, Int, Reference, Select
 from zope.component import getUtility
 from zope.interface import implementer, provider
 
 from lp.services.config import config
-from lp.services.database.interfaces import IStore
+from lp.services.database.interfaces import IPrimaryStore, IStore
 from lp.services.database.stormbase import StormBase
 from lp.services.job.interfaces.job import IRunnableJob
 from lp.services.job.model.job import Job
@@ -89,6 +89,29 @@ def iterReady():
             And(POFileStatsJob.job == Job.id, Job.id.is_in(Job.ready_jobs)),
         )
 
+    @classmethod
+    def claimReady(cls, limit, after_id=None, max_id=None):
+        """Lease up to `limit` ready statistics jobs.
+
+        The leases, of `lease_duration`, stop other runners from claiming
+        the same jobs before this one gets to them.  `after_id` and
+        `max_id` restrict the job IDs as in `Job.claimReady`.
+
+        :return: A list of the claimed `POFileStatsJob`s, by job ID.
+        """
+        job_ids = Job.claimReady(
+            Select(POFileStatsJob.job_id),
+            limit,
+            cls.lease_duration.total_seconds(),
+            after_id=after_id,
+            max_id=max_id,
+        )
+        return list(
+            IPrimaryStore(POFileStatsJob)
+            .find(POFileStatsJob, POFileStatsJob.job_id.is_in(job_ids))
+            .order_by(POFileStatsJob.job_id)
+        )
+
     def makeDerived(self):
         """Support UniversalJobSource.
 
@@ -0,0 +1,207 @@
+#!/usr/bin/python3 -S
+#
+# Copyright 2026 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Simulate dispatching a synthetic build farm's queue to idle builders.
+
+This generates a build farm with a mix of processors, virtualized and
+non-virtualized builders, and builders with open or restricted resources,
+along with a queue of waiting jobs.  It then compares:
+
+ * per-group dispatch, as buildd-manager used to do it: each idle builder
+   in scan order takes the best candidate from the candidates for each of
+   its groups, which are fetched with one query per group; and
+
+ * `BuildDispatchPlanner`, which fetches candidates for all builders with
+   a single query and plans a global assignment in memory.
+
+For each, it reports the simulated number of queries, the time taken, and
+how many builders were given jobs.  No database is needed.
+"""
+
+import _pythonpath  # noqa: F401
+
+import random
+import time
+
+from lp.buildmaster.enums import BuilderCleanStatus
+from lp.buildmaster.interactor import BuilderVitals
+from lp.buildmaster.manager import BuildDispatchPlanner, DispatchCandidate
+from lp.scripts.helpers import LPOptionParser
+
+PROCESSORS = ["amd64", "arm64", "armhf", "i386", "ppc64el", "riscv64", "s390x"]
+
+
+def make_builders(rng, count):
+    builders = []
+    for n in range(count):
+        processor_names = [rng.choice(PROCESSORS)]
+        if processor_names == ["amd64"] and rng.random() < 0.5:
+            processor_names.append("i386")
+        elif processor_names == ["arm64"] and rng.random() < 0.5:
+            processor_names.append("armhf")
+        open_resources = None
+        restricted_resources = None
+        if rng.random() < 0.1:
+            open_resources = ["large"]
+        elif rng.random() < 0.02:
+            restricted_resources = ["gpu"]
+        builders.append(
+            BuilderVitals(
+                name="builder-%05d" % n,
+                url=None,
+                processor_names=processor_names,
+                virtualized=rng.random() < 0.8,
+                vm_host=None,
+                vm_reset_protocol=None,
+                open_resources=open_resources,
+                restricted_resources=restricted_resources,
+                builderok=True,
+                manual=False,
+                build_queue=None,
+                version=None,
+                clean_status=BuilderCleanStatus.CLEAN,
+                active=True,
+                failure_count=0,
+                region=None,
+            )
+        )
+    return builders
+
+
+def make_candidates(rng, count):
+    candidates = []
+    for n in range(count):
+        builder_constraints = None
+        if rng.random() < 0.05:
+            builder_constraints = ["large"]
+        elif rng.random() < 0.01:
+            builder_constraints = ["gpu"]
+        candidates.append(
+            DispatchCandidate(
+                id=n,
+                lastscore=rng.randrange(10000),
+                processor_name=(
+                    None if rng.random() < 0.01 else rng.choice(PROCESSORS)
+                ),
+                virtualized=rng.random() < 0.8,
+                builder_constraints=builder_constraints,
+            )
+        )
+    candidates.sort(key=sort_key)
+    return candidates
+
+
+def sort_key(candidate):
+    return -candidate.lastscore, candidate.id
+
+
+def get_builder_group_keys(vitals):
+    return [
+        (
+            processor_name,
+            vitals.virtualized,
+            tuple(vitals.restricted_resources or ()),
+            tuple(vitals.open_resources or ()),
+        )
+        for processor_name in vitals.processor_names + [None]
+    ]
+
+
+def dispatch_per_group(builders, candidates):
+    """Simulate per-group prefetching, with one query per builder group."""
+    group_sizes = {}
+    for vitals in builders:
+        for key in get_builder_group_keys(vitals):
+            group_sizes[key] = group_sizes.get(key, 0) + 1
+    group_candidates = {}
+    taken = set()
+    queries = 0
+    dispatched = 0
+    for vitals in builders:
+        keys = get_builder_group_keys(vitals)
+        for key in keys:
+            if key not in group_candidates:
+                queries += 1
+                processor_name, virtualized, restricted, open_ = key
+                signature_vitals = vitals._replace(
+                    processor_names=[processor_name],
+                    restricted_resources=list(restricted),
+                    open_resources=list(open_),
+                )
+                group_candidates[key] = [
+                    candidate
+                    for candidate in candidates
+                    if candidate.processor_name == processor_name
+                    and BuildDispatchPlanner._canBuild(
+                        signature_vitals,
+                        BuildDispatchPlanner._getSignature(candidate),
+                    )
+                ][: group_sizes[key]]
+        heads = []
+        for key in keys:
+            for candidate in group_candidates[key]:
+                if candidate.id not in taken:
+                    heads.append(candidate)
+                    break
+        best = min(heads, key=sort_key, default=None)
+        if best is not None:
+            taken.add(best.id)
+            dispatched += 1
+    return queries, dispatched
+
+
+def dispatch_planned(builders, candidates):
+    """Dispatch using a `BuildDispatchPlanner`."""
+    planner = BuildDispatchPlanner(builders)
+    planner.plan(candidates)
+    return 1, len(planner.assignments)
+
+
+def main():
+    parser = LPOptionParser(description=__doc__)
+    parser.add_option(
+        "--builders",
+        type="int",
+        default=2000,
+        help="Number of idle builders [default: %default].",
+    )
+    parser.add_option(
+        "--jobs",
+        type="int",
+        default=20000,
+        help="Number of waiting jobs [default: %default].",
+    )
+    parser.add_option(
+        "--seed",
+        type="int",
+        default=0,
+        help="Random seed [default: %default].",
+    )
+    options, _ = parser.parse_args()
+
+    rng = random.Random(options.seed)
+    builders = make_builders(rng, options.builders)
+    candidates = make_candidates(rng, options.jobs)
+    # Builders are scanned in no particular order.
+    rng.shuffle(builders)
+    print(
+        "%d idle builders, %d waiting jobs" % (len(builders), len(candidates))
+    )
+
+    for name, dispatch in (
+        ("per-group", dispatch_per_group),
+        ("planned", dispatch_planned),
+    ):
+        start = time.monotonic()
+        queries, dispatched = dispatch(builders, candidates)
+        elapsed = time.monotonic() - start
+        print(
+            "%-10s %5d queries, %5d builders given jobs, %8.3fs"
+            % (name + ":", queries, dispatched, elapsed)
+        )
+
+
+if __name__ == "__main__":
+    main()
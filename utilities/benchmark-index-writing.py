@@ -0,0 +1,189 @@
+#!/usr/bin/python3 -S
+#
+# Copyright 2026 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Benchmark repository index writing on synthetic Packages files.
+
+In "codecs" mode, this writes a single large Packages file with all
+compressors, first on the calling thread and then with one
+`TempFileWriterThread` per codec.
+
+In "workers" mode, this writes a set of per-(component, architecture)
+Packages files, first serially using `RepositoryIndexFile` and then using a
+`ParallelIndexWriter` with increasing numbers of workers.
+
+Either way, it reports the wall-clock speedup.  No database is needed.
+"""
+
+import _pythonpath  # noqa: F401
+
+import os
+import shutil
+import tempfile
+import time
+
+from lp.archivepublisher.utils import ParallelIndexWriter, RepositoryIndexFile
+from lp.scripts.helpers import LPOptionParser
+from lp.soyuz.enums import IndexCompressionType
+
+STANZA_TEMPLATE = """\
+Package: package-%(n)d
+Source: source-%(source)d
+Priority: optional
+Section: universe/misc
+Installed-Size: %(size)d
+Maintainer: Ubuntu Developers <ubuntu-devel-discuss@lists.ubuntu.com>
+Architecture: %(arch)s
+Version: %(n)d.0-1ubuntu1
+Depends: libc6 (>= 2.34), package-%(dep)d (>= 1.0)
+Filename: pool/universe/s/source-%(source)d/package-%(n)d_%(n)d.0_%(arch)s.deb
+Size: %(size)d
+MD5sum: %(md5)s
+SHA1: %(sha1)s
+SHA256: %(sha256)s
+Description: synthetic package number %(n)d
+ This is a synthetic package used to benchmark index writing.  It has a
+ moderately long description so that compression has some work to do."""
+
+
+def make_index_contents(arch, stanzas):
+    """Return the rendered contents of a synthetic Packages file."""
+    chunks = []
+    for n in range(stanzas):
+        stanza = STANZA_TEMPLATE % {
+            "n": n,
+            "source": n // 3,
+            "dep": (n * 7) % stanzas,
+            "size": 1000 + n,
+            "arch": arch,
+            "md5": ("%032x" % (n * 2654435761))[-32:],
+            "sha1": ("%040x" % (n * 40503))[-40:],
+            "sha256": ("%064x" % (n * 2246822519))[-64:],
+        }
+        chunks.append(stanza.encode("utf-8") + b"\n\n")
+    return chunks
+
+
+def write_serially(indexes, temp_root, compressors, threaded=False):
+    for path, chunks in indexes:
+        with RepositoryIndexFile(
+            path, temp_root, compressors, threaded=threaded
+        ) as index:
+            for chunk in chunks:
+                index.write(chunk)
+
+
+def write_in_parallel(indexes, temp_root, compressors, workers):
+    with ParallelIndexWriter(workers) as writer:
+        for path, chunks in indexes:
+            with writer.open(path, temp_root, compressors) as index:
+                for chunk in chunks:
+                    index.write(chunk)
+
+
+def main():
+    parser = LPOptionParser(description=__doc__)
+    parser.add_option(
+        "--mode",
+        type="choice",
+        choices=("codecs", "workers"),
+        default="workers",
+        help="What to benchmark: codecs or workers [default: %default].",
+    )
+    parser.add_option(
+        "--stanzas",
+        type="int",
+        default=None,
+        help=(
+            "Number of stanzas in each Packages file [default: 100000 in "
+            "codecs mode, 20000 in workers mode]."
+        ),
+    )
+    parser.add_option(
+        "--components",
+        type="int",
+        default=4,
+        help="Number of components [default: %default].",
+    )
+    parser.add_option(
+        "--architectures",
+        type="int",
+        default=6,
+        help="Number of architectures [default: %default].",
+    )
+    parser.add_option(
+        "--max-workers",
+        type="int",
+        default=os.cpu_count(),
+        help="Largest number of workers to try [default: %default].",
+    )
+    options, _ = parser.parse_args()
+    if options.mode == "codecs":
+        options.components = options.architectures = 1
+        if options.stanzas is None:
+            options.stanzas = 100000
+    elif options.stanzas is None:
+        options.stanzas = 20000
+
+    compressors = [
+        IndexCompressionType.UNCOMPRESSED,
+        IndexCompressionType.GZIP,
+        IndexCompressionType.BZIP2,
+        IndexCompressionType.XZ,
+    ]
+    root = tempfile.mkdtemp()
+    try:
+        temp_root = os.path.join(root, "tmp")
+        os.makedirs(temp_root)
+        indexes = []
+        for component in range(options.components):
+            for arch in range(options.architectures):
+                indexes.append(
+                    (
+                        os.path.join(
+                            root,
+                            "dists",
+                            "component-%d" % component,
+                            "binary-arch%d" % arch,
+                            "Packages",
+                        ),
+                        make_index_contents("arch%d" % arch, options.stanzas),
+                    )
+                )
+        print(
+            "%d index files of %d stanzas each"
+            % (len(indexes), options.stanzas)
+        )
+
+        start = time.monotonic()
+        write_serially(indexes, temp_root, compressors)
+        serial = time.monotonic() - start
+        print("serial:     %8.2fs" % serial)
+
+        if options.mode == "codecs":
+            start = time.monotonic()
+            write_serially(indexes, temp_root, compressors, threaded=True)
+            elapsed = time.monotonic() - start
+            print(
+                "threaded:   %8.2fs (speedup %.2fx)"
+                % (elapsed, serial / elapsed)
+            )
+            return
+
+        workers = 1
+        while workers <= options.max_workers:
+            start = time.monotonic()
+            write_in_parallel(indexes, temp_root, compressors, workers)
+            elapsed = time.monotonic() - start
+            print(
+                "%2d workers: %8.2fs (speedup %.2fx)"
+                % (workers, elapsed, serial / elapsed)
+            )
+            workers *= 2
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/python3 -S
+#
+# Copyright 2026 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Compare the librarian's ways of serving file content over HTTP.
+
+This serves a temporary file through the librarian's `File` resource in
+two ways, and downloads it repeatedly from several concurrent clients:
+
+ * "stream": the file is wrapped so that it looks like a stream from
+   Swift, so it is sent by `FileProducer`, as all files used to be; and
+
+ * "local": the file is served as `LibrarianStorage.open` returns it for
+   content on local disk, so it is sent by Twisted's static file
+   producers.
+
+It also measures fetching each download as several byte ranges in
+parallel, as a client segmenting a large download would; "stream"
+ranges are each read from a new stream, as ranges of files in Swift are.
+For each, it reports the total throughput.  No database or librarian
+instance is needed.
+"""
+
+import _pythonpath  # noqa: F401
+
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+
+import requests
+from twisted.internet import defer, reactor
+from twisted.web import resource, server
+
+from lp.scripts.helpers import LPOptionParser
+from lp.services.librarianserver.web import File
+
+
+class StreamWrapper:
+    """Hide a local file's type, as if it were a stream from Swift."""
+
+    def __init__(self, f):
+        self._f = f
+
+    def read(self, size):
+        return self._f.read(size)
+
+    def close(self):
+        self._f.close()
+
+
+class BenchmarkResource(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, path, size):
+        super().__init__()
+        self.path = path
+        self.size = size
+
+    def openRange(self, first, last):
+        f = open(self.path, "rb")
+        f.seek(first)
+        return defer.succeed(StreamWrapper(f))
+
+    def render_GET(self, request):
+        stream = open(self.path, "rb")
+        if request.postpath[0] == b"stream":
+            stream = StreamWrapper(stream)
+        return File(
+            "application/octet-stream",
+            None,
+            datetime.now(timezone.utc),
+            stream,
+            self.size,
+            open_range=self.openRange,
+        ).render(request)
+
+
+def download(url):
+    with requests.get(url, stream=True) as response:
+        response.raise_for_status()
+        return sum(len(chunk) for chunk in response.iter_content(65536))
+
+
+def download_range(url, first, last):
+    headers = {"Range": "bytes=%d-%d" % (first, last)}
+    with requests.get(url, headers=headers, stream=True) as response:
+        response.raise_for_status()
+        assert response.status_code == 206
+        return sum(len(chunk) for chunk in response.iter_content(65536))
+
+
+def download_segmented(url, size, segments):
+    segment_size = -(-size // segments)
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        return sum(
+            executor.map(
+                lambda first: download_range(
+                    url, first, min(first + segment_size, size) - 1
+                ),
+                range(0, size, segment_size),
+            )
+        )
+
+
+def benchmark(fetch, clients, requests_per_client):
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        start = time.perf_counter()
+        sizes = list(
+            executor.map(
+                lambda _: fetch(), range(clients * requests_per_client)
+            )
+        )
+        elapsed = time.perf_counter() - start
+    return sum(sizes), elapsed
+
+
+def main():
+    parser = LPOptionParser()
+    parser.add_option(
+        "--size",
+        type="int",
+        default=256,
+        help="Size of the file to serve, in MiB (default: %default).",
+    )
+    parser.add_option(
+        "--clients",
+        type="int",
+        default=8,
+        help="Number of concurrent clients (default: %default).",
+    )
+    parser.add_option(
+        "--requests",
+        type="int",
+        default=4,
+        help="Number of downloads per client (default: %default).",
+    )
+    parser.add_option(
+        "--segments",
+        type="int",
+        default=4,
+        help=(
+            "Number of ranges to fetch in parallel for segmented downloads "
+            "(default: %default)."
+        ),
+    )
+    options, _ = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile() as f:
+        size = options.size * 1024 * 1024
+        block = os.urandom(1024 * 1024)
+        for _ in range(options.size):
+            f.write(block)
+        f.flush()
+
+        site = server.Site(BenchmarkResource(f.name, size))
+        port = reactor.listenTCP(0, site, interface="127.0.0.1")
+        thread = threading.Thread(
+            target=reactor.run, kwargs={"installSignalHandlers": False}
+        )
+        thread.start()
+        try:
+            base_url = "http://127.0.0.1:%d" % port.getHost().port
+            stream_url = "%s/stream" % base_url
+            local_url = "%s/local" % base_url
+            fetches = []
+            for name, url in (("stream", stream_url), ("local", local_url)):
+                fetches.append((name, partial(download, url)))
+                fetches.append(
+                    (
+                        "%s, %d segments" % (name, options.segments),
+                        partial(
+                            download_segmented, url, size, options.segments
+                        ),
+                    )
+                )
+            for name, fetch in fetches:
+                total, elapsed = benchmark(
+                    fetch, options.clients, options.requests
+                )
+                print(
+                    "%-20s  %8.1f MiB in %6.2fs: %8.1f MiB/s"
+                    % (
+                        name,
+                        total / 1024 / 1024,
+                        elapsed,
+                        total / 1024 / 1024 / elapsed,
+                    )
+                )
+        finally:
+            reactor.callFromThread(reactor.stop)
+            thread.join()
+
+
+if __name__ == "__main__":
+    main()